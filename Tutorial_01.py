@@ -25,6 +25,10 @@ Reason:
 # Tutorial: use this global variable to debug the code below.
 CT_DEBUG = 0
 
+#
+# Tutorial: 1 = print answers token by token as the LLM generates them, with time-to-first-token and tokens/sec.
+# 0 = print each answer when it is complete, as in the original tutorial.
+CT_STREAMING = 1
 #
 # Tutorial: increase the timeout when running on low-powered hardware.
 CT_REQUEST_TIMEOUT = 360.0
@@ -83,6 +87,9 @@ from llama_index.core.schema import Document, MetadataMode
 from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.llms.ollama import Ollama
 #
+# Tutorial: import the streaming helpers (time-to-first-token, tokens/sec).
+from datasdr_streaming import func_datasdr_print_answer
+#
 # Tutorial: call the specified embedding model.
 # An "embedding model" turns raw data into tokens ready to eb processed.
 Settings.embed_model = OllamaEmbedding(model_name=CT_EMBEDDING_MODEL[0])
@@ -134,17 +141,14 @@ if CT_DEBUG == 2:
 # Tutorial: now we'll ask the LLM questions regarding the Document we created manually.
 print("\n\n\n= = = Inference = = =")
 # Tutorial: create a query engine on the index object.
-query_engine= index.as_query_engine()
+query_engine= index.as_query_engine(streaming=CT_STREAMING == 1)
 #
-# Tutorial: ask questions to the query engine.
-response_01 = query_engine.query("When was the melanoma drug approved?")
-print(response_01)
+# Tutorial: ask questions to the query engine. The answers are printed as they are generated.
+response_01 = func_datasdr_print_answer(query_engine, "When was the melanoma drug approved?")
 #
-response_02 = query_engine.query("Who is the spponsor for the melanoma drug?")
-print(response_02)
+response_02 = func_datasdr_print_answer(query_engine, "Who is the spponsor for the melanoma drug?")
 # Tutorial: 
-response_03 = query_engine.query("Are there any age restrictions on the melanoma drug?")
-print(response_03)
+response_03 = func_datasdr_print_answer(query_engine, "Are there any age restrictions on the melanoma drug?")
 
 
 #
@@ -11,6 +11,7 @@ Requirements:
 * Open a command line window (Terminal / Powershell).
 * Activate the virtual environment.
 * Then type: "python3 Tutorial_02.py"
+* Or run the same steps from the command line, without editing this file: "python3 datasdr_cli.py --help"
 
 The first time you process a set of PDFs the script will generate the index files.
 Any other time you run the script it will re-load the previously-generated index files.
@@ -33,6 +34,50 @@ CT_DEBUG = 0
 CT_DATA_DIR = "/Users/server/Downloads/test/_data"
 # Tutorial: location of index files.
 CT_INDEX_DIR = "/Users/server/Downloads/test/_index"
+# Tutorial: both can also point to the ZIP files themselves, which are then read without extracting them, e.g.
+# CT_DATA_DIR = "/Users/server/Downloads/test/ClinicalTrials_gov_10_PDFs.zip"
+# CT_INDEX_DIR = "/Users/server/Downloads/test/ClinicalTrials_gov_10_PDFs__index.zip"
+# Tutorial: embedding cache. Keep it OUTSIDE CT_INDEX_DIR, so rebuilding the index re-uses the cached embeddings.
+CT_EMBEDDING_CACHE = "/Users/server/Downloads/test/_embedding_cache.sqlite3"
+#
+# Tutorial: 1 = refresh the index incrementally: only new, changed or deleted PDFs are (re-)indexed.
+# 0 = build the index once, then always re-load it.
+CT_REFRESH_MODE = 0
+#
+# Tutorial: processes extracting PDF pages, and the cache of extracted text (keep it OUTSIDE CT_INDEX_DIR).
+# 0 = let SimpleDirectoryReader parse the PDFs on one core, as in the original tutorial.
+CT_EXTRACT_WORKERS = 0
+CT_PDF_TEXT_CACHE = "/Users/server/Downloads/test/_pdf_text_cache.sqlite3"
+#
+# Tutorial: cache of LLM answers (keep it OUTSIDE CT_INDEX_DIR). Repeated questions are answered in milliseconds;
+# rebuilding the index invalidates its cached answers. "" = always ask the LLM.
+CT_RESPONSE_CACHE = "/Users/server/Downloads/test/_response_cache.sqlite3"
+#
+# Tutorial: 1 = print answers token by token as the LLM generates them, with time-to-first-token and tokens/sec.
+# 0 = print each answer when it is complete, as in the original tutorial.
+CT_STREAMING = 1
+#
+# Tutorial: 1 = hybrid retrieval: a SQLite3 FTS5 keyword index (kept next to CT_INDEX_DIR) is searched first, and exact
+# terms such as drug names ("Heplisav B") are found even when their embeddings are not close. 0 = vector search only.
+CT_HYBRID_RETRIEVAL = 1
+#
+# Tutorial: maximum tokens of retrieved context sent to the LLM. Duplicate chunks are dropped and chunks are trimmed to the
+# sentences with the keywords of the question (see datasdr_context.py); shorter prompts answer faster. 0 = send the chunks as retrieved.
+CT_CONTEXT_BUDGET = 1500
+#
+# Tutorial: 1 = after the answers below, ask the same questions to EVERY model in CT_MODEL_NAME, e.g. ["llama3", "meditron", "phi3:mini"].
+# The context is retrieved once per question and all models get the identical prompt; a table of latency and tokens/sec is printed.
+CT_COMPARE_MODELS = 0
+# Tutorial: models answering at the same time. Every model Ollama serves at once is kept in memory.
+CT_COMPARE_WORKERS = 2
+#
+# Tutorial: 1 = time every pipeline stage (SQLite3 query, chunking, embedding, persist, retrieval, LLM ..) and print a report at the end.
+CT_METRICS = 0
+# Tutorial: optional outputs: one JSON line per timed stage, and a Prometheus text file. "" = none.
+CT_METRICS_JSONL = ""
+CT_METRICS_PROMETHEUS = ""
+# Tutorial: file for a cProfile profile of the whole run, e.g. "/Users/server/Downloads/test/tutorial.prof". "" = no profiling.
+CT_PROFILE = ""
 #
 # Tutorial: increase the timeout when running on low-powered hardware.
 CT_REQUEST_TIMEOUT = 360.0
@@ -154,15 +199,66 @@ from llama_index.core import (
 from llama_index.core.schema import Document, MetadataMode
 #
 # Tutorial: import LlamaIndex libraries needed to interface with Ollama.
-from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.llms.ollama import Ollama
 #
+# Tutorial: batched, concurrent replacement for OllamaEmbedding. Same model names, many fewer HTTP round trips.
+from datasdr_embeddings import DataSDROllamaEmbedding
+# Tutorial: persistent embedding cache; unchanged chunks are never embedded twice.
+from datasdr_embedding_cache import DataSDRCachedEmbedding
+#
 # Tutorial: 
 from llama_index.readers.database import DatabaseReader
 #
+# Tutorial: loads the binary (memory-mapped) vector store when the index directory has one.
+# Convert an existing index once with: "python3 datasdr_vector_store.py <CT_INDEX_DIR>"
+from datasdr_vector_store import func_datasdr_load_index
+#
+# Tutorial: incremental refresh, see CT_REFRESH_MODE above.
+from datasdr_refresh import func_datasdr_refresh_pdf_index
+#
+# Tutorial: parallel PDF extraction with a text cache, see CT_EXTRACT_WORKERS above.
+from datasdr_pdf_extract import func_datasdr_load_pdf_documents
+#
+# Tutorial: reads PDFs straight from a ZIP file, skipping the "__MACOSX" junk.
+from datasdr_zip import func_datasdr_load_zip_documents
+#
+# Tutorial: import the LLM response cache.
+from datasdr_response_cache import func_datasdr_cached_query_engine
+#
+# Tutorial: import the streaming helpers (time-to-first-token, tokens/sec).
+from datasdr_streaming import func_datasdr_print_answer
+#
+# Tutorial: keyword + vector (hybrid) retrieval.
+from datasdr_hybrid import func_datasdr_hybrid_query_engine, func_datasdr_hybrid_retriever
+#
+# Tutorial: deduplicate, trim and pack the retrieved chunks under a token budget.
+from datasdr_context import DataSDRContextAssembler
+#
+# Tutorial: answer the same questions with several models in one run.
+from datasdr_compare_models import func_datasdr_compare_models, func_datasdr_print_comparison
+#
+# Tutorial: import the pipeline instrumentation (timers, counters, cProfile hook).
+from datasdr_metrics import (
+	CT_METRICS_REGISTRY,
+	func_datasdr_enable_metrics,
+	func_datasdr_stage,
+	func_datasdr_start_profiler,
+	func_datasdr_stop_profiler,
+)
+#
+# Tutorial: chunking and embedding as two timed stages.
+from datasdr_index_builder import func_datasdr_index_documents
+#
+if CT_METRICS:
+	func_datasdr_enable_metrics(CT_METRICS_JSONL or None)
+var_profiler = func_datasdr_start_profiler() if CT_PROFILE else None
+#
 # Tutorial: call the specified embedding model.
 # An "embedding model" turns raw data into tokens ready to eb processed.
-Settings.embed_model = OllamaEmbedding(model_name=CT_EMBEDDING_MODEL[0])
+Settings.embed_model = DataSDRCachedEmbedding(
+	DataSDROllamaEmbedding(model_name=CT_EMBEDDING_MODEL[0]),
+	cache_path=CT_EMBEDDING_CACHE,
+)
 #
 # Tutorial: configure Ollama with the desired model name, and define a request timeout.
 Settings.llm = Ollama(model=CT_MODEL_NAME[0], request_timeout=CT_REQUEST_TIMEOUT)
@@ -171,41 +267,84 @@ Settings.llm = Ollama(model=CT_MODEL_NAME[0], request_timeout=CT_REQUEST_TIMEOUT
 index = SummaryIndex([])
 #
 
+# Tutorial: in refresh mode, compare CT_DATA_DIR with the index and only process what changed.
+if CT_REFRESH_MODE == 1:
+	func_datasdr_refresh_pdf_index(CT_DATA_DIR, CT_INDEX_DIR, CT_PDF_TEXT_CACHE if CT_EXTRACT_WORKERS else None, CT_EXTRACT_WORKERS)
+	index = func_datasdr_load_index(CT_INDEX_DIR)
+	print("Index loaded.\n\n")
 # Check if index already exists
-if not os.path.exists(CT_INDEX_DIR):
+elif not os.path.exists(CT_INDEX_DIR):
 	os.makedirs(CT_INDEX_DIR)
-	documents = SimpleDirectoryReader(CT_DATA_DIR).load_data()
+	if CT_DATA_DIR.endswith(".zip"):
+		documents = func_datasdr_load_zip_documents(CT_DATA_DIR)
+	elif CT_EXTRACT_WORKERS:
+		documents = func_datasdr_load_pdf_documents(CT_DATA_DIR, CT_PDF_TEXT_CACHE, CT_EXTRACT_WORKERS)
+	else:
+		documents = SimpleDirectoryReader(CT_DATA_DIR).load_data()
 	#
-	index = VectorStoreIndex.from_documents(
+	index = func_datasdr_index_documents(
 	    documents,
 	)
 	#
-	index.storage_context.persist(persist_dir=CT_INDEX_DIR)
-	print("Index stored in directory [%s]\n\n" % (CT_INDEX_DIR))
+	with func_datasdr_stage("persist"):
+		index.storage_context.persist(persist_dir=CT_INDEX_DIR)
+	print("Index stored in directory [%s]" % (CT_INDEX_DIR))
+	print(Settings.embed_model.func_cache_report(), "\n\n")
 	#
 else:
 	# Load existing index:
 	print("Loading index from directory [%s]\n\n" % (CT_INDEX_DIR))
-	storage_context = StorageContext.from_defaults(persist_dir=CT_INDEX_DIR)
-	index = load_index_from_storage(storage_context)
+	index = func_datasdr_load_index(CT_INDEX_DIR)
 	print("Index loaded.\n\n")
 #
 # Tutorial: now we'll ask the LLM questions regarding the PDFs we loaded.
 print("\n\n\n= = = Inference = = =")
 # Tutorial: create a query engine on the index object.
-query_engine= index.as_query_engine()
+var_context_assembler = DataSDRContextAssembler(token_budget=CT_CONTEXT_BUDGET) if CT_CONTEXT_BUDGET else None
+var_postprocessors = [var_context_assembler] if var_context_assembler is not None else []
+if CT_HYBRID_RETRIEVAL == 1:
+	query_engine = func_datasdr_hybrid_query_engine(index, CT_INDEX_DIR, streaming=CT_STREAMING == 1, node_postprocessors=var_postprocessors)
+else:
+	query_engine= index.as_query_engine(streaming=CT_STREAMING == 1, node_postprocessors=var_postprocessors)
+if CT_RESPONSE_CACHE:
+	query_engine = func_datasdr_cached_query_engine(index, CT_INDEX_DIR, CT_RESPONSE_CACHE, in_query_engine=query_engine)
 
 
 #
-# Tutorial: ask questions to the query engine.
-response_01 = query_engine.query("Describe the protocol about Thrombosis?")
-print(response_01, "\n")
+# Tutorial: ask questions to the query engine. The answers are printed as they are generated.
+response_01 = func_datasdr_print_answer(query_engine, "Describe the protocol about Thrombosis?")
 #
-response_02 = query_engine.query("What do you know about elastography from the context?")
-print(response_02, "\n")
+response_02 = func_datasdr_print_answer(query_engine, "What do you know about elastography from the context?")
 # Tutorial: 
-response_03 = query_engine.query("What do you know about Heplisav B from the context?")
-print(response_03, "\n")
+response_03 = func_datasdr_print_answer(query_engine, "What do you know about Heplisav B from the context?")
+if CT_RESPONSE_CACHE:
+	print(query_engine.func_cache_report())
+if var_context_assembler is not None:
+	print(var_context_assembler.func_context_report())
+#
+# Tutorial: the homework below, in one pass: every model answers the same questions over the same retrieved chunks.
+if CT_COMPARE_MODELS == 1:
+	print("\n\n\n= = = Model comparison: %s = = =" % (", ".join(CT_MODEL_NAME)))
+	if CT_HYBRID_RETRIEVAL == 1:
+		var_retriever = func_datasdr_hybrid_retriever(index, CT_INDEX_DIR)
+	else:
+		var_retriever = index.as_retriever()
+	var_comparison = func_datasdr_compare_models(
+		var_retriever,
+		["Describe the protocol about Thrombosis?", "What do you know about elastography from the context?", "What do you know about Heplisav B from the context?"],
+		CT_MODEL_NAME,
+		in_workers=CT_COMPARE_WORKERS,
+		in_request_timeout=CT_REQUEST_TIMEOUT,
+	)
+	func_datasdr_print_comparison(var_comparison)
+#
+# Tutorial: where did the time go?
+if CT_METRICS:
+	print("\n" + CT_METRICS_REGISTRY.func_report())
+	if CT_METRICS_PROMETHEUS:
+		CT_METRICS_REGISTRY.func_write_prometheus(CT_METRICS_PROMETHEUS)
+if var_profiler is not None:
+	func_datasdr_stop_profiler(var_profiler, CT_PROFILE)
 
 
 #
@@ -235,6 +374,7 @@ According to the provided context, Heplisav-B is a vaccine that uses a synthetic
 """
 01. Change the model name in CT_MODEL_NAME for each of the LLMs you downloaded, and re-run the code.
 Compare the results of each model over the exact same content.
+Or list all of them in CT_MODEL_NAME and set CT_COMPARE_MODELS = 1: they are compared in one run (see datasdr_compare_models.py).
 >> Spoiler alert: LLMs lie! <<
 
 
@@ -243,4 +383,5 @@ Compare the results of each model over the exact same content.
 * Add your own, internal PDFs here.
 * Delete the CT_INDEX_DIR directory.
 * Re-run the script.
+* Or: set CT_REFRESH_MODE = 1, and only the PDFs you added, changed or deleted are processed.
 """
\ No newline at end of file
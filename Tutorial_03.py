@@ -12,6 +12,7 @@ Requirements:
 * Activate the virtual environment.
 * Make sure Ollama is running! "ollama serve" or launch the application.
 * Then type: "python3 Tutorial_03.py"
+* Or run the same steps from the command line, without editing this file: "python3 datasdr_cli.py --help"
 
 
 The first time you process a set of SQLite3 files:
@@ -56,6 +57,31 @@ CT_SPONSORS_NAME = ['Abbott', 'Abbvie', 'AstraZeneca', 'Bayer', 'Bristol_Myers_S
 #
 # Tutorial: start with a few records, say 10. Then slowly increase the number of records, based on your hardware's capabilities.
 CT_LIMIT_RECORDS = 10
+#
+# Tutorial: number of sponsors indexed at the same time. 1 = one sponsor after the other.
+CT_BUILD_WORKERS = 1
+#
+# Tutorial: 1 = refresh existing indices incrementally: only new, changed or deleted nct_id rows are (re-)indexed.
+CT_REFRESH_MODE = 0
+#
+# Tutorial: rows read per page when streaming a whole sponsor table (CT_LIMIT_RECORDS is ignored).
+# 0 = load CT_LIMIT_RECORDS rows at once, as in the original tutorial.
+CT_STREAM_BATCH_SIZE = 0
+#
+# Tutorial: 1 = streaming mode adds an index on nct_id to each sponsor's SQLite3 file, so pages are read faster.
+# This writes to your SQLite3 files. 0 = leave them untouched.
+CT_STREAM_CREATE_NCT_ID_INDEX = 0
+#
+# Tutorial: 1 = answer count / filter / group-by questions with SQL, and only send free-text questions to the LLM.
+CT_STRUCTURED_QUERIES = 1
+#
+# Tutorial: 1 = the SQL fast path adds one index per filterable column to each sponsor's SQLite3 file.
+# This writes to your SQLite3 files. 0 = the fast path only reads them.
+CT_ROUTER_CREATE_INDEXES = 0
+#
+# Tutorial: URL of a running datasdr_index_server.py, e.g. "http://127.0.0.1:8765". The server keeps the indices loaded,
+# so questions are answered without re-loading them on every run. "" = load the indices in this script.
+CT_INDEX_SERVER_URL = ""
 # Tutorial: adjust to fit your local configuration.
 CT_SQLITE3_DIRECTORY = "/Users/server/Downloads/test/_Datafiles/"
 #
@@ -64,6 +90,33 @@ CT_SQLITE3_DIRECTORY = "/Users/server/Downloads/test/_Datafiles/"
 CT_DATA_DIR = "/Users/server/Downloads/test/_data"
 # Tutorial: location of index files.
 CT_INDEX_DIR = "/Users/server/Downloads/test/_index"
+# Tutorial: embedding cache. Keep it OUTSIDE the index directories, so rebuilding an index re-uses the cached embeddings.
+CT_EMBEDDING_CACHE = "/Users/server/Downloads/test/_embedding_cache.sqlite3"
+# Tutorial: cache of LLM answers. Rebuilding a sponsor index invalidates its cached answers. "" = always ask the LLM.
+CT_RESPONSE_CACHE = "/Users/server/Downloads/test/_response_cache.sqlite3"
+#
+# Tutorial: 1 = print answers token by token as the LLM generates them, with time-to-first-token and tokens/sec.
+# 0 = print each answer when it is complete, as in the original tutorial.
+CT_STREAMING = 1
+#
+# Tutorial: metadata filters applied before vector search in RAG answers, e.g. {"phase": "Phase 3", "overall_status": "Completed",
+# "start_date_from": "2015-01-01"}. Keys: sponsor, nct_id, phase, overall_status, study_type, <date column>_from / _to. {} = none.
+CT_RAG_FILTERS = {}
+#
+# Tutorial: 1 = hybrid retrieval: keyword (SQLite3 FTS5) + vector search, so NCT IDs and drug names are matched exactly. 0 = vector only.
+CT_HYBRID_RETRIEVAL = 1
+#
+# Tutorial: maximum tokens of retrieved context sent to the LLM. Duplicate chunks are dropped and chunks are trimmed to the
+# sentences with the keywords of the question (see datasdr_context.py); shorter prompts answer faster. 0 = send the chunks as retrieved.
+CT_CONTEXT_BUDGET = 1500
+#
+# Tutorial: 1 = time every pipeline stage (SQLite3 query, chunking, embedding, persist, retrieval, LLM ..) and print a report at the end.
+CT_METRICS = 0
+# Tutorial: optional outputs: one JSON line per timed stage, and a Prometheus text file. "" = none.
+CT_METRICS_JSONL = ""
+CT_METRICS_PROMETHEUS = ""
+# Tutorial: file for a cProfile profile of the whole run, e.g. "/Users/server/Downloads/test/tutorial.prof". "" = no profiling.
+CT_PROFILE = ""
 #
 # Tutorial: increase the timeout when running on low-powered hardware.
 CT_REQUEST_TIMEOUT = 360.0
@@ -109,7 +162,7 @@ start_time = time.time()
 #
 import os
 import sys
-from zipfile import ZipFile
+from contextlib import nullcontext
 #
 # Tutorial: import core LlamaIndex libraries needed for this file to run properly.
 # Notice a few new imports compared to Tutorial_01.py
@@ -126,19 +179,79 @@ from llama_index.core import (
 from llama_index.core.schema import Document, MetadataMode
 #
 # Tutorial: import LlamaIndex libraries needed to interface with Ollama.
-from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.llms.ollama import Ollama
 #
-# Tutorial: this library allows the Python code to access data stored in databases.
-from llama_index.readers.database import DatabaseReader
+# Tutorial: batched, concurrent replacement for OllamaEmbedding. Same model names, many fewer HTTP round trips.
+from datasdr_embeddings import DataSDROllamaEmbedding
+# Tutorial: persistent embedding cache; unchanged chunks are never embedded twice.
+from datasdr_embedding_cache import DataSDRCachedEmbedding
+#
+# Tutorial: loads the binary (memory-mapped) vector store when the index directory has one.
+from datasdr_vector_store import func_datasdr_load_index
+#
+# Tutorial: incremental refresh, see CT_REFRESH_MODE above.
+from datasdr_refresh import func_datasdr_refresh_sqlite_index
+#
+# Tutorial: file names and SELECT statement shared with the helper files.
+# Tutorial: rows become Documents with the row mapping of CT_ROW_MAPPING: narrative columns are embedded,
+# the other columns are typed metadata. Set CT_ROW_MAPPING = "flat" in datasdr_sqlite.py to embed every column.
+from datasdr_sqlite import (
+	func_datasdr_load_sponsor_documents,
+	func_datasdr_sponsor_index_directory,
+	func_datasdr_sponsor_sqlite_path,
+)
+#
+# Tutorial: SQL fast path for aggregate questions, see CT_STRUCTURED_QUERIES above.
+from datasdr_router import func_datasdr_answer_question
+#
+# Tutorial: client for the long-lived index server, see CT_INDEX_SERVER_URL above.
+from datasdr_index_server import func_datasdr_ask_server
+#
+# Tutorial: one question across all sponsors: parallel retrieval, merged top-k, one LLM call.
+from datasdr_fanout import func_datasdr_fanout_query, func_datasdr_load_sponsor_indices
+#
+# Tutorial: extracts only missing or stale SQLite3 files from the ZIPs.
+from datasdr_zip import func_datasdr_unzip_sqlite_files
+#
+# Tutorial: import the LLM response cache.
+from datasdr_response_cache import func_datasdr_cached_query_engine
+#
+# Tutorial: import the streaming helpers (time-to-first-token, tokens/sec).
+from datasdr_streaming import func_datasdr_print_answer, func_datasdr_print_response
+#
+# Tutorial: keyword + vector (hybrid) retrieval.
+from datasdr_hybrid import func_datasdr_hybrid_query_engine
+#
+# Tutorial: deduplicate, trim and pack the retrieved chunks under a token budget.
+from datasdr_context import DataSDRContextAssembler
+#
+# Tutorial: import the pipeline instrumentation (timers, counters, cProfile hook).
+from datasdr_metrics import (
+	CT_METRICS_REGISTRY,
+	func_datasdr_enable_metrics,
+	func_datasdr_stage,
+	func_datasdr_profile,
+)
+#
+# Tutorial: chunking and embedding as two timed stages.
+from datasdr_index_builder import func_datasdr_index_documents
+#
+# Tutorial: metadata filters (phase, status, dates, ..), applied with an inverted index before similarity scoring.
+from datasdr_metadata_index import func_datasdr_filters_from_dict
 #
 # Tutorial: call the specified embedding model.
 # An "embedding model" turns raw data into tokens ready to eb processed.
-Settings.embed_model = OllamaEmbedding(model_name=CT_EMBEDDING_MODEL[0])
+Settings.embed_model = DataSDRCachedEmbedding(
+	DataSDROllamaEmbedding(model_name=CT_EMBEDDING_MODEL[0]),
+	cache_path=CT_EMBEDDING_CACHE,
+)
 #
 # Tutorial: configure Ollama with the desired model name, and define a request timeout.
 Settings.llm = Ollama(model=CT_MODEL_NAME[0], request_timeout=CT_REQUEST_TIMEOUT)
 #
+# Tutorial: one context assembler for all sponsors; it keeps the prompt tokens saved per question.
+var_context_assembler = DataSDRContextAssembler(token_budget=CT_CONTEXT_BUDGET) if CT_CONTEXT_BUDGET else None
+#
 # Tutorial: initialize an index object.
 index = SummaryIndex([])
 #
@@ -146,54 +259,71 @@ CT_INDEX_DIR = os.path.join(CT_SQLITE3_DIRECTORY, "_index")
 #
 def func_datasdr_unzip_files(in_directory:str) -> int:
 	"""
-	This function unZIPs a directory full of ZIPped files.
+	This function unZIPs the SQLite3 files of a directory full of ZIPped files.
+	Files already extracted (same CRC-32 and size) are skipped; "__MACOSX" junk is never extracted.
 
 	in_directory: str - Directory where ZIped files are located at.
 	"""
-	for root, dirs, files in os.walk(CT_SQLITE3_DIRECTORY):
-		#
-		full_filenames = [os.path.join(root, name) for name in files]
-		for each_filename in full_filenames:
-			if each_filename.endswith(".zip"):
-				zfile = ZipFile(each_filename)
-				zfile.extractall(CT_SQLITE3_DIRECTORY)
-				zfile.close()
+	func_datasdr_unzip_sqlite_files(in_directory)
 	#
 	return 1
 #
 # Tutorial: now we open each SQLite3 file; retrieve records; and generate the corresponding index files:
-def func_datasdr_generate_indices(in_sponsors_dict, in_sqlite_directory: str) -> int:
+def func_datasdr_generate_indices(in_sponsors_dict, in_sqlite_directory: str, in_workers: int = CT_BUILD_WORKERS, in_refresh: int = CT_REFRESH_MODE) -> int:
 	"""
 	This function generates sponsor-specific index for each SQLite3 file in the directory.
 
 	in_sponsors_dict - Dictionary with names of sponsors.
 	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_workers: int - Number of sponsors indexed at the same time.
+	in_refresh: int - 1 = refresh existing indices incrementally.
 	"""
+	# Tutorial: in refresh mode, each sponsor index is compared with its SQLite3 file and only changed rows are processed.
+	if in_refresh == 1:
+		for one_sponsor in in_sponsors_dict:
+			# Tutorial: streamed indices cover the whole table, not only CT_LIMIT_RECORDS rows.
+			func_datasdr_refresh_sqlite_index(in_sqlite_directory, one_sponsor, None if CT_STREAM_BATCH_SIZE > 0 else CT_LIMIT_RECORDS)
+		return 1
+	#
+	# Tutorial: streaming mode pages through each whole table, chunking and embedding page by page.
+	if CT_STREAM_BATCH_SIZE > 0:
+		from datasdr_index_builder import func_datasdr_build_sponsor_index_streaming
+		for one_sponsor in in_sponsors_dict:
+			var_result = func_datasdr_build_sponsor_index_streaming(one_sponsor, in_sqlite_directory, in_batch_size=CT_STREAM_BATCH_SIZE, in_create_nct_id_index=CT_STREAM_CREATE_NCT_ID_INDEX == 1)
+			print("Index [%s] %s: %d rows, %d nodes in %.2f seconds\n" % (var_result["index_directory"], var_result["status"], var_result["documents"], var_result["nodes"], var_result["seconds"]))
+		return 1
+	#
+	# Tutorial: with more than one worker, sponsors are indexed in parallel by datasdr_index_builder.py.
+	if in_workers > 1:
+		from datasdr_index_builder import func_datasdr_generate_indices_parallel
+		func_datasdr_generate_indices_parallel(in_sponsors_dict, in_sqlite_directory, in_workers=in_workers, in_limit_records=CT_LIMIT_RECORDS, in_embedding_model=CT_EMBEDDING_MODEL[0], in_embedding_cache=CT_EMBEDDING_CACHE)
+		return 1
+	#
 	for one_sponsor in in_sponsors_dict:
-		# SQLite3:
-		reader_DB = DatabaseReader(
-			uri = "sqlite:///%sTrialTwin_%s.sqlite3" % (in_sqlite_directory, one_sponsor),
-		)
-		var_sponsor_index_directory = "%s_%s" % (in_sqlite_directory, one_sponsor)
+		var_sponsor_index_directory = func_datasdr_sponsor_index_directory(in_sqlite_directory, one_sponsor)
 		# Check if index already exists
 		if not os.path.exists(var_sponsor_index_directory):
 			os.makedirs(var_sponsor_index_directory)
 			#
 			print("\n\nRetrieve data from SQLite3 file for [%s]\n" % (one_sponsor))
 			#
-			documents_DB = reader_DB.load_data(
-			 	query="SELECT nct_id, nlm_download_date_description, study_first_submitted_date, results_first_submitted_date, disposition_first_submitted_date, last_update_submitted_date, study_first_submitted_qc_date, study_first_posted_date, study_first_posted_date_type, results_first_submitted_qc_date, results_first_posted_date, results_first_posted_date_type, disposition_first_submitted_qc_date, disposition_first_posted_date, disposition_first_posted_date_type, last_update_submitted_qc_date, last_update_posted_date, last_update_posted_date_type, start_month_year, start_date_type, start_date, verification_month_year, verification_date, completion_month_year, completion_date_type, completion_date, primary_completion_month_year, primary_completion_date_type, primary_completion_date, target_duration, study_type, acronym, baseline_population, brief_title, official_title, overall_status, last_known_status, phase, enrollment, enrollment_type, source, limitations_and_caveats, number_of_arms, number_of_groups, why_stopped, has_expanded_access, expanded_access_type_individual, expanded_access_type_intermediate, expanded_access_type_treatment, has_dmc, is_fda_regulated_drug, is_fda_regulated_device, is_unapproved_device, is_ppsd, is_us_export, biospec_retention, biospec_description, ipd_time_frame, ipd_access_criteria, ipd_url, plan_to_share_ipd, plan_to_share_ipd_description, created_at, updated_at, source_class, delayed_posting, expanded_access_nctid, expanded_access_status_for_nctid, fdaaa801_violation, baseline_type_units_analyzed, datasdr_brief_summaries__description, datasdr_downcase_name_list, datasdr_baseline_counts__count, datasdr_baseline_counts__ctgov_group_code, datasdr_baseline_counts__result_group_id, datasdr_baseline_counts__scope, datasdr_baseline_counts__units, datasdr_code_biospec_retention, datasdr_code_enrollment_type, datasdr_code_expanded_access_status_for_nctid, datasdr_code_last_known_status, datasdr_code_overall_status, datasdr_code_phase, datasdr_code_plan_to_share_ipd, datasdr_code_source_class, datasdr_code_study_type, datasdr_pdf_file_contents, datasdr_pdf_file_number_pages, datasdr_pdf_document_type, lead_or_collaborator, name FROM %s ORDER BY nct_id ASC LIMIT %d;" % (one_sponsor, CT_LIMIT_RECORDS)
+			documents_DB = func_datasdr_load_sponsor_documents(
+				func_datasdr_sponsor_sqlite_path(in_sqlite_directory, one_sponsor),
+				one_sponsor,
+				CT_LIMIT_RECORDS,
 			)
 			#
 			print("Database results received.\nWill generate index in directory [%s]\n" % (var_sponsor_index_directory))
 			#
-			index_DB = VectorStoreIndex.from_documents(
+			index_DB = func_datasdr_index_documents(
 				documents_DB,
-				show_progress=True
+				in_show_progress=True
 				)
 			#
-			index_DB.storage_context.persist(persist_dir=var_sponsor_index_directory)
-			print("Index stored in directory [%s]\n\n" % (var_sponsor_index_directory))
+			with func_datasdr_stage("persist", sponsor=one_sponsor):
+				index_DB.storage_context.persist(persist_dir=var_sponsor_index_directory)
+			print("Index stored in directory [%s]" % (var_sponsor_index_directory))
+			print(Settings.embed_model.func_cache_report(), "\n\n")
 		#
 	#
 	return 1
@@ -210,43 +340,104 @@ def func_datasdr_ask_questions(in_sponsors_dict, in_sqlite_directory) -> int:
 	print("\n\n\n= = = Inference = = =")
 
 	for one_sponsor in in_sponsors_dict:
-		var_sponsor_index_directory = "%s_%s" % (in_sqlite_directory, one_sponsor)
-		# Load existing index:
+		var_sponsor_index_directory = func_datasdr_sponsor_index_directory(in_sqlite_directory, one_sponsor)
 		print("\n\n= = = = = Sponsor: %s = = = = =\n" % (one_sponsor))
-		print("Loading index from directory [%s]" % (var_sponsor_index_directory))
-		storage_context = StorageContext.from_defaults(persist_dir=var_sponsor_index_directory)
-		index = load_index_from_storage(storage_context)
-		print("Index loaded.")
+		var_query_engine = []
 		#
-		# Tutorial: create a query engine on the index object.
-		query_engine= index.as_query_engine()
+		def func_get_query_engine():
+			# Tutorial: the index is only loaded the first time a question needs the RAG path.
+			if not var_query_engine:
+				# Load existing index:
+				print("Loading index from directory [%s]" % (var_sponsor_index_directory))
+				index = func_datasdr_load_index(var_sponsor_index_directory)
+				print("Index loaded.")
+				#
+				# Tutorial: create a query engine on the index object.
+				var_filters = func_datasdr_filters_from_dict(CT_RAG_FILTERS)
+				var_postprocessors = [var_context_assembler] if var_context_assembler is not None else []
+				if CT_HYBRID_RETRIEVAL == 1:
+					var_engine = func_datasdr_hybrid_query_engine(index, var_sponsor_index_directory, streaming=CT_STREAMING == 1, filters=var_filters, node_postprocessors=var_postprocessors)
+				else:
+					var_engine = index.as_query_engine(streaming=CT_STREAMING == 1, filters=var_filters, node_postprocessors=var_postprocessors)
+				if CT_RESPONSE_CACHE:
+					var_engine = func_datasdr_cached_query_engine(index, var_sponsor_index_directory, CT_RESPONSE_CACHE, in_query_engine=var_engine)
+				var_query_engine.append(var_engine)
+			return var_query_engine[0]
 		#
 		# Tutorial: now we ask the same question to all indices.
 		#
 		# Tutorial: ask questions to the query engine.
-		response_01 = query_engine.query("How many studies has this sponsor conducted?")
-		print(response_01, "\n")
-		#
-		response_02 = query_engine.query("How many studies of type 'Interventional'?")
-		print(response_02, "\n")
-		# 
-		response_03 = query_engine.query("How many studies have an overall status of 'Completed'?")
-		print(response_03, "\n")
+		for one_question in [
+			"How many studies has this sponsor conducted?",
+			"How many studies of type 'Interventional'?",
+			"How many studies have an overall status of 'Completed'?",
+		]:
+			if CT_INDEX_SERVER_URL:
+				var_result = func_datasdr_ask_server(one_sponsor, one_question, CT_INDEX_SERVER_URL, in_filters=CT_RAG_FILTERS)
+				print(var_result["answer"], "\n")
+				if CT_DEBUG:
+					print("[%s, %.3f seconds]\n" % (var_result["route"], var_result["seconds"]))
+			elif CT_STRUCTURED_QUERIES:
+				var_start = time.time()
+				var_result = func_datasdr_answer_question(one_question, in_sqlite_directory, one_sponsor, func_get_query_engine, in_create_indexes=CT_ROUTER_CREATE_INDEXES == 1)
+				# Tutorial: RAG answers are streamed; SQL answers are complete strings.
+				func_datasdr_print_response(var_result["answer"], var_start, var_result["route"] == "rag")
+				if CT_DEBUG:
+					print("[%s, %.3f seconds] %s\n" % (var_result["route"], var_result["seconds"], var_result["sql"] or ""))
+			else:
+				func_datasdr_print_answer(func_get_query_engine(), one_question)
 		#
-		return 1
+	if var_context_assembler is not None and var_context_assembler.reports:
+		print(var_context_assembler.func_context_report())
+	return 1
+#
+#
+def func_datasdr_ask_across_sponsors(in_sponsors_dict, in_sqlite_directory, in_question: str) -> int:
+	"""
+	This function asks ONE question across all sponsor indices: the indices are searched in parallel,
+	the best chunks of all sponsors are merged, and the LLM is called once to compare them.
+
+	in_sponsors_dict - Dictionary with names of sponsors.
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_question: str - Question in plain English.
+	"""
+	print("\n\n\n= = = Inference across sponsors = = =\n")
+	var_indices = func_datasdr_load_sponsor_indices(in_sqlite_directory, in_sponsors_dict)
+	print("Indices loaded: %s\n" % (", ".join(var_indices)))
+	var_start = time.time()
+	var_result = func_datasdr_fanout_query(var_indices, in_question, in_streaming=CT_STREAMING == 1, in_filters=func_datasdr_filters_from_dict(CT_RAG_FILTERS))
+	func_datasdr_print_response(var_result["answer"], var_start)
+	if CT_DEBUG:
+		for one_sponsor, one_score in var_result["sources"]:
+			print("\t%s: %.4f" % (one_sponsor, one_score or 0.0))
+		print("Retrieval: %.3f seconds, synthesis: %.3f seconds" % (var_result["retrieve_seconds"], var_result["synthesize_seconds"]))
+	return 1
 #
 #
 if __name__ == "__main__":
 	print ("\n\nStarting Tutorial_03.py\n\n")
 	#
-	# Tutorial: comment the following line if the ZIPped files have been extracted already:
-	# func_datasdr_unzip_files(CT_SQLITE3_DIRECTORY)
-	#
-	# Tutorial: comment the following line if the SQLite3 files have been processed already:
-	func_datasdr_generate_indices(CT_SPONSORS_NAME, CT_SQLITE3_DIRECTORY)
+	if CT_METRICS:
+		func_datasdr_enable_metrics(CT_METRICS_JSONL or None)
+	with (func_datasdr_profile(CT_PROFILE) if CT_PROFILE else nullcontext()):
+		#
+		# Tutorial: comment the following line if the ZIPped files have been extracted already:
+		# func_datasdr_unzip_files(CT_SQLITE3_DIRECTORY)
+		#
+		# Tutorial: comment the following line if the SQLite3 files have been processed already:
+		func_datasdr_generate_indices(CT_SPONSORS_NAME, CT_SQLITE3_DIRECTORY)
+		#
+		# Tutorial: ask questions.
+		# func_datasdr_ask_questions(CT_SPONSORS_NAME, CT_SQLITE3_DIRECTORY)
+		#
+		# Tutorial: ask one question to all sponsors at once.
+		# func_datasdr_ask_across_sponsors(CT_SPONSORS_NAME, CT_SQLITE3_DIRECTORY, "Which sponsors run studies on cirrhosis, and in which phases?")
 	#
-	# Tutorial: ask questions.
-	# func_datasdr_ask_questions(CT_SPONSORS_NAME, CT_SQLITE3_DIRECTORY)
+	# Tutorial: where did the time go?
+	if CT_METRICS:
+		print("\n" + CT_METRICS_REGISTRY.func_report())
+		if CT_METRICS_PROMETHEUS:
+			CT_METRICS_REGISTRY.func_write_prometheus(CT_METRICS_PROMETHEUS)
 
 
 
@@ -0,0 +1,332 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_ann.py
+# Purpose: Approximate nearest-neighbour (IVF) search on top of the binary vector store, with a recall check.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+DataSDRMmapVectorStore (and the default SimpleVectorStore) compare the question with EVERY stored
+embedding. That is fine for the 10 sample PDFs; it is not for the 400,000 trials of ClinicalTrials.gov.
+
+This file adds an inverted-file (IVF) index:
+* The embeddings are grouped into "n_lists" clusters with k-means (cosine similarity).
+* A question is compared with the cluster centres first, then only with the embeddings of the
+  "n_probe" closest clusters. With n_lists = sqrt(N), each question scores about n_probe * sqrt(N) rows.
+* Raise n_probe for better recall, lower it for speed. n_probe = n_lists is an exact search.
+* Rows added after training (refresh) are always scored, until the next persist assigns them a cluster.
+
+Files written next to the binary vector store:
+	default__vector_store.ivf.npz    - cluster centres and the cluster of every row.
+
+func_datasdr_load_index() in datasdr_vector_store.py picks up the IVF file automatically.
+
+Usage:
+	# Tutorial: build the IVF index of an existing index directory, then measure recall against brute force.
+	python3 datasdr_ann.py /Users/server/Downloads/test/_index
+	python3 datasdr_ann.py /Users/server/Downloads/test/_Datafiles/_Abbott --lists 80 --probe 1,2,4,8,16
+	# Tutorial: recall check only.
+	python3 datasdr_ann.py /Users/server/Downloads/test/_index --check
+"""
+
+import argparse
+import io
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import fsspec
+import numpy as np
+#
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode, VectorStoreQueryResult
+
+from datasdr_vector_store import (
+	CT_DEFAULT_BASENAME,
+	CT_DEFAULT_JSON_FNAME,
+	DataSDRMmapVectorStore,
+	func_datasdr_convert_index_directory,
+	func_datasdr_has_mmap_store,
+	func_datasdr_vector_store_base,
+	func_datasdr_write_atomic,
+)
+
+CT_IVF_SUFFIX = ".ivf.npz"
+#
+# Tutorial: clusters probed per question. Tune with the recall check below.
+CT_IVF_N_PROBE = 8
+#
+# Tutorial: k-means settings. Training uses a random sample of at most CT_IVF_TRAIN_SAMPLE rows.
+CT_IVF_ITERATIONS = 15
+CT_IVF_TRAIN_SAMPLE = 100000
+CT_IVF_SEED = 42
+#
+# Tutorial: re-train on persist when more than this fraction of the rows was added after training.
+CT_IVF_RETRAIN_FRACTION = 0.2
+#
+# Tutorial: rows scored per block when assigning clusters, to bound memory use.
+CT_IVF_BLOCK_ROWS = 65536
+
+
+def func_datasdr_ivf_default_lists(in_rows: int) -> int:
+	"""
+	This function returns the default number of clusters: about sqrt(N).
+
+	in_rows: int - Number of stored embeddings.
+	"""
+	return max(1, int(round(np.sqrt(in_rows))))
+#
+#
+def func_datasdr_normalize(in_vectors: np.ndarray) -> np.ndarray:
+	"""
+	This function returns float32 copies of the vectors with unit length, so dot product = cosine similarity.
+
+	in_vectors: np.ndarray - N x D matrix.
+	"""
+	var_vectors = np.asarray(in_vectors, dtype=np.float32)
+	var_norms = np.linalg.norm(var_vectors, axis=1, keepdims=True)
+	var_norms[var_norms == 0] = 1.0
+	return var_vectors / var_norms
+#
+#
+def func_datasdr_kmeans(in_vectors: np.ndarray, in_lists: int, in_iterations: int = CT_IVF_ITERATIONS, in_seed: int = CT_IVF_SEED) -> np.ndarray:
+	"""
+	This function clusters unit vectors with spherical k-means and returns the unit-length centres.
+
+	in_vectors: np.ndarray - N x D matrix of unit vectors.
+	in_lists: int - Number of clusters. Small indices get at most one cluster per vector.
+	in_iterations: int - k-means iterations.
+	in_seed: int - Random seed, so the same data always gives the same clusters.
+	"""
+	var_lists = max(1, min(in_lists, len(in_vectors)))
+	var_rng = np.random.default_rng(in_seed)
+	var_centroids = in_vectors[var_rng.choice(len(in_vectors), var_lists, replace=False)].copy()
+	for _ in range(in_iterations):
+		var_assignments = np.argmax(in_vectors @ var_centroids.T, axis=1)
+		var_sums = np.zeros_like(var_centroids)
+		np.add.at(var_sums, var_assignments, in_vectors)
+		var_counts = np.bincount(var_assignments, minlength=var_lists)
+		# Tutorial: an empty cluster is moved to a random vector, so no cluster is wasted.
+		var_empty = np.flatnonzero(var_counts == 0)
+		var_sums[var_empty] = in_vectors[var_rng.choice(len(in_vectors), len(var_empty))]
+		var_centroids = func_datasdr_normalize(var_sums)
+	return var_centroids
+#
+#
+class DataSDRIVFVectorStore(DataSDRMmapVectorStore):
+	"""
+	DataSDRMmapVectorStore with an inverted-file (IVF) index for approximate nearest-neighbour search.
+	"""
+
+	n_lists: int = Field(default=0, ge=0, description="Number of clusters. 0 = about sqrt(N), chosen when training.")
+	n_probe: int = Field(default=CT_IVF_N_PROBE, gt=0, description="Clusters scored per question.")
+
+	_centroids: Optional[np.ndarray] = PrivateAttr(default=None)
+	_assignments: np.ndarray = PrivateAttr(default_factory=lambda: np.zeros(0, dtype=np.int32))
+	_list_rows: Optional[np.ndarray] = PrivateAttr(default=None)
+	_list_offsets: Optional[np.ndarray] = PrivateAttr(default=None)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "DataSDRIVFVectorStore"
+
+	@classmethod
+	def from_persist_path(cls, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> "DataSDRIVFVectorStore":
+		"""
+		This function opens the binary vector store plus its IVF file, if there is one.
+
+		persist_path: str - Path of the JSON vector store file, with or without ".json".
+		"""
+		var_store = super().from_persist_path(persist_path, fs=fs)
+		var_ivf_path = func_datasdr_vector_store_base(persist_path) + CT_IVF_SUFFIX
+		if os.path.exists(var_ivf_path):
+			with np.load(var_ivf_path) as var_ivf:
+				var_assignments = var_ivf["assignments"]
+				# Tutorial: a crash between writing the IVF file and the sidecar leaves them out of step; then we search exactly.
+				if len(var_assignments) == len(var_store._ids):
+					var_store.n_lists = len(var_ivf["centroids"])
+					var_store.n_probe = int(var_ivf["n_probe"])
+					var_store._func_set_index(var_ivf["centroids"], var_assignments)
+		return var_store
+
+	# - - - - -
+	# Training and assignment.
+	def _func_set_index(self, in_centroids: np.ndarray, in_assignments: np.ndarray) -> None:
+		"""
+		This function stores the centres and builds the inverted lists: row numbers grouped by cluster.
+		"""
+		self._centroids = np.asarray(in_centroids, dtype=np.float32)
+		self._assignments = np.asarray(in_assignments, dtype=np.int32)
+		self._list_rows = np.argsort(self._assignments, kind="stable")
+		self._list_offsets = np.concatenate([[0], np.cumsum(np.bincount(self._assignments, minlength=len(self._centroids)))])
+
+	def func_assign(self, in_rows: np.ndarray) -> np.ndarray:
+		"""
+		This function returns the closest cluster of each row.
+
+		in_rows: np.ndarray - Row numbers.
+		"""
+		var_assignments = np.empty(len(in_rows), dtype=np.int32)
+		for var_start in range(0, len(in_rows), CT_IVF_BLOCK_ROWS):
+			var_block = func_datasdr_normalize(self._matrix[in_rows[var_start:var_start + CT_IVF_BLOCK_ROWS]])
+			var_assignments[var_start:var_start + len(var_block)] = np.argmax(var_block @ self._centroids.T, axis=1)
+		return var_assignments
+
+	def func_train(self, in_lists: int = 0) -> None:
+		"""
+		This function (re-)trains the clusters on the live rows and assigns every row to one.
+
+		in_lists: int - Number of clusters. 0 = keep n_lists, or about sqrt(N) if n_lists is 0.
+		"""
+		self._func_flush_pending()
+		var_alive = np.flatnonzero(self._alive)
+		if len(var_alive) == 0:
+			self._centroids = None
+			return
+		var_lists = min(in_lists or self.n_lists or func_datasdr_ivf_default_lists(len(var_alive)), len(var_alive))
+		var_rng = np.random.default_rng(CT_IVF_SEED)
+		var_sample = np.sort(var_rng.choice(var_alive, min(len(var_alive), CT_IVF_TRAIN_SAMPLE), replace=False))
+		var_centroids = func_datasdr_kmeans(func_datasdr_normalize(self._matrix[var_sample]), var_lists)
+		# Tutorial: k-means returns fewer clusters than asked when the training sample is smaller.
+		self.n_lists = len(var_centroids)
+		self._centroids = var_centroids
+		self._func_set_index(var_centroids, self.func_assign(np.arange(len(self._matrix))))
+
+	# - - - - -
+	# LlamaIndex vector store protocol.
+	def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+		"""Return the approximate top-k most similar nodes. Pass n_probe=.. through vector_store_kwargs to override it."""
+		if query.mode != VectorStoreQueryMode.DEFAULT:
+			raise ValueError("DataSDRIVFVectorStore only supports the default query mode, not [%s]" % (query.mode))
+		self._func_flush_pending()
+		# Tutorial: lists of node or document IDs are already small: search them exactly.
+		if self._centroids is None or query.node_ids is not None or query.doc_ids is not None:
+			return super().query(query, **kwargs)
+		if self._matrix is None or len(self._ids) == 0:
+			return VectorStoreQueryResult(similarities=[], ids=[])
+		#
+		if query.filters is not None:
+			var_allowed = np.zeros(len(self._ids), dtype=bool)
+			var_allowed[self.func_candidate_rows(query)] = True
+		else:
+			var_allowed = self._alive
+		var_query = func_datasdr_normalize(np.asarray([query.query_embedding]))[0]
+		var_order = np.argsort(-(self._centroids @ var_query))
+		# Tutorial: rows added after training have no cluster yet; they are always scored.
+		var_unassigned = np.arange(len(self._assignments), len(self._ids))
+		#
+		var_probe = min(kwargs.get("n_probe", self.n_probe), len(var_order))
+		while True:
+			var_rows = np.concatenate(
+				[self._list_rows[self._list_offsets[one_list]:self._list_offsets[one_list + 1]] for one_list in var_order[:var_probe]] + [var_unassigned]
+			)
+			var_rows = var_rows[var_allowed[var_rows]]
+			# Tutorial: strict filters can leave too few rows in the probed clusters; probe more.
+			if len(var_rows) >= query.similarity_top_k or var_probe >= len(var_order):
+				break
+			var_probe = min(var_probe * 2, len(var_order))
+		if len(var_rows) == 0:
+			return VectorStoreQueryResult(similarities=[], ids=[])
+		return self.func_top_k(query.query_embedding, np.sort(var_rows), query.similarity_top_k)
+
+	def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+		"""
+		Write the IVF file, then the binary vector store. New rows are assigned to the closest cluster,
+		or the clusters are re-trained when many rows were added since training.
+		"""
+		self._func_flush_pending()
+		var_alive = np.flatnonzero(self._alive)
+		var_new = len(self._ids) - len(self._assignments)
+		if self._centroids is None or var_new > CT_IVF_RETRAIN_FRACTION * max(1, len(var_alive)):
+			self.func_train()
+		elif var_new > 0:
+			self._func_set_index(self._centroids, np.concatenate([self._assignments, self.func_assign(np.arange(len(self._assignments), len(self._ids)))]))
+		#
+		if self._centroids is not None:
+			var_buffer = io.BytesIO()
+			np.savez(var_buffer, centroids=self._centroids, assignments=self._assignments[var_alive], n_probe=np.int32(self.n_probe))
+			func_datasdr_write_atomic(func_datasdr_vector_store_base(persist_path) + CT_IVF_SUFFIX, lambda f: f.write(var_buffer.getvalue()))
+		# Tutorial: the files only keep live rows; in memory, deleted rows stay hidden by the "alive" mask.
+		super().persist(persist_path, fs=fs)
+#
+#
+def func_datasdr_build_ivf_index(in_index_directory: str, in_lists: int = 0, in_probe: int = CT_IVF_N_PROBE) -> DataSDRIVFVectorStore:
+	"""
+	This function adds an IVF file to an index directory, converting its JSON vector store to the binary format first if needed.
+
+	in_index_directory: str - Index directory.
+	in_lists: int - Number of clusters. 0 = about sqrt(N).
+	in_probe: int - Default clusters probed per question, saved with the index.
+	"""
+	if not func_datasdr_has_mmap_store(in_index_directory):
+		func_datasdr_convert_index_directory(in_index_directory)
+	var_persist_path = os.path.join(in_index_directory, CT_DEFAULT_JSON_FNAME)
+	var_store = DataSDRIVFVectorStore.from_persist_path(var_persist_path)
+	var_start = time.time()
+	var_store.n_probe = in_probe
+	var_store.func_train(in_lists)
+	var_store.persist(var_persist_path)
+	print("IVF index for [%s]: %d vectors in %d clusters, trained in %.2f seconds" % (in_index_directory, len(var_store._ids), var_store.n_lists, time.time() - var_start))
+	return var_store
+#
+#
+def func_datasdr_ivf_recall(in_index_directory: str, in_probes: List[int], in_queries: int = 200, in_top_k: int = 10, in_seed: int = CT_IVF_SEED) -> List[Dict]:
+	"""
+	This function measures recall@k and latency of the IVF search against an exact (brute-force) search.
+	Queries are the midpoints of two random stored embeddings: close to real content, but never an exact copy of one row.
+	Returns one dictionary per n_probe value.
+
+	in_index_directory: str - Index directory with an IVF file.
+	in_probes - n_probe values to measure.
+	in_queries: int - Number of queries.
+	in_top_k: int - k of recall@k.
+	in_seed: int - Random seed for the queries.
+	"""
+	var_store = DataSDRIVFVectorStore.from_persist_dir(in_index_directory)
+	if var_store._centroids is None:
+		raise ValueError("No IVF file in [%s]: run 'python3 datasdr_ann.py %s' first" % (in_index_directory, in_index_directory))
+	var_rng = np.random.default_rng(in_seed)
+	var_unit = func_datasdr_normalize(var_store._matrix)
+	var_pairs = var_rng.integers(0, len(var_unit), size=(in_queries, 2))
+	var_query_vectors = func_datasdr_normalize(var_unit[var_pairs[:, 0]] + var_unit[var_pairs[:, 1]])
+	var_queries = [VectorStoreQuery(query_embedding=one_vector.tolist(), similarity_top_k=in_top_k) for one_vector in var_query_vectors]
+	#
+	var_start = time.time()
+	var_exact = [set(DataSDRMmapVectorStore.query(var_store, one_query).ids) for one_query in var_queries]
+	var_exact_ms = (time.time() - var_start) * 1000.0 / in_queries
+	#
+	var_results = []
+	for one_probe in in_probes:
+		var_start = time.time()
+		var_found = [var_store.query(one_query, n_probe=one_probe).ids for one_query in var_queries]
+		var_ms = (time.time() - var_start) * 1000.0 / in_queries
+		var_recall = np.mean([len(var_exact[i] & set(one_ids)) / max(1, len(var_exact[i])) for i, one_ids in enumerate(var_found)])
+		var_results.append({"n_probe": one_probe, "n_lists": var_store.n_lists, "recall": float(var_recall), "ms_per_query": var_ms, "exact_ms_per_query": var_exact_ms})
+	return var_results
+#
+#
+if __name__ == "__main__":
+	var_parser = argparse.ArgumentParser(description="Build an IVF index and measure its recall against brute force.")
+	var_parser.add_argument("index_directory", nargs="+")
+	var_parser.add_argument("--lists", type=int, default=0, help="Number of clusters. Default: about sqrt(N).")
+	var_parser.add_argument("--probe", default="1,2,4,8,16", help="n_probe values for the recall check. The first value >= 95%% recall is saved as default.")
+	var_parser.add_argument("--queries", type=int, default=200)
+	var_parser.add_argument("--top-k", type=int, default=10)
+	var_parser.add_argument("--check", action="store_true", help="Only run the recall check.")
+	var_arguments = var_parser.parse_args()
+	var_probes = [int(one_value) for one_value in var_arguments.probe.split(",")]
+	#
+	for one_directory in var_arguments.index_directory:
+		if not var_arguments.check:
+			func_datasdr_build_ivf_index(one_directory, var_arguments.lists)
+		var_results = func_datasdr_ivf_recall(one_directory, var_probes, var_arguments.queries, var_arguments.top_k)
+		print("\n%s  (recall@%d over %d queries; exact search: %.3f ms/query)" % (one_directory, var_arguments.top_k, var_arguments.queries, var_results[0]["exact_ms_per_query"]))
+		print("%8s %8s %8s %12s" % ("n_lists", "n_probe", "recall", "ms/query"))
+		for one_result in var_results:
+			print("%8d %8d %8.3f %12.3f" % (one_result["n_lists"], one_result["n_probe"], one_result["recall"], one_result["ms_per_query"]))
+		if not var_arguments.check:
+			# Tutorial: save the fastest n_probe that reaches 95% recall as the default of this index.
+			var_good = [one_result["n_probe"] for one_result in var_results if one_result["recall"] >= 0.95]
+			if var_good:
+				var_store = DataSDRIVFVectorStore.from_persist_dir(one_directory)
+				var_store.n_probe = min(var_good)
+				var_store.persist(os.path.join(one_directory, CT_DEFAULT_JSON_FNAME))
+				print("Default n_probe saved: %d" % (var_store.n_probe))
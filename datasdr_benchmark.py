@@ -0,0 +1,356 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_benchmark.py
+# Purpose: Reproducible benchmark of the indexing and query paths on the bundled sample data.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+The tutorials only print "--- Runtime: .. seconds ---" at the end. That number mixes every stage,
+and depends on the speed of the local Ollama models.
+
+This file measures each stage on the data shipped with the repository, against the deterministic fake
+Ollama server of datasdr_fake_ollama.py (embeddings and chat), so two runs on the same machine are comparable:
+* ClinicalTrials_gov_10_PDFs.zip: PDF ingest (pages/sec), streamed from the ZIP.
+* TrialTwin_Abbott.sqlite3.zip: SQLite3 extraction, then rows/sec, as in Tutorial_03.py.
+* 100_Drugs_FDA.zip: load of a pre-generated index straight from its ZIP.
+For each of the three corpora: chunking, embeddings/sec, index persist and load time, retrieval p50/p95/p99.
+Then LLM answers through /api/chat: time-to-first-token and tokens/sec. The peak RSS of the process so far is recorded
+after every stage ("process_peak_rss_mb"); it is a high-water mark, so it only grows when a stage raises it.
+
+Results go to a JSON file. Compare two runs (e.g. before and after a change) to spot regressions.
+
+Usage:
+	python3 datasdr_benchmark.py run                                   # writes benchmark_results.json
+	python3 datasdr_benchmark.py run --output after.json --queries 500
+	python3 datasdr_benchmark.py compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Tutorial: default location of the bundled ZIP files: the directory of this file.
+CT_BENCH_DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+CT_BENCH_OUTPUT = "benchmark_results.json"
+#
+CT_BENCH_PDF_ZIP = "ClinicalTrials_gov_10_PDFs.zip"
+CT_BENCH_SQLITE_ZIP = "TrialTwin_Abbott.sqlite3.zip"
+CT_BENCH_SQLITE_SPONSOR = "Abbott"
+CT_BENCH_FDA_ZIP = "100_Drugs_FDA.zip"
+#
+# Tutorial: rows of the sponsor table indexed; the whole table takes much longer to embed.
+CT_BENCH_SQLITE_ROWS = 500
+#
+# Tutorial: retrievals timed per corpus, and LLM answers timed in total.
+CT_BENCH_QUERIES = 200
+CT_BENCH_LLM_QUERIES = 10
+CT_BENCH_TOP_K = 2
+#
+# Tutorial: simulated Ollama costs. 0 = measure only the code of this repository.
+CT_BENCH_REQUEST_DELAY = 0.0
+CT_BENCH_TEXT_DELAY = 0.0
+CT_BENCH_EMBEDDING_DIM = 768
+#
+# Tutorial: fixed questions, asked in this order, so every run does the same work.
+CT_BENCH_QUESTIONS = [
+	"Describe the protocol about Thrombosis?",
+	"What do you know about elastography from the context?",
+	"What do you know about Heplisav B from the context?",
+	"Which studies are about cirrhosis?",
+	"What are the inclusion criteria?",
+	"Which drugs are approved as tablets?",
+	"Who is the sponsor of the study?",
+	"What is the primary outcome measure?",
+	"Are there any age restrictions?",
+	"How many participants were enrolled?",
+]
+
+
+def func_datasdr_peak_rss_mb() -> Optional[float]:
+	"""
+	This function returns the peak resident memory of this process so far, in MB.
+	Returns None on Windows without psutil.
+	"""
+	try:
+		import resource
+	except ImportError:
+		# Tutorial: "resource" is Unix-only. On Windows, psutil reports the peak working set, if it is installed.
+		try:
+			import psutil
+		except ImportError:
+			return None
+		var_memory = psutil.Process().memory_info()
+		return getattr(var_memory, "peak_wset", var_memory.rss) / 1048576.0
+	var_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Tutorial: macOS reports bytes, Linux reports kilobytes.
+	return var_peak / 1048576.0 if sys.platform == "darwin" else var_peak / 1024.0
+#
+#
+def func_datasdr_percentiles(in_seconds: List[float]) -> Dict[str, float]:
+	"""
+	This function summarizes a list of latencies, in milliseconds. An empty list (e.g. --queries 0) gives zeros.
+
+	in_seconds - Latencies in seconds.
+	"""
+	if not in_seconds:
+		return {"count": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+	var_ms = np.asarray(in_seconds, dtype=np.float64) * 1000.0
+	return {
+		"count": int(var_ms.size),
+		"mean_ms": float(var_ms.mean()),
+		"p50_ms": float(np.percentile(var_ms, 50)),
+		"p95_ms": float(np.percentile(var_ms, 95)),
+		"p99_ms": float(np.percentile(var_ms, 99)),
+		"max_ms": float(var_ms.max()),
+	}
+#
+#
+def func_datasdr_git_version(in_directory: str) -> str:
+	"""
+	This function returns the git commit of the repository ("" outside a git checkout), so results name their version.
+
+	in_directory: str - Directory inside the repository.
+	"""
+	try:
+		return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=in_directory, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return ""
+#
+#
+def func_datasdr_bench_corpus(in_name: str, in_documents, in_work_directory: str, in_queries: int) -> Dict:
+	"""
+	This function chunks, embeds, persists, re-loads and queries one corpus. Returns its measurements.
+
+	in_name: str - Corpus name, used for the index directory.
+	in_documents - Documents (or nodes) of the corpus.
+	in_work_directory: str - Scratch directory.
+	in_queries: int - Number of timed retrievals.
+	"""
+	from llama_index.core import Settings, VectorStoreIndex
+	from llama_index.core.schema import QueryBundle
+	#
+	from datasdr_docstore import func_datasdr_new_storage_context
+	from datasdr_vector_store import DataSDRMmapVectorStore, func_datasdr_load_index
+	#
+	var_result: Dict = {"documents": len(in_documents)}
+	var_start = time.perf_counter()
+	var_nodes = Settings.node_parser.get_nodes_from_documents(in_documents)
+	var_result["chunk_seconds"] = time.perf_counter() - var_start
+	var_result["chunks"] = len(var_nodes)
+	#
+	var_start = time.perf_counter()
+	var_index = VectorStoreIndex(var_nodes, storage_context=func_datasdr_new_storage_context(DataSDRMmapVectorStore()))
+	var_result["embed_seconds"] = time.perf_counter() - var_start
+	var_result["embeddings_per_second"] = len(var_nodes) / var_result["embed_seconds"]
+	#
+	var_index_directory = os.path.join(in_work_directory, "_index_%s" % (in_name))
+	var_start = time.perf_counter()
+	var_index.storage_context.persist(persist_dir=var_index_directory)
+	var_result["persist_seconds"] = time.perf_counter() - var_start
+	var_result["index_bytes"] = sum(one_entry.stat().st_size for one_entry in os.scandir(var_index_directory) if one_entry.is_file())
+	del var_index
+	#
+	var_start = time.perf_counter()
+	var_index = func_datasdr_load_index(var_index_directory)
+	var_result["load_seconds"] = time.perf_counter() - var_start
+	#
+	# Tutorial: the question embeddings are computed before timing, so only the search itself is measured.
+	var_retriever = var_index.as_retriever(similarity_top_k=CT_BENCH_TOP_K)
+	var_bundles = [QueryBundle(query_str=one_question, embedding=Settings.embed_model.get_query_embedding(one_question)) for one_question in CT_BENCH_QUESTIONS]
+	var_latencies = []
+	for i in range(in_queries):
+		var_start = time.perf_counter()
+		var_retriever.retrieve(var_bundles[i % len(var_bundles)])
+		var_latencies.append(time.perf_counter() - var_start)
+	var_result["retrieval"] = func_datasdr_percentiles(var_latencies)
+	return var_result
+#
+#
+def func_datasdr_run_benchmark(
+	in_data_directory: str = CT_BENCH_DATA_DIR,
+	in_queries: int = CT_BENCH_QUERIES,
+	in_llm_queries: int = CT_BENCH_LLM_QUERIES,
+	in_sqlite_rows: int = CT_BENCH_SQLITE_ROWS,
+	in_request_delay: float = CT_BENCH_REQUEST_DELAY,
+	in_text_delay: float = CT_BENCH_TEXT_DELAY,
+	in_embedding_dim: int = CT_BENCH_EMBEDDING_DIM,
+) -> Dict:
+	"""
+	This function runs every stage of the benchmark and returns the results as a dictionary.
+
+	in_data_directory: str - Directory with the bundled ZIP files.
+	in_queries: int - Timed retrievals per corpus.
+	in_llm_queries: int - Timed LLM answers.
+	in_sqlite_rows: int - Rows of the sponsor table to index.
+	in_request_delay: float - Simulated seconds per embedding request.
+	in_text_delay: float - Simulated seconds per embedded text.
+	in_embedding_dim: int - Dimensions of the fake embeddings.
+	"""
+	from llama_index.core import Settings
+	from llama_index.llms.ollama import Ollama
+	#
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	from datasdr_fake_ollama import func_datasdr_start_fake_ollama
+	from datasdr_sqlite import func_datasdr_embedded_tokens, func_datasdr_iter_sponsor_rows, func_datasdr_row_mapping_version, func_datasdr_row_to_document, func_datasdr_sponsor_sqlite_path
+	from datasdr_streaming import func_datasdr_stream_query
+	from datasdr_zip import func_datasdr_extract_stale_members, func_datasdr_load_index_from_zip, func_datasdr_load_zip_documents
+	#
+	var_server = func_datasdr_start_fake_ollama(in_request_delay=in_request_delay, in_text_delay=in_text_delay, in_embedding_dim=in_embedding_dim)
+	var_base_url = "http://127.0.0.1:%d" % (var_server.server_address[1])
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text", base_url=var_base_url)
+	Settings.llm = Ollama(model="llama3", base_url=var_base_url, request_timeout=360.0)
+	var_work_directory = tempfile.mkdtemp(prefix="datasdr_benchmark_")
+	var_results: Dict = {}
+	# Tutorial: ru_maxrss is the peak of the whole process so far, not the memory of one stage.
+	var_peak_rss: Dict[str, Optional[float]] = {}
+	try:
+		# Tutorial: 1. PDFs, read straight from the ZIP.
+		var_start = time.perf_counter()
+		var_pdf_documents = func_datasdr_load_zip_documents(os.path.join(in_data_directory, CT_BENCH_PDF_ZIP))
+		var_seconds = time.perf_counter() - var_start
+		var_results["pdf_ingest"] = {"pages": len(var_pdf_documents), "seconds": var_seconds, "pages_per_second": len(var_pdf_documents) / var_seconds}
+		var_peak_rss["after_pdf_ingest"] = func_datasdr_peak_rss_mb()
+		print("PDF ingest: %d pages, %.1f pages/sec" % (len(var_pdf_documents), var_results["pdf_ingest"]["pages_per_second"]))
+		#
+		# Tutorial: 2. SQLite3 rows, as in Tutorial_03.py.
+		var_start = time.perf_counter()
+		func_datasdr_extract_stale_members(os.path.join(in_data_directory, CT_BENCH_SQLITE_ZIP), var_work_directory)
+		var_extract_seconds = time.perf_counter() - var_start
+		var_start = time.perf_counter()
+		var_sqlite_documents = [
+			func_datasdr_row_to_document(one_row[0], one_row[1:])
+			for one_page in func_datasdr_iter_sponsor_rows(func_datasdr_sponsor_sqlite_path(var_work_directory + os.sep, CT_BENCH_SQLITE_SPONSOR), CT_BENCH_SQLITE_SPONSOR, in_limit_records=in_sqlite_rows)
+			for one_row in one_page
+		]
+		var_seconds = time.perf_counter() - var_start
+		var_results["sqlite_ingest"] = {"extract_seconds": var_extract_seconds, "rows": len(var_sqlite_documents), "seconds": var_seconds, "rows_per_second": len(var_sqlite_documents) / var_seconds}
+		var_peak_rss["after_sqlite_ingest"] = func_datasdr_peak_rss_mb()
+		# Tutorial: tokens embedded per row depend on the row mapping (datasdr_sqlite.py).
+		var_results["sqlite_ingest"]["row_mapping"] = func_datasdr_row_mapping_version()
+		var_results["sqlite_ingest"]["embed_tokens_per_row"] = func_datasdr_embedded_tokens(var_sqlite_documents)["embed_tokens_per_document"]
+		print("SQLite3 ingest: %d rows, %.1f rows/sec, %.1f embedded tokens/row" % (len(var_sqlite_documents), var_results["sqlite_ingest"]["rows_per_second"], var_results["sqlite_ingest"]["embed_tokens_per_row"]))
+		#
+		# Tutorial: 3. Pre-generated FDA index, loaded from its ZIP. Its nodes are re-embedded below.
+		var_start = time.perf_counter()
+		var_fda_index = func_datasdr_load_index_from_zip(os.path.join(in_data_directory, CT_BENCH_FDA_ZIP))
+		var_seconds = time.perf_counter() - var_start
+		var_fda_nodes = list(var_fda_index.docstore.docs.values())
+		var_results["fda_load"] = {"nodes": len(var_fda_nodes), "seconds": var_seconds}
+		var_peak_rss["after_fda_load"] = func_datasdr_peak_rss_mb()
+		print("FDA index load: %d nodes in %.2f seconds" % (len(var_fda_nodes), var_seconds))
+		del var_fda_index
+		#
+		for var_name, var_documents in [("pdf", var_pdf_documents), ("sqlite", var_sqlite_documents), ("fda", var_fda_nodes)]:
+			var_results["index_%s" % (var_name)] = func_datasdr_bench_corpus(var_name, var_documents, var_work_directory, in_queries)
+			var_one = var_results["index_%s" % (var_name)]
+			var_peak_rss["after_index_%s" % (var_name)] = func_datasdr_peak_rss_mb()
+			print("Index %-6s: %5d chunks, %8.1f embeddings/sec, persist %.2f s, load %.2f s, retrieval p50 %.2f ms, p99 %.2f ms" % (
+				var_name, var_one["chunks"], var_one["embeddings_per_second"], var_one["persist_seconds"], var_one["load_seconds"],
+				var_one["retrieval"]["p50_ms"], var_one["retrieval"]["p99_ms"],
+			))
+		#
+		# Tutorial: 4. Full questions (retrieval + streamed LLM answer) against the PDF index.
+		from datasdr_vector_store import func_datasdr_load_index
+		var_query_engine = func_datasdr_load_index(os.path.join(var_work_directory, "_index_pdf")).as_query_engine(streaming=True)
+		var_answers = [func_datasdr_stream_query(var_query_engine, CT_BENCH_QUESTIONS[i % len(CT_BENCH_QUESTIONS)]) for i in range(in_llm_queries)]
+		var_results["llm_query"] = {
+			"ttft": func_datasdr_percentiles([one_stats["ttft_seconds"] for one_stats in var_answers]),
+			"total": func_datasdr_percentiles([one_stats["seconds"] for one_stats in var_answers]),
+			"tokens_per_second": float(np.mean([one_stats["tokens_per_second"] for one_stats in var_answers])) if var_answers else 0.0,
+		}
+		var_peak_rss["after_llm_query"] = func_datasdr_peak_rss_mb()
+		print("LLM query: time-to-first-token p50 %.1f ms, %.1f tokens/sec" % (var_results["llm_query"]["ttft"]["p50_ms"], var_results["llm_query"]["tokens_per_second"]))
+	finally:
+		var_server.shutdown()
+		shutil.rmtree(var_work_directory, ignore_errors=True)
+	var_results["process_peak_rss_mb"] = var_peak_rss
+	#
+	return {
+		"version": func_datasdr_git_version(CT_BENCH_DATA_DIR),
+		"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"cpu_count": os.cpu_count(),
+		"settings": {
+			"queries": in_queries, "llm_queries": in_llm_queries, "sqlite_rows": in_sqlite_rows, "top_k": CT_BENCH_TOP_K,
+			"request_delay": in_request_delay, "text_delay": in_text_delay, "embedding_dim": in_embedding_dim,
+		},
+		"peak_rss_mb": func_datasdr_peak_rss_mb(),
+		"results": var_results,
+	}
+#
+#
+def func_datasdr_flatten_results(in_results: Dict, in_prefix: str = "") -> Dict[str, float]:
+	"""
+	This function flattens nested results into {"index_pdf.retrieval.p50_ms": 1.23, ..}, keeping numbers only.
+
+	in_results - Results, or part of them.
+	in_prefix: str - Key prefix.
+	"""
+	var_flat: Dict[str, float] = {}
+	for one_key, one_value in in_results.items():
+		if isinstance(one_value, dict):
+			var_flat.update(func_datasdr_flatten_results(one_value, in_prefix + one_key + "."))
+		elif isinstance(one_value, (int, float)) and not isinstance(one_value, bool):
+			var_flat[in_prefix + one_key] = one_value
+	return var_flat
+#
+#
+def func_datasdr_compare_results(in_before: Dict, in_after: Dict) -> None:
+	"""
+	This function prints every measurement of two benchmark runs side by side, with the relative change.
+
+	in_before - Results of the reference run.
+	in_after - Results of the new run.
+	"""
+	var_before = func_datasdr_flatten_results(in_before["results"])
+	var_after = func_datasdr_flatten_results(in_after["results"])
+	print("%-48s %14s %14s %9s" % ("", in_before.get("version") or "before", in_after.get("version") or "after", "change"))
+	for one_key in sorted(set(var_before) | set(var_after)):
+		var_old = var_before.get(one_key)
+		var_new = var_after.get(one_key)
+		var_change = ""
+		if var_old and var_new is not None:
+			var_change = "%+.1f%%" % (100.0 * (var_new - var_old) / var_old)
+		print("%-48s %14s %14s %9s" % (one_key, "-" if var_old is None else "%.3f" % var_old, "-" if var_new is None else "%.3f" % var_new, var_change))
+#
+#
+if __name__ == "__main__":
+	var_parser = argparse.ArgumentParser(description="DataSDR benchmark on the bundled sample data.")
+	var_commands = var_parser.add_subparsers(dest="command", required=True)
+	var_run = var_commands.add_parser("run", help="Run the benchmark and write the results to a JSON file.")
+	var_run.add_argument("--data-dir", default=CT_BENCH_DATA_DIR, help="Directory with the bundled ZIP files.")
+	var_run.add_argument("--output", default=CT_BENCH_OUTPUT)
+	var_run.add_argument("--queries", type=int, default=CT_BENCH_QUERIES)
+	var_run.add_argument("--llm-queries", type=int, default=CT_BENCH_LLM_QUERIES)
+	var_run.add_argument("--sqlite-rows", type=int, default=CT_BENCH_SQLITE_ROWS)
+	var_run.add_argument("--request-delay", type=float, default=CT_BENCH_REQUEST_DELAY)
+	var_run.add_argument("--text-delay", type=float, default=CT_BENCH_TEXT_DELAY)
+	var_run.add_argument("--embedding-dim", type=int, default=CT_BENCH_EMBEDDING_DIM)
+	var_compare = var_commands.add_parser("compare", help="Compare two result files.")
+	var_compare.add_argument("before")
+	var_compare.add_argument("after")
+	var_args = var_parser.parse_args()
+	#
+	if var_args.command == "run":
+		var_report = func_datasdr_run_benchmark(
+			var_args.data_dir, var_args.queries, var_args.llm_queries, var_args.sqlite_rows,
+			var_args.request_delay, var_args.text_delay, var_args.embedding_dim,
+		)
+		with open(var_args.output, "w") as f:
+			json.dump(var_report, f, indent=1)
+		print("\nPeak RSS: %s MB. Results written to [%s]" % ("n/a" if var_report["peak_rss_mb"] is None else "%.1f" % (var_report["peak_rss_mb"]), var_args.output))
+	else:
+		with open(var_args.before, "r") as f:
+			var_before = json.load(f)
+		with open(var_args.after, "r") as f:
+			var_after = json.load(f)
+		func_datasdr_compare_results(var_before, var_after)
@@ -0,0 +1,438 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_cli.py
+# Purpose: One command-line entry point (build, refresh, ask, bench ..) that only imports what each command needs.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+Every tutorial imports LlamaIndex, the Ollama clients and DatabaseReader at the top, and creates
+Settings.embed_model and Settings.llm before doing anything else. Each run pays seconds of imports,
+even to list the sponsors or to check that an index exists, and the paths are "/Users/server/.." constants.
+
+This file is a single entry point with subcommands. Paths, sponsors and models are arguments:
+* sponsors  - list the TrialTwin SQLite3 files of a directory and their index directories. Standard library only.
+* check     - report which files an index directory contains (vector store, docstore, int8/IVF, keyword index). Standard library only.
+* build     - build a PDF index (Tutorial_02.py) or sponsor indices (Tutorial_03.py).
+* refresh   - refresh a PDF index or sponsor indices incrementally (datasdr_refresh.py).
+* reembed   - re-embed an index with another embedding model, next to its current vector store (datasdr_reembed.py).
+* ask       - answer questions from an index. With --sponsor, structured questions are answered with SQL first
+              (datasdr_router.py), and the index, the embedding model and the LLM are only loaded for the others.
+* bench     - run datasdr_benchmark.py on the bundled sample data.
+
+Modules are imported inside each command, and the embedding model and LLM are created only when the command
+uses them. --import-times prints how long each import and each client took.
+
+Usage:
+	python3 datasdr_cli.py sponsors /Users/server/Downloads/test/_Datafiles/
+	python3 datasdr_cli.py check /Users/server/Downloads/test/_index
+	python3 datasdr_cli.py build pdf /Users/server/Downloads/test/_data /Users/server/Downloads/test/_index --extract-workers 4
+	python3 datasdr_cli.py build sqlite /Users/server/Downloads/test/_Datafiles/ Abbott Pfizer --workers 2 --limit 10
+	python3 datasdr_cli.py refresh pdf /Users/server/Downloads/test/_data /Users/server/Downloads/test/_index
+	python3 datasdr_cli.py ask /Users/server/Downloads/test/_index "Describe the protocol about Thrombosis?" --model llama3
+	python3 datasdr_cli.py ask /Users/server/Downloads/test/_Datafiles/ "How many studies has this sponsor conducted?" --sponsor Abbott
+	python3 datasdr_cli.py reembed /Users/server/Downloads/test/_index --embedding-model mxbai-embed-large
+	python3 datasdr_cli.py ask /Users/server/Downloads/test/_index "Describe the protocol about Thrombosis?" --namespace mxbai_embed_large --embedding-model mxbai-embed-large
+	python3 datasdr_cli.py --import-times bench --queries 50
+"""
+
+import time
+CT_CLI_START = time.perf_counter()
+#
+import argparse
+import glob
+import importlib
+import os
+import sys
+from typing import Dict, List, Optional
+
+# Tutorial: same defaults as the tutorials.
+CT_CLI_MODEL = "llama3"
+CT_CLI_EMBEDDING_MODEL = "nomic-embed-text"
+CT_CLI_REQUEST_TIMEOUT = 360.0
+CT_CLI_OLLAMA_BASE_URL = "http://localhost:11434"
+# Tutorial: nodes embedded per batch by "reembed", as CT_REEMBED_BATCH_NODES in datasdr_reembed.py.
+CT_CLI_REEMBED_BATCH = 512
+# Tutorial: tokens of retrieved context sent to the LLM by "ask", as CT_CONTEXT_BUDGET in the tutorials. 0 = chunks as retrieved.
+CT_CLI_CONTEXT_BUDGET = 1500
+#
+# Tutorial: files "check" looks for. Names as in datasdr_vector_store.py, datasdr_ann.py, datasdr_quantize.py,
+# datasdr_docstore.py, datasdr_refresh.py and datasdr_hybrid.py; repeated here because importing those modules imports LlamaIndex.
+CT_CLI_INDEX_FILES = [
+	("index_store.json", "index structure"),
+	("default__vector_store.json", "vector store (JSON)"),
+	("default__vector_store.npy", "vector store (binary, memory-mapped)"),
+	("default__vector_store.int8.npz", "int8 codes (datasdr_quantize.py)"),
+	("default__vector_store.ivf.npz", "IVF clusters (datasdr_ann.py)"),
+	("docstore.json", "docstore (JSON)"),
+	("docstore.sqlite3", "docstore (SQLite3)"),
+	("datasdr_manifest.json", "refresh manifest"),
+]
+#
+# Tutorial: seconds spent importing each module and creating each client, in order. Printed by --import-times.
+CT_STARTUP_SECONDS: Dict[str, float] = {}
+
+
+def func_datasdr_lazy_import(in_module: str):
+	"""
+	This function imports a module the first time a command needs it, and records how long the import took.
+	Modules already imported by an earlier import cost nothing and are not recorded again.
+
+	in_module: str - Module name, e.g. "datasdr_vector_store".
+	"""
+	if in_module in sys.modules:
+		return sys.modules[in_module]
+	var_start = time.perf_counter()
+	var_module = importlib.import_module(in_module)
+	CT_STARTUP_SECONDS["import " + in_module] = time.perf_counter() - var_start
+	return var_module
+#
+#
+def func_datasdr_configure_models(in_args, in_llm: bool) -> None:
+	"""
+	This function creates the embedding model (with the optional embedding cache) and, if needed, the LLM, in LlamaIndex Settings.
+
+	in_args - Parsed arguments with embedding_model, embedding_cache, model, ollama_url and request_timeout.
+	in_llm: bool - Also create the LLM.
+	"""
+	var_core = func_datasdr_lazy_import("llama_index.core")
+	var_embeddings = func_datasdr_lazy_import("datasdr_embeddings")
+	var_start = time.perf_counter()
+	var_embed_model = var_embeddings.DataSDROllamaEmbedding(model_name=in_args.embedding_model, base_url=in_args.ollama_url)
+	if getattr(in_args, "embedding_cache", ""):
+		var_embed_model = func_datasdr_lazy_import("datasdr_embedding_cache").DataSDRCachedEmbedding(var_embed_model, cache_path=in_args.embedding_cache)
+	var_core.Settings.embed_model = var_embed_model
+	CT_STARTUP_SECONDS["client embedding (%s)" % (in_args.embedding_model)] = time.perf_counter() - var_start
+	if in_llm:
+		var_ollama = func_datasdr_lazy_import("llama_index.llms.ollama")
+		var_start = time.perf_counter()
+		var_core.Settings.llm = var_ollama.Ollama(model=in_args.model, base_url=in_args.ollama_url, request_timeout=in_args.request_timeout)
+		CT_STARTUP_SECONDS["client llm (%s)" % (in_args.model)] = time.perf_counter() - var_start
+#
+#
+def func_datasdr_startup_report(in_command_seconds: float) -> str:
+	"""
+	This function returns the import-time breakdown of this run.
+
+	in_command_seconds: float - Seconds spent in the command, imports included.
+	"""
+	var_lines = ["%-52s %10s" % ("startup", "seconds"), "%-52s %10.3f" % ("datasdr_cli.py (standard library)", CT_STARTUP_SECONDS.get("cli", 0.0))]
+	for one_name, one_seconds in CT_STARTUP_SECONDS.items():
+		if one_name != "cli":
+			var_lines.append("%-52s %10.3f" % (one_name, one_seconds))
+	var_lazy = sum(one_seconds for one_name, one_seconds in CT_STARTUP_SECONDS.items() if one_name != "cli")
+	var_lines.append("%-52s %10.3f" % ("imports and clients (total)", var_lazy))
+	var_lines.append("%-52s %10.3f" % ("command, without imports and clients", in_command_seconds - var_lazy))
+	return "\n".join(var_lines)
+#
+#
+def func_datasdr_sqlite_directory(in_directory: str) -> str:
+	"""
+	This function returns a SQLite3 directory with a trailing separator, as datasdr_sqlite.py expects.
+
+	in_directory: str - Directory where SQLite3 files are located at.
+	"""
+	return os.path.join(in_directory, "")
+#
+#
+# - - - - -
+# Commands.
+def func_datasdr_cmd_sponsors(in_args) -> int:
+	"""
+	This function lists the sponsors of a SQLite3 directory, with the size of each file and the state of its index.
+	"""
+	var_sqlite = func_datasdr_lazy_import("datasdr_sqlite")
+	var_directory = func_datasdr_sqlite_directory(in_args.sqlite_directory)
+	var_paths = sorted(glob.glob(os.path.join(var_directory, "TrialTwin_*.sqlite3")))
+	if not var_paths:
+		print("No TrialTwin_<Sponsor>.sqlite3 files in [%s]" % (var_directory))
+		return 1
+	print("%-26s %12s  %s" % ("sponsor", "MB", "index"))
+	for one_path in var_paths:
+		var_sponsor = os.path.basename(one_path)[len("TrialTwin_"):-len(".sqlite3")]
+		var_index_directory = var_sqlite.func_datasdr_sponsor_index_directory(var_directory, var_sponsor)
+		print("%-26s %12.1f  %s" % (var_sponsor, os.path.getsize(one_path) / 1e6, var_index_directory if os.path.isdir(var_index_directory) else "-"))
+	return 0
+#
+#
+def func_datasdr_cmd_check(in_args) -> int:
+	"""
+	This function reports the files of each index directory. Returns 1 if any directory is not a persisted index.
+	"""
+	var_status = 0
+	for one_directory in in_args.index_directory:
+		if one_directory.lower().endswith(".zip") and os.path.isfile(one_directory):
+			print("[%s] ZIP file, %.1f MB (read in place by datasdr_zip.py)" % (one_directory, os.path.getsize(one_directory) / 1e6))
+			continue
+		if not os.path.exists(os.path.join(one_directory, "index_store.json")):
+			print("[%s] no index" % (one_directory))
+			var_status = 1
+			continue
+		print("[%s]" % (one_directory))
+		for one_fname, one_description in CT_CLI_INDEX_FILES:
+			var_path = os.path.join(one_directory, one_fname)
+			if os.path.exists(var_path):
+				print("    %-34s %10.1f MB  %s" % (one_fname, os.path.getsize(var_path) / 1e6, one_description))
+		var_fts = one_directory.rstrip("/\\") + ".fts5.sqlite3"
+		if os.path.exists(var_fts):
+			print("    %-34s %10.1f MB  %s" % (os.path.basename(var_fts), os.path.getsize(var_fts) / 1e6, "keyword index (datasdr_hybrid.py)"))
+	return var_status
+#
+#
+def func_datasdr_load_documents(in_args) -> List:
+	"""
+	This function reads the PDFs to index, as Tutorial_02.py does: from a ZIP file, with parallel extraction, or with SimpleDirectoryReader.
+	"""
+	if in_args.data_directory.lower().endswith(".zip"):
+		return func_datasdr_lazy_import("datasdr_zip").func_datasdr_load_zip_documents(in_args.data_directory)
+	if in_args.extract_workers:
+		return func_datasdr_lazy_import("datasdr_pdf_extract").func_datasdr_load_pdf_documents(in_args.data_directory, in_args.text_cache, in_args.extract_workers)
+	return func_datasdr_lazy_import("llama_index.core").SimpleDirectoryReader(in_args.data_directory).load_data()
+#
+#
+def func_datasdr_cmd_build(in_args) -> int:
+	"""
+	This function builds a PDF index, or the indices of the given sponsors.
+	"""
+	if in_args.kind == "sqlite":
+		# Tutorial: worker processes create their own embedding clients; the parent process needs none.
+		var_builder = func_datasdr_lazy_import("datasdr_index_builder")
+		var_directory = func_datasdr_sqlite_directory(in_args.source)
+		if in_args.stream_batch:
+			func_datasdr_configure_models(in_args, False)
+			for one_sponsor in in_args.targets:
+				var_result = var_builder.func_datasdr_build_sponsor_index_streaming(
+					one_sponsor, var_directory, in_batch_size=in_args.stream_batch, in_limit_records=in_args.limit,
+					in_create_nct_id_index=in_args.create_nct_id_index,
+				)
+				print("Index [%s] %s: %d rows, %d nodes in %.2f seconds" % (var_result["index_directory"], var_result["status"], var_result["documents"], var_result["nodes"], var_result["seconds"]))
+			return 0
+		var_results = var_builder.func_datasdr_generate_indices_parallel(
+			in_args.targets, var_directory, in_workers=in_args.workers, in_limit_records=in_args.limit or var_builder.CT_LIMIT_RECORDS,
+			in_embedding_model=in_args.embedding_model, in_embedding_cache=in_args.embedding_cache or None, in_base_url=in_args.ollama_url,
+		)
+		return 1 if any(one_result["status"] == "failed" for one_result in var_results) else 0
+	#
+	if len(in_args.targets) != 1:
+		print("build pdf <data directory> <index directory>")
+		return 2
+	var_index_directory = in_args.targets[0]
+	if os.path.exists(var_index_directory):
+		print("Index directory [%s] already exists: use 'refresh', or delete it first." % (var_index_directory))
+		return 1
+	in_args.data_directory = in_args.source
+	func_datasdr_configure_models(in_args, False)
+	var_documents = func_datasdr_load_documents(in_args)
+	var_index = func_datasdr_lazy_import("datasdr_index_builder").func_datasdr_index_documents(var_documents, in_show_progress=True)
+	with func_datasdr_lazy_import("datasdr_metrics").func_datasdr_stage("persist"):
+		var_index.storage_context.persist(persist_dir=var_index_directory)
+	print("Index stored in directory [%s]" % (var_index_directory))
+	if in_args.embedding_cache:
+		print(func_datasdr_lazy_import("llama_index.core").Settings.embed_model.func_cache_report())
+	return 0
+#
+#
+def func_datasdr_cmd_refresh(in_args) -> int:
+	"""
+	This function refreshes a PDF index, or the indices of the given sponsors, incrementally.
+	"""
+	func_datasdr_configure_models(in_args, False)
+	var_refresh = func_datasdr_lazy_import("datasdr_refresh")
+	if in_args.kind == "sqlite":
+		for one_sponsor in in_args.targets:
+			var_refresh.func_datasdr_refresh_sqlite_index(func_datasdr_sqlite_directory(in_args.source), one_sponsor, in_args.limit)
+		return 0
+	if len(in_args.targets) != 1:
+		print("refresh pdf <data directory> <index directory>")
+		return 2
+	var_refresh.func_datasdr_refresh_pdf_index(in_args.source, in_args.targets[0], in_args.text_cache if in_args.extract_workers else None, in_args.extract_workers or 1)
+	return 0
+#
+#
+def func_datasdr_query_engine(in_args, in_index_directory: str):
+	"""
+	This function loads an index and returns its query engine: hybrid and/or cached, streaming unless --no-stream.
+
+	in_args - Parsed arguments of the "ask" command.
+	in_index_directory: str - Index directory (or ZIP).
+	"""
+	func_datasdr_configure_models(in_args, True)
+	var_index = func_datasdr_lazy_import("datasdr_vector_store").func_datasdr_load_index(in_index_directory, in_namespace=in_args.namespace or None)
+	var_postprocessors = []
+	if in_args.context_budget:
+		in_args.context_assembler = func_datasdr_lazy_import("datasdr_context").DataSDRContextAssembler(token_budget=in_args.context_budget)
+		var_postprocessors.append(in_args.context_assembler)
+	if in_args.hybrid:
+		var_engine = func_datasdr_lazy_import("datasdr_hybrid").func_datasdr_hybrid_query_engine(
+			var_index, in_index_directory, similarity_top_k=in_args.top_k, streaming=not in_args.no_stream, node_postprocessors=var_postprocessors,
+		)
+	else:
+		var_engine = var_index.as_query_engine(similarity_top_k=in_args.top_k, streaming=not in_args.no_stream, node_postprocessors=var_postprocessors)
+	if in_args.response_cache:
+		var_engine = func_datasdr_lazy_import("datasdr_response_cache").func_datasdr_cached_query_engine(
+			var_index, in_index_directory, in_args.response_cache, in_query_engine=var_engine,
+		)
+	return var_engine
+#
+#
+def func_datasdr_print_context_report(in_args) -> None:
+	"""
+	This function prints the prompt tokens saved by context assembly, if any question used it.
+	"""
+	var_assembler = getattr(in_args, "context_assembler", None)
+	if var_assembler is not None and var_assembler.reports:
+		print("\n" + var_assembler.func_context_report())
+#
+#
+def func_datasdr_cmd_ask(in_args) -> int:
+	"""
+	This function answers questions from an index. With --sponsor, structured questions go to SQL and the index is loaded only if needed.
+	"""
+	if not in_args.sponsor:
+		var_streaming = func_datasdr_lazy_import("datasdr_streaming")
+		var_engine = func_datasdr_query_engine(in_args, in_args.target)
+		for one_question in in_args.questions:
+			print("\n= = = %s" % (one_question))
+			var_streaming.func_datasdr_print_answer(var_engine, one_question)
+		func_datasdr_print_context_report(in_args)
+		return 0
+	#
+	var_router = func_datasdr_lazy_import("datasdr_router")
+	var_directory = func_datasdr_sqlite_directory(in_args.target)
+	var_engines: List = []
+	#
+	def func_get_query_engine():
+		# Tutorial: the index, the embedding model and the LLM are created the first time a question needs RAG.
+		if not var_engines:
+			var_engines.append(func_datasdr_query_engine(in_args, func_datasdr_lazy_import("datasdr_sqlite").func_datasdr_sponsor_index_directory(var_directory, in_args.sponsor)))
+		return var_engines[0]
+	#
+	for one_question in in_args.questions:
+		print("\n= = = %s" % (one_question))
+		var_start = time.time()
+		var_result = var_router.func_datasdr_answer_question(one_question, var_directory, in_args.sponsor, func_get_query_engine, in_args.create_router_indexes)
+		if var_result["route"] == "sql":
+			print(var_result["answer"])
+			print("[sql, %.3f seconds] %s" % (var_result["seconds"], var_result["sql"]))
+		else:
+			func_datasdr_lazy_import("datasdr_streaming").func_datasdr_print_response(var_result["answer"], var_start, not in_args.no_stream)
+	func_datasdr_print_context_report(in_args)
+	return 0
+#
+#
+def func_datasdr_cmd_reembed(in_args) -> int:
+	"""
+	This function re-embeds the docstore of an index with --embedding-model into a second vector store (datasdr_reembed.py).
+	"""
+	func_datasdr_configure_models(in_args, False)
+	var_result = func_datasdr_lazy_import("datasdr_reembed").func_datasdr_reembed_index(
+		in_args.index_directory, func_datasdr_lazy_import("llama_index.core").Settings.embed_model, in_args.namespace or None, in_args.batch, in_args.overwrite,
+	)
+	print("Ask with: ask %s \"<question>\" --namespace %s --embedding-model %s" % (in_args.index_directory, var_result["namespace"], in_args.embedding_model))
+	return 0
+#
+#
+def func_datasdr_cmd_bench(in_args) -> int:
+	"""
+	This function runs the benchmark of datasdr_benchmark.py and writes its JSON results.
+	"""
+	import json
+	#
+	var_benchmark = func_datasdr_lazy_import("datasdr_benchmark")
+	var_report = var_benchmark.func_datasdr_run_benchmark(
+		in_args.data_dir or var_benchmark.CT_BENCH_DATA_DIR, var_benchmark.CT_BENCH_QUERIES if in_args.queries is None else in_args.queries,
+		var_benchmark.CT_BENCH_LLM_QUERIES if in_args.llm_queries is None else in_args.llm_queries,
+	)
+	with open(in_args.output, "w") as f:
+		json.dump(var_report, f, indent=1)
+	print("\nPeak RSS: %s MB. Results written to [%s]" % ("n/a" if var_report["peak_rss_mb"] is None else "%.1f" % (var_report["peak_rss_mb"]), in_args.output))
+	return 0
+#
+#
+def func_datasdr_cli_parser() -> argparse.ArgumentParser:
+	"""
+	This function returns the argument parser of all commands.
+	"""
+	var_parser = argparse.ArgumentParser(description="DataSDR local LLM: build, refresh and query indices.")
+	var_parser.add_argument("--import-times", action="store_true", help="Print the seconds spent importing modules and creating clients.")
+	var_commands = var_parser.add_subparsers(dest="command", required=True)
+	#
+	# Tutorial: options shared by the commands that embed or ask.
+	var_models = argparse.ArgumentParser(add_help=False)
+	var_models.add_argument("--embedding-model", default=CT_CLI_EMBEDDING_MODEL)
+	var_models.add_argument("--embedding-cache", default="", help="Embedding cache file; keep it outside the index directory.")
+	var_models.add_argument("--model", default=CT_CLI_MODEL, help="Ollama LLM, e.g. llama3, meditron, phi3:mini.")
+	var_models.add_argument("--ollama-url", default=CT_CLI_OLLAMA_BASE_URL)
+	var_models.add_argument("--request-timeout", type=float, default=CT_CLI_REQUEST_TIMEOUT)
+	#
+	var_sponsors = var_commands.add_parser("sponsors", help="List the sponsor SQLite3 files of a directory.")
+	var_sponsors.add_argument("sqlite_directory")
+	var_sponsors.set_defaults(func=func_datasdr_cmd_sponsors)
+	#
+	var_check = var_commands.add_parser("check", help="Report the files of index directories.")
+	var_check.add_argument("index_directory", nargs="+")
+	var_check.set_defaults(func=func_datasdr_cmd_check)
+	#
+	for one_name, one_func, one_help in [
+		("build", func_datasdr_cmd_build, "Build a PDF index, or sponsor indices."),
+		("refresh", func_datasdr_cmd_refresh, "Refresh a PDF index, or sponsor indices, incrementally."),
+	]:
+		var_command = var_commands.add_parser(one_name, parents=[var_models], help=one_help,
+			description="%s pdf <data directory or ZIP> <index directory> | %s sqlite <sqlite directory> <Sponsor> [<Sponsor> ..]" % (one_name, one_name))
+		var_command.add_argument("kind", choices=["pdf", "sqlite"])
+		var_command.add_argument("source", help="PDF directory (or ZIP), or SQLite3 directory.")
+		var_command.add_argument("targets", nargs="+", help="Index directory (pdf), or sponsor names (sqlite).")
+		var_command.add_argument("--extract-workers", type=int, default=0, help="pdf: processes extracting PDF pages. 0 = SimpleDirectoryReader.")
+		var_command.add_argument("--text-cache", default="", help="pdf: extracted-text cache file, used with --extract-workers.")
+		var_command.add_argument("--limit", type=int, default=None, help="sqlite: maximum rows per sponsor.")
+		var_command.add_argument("--workers", type=int, default=1, help="sqlite: sponsors built at the same time.")
+		var_command.add_argument("--stream-batch", type=int, default=0, help="sqlite: rows per page for streaming builds. 0 = read the rows at once.")
+		if one_name == "build":
+			var_command.add_argument("--create-nct-id-index", action="store_true", help="sqlite: add an index on nct_id to each SQLite3 file (modifies it), so streaming pages are read faster.")
+		var_command.set_defaults(func=one_func)
+	#
+	var_ask = var_commands.add_parser("ask", parents=[var_models], help="Answer questions from an index.")
+	var_ask.add_argument("target", help="Index directory (or ZIP); with --sponsor, the SQLite3 directory.")
+	var_ask.add_argument("questions", nargs="+")
+	var_ask.add_argument("--sponsor", default="", help="Answer structured questions with SQL from TrialTwin_<Sponsor>.sqlite3 first.")
+	var_ask.add_argument("--create-router-indexes", action="store_true", help="With --sponsor: add column indexes to the SQLite3 file (modifies it), so SQL answers never scan the table.")
+	var_ask.add_argument("--top-k", type=int, default=2)
+	var_ask.add_argument("--hybrid", action="store_true", help="Keyword + vector retrieval (datasdr_hybrid.py).")
+	var_ask.add_argument("--response-cache", default="", help="LLM answer cache file; keep it outside the index directory.")
+	var_ask.add_argument("--no-stream", action="store_true")
+	var_ask.add_argument("--context-budget", type=int, default=CT_CLI_CONTEXT_BUDGET, help="Tokens of retrieved context sent to the LLM (datasdr_context.py). 0 = chunks as retrieved.")
+	var_ask.add_argument("--namespace", default="", help="Vector store written by 'reembed', e.g. mxbai_embed_large. Use with the same --embedding-model.")
+	var_ask.set_defaults(func=func_datasdr_cmd_ask)
+	#
+	var_reembed = var_commands.add_parser("reembed", parents=[var_models], help="Re-embed an index with another --embedding-model, next to its current vector store.")
+	var_reembed.add_argument("index_directory")
+	var_reembed.add_argument("--namespace", default="", help="Default: the model name, e.g. mxbai_embed_large.")
+	var_reembed.add_argument("--batch", type=int, default=CT_CLI_REEMBED_BATCH)
+	var_reembed.add_argument("--overwrite", action="store_true")
+	var_reembed.set_defaults(func=func_datasdr_cmd_reembed)
+	#
+	var_bench = var_commands.add_parser("bench", help="Run datasdr_benchmark.py on the bundled sample data.")
+	var_bench.add_argument("--data-dir", default="", help="Directory with the bundled ZIP files. Default: this repository.")
+	var_bench.add_argument("--output", default="benchmark_results.json")
+	var_bench.add_argument("--queries", type=int, default=None)
+	var_bench.add_argument("--llm-queries", type=int, default=None)
+	var_bench.set_defaults(func=func_datasdr_cmd_bench)
+	return var_parser
+#
+#
+def func_datasdr_cli(in_argv: Optional[List[str]] = None) -> int:
+	"""
+	This function runs one command and returns its exit code.
+
+	in_argv - Arguments without the program name. None = sys.argv[1:].
+	"""
+	var_args = func_datasdr_cli_parser().parse_args(in_argv)
+	var_start = time.perf_counter()
+	var_status = var_args.func(var_args)
+	if var_args.import_times:
+		print("\n" + func_datasdr_startup_report(time.perf_counter() - var_start))
+	return var_status
+#
+#
+CT_STARTUP_SECONDS["cli"] = time.perf_counter() - CT_CLI_START
+#
+if __name__ == "__main__":
+	sys.exit(func_datasdr_cli())
@@ -0,0 +1,229 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_compare_models.py
+# Purpose: Compare LLMs on the same questions: retrieve context once per question, ask every model with the same prompt.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+The homework of every tutorial is to change CT_MODEL_NAME to each downloaded model (llama3, meditron,
+medllama2, phi3 ..) and re-run the script. Every run loads the index, embeds the questions and retrieves
+the same chunks again, and the answers end up spread over several terminal windows.
+
+This file compares models in one pass:
+* Every question is embedded and retrieved ONCE.
+* The retrieved chunks are sent to every model with the same response synthesizer, so all models see the identical prompt.
+* Models are asked in parallel, at most CT_COMPARE_WORKERS requests at a time (every loaded model uses RAM/VRAM in Ollama).
+  Requests are ordered model by model, so Ollama does not keep swapping models in and out.
+* Every answer is streamed and measured (time-to-first-token, tokens/sec, total seconds, see datasdr_streaming.py).
+* A table per model (latency, tokens/sec, errors) and the answers side by side are printed; the whole
+  result can be saved as JSON.
+
+A model that is not downloaded does not stop the comparison: its answers are reported as errors.
+
+Usage:
+	from datasdr_compare_models import func_datasdr_compare_models, func_datasdr_print_comparison
+	var_result = func_datasdr_compare_models(index.as_retriever(similarity_top_k=2), ["Describe the protocol about Thrombosis?"], ["llama3", "meditron", "phi3:mini"])
+	func_datasdr_print_comparison(var_result)
+
+	python3 datasdr_compare_models.py /Users/server/Downloads/test/_index llama3,meditron,phi3:mini "Describe the protocol about Thrombosis?" --output comparison.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from llama_index.core import get_response_synthesizer
+from llama_index.core.schema import QueryBundle
+from llama_index.llms.ollama import Ollama
+
+from datasdr_embeddings import CT_OLLAMA_BASE_URL
+from datasdr_streaming import func_datasdr_stream_tokens
+
+# Tutorial: models answering at the same time. Ollama keeps every model it serves in memory: keep this low
+# on machines with little RAM/VRAM (see OLLAMA_MAX_LOADED_MODELS and OLLAMA_NUM_PARALLEL in the Ollama docs).
+CT_COMPARE_WORKERS = 2
+#
+# Tutorial: increase the timeout when running on low-powered hardware.
+CT_COMPARE_REQUEST_TIMEOUT = 360.0
+#
+# Tutorial: LlamaIndex response mode used for every model. "compact" packs all chunks into as few LLM calls as possible.
+CT_COMPARE_RESPONSE_MODE = "compact"
+
+
+def func_datasdr_retrieve_questions(in_retriever, in_questions: List[str]) -> List[Dict]:
+	"""
+	This function retrieves the context of every question once.
+	Returns one dictionary per question with "question", "nodes", "sources" and "retrieve_seconds".
+
+	in_retriever - Any retriever, e.g. index.as_retriever(similarity_top_k=2) or func_datasdr_hybrid_retriever().
+	in_questions - Questions in plain English.
+	"""
+	var_contexts = []
+	for one_question in in_questions:
+		var_start = time.time()
+		var_nodes = in_retriever.retrieve(one_question)
+		var_contexts.append({
+			"question": one_question,
+			"nodes": var_nodes,
+			"sources": [(one_node.node.metadata.get("file_name") or one_node.node.node_id, one_node.score) for one_node in var_nodes],
+			"retrieve_seconds": time.time() - var_start,
+		})
+	return var_contexts
+#
+#
+def func_datasdr_model_answer(in_llm, in_context: Dict, in_response_mode: str = CT_COMPARE_RESPONSE_MODE) -> Dict:
+	"""
+	This function asks one model one question, with already retrieved context, and streams the answer.
+	Returns the statistics of func_datasdr_stream_tokens() (without the response object), plus "error".
+
+	in_llm - LLM, e.g. Ollama(model="meditron").
+	in_context - One entry of func_datasdr_retrieve_questions().
+	in_response_mode: str - LlamaIndex response mode.
+	"""
+	var_start = time.time()
+	var_stats: Dict = {"answer": "", "streamed": True, "ttft_seconds": None, "tokens": 0, "tokens_per_second": 0.0, "error": None}
+	try:
+		var_synthesizer = get_response_synthesizer(llm=in_llm, response_mode=in_response_mode, streaming=True)
+		var_response = var_synthesizer.synthesize(QueryBundle(in_context["question"]), in_context["nodes"])
+		for _ in func_datasdr_stream_tokens(var_response, var_stats, var_start):
+			pass
+	except Exception as e:
+		# Tutorial: typically a model that was not downloaded ("ollama pull <ModelName>") or a timeout.
+		var_stats["error"] = "%s: %s" % (type(e).__name__, e)
+	var_stats["seconds"] = time.time() - var_start
+	return var_stats
+#
+#
+def func_datasdr_summarize_model(in_answers: List[Dict]) -> Dict:
+	"""
+	This function returns the latency summary of one model: means over its successful answers.
+
+	in_answers - Statistics of func_datasdr_model_answer(), one per question.
+	"""
+	var_ok = [one_answer for one_answer in in_answers if one_answer["error"] is None and one_answer["ttft_seconds"] is not None]
+	var_count = len(var_ok) or 1
+	return {
+		"answered": len(var_ok),
+		"errors": len(in_answers) - len(var_ok),
+		"mean_seconds": sum(one_answer["seconds"] for one_answer in var_ok) / var_count,
+		"mean_ttft_seconds": sum(one_answer["ttft_seconds"] for one_answer in var_ok) / var_count,
+		"tokens_per_second": sum(one_answer["tokens_per_second"] for one_answer in var_ok) / var_count,
+		"tokens": sum(one_answer["tokens"] for one_answer in var_ok),
+	}
+#
+#
+def func_datasdr_compare_models(
+	in_retriever,
+	in_questions: List[str],
+	in_models: List[str],
+	in_workers: int = CT_COMPARE_WORKERS,
+	in_response_mode: str = CT_COMPARE_RESPONSE_MODE,
+	in_base_url: str = CT_OLLAMA_BASE_URL,
+	in_request_timeout: float = CT_COMPARE_REQUEST_TIMEOUT,
+) -> Dict:
+	"""
+	This function answers every question with every model. The context of a question is retrieved once and shared by all models.
+	Returns a dictionary with "questions" (question, sources, retrieve_seconds), "models" (model -> summary and "answers",
+	one per question, in question order) and "seconds" (wall time of the whole comparison).
+
+	in_retriever - Any retriever, e.g. index.as_retriever(similarity_top_k=2).
+	in_questions - Questions in plain English.
+	in_models - Ollama model names, e.g. ["llama3", "meditron"].
+	in_workers: int - Maximum number of answers generated at the same time.
+	in_response_mode: str - LlamaIndex response mode, identical for all models.
+	in_base_url: str - Ollama server.
+	in_request_timeout: float - Seconds allowed per LLM request.
+	"""
+	var_start = time.time()
+	var_contexts = func_datasdr_retrieve_questions(in_retriever, in_questions)
+	var_llms = {one_model: Ollama(model=one_model, base_url=in_base_url, request_timeout=in_request_timeout) for one_model in in_models}
+	#
+	# Tutorial: model by model, question by question: each model is loaded by Ollama once and then stays busy.
+	var_tasks = [(one_model, one_context) for one_model in in_models for one_context in var_contexts]
+	with ThreadPoolExecutor(max_workers=max(1, in_workers)) as var_executor:
+		var_answers = list(var_executor.map(lambda in_task: func_datasdr_model_answer(var_llms[in_task[0]], in_task[1], in_response_mode), var_tasks))
+	#
+	var_models = {}
+	for one_position, one_model in enumerate(in_models):
+		var_model_answers = var_answers[one_position * len(var_contexts):(one_position + 1) * len(var_contexts)]
+		var_models[one_model] = {**func_datasdr_summarize_model(var_model_answers), "answers": var_model_answers}
+	return {
+		"questions": [{key: value for key, value in one_context.items() if key != "nodes"} for one_context in var_contexts],
+		"models": var_models,
+		"seconds": time.time() - var_start,
+	}
+#
+#
+def func_datasdr_comparison_table(in_result: Dict) -> str:
+	"""
+	This function returns the per-model latency table of a comparison.
+
+	in_result - Result of func_datasdr_compare_models().
+	"""
+	var_lines = ["%-24s %8s %7s %10s %10s %11s" % ("model", "answered", "errors", "mean (s)", "ttft (s)", "tokens/sec")]
+	for one_model, one_summary in in_result["models"].items():
+		var_lines.append("%-24s %8d %7d %10.2f %10.2f %11.1f" % (
+			one_model, one_summary["answered"], one_summary["errors"], one_summary["mean_seconds"], one_summary["mean_ttft_seconds"], one_summary["tokens_per_second"],
+		))
+	var_lines.append("%d questions x %d models in %.2f seconds." % (len(in_result["questions"]), len(in_result["models"]), in_result["seconds"]))
+	return "\n".join(var_lines)
+#
+#
+def func_datasdr_print_comparison(in_result: Dict) -> None:
+	"""
+	This function prints the answers of all models, question by question, then the per-model latency table.
+
+	in_result - Result of func_datasdr_compare_models().
+	"""
+	for one_position, one_question in enumerate(in_result["questions"]):
+		print("\n= = = Question %d: %s" % (one_position + 1, one_question["question"]))
+		print("Context: %s (retrieved once in %.3f seconds)" % (", ".join(str(one_source) for one_source, _ in one_question["sources"]), one_question["retrieve_seconds"]))
+		for one_model, one_summary in in_result["models"].items():
+			var_answer = one_summary["answers"][one_position]
+			if var_answer["error"] is not None:
+				print("\n[%s] ERROR %s" % (one_model, var_answer["error"]))
+			else:
+				print("\n[%s] %.2f seconds, %.1f tokens/sec\n%s" % (one_model, var_answer["seconds"], var_answer["tokens_per_second"], var_answer["answer"].strip()))
+	print("\n" + func_datasdr_comparison_table(in_result))
+#
+#
+def func_datasdr_write_comparison(in_result: Dict, in_path: str) -> None:
+	"""
+	This function saves a comparison as JSON.
+
+	in_result - Result of func_datasdr_compare_models().
+	in_path: str - Output JSON file.
+	"""
+	with open(in_path, "w") as var_file:
+		json.dump(in_result, var_file, indent=2)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_compare_models.py <index directory> <model,model,..> "<question>" ["<question>" ..] [--output file.json]
+	from llama_index.core import Settings
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	from datasdr_vector_store import func_datasdr_load_index
+	#
+	var_parser = argparse.ArgumentParser(description="Answer the same questions with several Ollama models.")
+	var_parser.add_argument("index_directory")
+	var_parser.add_argument("models", help="Comma separated model names, e.g. llama3,meditron,phi3:mini")
+	var_parser.add_argument("questions", nargs="+")
+	var_parser.add_argument("--top-k", type=int, default=2)
+	var_parser.add_argument("--workers", type=int, default=CT_COMPARE_WORKERS)
+	var_parser.add_argument("--ollama-url", default=CT_OLLAMA_BASE_URL)
+	var_parser.add_argument("--output", default="")
+	var_args = var_parser.parse_args()
+	#
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text", base_url=var_args.ollama_url)
+	var_index = func_datasdr_load_index(var_args.index_directory)
+	var_result = func_datasdr_compare_models(
+		var_index.as_retriever(similarity_top_k=var_args.top_k), var_args.questions, [one_model for one_model in var_args.models.split(",") if one_model],
+		in_workers=var_args.workers, in_base_url=var_args.ollama_url,
+	)
+	func_datasdr_print_comparison(var_result)
+	if var_args.output:
+		func_datasdr_write_comparison(var_result, var_args.output)
+		print("Saved to [%s]" % (var_args.output))
+	sys.exit(1 if any(one_summary["errors"] for one_summary in var_result["models"].values()) else 0)
@@ -0,0 +1,268 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_context.py
+# Purpose: Assemble the LLM context under a token budget: drop duplicate chunks, keep the sentences relevant to the question.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+index.as_query_engine() sends the retrieved chunks to Ollama as they are:
+* SQLite3 rows are long, and most of their "column: value" pairs have nothing to do with the question.
+* The same protocol text often comes back twice, e.g. from the "Prot" and "Prot_SAP" PDFs of one trial,
+  or from two overlapping chunks.
+On a CPU-only computer, the time before the first token grows with the length of the prompt.
+
+This file is a node postprocessor that runs between retrieval and the LLM:
+* Deduplication: a chunk whose word 5-grams are mostly (CT_CONTEXT_DEDUP_THRESHOLD) contained in a better-scored
+  chunk is dropped. Sentences already sent with another chunk are not repeated.
+* Trimming: chunks are split into sentences (and "column: value" pairs for SQLite3 rows). Only the sentences
+  that contain a keyword of the question are kept, with CT_CONTEXT_NEIGHBOUR_UNITS sentences around each.
+  A chunk without any keyword is kept whole: vector search found it relevant.
+* Packing: chunks are added best first until CT_CONTEXT_TOKEN_BUDGET tokens (text and metadata, as the LLM sees them).
+  The chunk that does not fit is cut at a sentence boundary.
+* Reporting: prompt tokens before and after, per question (func_context_report()), and the "prompt_tokens_saved"
+  counter of datasdr_metrics.py.
+
+Usage:
+	from datasdr_context import DataSDRContextAssembler
+	var_assembler = DataSDRContextAssembler(token_budget=1500)
+	query_engine = index.as_query_engine(node_postprocessors=[var_assembler])
+	..
+	print(var_assembler.func_context_report())
+
+	# Tutorial: compare the context before and after assembly for one question.
+	python3 datasdr_context.py /Users/server/Downloads/test/_index "Describe the protocol about Thrombosis?" --budget 800
+"""
+
+import re
+import sys
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.utils import get_tokenizer
+
+from datasdr_hybrid import func_datasdr_keywords
+from datasdr_metrics import func_datasdr_count, func_datasdr_stage
+
+# Tutorial: maximum tokens of retrieved context sent to the LLM (text and metadata). The prompt template and question come on top.
+CT_CONTEXT_TOKEN_BUDGET = 1500
+#
+# Tutorial: a chunk is a duplicate when this share of its word 5-grams is found in a better chunk. 1.0 = exact copies only.
+CT_CONTEXT_DEDUP_THRESHOLD = 0.8
+CT_CONTEXT_SHINGLE_WORDS = 5
+#
+# Tutorial: sentences kept before and after each sentence that contains a keyword of the question.
+CT_CONTEXT_NEIGHBOUR_UNITS = 1
+#
+# Tutorial: units always kept at the start of a trimmed chunk: the "nct_id: .." of a SQLite3 row, or the heading of a PDF page.
+CT_CONTEXT_HEAD_UNITS = 1
+#
+# Tutorial: a chunk is only cut to fit the budget if at least this many tokens of it fit; otherwise packing stops.
+CT_CONTEXT_MIN_NODE_TOKENS = 48
+#
+# Tutorial: sentence ends and line breaks, plus the ", column: value" pairs of SQLite3 rows with CT_ROW_MAPPING = "flat".
+CT_CONTEXT_UNIT_SPLIT = re.compile(r"(?<=[.!?;])\s+|\n+|,\s+(?=[a-z][a-z0-9_]*: )")
+
+
+def func_datasdr_split_units(in_text: str) -> List[str]:
+	"""
+	This function splits a chunk into the units trimming works on: sentences, lines, "column: value" pairs.
+
+	in_text: str - Chunk text.
+	"""
+	return [one_unit.strip() for one_unit in CT_CONTEXT_UNIT_SPLIT.split(in_text) if one_unit and one_unit.strip()]
+#
+#
+def func_datasdr_shingles(in_text: str, in_words: int = CT_CONTEXT_SHINGLE_WORDS) -> Set[Tuple[str, ...]]:
+	"""
+	This function returns the word n-grams of a text, used to detect near-duplicate chunks.
+
+	in_text: str - Chunk text.
+	in_words: int - Words per n-gram.
+	"""
+	var_words = re.findall(r"\w+", in_text.lower())
+	if len(var_words) < in_words:
+		return {tuple(var_words)} if var_words else set()
+	return {tuple(var_words[i:i + in_words]) for i in range(len(var_words) - in_words + 1)}
+#
+#
+def func_datasdr_plural_stem(in_word: str) -> str:
+	"""
+	This function removes one plural "s" from a word: "trials" -> "trial". Words ending in "ss" ("class") are kept.
+
+	in_word: str - Lower-case word.
+	"""
+	if len(in_word) > 3 and in_word.endswith("s") and not in_word.endswith("ss"):
+		return in_word[:-1]
+	return in_word
+#
+#
+def func_datasdr_relevant_units(in_units: List[str], in_keywords: List[str], in_neighbours: int = CT_CONTEXT_NEIGHBOUR_UNITS) -> List[int]:
+	"""
+	This function returns the positions of the units to keep: the first CT_CONTEXT_HEAD_UNITS, those with a keyword
+	of the question, and their neighbours. Returns every position if no unit has a keyword.
+
+	in_units - Units of one chunk, from func_datasdr_split_units().
+	in_keywords - Keywords of the question, from func_datasdr_keywords().
+	in_neighbours: int - Units kept before and after each match.
+	"""
+	var_keywords = set(in_keywords)
+	var_keep: Set[int] = set()
+	for i, one_unit in enumerate(in_units):
+		var_words = set(re.findall(r"\w+", one_unit.lower()))
+		# Tutorial: "trials" also matches "trial". Regular plurals only: "thromboses" does not match "thrombosis".
+		var_words |= {func_datasdr_plural_stem(one_word) for one_word in var_words}
+		if var_keywords & var_words or {func_datasdr_plural_stem(one_keyword) for one_keyword in var_keywords} & var_words:
+			var_keep.update(range(max(0, i - in_neighbours), min(len(in_units), i + in_neighbours + 1)))
+	if not var_keep:
+		return list(range(len(in_units)))
+	var_keep.update(range(min(CT_CONTEXT_HEAD_UNITS, len(in_units))))
+	return sorted(var_keep)
+#
+#
+class DataSDRContextAssembler(BaseNodePostprocessor):
+	"""
+	Node postprocessor: deduplicates retrieved chunks, trims them to the sentences relevant to the question,
+	and packs them under a token budget. Keeps per-question token counts for func_context_report().
+	"""
+
+	token_budget: int = Field(default=CT_CONTEXT_TOKEN_BUDGET, gt=0, description="Maximum tokens of context sent to the LLM.")
+	dedup_threshold: float = Field(default=CT_CONTEXT_DEDUP_THRESHOLD, description="Share of 5-grams contained in a better chunk that makes a duplicate.")
+	neighbour_units: int = Field(default=CT_CONTEXT_NEIGHBOUR_UNITS, ge=0, description="Sentences kept around each relevant sentence.")
+	trim: bool = Field(default=True, description="Keep only the sentences relevant to the question.")
+
+	_reports: List[Dict] = PrivateAttr(default_factory=list)
+	_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "DataSDRContextAssembler"
+
+	@property
+	def reports(self) -> List[Dict]:
+		"""One dictionary per question: question, nodes_in, nodes_out, duplicates, tokens_in, tokens_out, tokens_saved."""
+		return self._reports
+
+	def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+		with func_datasdr_stage("context_assembly"):
+			var_tokenizer = get_tokenizer()
+			var_keywords = func_datasdr_keywords(query_bundle.query_str) if (query_bundle is not None and self.trim) else []
+			var_ranked = sorted(nodes, key=lambda one_node: -(one_node.score or 0.0))
+			var_report = {
+				"question": query_bundle.query_str if query_bundle is not None else "",
+				"nodes_in": len(nodes), "nodes_out": 0, "duplicates": 0,
+				"tokens_in": sum(len(var_tokenizer(one_node.node.get_content(metadata_mode=MetadataMode.LLM))) for one_node in nodes),
+				"tokens_out": 0,
+			}
+			#
+			var_result: List[NodeWithScore] = []
+			var_kept_shingles: List[Set[Tuple[str, ...]]] = []
+			var_sent_units: Set[str] = set()
+			for one_node in var_ranked:
+				if not isinstance(one_node.node, TextNode):
+					var_result.append(one_node)
+					continue
+				var_text = one_node.node.get_content(metadata_mode=MetadataMode.NONE)
+				var_shingles = func_datasdr_shingles(var_text)
+				if var_shingles and any(
+					len(var_shingles & one_kept) / len(var_shingles) >= self.dedup_threshold for one_kept in var_kept_shingles
+				):
+					var_report["duplicates"] += 1
+					continue
+				#
+				var_all_units = func_datasdr_split_units(var_text)
+				var_units = var_all_units
+				if var_keywords:
+					var_units = [var_all_units[i] for i in func_datasdr_relevant_units(var_all_units, var_keywords, self.neighbour_units)]
+				# Tutorial: overlapping chunks share sentences; each sentence is sent once.
+				var_units = [one_unit for one_unit in var_units if one_unit.lower() not in var_sent_units]
+				if not var_units:
+					var_report["duplicates"] += 1
+					continue
+				#
+				var_remaining = self.token_budget - var_report["tokens_out"]
+				var_new_node, var_tokens = self._func_fit(
+					one_node.node, var_units, var_text if len(var_units) == len(var_all_units) else None, var_remaining, var_tokenizer, len(var_result) == 0,
+				)
+				if var_new_node is None:
+					break
+				var_kept_shingles.append(var_shingles)
+				var_sent_units.update(one_unit.lower() for one_unit in func_datasdr_split_units(var_new_node.text))
+				var_result.append(NodeWithScore(node=var_new_node, score=one_node.score))
+				var_report["tokens_out"] += var_tokens
+				if var_report["tokens_out"] >= self.token_budget:
+					break
+			#
+			var_report["nodes_out"] = len(var_result)
+			var_report["tokens_saved"] = var_report["tokens_in"] - var_report["tokens_out"]
+			with self._lock:
+				self._reports.append(var_report)
+			func_datasdr_count("prompt_tokens_in", var_report["tokens_in"])
+			func_datasdr_count("prompt_tokens_saved", var_report["tokens_saved"])
+			return var_result
+
+	def _func_fit(self, in_node: TextNode, in_units: List[str], in_text: Optional[str], in_remaining: int, in_tokenizer, in_first: bool) -> Tuple[Optional[TextNode], int]:
+		"""
+		This function returns a copy of a chunk with the given units as text, cut to fit the remaining budget, and its token count.
+		Returns (None, 0) if less than CT_CONTEXT_MIN_NODE_TOKENS fit; the best chunk is always kept, cut if needed.
+
+		in_node: TextNode - Retrieved chunk. It is never modified: docstores may hand out shared objects.
+		in_units - Units to keep, in their original order.
+		in_text: str - Original text, when every unit is kept: it is sent unchanged if it fits. None = join the units.
+		in_remaining: int - Tokens left in the budget.
+		in_tokenizer - Tokenizer from get_tokenizer().
+		in_first: bool - This is the best chunk of the question.
+		"""
+		var_node = in_node.copy()
+		var_node.text = in_text if in_text is not None else "\n".join(in_units)
+		var_tokens = len(in_tokenizer(var_node.get_content(metadata_mode=MetadataMode.LLM)))
+		if var_tokens <= in_remaining:
+			return var_node, var_tokens
+		if in_remaining < CT_CONTEXT_MIN_NODE_TOKENS and not in_first:
+			return None, 0
+		# Tutorial: the metadata header is always sent; units are added until the budget is reached.
+		var_node.text = ""
+		var_used = len(in_tokenizer(var_node.get_content(metadata_mode=MetadataMode.LLM)))
+		var_kept = []
+		for one_unit in in_units:
+			var_unit_tokens = len(in_tokenizer(one_unit)) + 1
+			if var_used + var_unit_tokens > in_remaining and var_kept:
+				break
+			var_kept.append(one_unit)
+			var_used += var_unit_tokens
+		var_node.text = "\n".join(var_kept)
+		return var_node, len(in_tokenizer(var_node.get_content(metadata_mode=MetadataMode.LLM)))
+
+	def func_context_report(self) -> str:
+		"""
+		This function returns the prompt tokens before and after assembly, one line per question, and the totals.
+		"""
+		var_lines = ["%-48s %9s %6s %8s %8s %8s" % ("question", "chunks", "dups", "tokens", "sent", "saved")]
+		for one_report in self._reports:
+			var_lines.append("%-48s %4d->%-4d %6d %8d %8d %7.0f%%" % (
+				one_report["question"][:48], one_report["nodes_in"], one_report["nodes_out"], one_report["duplicates"],
+				one_report["tokens_in"], one_report["tokens_out"], 100.0 * one_report["tokens_saved"] / max(1, one_report["tokens_in"]),
+			))
+		var_in = sum(one_report["tokens_in"] for one_report in self._reports)
+		var_out = sum(one_report["tokens_out"] for one_report in self._reports)
+		var_lines.append("Context assembly: %d questions, %d prompt tokens -> %d (%d saved, %.0f%%), budget %d." % (
+			len(self._reports), var_in, var_out, var_in - var_out, 100.0 * (var_in - var_out) / max(1, var_in), self.token_budget,
+		))
+		return "\n".join(var_lines)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_context.py <index directory> "<question>" [--budget N] [--top-k K]
+	from llama_index.core import Settings
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	from datasdr_vector_store import func_datasdr_load_index
+	#
+	var_budget = int(sys.argv[sys.argv.index("--budget") + 1]) if "--budget" in sys.argv else CT_CONTEXT_TOKEN_BUDGET
+	var_top_k = int(sys.argv[sys.argv.index("--top-k") + 1]) if "--top-k" in sys.argv else 5
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text")
+	var_nodes = func_datasdr_load_index(sys.argv[1]).as_retriever(similarity_top_k=var_top_k).retrieve(sys.argv[2])
+	var_assembler = DataSDRContextAssembler(token_budget=var_budget)
+	for one_node in var_assembler.postprocess_nodes(var_nodes, query_str=sys.argv[2]):
+		print("\n- - - %s (score %.3f)\n%s" % (one_node.node.node_id, one_node.score or 0.0, one_node.node.get_content(metadata_mode=MetadataMode.LLM)))
+	print("\n" + var_assembler.func_context_report())
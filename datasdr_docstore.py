@@ -0,0 +1,362 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_docstore.py
+# Purpose: Compressed SQLite3 docstore, read lazily by node ID, to replace the JSON "docstore.json" file.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+The default LlamaIndex docstore keeps the text and metadata of every chunk in "docstore.json".
+Loading an index parses the whole file (7.1 MB for 100_Drugs_FDA), although a question only needs the
+top-k retrieved chunks.
+
+This file stores the docstore in one SQLite3 file instead:
+	docstore.sqlite3   - one row per node (and per ref_doc / hash entry), zlib-compressed JSON, primary key = node ID.
+
+* Loading an index only opens the file: load time and RAM no longer grow with the size of the corpus text.
+* Nodes are read by ID when a query retrieves them; the most recently used ones are kept in an LRU (CT_DOCSTORE_LRU_NODES).
+* New indices are built in an in-memory SQLite3 database, copied to "docstore.sqlite3" by storage_context.persist(..).
+* Changes to a loaded index (datasdr_refresh.py) stay in an open transaction until persist(..), so the
+  directory on disk is never half-updated.
+
+Usage:
+	# Tutorial: convert an existing index directory once.
+	python3 datasdr_docstore.py /Users/server/Downloads/test/_index [--remove-json]
+
+	# Tutorial: func_datasdr_load_index() picks up "docstore.sqlite3" automatically.
+	from datasdr_vector_store import func_datasdr_load_index
+	index = func_datasdr_load_index("/Users/server/Downloads/test/_index")
+
+	# Tutorial: new indices, with the docstore of CT_DOCSTORE.
+	from datasdr_docstore import func_datasdr_new_storage_context
+	storage_context = func_datasdr_new_storage_context(DataSDRMmapVectorStore())
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import fsspec
+#
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.docstore.utils import json_to_doc
+from llama_index.core.storage.kvstore.types import DEFAULT_BATCH_SIZE, DEFAULT_COLLECTION, BaseKVStore
+
+# Tutorial: 1 = new indices keep their docstore in "docstore.sqlite3". 0 = "docstore.json", as in the original tutorials.
+CT_DOCSTORE = 1
+#
+# Tutorial: file name of the SQLite3 docstore inside the index directory.
+CT_DOCSTORE_FNAME = "docstore.sqlite3"
+CT_DOCSTORE_JSON_FNAME = "docstore.json"
+#
+# Tutorial: nodes kept decompressed in RAM. Retrieved chunks are read again by the LLM synthesis and by repeated questions.
+CT_DOCSTORE_LRU_NODES = 2048
+#
+# Tutorial: zlib level, 1 (fast) .. 9 (small). Chunk text compresses about 3:1.
+CT_DOCSTORE_ZLIB_LEVEL = 6
+#
+# Tutorial: files SQLite3 and persist() create next to "docstore.sqlite3" while it is open or being written.
+# They are not part of the index: index versions (datasdr_response_cache.py) and reload checks (datasdr_index_server.py) skip them.
+CT_DOCSTORE_TRANSIENT_FILES = re.compile(r"(-wal|-shm|-journal|\.tmp-\d+)$")
+
+
+class DataSDRSQLiteKVStore(BaseKVStore):
+	"""
+	Key-value store in one SQLite3 table: (collection, key) -> zlib-compressed JSON, with an LRU of decoded values.
+	Safe to share between threads. Writes are committed by persist().
+	"""
+
+	def __init__(self, in_path: str = ":memory:", in_lru_size: int = CT_DOCSTORE_LRU_NODES) -> None:
+		self.path = in_path
+		self.lru_size = in_lru_size
+		self.hits = 0
+		self.misses = 0
+		self._lru: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+		self._lock = threading.RLock()
+		self._connection = sqlite3.connect(in_path, timeout=60.0, check_same_thread=False)
+		if in_path != ":memory:":
+			# Tutorial: not WAL. Opening an index for reading must not create "-wal" / "-shm" files in its directory.
+			self._connection.execute("PRAGMA journal_mode=DELETE")
+		self._connection.execute(
+			"CREATE TABLE IF NOT EXISTS kv (collection TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (collection, key))"
+		)
+		self._connection.commit()
+
+	def _func_lru_put(self, in_lru_key: Tuple[str, str], in_json: str) -> None:
+		"""
+		This function adds a decoded value to the LRU, dropping the least recently used one when full.
+		"""
+		self._lru[in_lru_key] = in_json
+		self._lru.move_to_end(in_lru_key)
+		if len(self._lru) > self.lru_size:
+			self._lru.popitem(last=False)
+
+	def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+		self.put_all([(key, val)], collection=collection)
+
+	async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+		self.put(key, val, collection=collection)
+
+	def put_all(self, kv_pairs: List[Tuple[str, dict]], collection: str = DEFAULT_COLLECTION, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+		var_rows = [(collection, one_key, zlib.compress(json.dumps(one_value).encode("utf-8"), CT_DOCSTORE_ZLIB_LEVEL)) for one_key, one_value in kv_pairs]
+		with self._lock:
+			self._connection.executemany("INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)", var_rows)
+			for one_key, _ in kv_pairs:
+				self._lru.pop((collection, one_key), None)
+
+	async def aput_all(self, kv_pairs: List[Tuple[str, dict]], collection: str = DEFAULT_COLLECTION, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+		self.put_all(kv_pairs, collection=collection, batch_size=batch_size)
+
+	def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+		var_lru_key = (collection, key)
+		with self._lock:
+			var_json = self._lru.get(var_lru_key)
+			if var_json is not None:
+				self._lru.move_to_end(var_lru_key)
+				self.hits += 1
+			else:
+				var_row = self._connection.execute("SELECT value FROM kv WHERE collection = ? AND key = ?", var_lru_key).fetchone()
+				if var_row is None:
+					return None
+				self.misses += 1
+				var_json = zlib.decompress(var_row[0]).decode("utf-8")
+				self._func_lru_put(var_lru_key, var_json)
+		# Tutorial: every caller gets its own dictionary; LlamaIndex modifies the dictionaries it deserializes.
+		return json.loads(var_json)
+
+	async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+		return self.get(key, collection=collection)
+
+	def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+		with self._lock:
+			var_rows = self._connection.execute("SELECT key, value FROM kv WHERE collection = ?", (collection,)).fetchall()
+		return {one_key: json.loads(zlib.decompress(one_value)) for one_key, one_value in var_rows}
+
+	async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+		return self.get_all(collection=collection)
+
+	def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+		with self._lock:
+			self._lru.pop((collection, key), None)
+			return self._connection.execute("DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key)).rowcount > 0
+
+	async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+		return self.delete(key, collection=collection)
+
+	def func_count(self, in_collection: str) -> int:
+		"""
+		This function returns the number of entries of a collection.
+
+		in_collection: str - Collection name, e.g. "docstore/data".
+		"""
+		with self._lock:
+			return self._connection.execute("SELECT COUNT(*) FROM kv WHERE collection = ?", (in_collection,)).fetchone()[0]
+
+	def func_keys(self, in_collection: str) -> List[str]:
+		"""
+		This function returns the keys of a collection, without reading the values.
+
+		in_collection: str - Collection name, e.g. "docstore/data".
+		"""
+		with self._lock:
+			return [one_row[0] for one_row in self._connection.execute("SELECT key FROM kv WHERE collection = ?", (in_collection,))]
+
+	def func_iter_items(self, in_collection: str, in_batch_rows: int = CT_DOCSTORE_LRU_NODES) -> Iterator[Tuple[str, dict]]:
+		"""
+		This function yields every (key, value) of a collection in key order, reading in_batch_rows rows at a time.
+		The LRU is not used, so a full scan does not evict the nodes of recent queries.
+
+		in_collection: str - Collection name, e.g. "docstore/data".
+		in_batch_rows: int - Rows read per SELECT.
+		"""
+		var_last_key = ""
+		while True:
+			with self._lock:
+				var_rows = self._connection.execute(
+					"SELECT key, value FROM kv WHERE collection = ? AND key > ? ORDER BY key LIMIT ?", (in_collection, var_last_key, in_batch_rows)
+				).fetchall()
+			for one_key, one_value in var_rows:
+				yield one_key, json.loads(zlib.decompress(one_value))
+			if len(var_rows) < in_batch_rows:
+				return
+			var_last_key = var_rows[-1][0]
+
+	def func_commit(self) -> None:
+		"""
+		This function commits pending writes to the SQLite3 file.
+		"""
+		with self._lock:
+			self._connection.commit()
+
+	def persist(self, in_path: str) -> None:
+		"""
+		This function commits pending writes to in_path. A different in_path receives a complete copy (SQLite3 backup);
+		the copy is written to a temporary file and renamed, so it is never seen half-written.
+
+		in_path: str - SQLite3 file.
+		"""
+		with self._lock:
+			# Tutorial: a backup only copies committed data.
+			self._connection.commit()
+			if self.path != ":memory:" and os.path.abspath(in_path) == os.path.abspath(self.path):
+				return
+			os.makedirs(os.path.dirname(os.path.abspath(in_path)), exist_ok=True)
+			var_tmp_path = "%s.tmp-%d" % (in_path, os.getpid())
+			if os.path.exists(var_tmp_path):
+				os.remove(var_tmp_path)
+			var_target = sqlite3.connect(var_tmp_path)
+			try:
+				self._connection.backup(var_target)
+				var_target.execute("PRAGMA journal_mode=DELETE")
+			finally:
+				var_target.close()
+			os.replace(var_tmp_path, in_path)
+
+	def close(self) -> None:
+		with self._lock:
+			self._connection.close()
+#
+#
+class DataSDRSQLiteDocumentStore(KVDocumentStore):
+	"""
+	LlamaIndex docstore backed by DataSDRSQLiteKVStore. Nodes are read lazily by ID.
+	"""
+
+	def __init__(self, in_kvstore: Optional[DataSDRSQLiteKVStore] = None, namespace: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+		super().__init__(in_kvstore or DataSDRSQLiteKVStore(), namespace=namespace, batch_size=batch_size)
+
+	@classmethod
+	def from_persist_dir(cls, in_persist_dir: str, namespace: Optional[str] = None, in_lru_size: int = CT_DOCSTORE_LRU_NODES) -> "DataSDRSQLiteDocumentStore":
+		"""
+		This function opens the "docstore.sqlite3" of an index directory. No node is read.
+
+		in_persist_dir: str - Index directory.
+		namespace: str - LlamaIndex docstore namespace.
+		in_lru_size: int - Nodes kept decompressed in RAM.
+		"""
+		var_path = os.path.join(in_persist_dir, CT_DOCSTORE_FNAME)
+		if not os.path.exists(var_path):
+			raise FileNotFoundError("No [%s] in [%s]" % (CT_DOCSTORE_FNAME, in_persist_dir))
+		return cls(DataSDRSQLiteKVStore(var_path, in_lru_size), namespace=namespace)
+
+	def persist(self, persist_path: str = CT_DOCSTORE_JSON_FNAME, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+		"""
+		This function saves the docstore. storage_context.persist(..) passes the path of "docstore.json";
+		"docstore.sqlite3" is written in the same directory instead.
+		"""
+		self._kvstore.persist(os.path.join(os.path.dirname(persist_path), CT_DOCSTORE_FNAME))
+
+	def func_commit(self) -> None:
+		"""
+		This function commits the nodes written so far to "docstore.sqlite3", without copying the file.
+		"""
+		self._kvstore.func_commit()
+
+	def close(self) -> None:
+		"""
+		This function closes the SQLite3 file. Used when a reloaded index replaces this one.
+		"""
+		self._kvstore.close()
+
+	def func_node_count(self) -> int:
+		"""
+		This function returns the number of nodes in the docstore, without reading them.
+		"""
+		return self._kvstore.func_count(self._node_collection)
+
+	def func_node_ids(self) -> List[str]:
+		"""
+		This function returns the IDs of the nodes in the docstore, without reading them.
+		"""
+		return self._kvstore.func_keys(self._node_collection)
+
+	def func_iter_nodes(self, in_batch_rows: int = CT_DOCSTORE_LRU_NODES) -> Iterator[BaseNode]:
+		"""
+		This function yields every node of the docstore, in node ID order, without reading them all into RAM.
+
+		in_batch_rows: int - Nodes read per SELECT.
+		"""
+		for _, one_value in self._kvstore.func_iter_items(self._node_collection, in_batch_rows):
+			yield json_to_doc(one_value)
+#
+#
+def func_datasdr_is_transient_file(in_file_name: str) -> int:
+	"""
+	This function returns 1 for the temporary files of a SQLite3 docstore (journal, WAL, persist() copy), 0 for index files.
+
+	in_file_name: str - File name inside an index directory.
+	"""
+	return 1 if CT_DOCSTORE_TRANSIENT_FILES.search(in_file_name) else 0
+#
+#
+def func_datasdr_has_sqlite_docstore(in_index_directory: str) -> int:
+	"""
+	This function returns 1 if an index directory contains a SQLite3 docstore.
+
+	in_index_directory: str - Index directory.
+	"""
+	return 1 if os.path.exists(os.path.join(in_index_directory, CT_DOCSTORE_FNAME)) else 0
+#
+#
+def func_datasdr_new_docstore():
+	"""
+	This function returns an empty docstore for a new index: DataSDRSQLiteDocumentStore if CT_DOCSTORE = 1, else SimpleDocumentStore.
+	"""
+	if CT_DOCSTORE == 1:
+		return DataSDRSQLiteDocumentStore()
+	return SimpleDocumentStore()
+#
+#
+def func_datasdr_new_storage_context(in_vector_store=None):
+	"""
+	This function returns the StorageContext of a new index, with the docstore of func_datasdr_new_docstore().
+
+	in_vector_store - Optional vector store, e.g. DataSDRMmapVectorStore().
+	"""
+	from llama_index.core import StorageContext
+	#
+	return StorageContext.from_defaults(vector_store=in_vector_store, docstore=func_datasdr_new_docstore())
+#
+#
+def func_datasdr_convert_docstore(in_index_directory: str, in_remove_json: bool = False) -> int:
+	"""
+	This function converts the "docstore.json" of an existing index directory to "docstore.sqlite3".
+
+	in_index_directory: str - Index directory created by "storage_context.persist(..)".
+	in_remove_json: bool - Delete the JSON file after a successful conversion.
+	"""
+	var_json_path = os.path.join(in_index_directory, CT_DOCSTORE_JSON_FNAME)
+	if not os.path.exists(var_json_path):
+		print("No [%s] found in [%s]" % (CT_DOCSTORE_JSON_FNAME, in_index_directory))
+		return 0
+	#
+	var_docstore = DataSDRSQLiteDocumentStore()
+	with open(var_json_path, "r") as f:
+		# Tutorial: "docstore.json" is {collection: {key: value}}, the same collections as the SQLite3 table.
+		for one_collection, one_values in json.load(f).items():
+			var_docstore._kvstore.put_all(list(one_values.items()), collection=one_collection)
+	var_docstore.persist(var_json_path)
+	#
+	var_sqlite_size = os.path.getsize(os.path.join(in_index_directory, CT_DOCSTORE_FNAME))
+	print("Converted [%s]: %d nodes, %d bytes JSON -> %d bytes SQLite3" % (in_index_directory, var_docstore.func_node_count(), os.path.getsize(var_json_path), var_sqlite_size))
+	#
+	if in_remove_json:
+		os.remove(var_json_path)
+	return 1
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_docstore.py <index_dir> [<index_dir> ..] [--remove-json]
+	var_remove_json = "--remove-json" in sys.argv
+	for one_directory in [one_arg for one_arg in sys.argv[1:] if not one_arg.startswith("--")]:
+		func_datasdr_convert_docstore(one_directory, in_remove_json=var_remove_json)
+		var_start = time.time()
+		var_docstore = DataSDRSQLiteDocumentStore.from_persist_dir(one_directory)
+		print("  opened in %.4f seconds, %d nodes available" % (time.time() - var_start, var_docstore.func_node_count()))
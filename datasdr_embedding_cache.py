@@ -0,0 +1,272 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_embedding_cache.py
+# Purpose: Persistent, content-addressed embedding cache keyed by chunk text and embedding model name.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+The homework in Tutorial_02.py and Tutorial_03.py asks you to delete CT_INDEX_DIR and re-run the
+script. Without a cache, every chunk is embedded again, even if 99% of the PDFs or SQLite3 rows
+did not change.
+
+This file keeps every embedding in a single SQLite3 file, keyed by SHA-256(model name + chunk text),
+with query embeddings kept apart from text embeddings:
+* A rebuild only pays for new or changed chunks.
+* The file size is bounded: the least recently used embeddings are evicted first.
+* Hit and miss counts are kept, so you can see the savings.
+
+Usage:
+	from datasdr_embedding_cache import DataSDRCachedEmbedding
+	Settings.embed_model = DataSDRCachedEmbedding(
+		DataSDROllamaEmbedding(model_name="nomic-embed-text"),
+		cache_path="/Users/server/Downloads/test/_embedding_cache.sqlite3",
+	)
+	..
+	print(Settings.embed_model.func_cache_report())
+
+Inspect a cache file:
+	python3 datasdr_embedding_cache.py /Users/server/Downloads/test/_embedding_cache.sqlite3
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+# Tutorial: maximum size of the cached vectors, in bytes. 1 GB holds about 330,000 768-dimension embeddings.
+CT_EMBEDDING_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+#
+# Tutorial: SQLite3 limits the number of "?" parameters in one statement.
+CT_SQLITE_CHUNK = 500
+
+
+def func_datasdr_embedding_key(in_model_name: str, in_text: str, in_kind: str = "text") -> str:
+	"""
+	This function returns the cache key of a chunk: SHA-256 of the embedding kind, the model name and the text.
+	Models with a query instruction or prefix embed a question differently from the same text as a chunk.
+	Text keys keep the original format, so existing cache files stay valid.
+
+	in_model_name: str - Embedding model name, e.g. "nomic-embed-text".
+	in_text: str - Chunk text, exactly as sent to the embedding model.
+	in_kind: str - "text" (chunks) or "query" (questions).
+	"""
+	var_prefix = "" if in_kind == "text" else "%s\x00" % (in_kind)
+	return hashlib.sha256(("%s%s\x00%s" % (var_prefix, in_model_name, in_text)).encode("utf-8")).hexdigest()
+#
+#
+class DataSDREmbeddingCache:
+	"""
+	SQLite3-backed embedding cache with size-bounded LRU eviction.
+	Safe to share between threads; several processes may use the same file.
+	"""
+
+	def __init__(self, in_cache_path: str, in_max_bytes: int = CT_EMBEDDING_CACHE_MAX_BYTES) -> None:
+		self.cache_path = in_cache_path
+		self.max_bytes = in_max_bytes
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(in_cache_path, timeout=60.0, check_same_thread=False)
+		self._connection.execute("PRAGMA journal_mode=WAL")
+		self._connection.execute("PRAGMA synchronous=NORMAL")
+		self._connection.execute(
+			"CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+		)
+		self._connection.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+		self._connection.commit()
+		# Tutorial: size of the vectors, read once and then kept up to date on insert and eviction.
+		self._bytes, self._rows = self._func_read_total()
+
+	def _func_read_total(self) -> Tuple[int, int]:
+		"""
+		This function returns the bytes of all the vectors and the number of rows. It reads the whole table.
+		"""
+		var_bytes, var_rows = self._connection.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings").fetchone()
+		return int(var_bytes), int(var_rows)
+
+	def func_get_many(self, in_keys: List[str]) -> Dict[str, List[float]]:
+		"""
+		This function returns the cached embeddings for the given keys. Missing keys are left out.
+
+		in_keys - Cache keys from func_datasdr_embedding_key().
+		"""
+		var_found: Dict[str, List[float]] = {}
+		var_now = time.time()
+		with self._lock:
+			for var_start in range(0, len(in_keys), CT_SQLITE_CHUNK):
+				var_chunk = in_keys[var_start:var_start + CT_SQLITE_CHUNK]
+				var_rows = self._connection.execute(
+					"SELECT key, vector FROM embeddings WHERE key IN (%s)" % (",".join("?" * len(var_chunk))), var_chunk
+				).fetchall()
+				for one_key, one_blob in var_rows:
+					var_found[one_key] = array("f", one_blob).tolist()
+			# Tutorial: touching "last_used" is what makes the eviction least-recently-used.
+			self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(var_now, one_key) for one_key in var_found])
+			self._connection.commit()
+			self.hits += len(var_found)
+			self.misses += len(set(in_keys)) - len(var_found)
+		return var_found
+
+	def func_put_many(self, in_model_name: str, in_items: Dict[str, List[float]]) -> None:
+		"""
+		This function stores embeddings, then evicts old entries if the cache is over its size limit.
+
+		in_model_name: str - Embedding model name.
+		in_items - Dictionary of cache key -> embedding.
+		"""
+		var_now = time.time()
+		var_rows = [(one_key, in_model_name, array("f", one_vector).tobytes(), var_now) for one_key, one_vector in in_items.items()]
+		var_keys = list(in_items)
+		with self._lock:
+			# Tutorial: rows replaced by INSERT OR REPLACE are subtracted from the running size.
+			var_replaced_bytes, var_replaced_rows = 0, 0
+			for var_start in range(0, len(var_keys), CT_SQLITE_CHUNK):
+				var_chunk = var_keys[var_start:var_start + CT_SQLITE_CHUNK]
+				var_bytes, var_count = self._connection.execute(
+					"SELECT COALESCE(SUM(LENGTH(vector)), 0), COUNT(*) FROM embeddings WHERE key IN (%s)" % (",".join("?" * len(var_chunk))), var_chunk
+				).fetchone()
+				var_replaced_bytes += var_bytes
+				var_replaced_rows += var_count
+			self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", var_rows)
+			self._connection.commit()
+			self._bytes += sum(len(one_row[2]) for one_row in var_rows) - var_replaced_bytes
+			self._rows += len(var_rows) - var_replaced_rows
+			self._func_evict()
+
+	def _func_evict(self) -> None:
+		"""
+		This function deletes the least recently used embeddings until the cache fits in max_bytes.
+		The table is only read when the running size is over the limit.
+		"""
+		if self._bytes <= self.max_bytes:
+			return
+		# Tutorial: other processes may share the file; re-read the exact size before deleting anything.
+		self._bytes, self._rows = self._func_read_total()
+		if self._bytes <= self.max_bytes or self._rows == 0:
+			return
+		# Tutorial: estimate how many rows to drop from the average vector size, plus 10% headroom.
+		var_average = self._bytes / self._rows
+		var_drop = int((self._bytes - self.max_bytes * 0.9) / var_average) + 1
+		var_victims = self._connection.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used ASC LIMIT ?", (var_drop,)).fetchall()
+		var_deleted = 0
+		for var_start in range(0, len(var_victims), CT_SQLITE_CHUNK):
+			var_chunk = [one_key for one_key, _ in var_victims[var_start:var_start + CT_SQLITE_CHUNK]]
+			var_deleted += self._connection.execute("DELETE FROM embeddings WHERE key IN (%s)" % (",".join("?" * len(var_chunk))), var_chunk).rowcount
+		self._connection.commit()
+		self._bytes -= sum(one_length for _, one_length in var_victims)
+		self._rows -= var_deleted
+		self.evictions += var_deleted
+
+	def func_stats(self) -> Dict[str, Any]:
+		"""
+		This function returns hit/miss counts for this session plus the size of the cache file contents.
+		"""
+		with self._lock:
+			var_bytes, var_rows = self._func_read_total()
+		var_lookups = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": (self.hits / var_lookups) if var_lookups else 0.0,
+			"evictions": self.evictions,
+			"entries": var_rows,
+			"bytes": var_bytes,
+			"max_bytes": self.max_bytes,
+		}
+
+	def close(self) -> None:
+		with self._lock:
+			self._connection.close()
+#
+#
+class DataSDRCachedEmbedding(BaseEmbedding):
+	"""
+	Embedding model wrapper that answers from DataSDREmbeddingCache and only embeds cache misses.
+	"""
+
+	embed_model: BaseEmbedding = Field(description="Embedding model used for cache misses.")
+
+	_cache: DataSDREmbeddingCache = PrivateAttr()
+
+	def __init__(self, embed_model: BaseEmbedding, cache_path: str, max_bytes: int = CT_EMBEDDING_CACHE_MAX_BYTES, **kwargs: Any) -> None:
+		kwargs.setdefault("embed_batch_size", embed_model.embed_batch_size)
+		super().__init__(embed_model=embed_model, model_name=embed_model.model_name, **kwargs)
+		self._cache = DataSDREmbeddingCache(cache_path, max_bytes)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "DataSDRCachedEmbedding"
+
+	@property
+	def cache(self) -> DataSDREmbeddingCache:
+		return self._cache
+
+	def _func_embed_with_cache(self, in_texts: List[str], in_embed_misses, in_kind: str = "text") -> List[List[float]]:
+		"""
+		This function looks up every text, embeds the misses with in_embed_misses, and stores them.
+
+		in_texts - Texts to embed.
+		in_embed_misses - Function that embeds a list of texts.
+		in_kind: str - "text" or "query", see func_datasdr_embedding_key().
+		"""
+		var_keys = [func_datasdr_embedding_key(self.model_name, one_text, in_kind) for one_text in in_texts]
+		var_found = self._cache.func_get_many(var_keys)
+		#
+		var_missing: Dict[str, str] = {}
+		for one_key, one_text in zip(var_keys, in_texts):
+			if one_key not in var_found:
+				var_missing[one_key] = one_text
+		if var_missing:
+			var_new = dict(zip(var_missing.keys(), in_embed_misses(list(var_missing.values()))))
+			self._cache.func_put_many(self.model_name, var_new)
+			var_found.update(var_new)
+		return [var_found[one_key] for one_key in var_keys]
+
+	def _get_query_embedding(self, query: str) -> List[float]:
+		"""Get query embedding."""
+		return self._func_embed_with_cache([query], lambda in_texts: [self.embed_model.get_query_embedding(in_texts[0])], "query")[0]
+
+	async def _aget_query_embedding(self, query: str) -> List[float]:
+		"""The asynchronous version of _get_query_embedding."""
+		return await asyncio.to_thread(self._get_query_embedding, query)
+
+	def _get_text_embedding(self, text: str) -> List[float]:
+		"""Get text embedding."""
+		return self._get_text_embeddings([text])[0]
+
+	async def _aget_text_embedding(self, text: str) -> List[float]:
+		"""Asynchronously get text embedding."""
+		return await asyncio.to_thread(self._get_text_embedding, text)
+
+	def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+		"""Get text embeddings, embedding only the cache misses."""
+		return self._func_embed_with_cache(texts, self.embed_model._get_text_embeddings)
+
+	async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+		"""Asynchronously get text embeddings."""
+		return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+	def func_cache_report(self) -> str:
+		"""
+		This function returns a one-line summary of cache hits and misses.
+		"""
+		var_stats = self._cache.func_stats()
+		return "Embedding cache: %d hits, %d misses (%.1f%% hit rate), %d entries, %.1f MB of %.1f MB" % (
+			var_stats["hits"], var_stats["misses"], 100.0 * var_stats["hit_rate"], var_stats["entries"],
+			var_stats["bytes"] / 1048576.0, var_stats["max_bytes"] / 1048576.0,
+		)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_embedding_cache.py <cache file>
+	var_connection = sqlite3.connect(sys.argv[1])
+	for one_model, one_count, one_bytes in var_connection.execute("SELECT model, COUNT(*), SUM(LENGTH(vector)) FROM embeddings GROUP BY model"):
+		print("%-30s %10d embeddings %10.1f MB" % (one_model, one_count, one_bytes / 1048576.0))
+	var_connection.close()
@@ -0,0 +1,221 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_embeddings.py
+# Purpose: Batched, concurrent embedding client for Ollama.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+OllamaEmbedding sends one HTTP request per chunk, one after the other. Indexing a sponsor SQLite3
+file therefore spends most of its time waiting for round trips.
+
+DataSDROllamaEmbedding is a drop-in replacement:
+* Chunks are grouped into batches of "request_batch_size" texts per request ("/api/embed").
+* Up to "max_concurrency" requests are in flight at the same time.
+* All requests share one pooled HTTP connection pool (keep-alive).
+* Failed requests are retried with exponential backoff.
+* Older Ollama versions without "/api/embed" fall back to "/api/embeddings", one text per request.
+
+Usage:
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text")
+
+Benchmark against the local fake Ollama server:
+	python3 datasdr_embeddings.py
+"""
+
+import asyncio
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+import httpx
+#
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+from datasdr_metrics import func_datasdr_count, func_datasdr_stage
+
+# Tutorial: texts sent in a single HTTP request.
+CT_REQUEST_BATCH_SIZE = 32
+#
+# Tutorial: HTTP requests in flight at the same time. Ollama processes them in parallel when OLLAMA_NUM_PARALLEL > 1.
+CT_MAX_CONCURRENCY = 4
+#
+# Tutorial: retries for failed requests, and the first backoff delay in seconds (doubled on each retry).
+CT_MAX_RETRIES = 5
+CT_BACKOFF_SECONDS = 0.5
+#
+CT_REQUEST_TIMEOUT = 360.0
+CT_OLLAMA_BASE_URL = "http://localhost:11434"
+
+
+class DataSDROllamaEmbedding(BaseEmbedding):
+	"""
+	Ollama embedding client with request batching, concurrency, connection pooling and retries.
+	"""
+
+	base_url: str = Field(default=CT_OLLAMA_BASE_URL, description="Base url the model is hosted by Ollama")
+	model_name: str = Field(description="The Ollama model to use.")
+	request_batch_size: int = Field(default=CT_REQUEST_BATCH_SIZE, gt=0, description="Texts per HTTP request.")
+	max_concurrency: int = Field(default=CT_MAX_CONCURRENCY, gt=0, description="HTTP requests in flight.")
+	max_retries: int = Field(default=CT_MAX_RETRIES, ge=0, description="Retries per failed request.")
+	backoff_seconds: float = Field(default=CT_BACKOFF_SECONDS, ge=0, description="First retry delay.")
+	request_timeout: float = Field(default=CT_REQUEST_TIMEOUT, description="Timeout per HTTP request.")
+
+	_client: Optional[httpx.Client] = PrivateAttr(default=None)
+	_executor: Optional[ThreadPoolExecutor] = PrivateAttr(default=None)
+	_batch_endpoint: bool = PrivateAttr(default=True)
+
+	def __init__(self, model_name: str, base_url: str = CT_OLLAMA_BASE_URL, request_batch_size: int = CT_REQUEST_BATCH_SIZE, max_concurrency: int = CT_MAX_CONCURRENCY, **kwargs: Any) -> None:
+		# Tutorial: LlamaIndex hands "embed_batch_size" texts at a time to the client; make it large
+		# enough to keep "max_concurrency" requests of "request_batch_size" texts busy.
+		kwargs.setdefault("embed_batch_size", request_batch_size * max_concurrency * 2)
+		super().__init__(model_name=model_name, base_url=base_url, request_batch_size=request_batch_size, max_concurrency=max_concurrency, **kwargs)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "DataSDROllamaEmbedding"
+
+	# - - - - -
+	# HTTP plumbing.
+	def _func_client(self) -> httpx.Client:
+		if self._client is None:
+			self._client = httpx.Client(
+				base_url=self.base_url,
+				timeout=self.request_timeout,
+				limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+			)
+		return self._client
+
+	def _func_executor(self) -> ThreadPoolExecutor:
+		if self._executor is None:
+			self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="datasdr-embed")
+		return self._executor
+
+	def _func_post(self, in_path: str, in_body: dict) -> dict:
+		"""
+		This function POSTs a JSON body, retrying connection errors, timeouts, 429 and 5xx answers.
+
+		in_path: str - Endpoint path, e.g. "/api/embed".
+		in_body: dict - JSON body.
+		"""
+		var_attempt = 0
+		while True:
+			try:
+				var_response = self._func_client().post(in_path, json=in_body)
+				if var_response.status_code == 429 or var_response.status_code >= 500:
+					var_response.raise_for_status()
+				if var_response.status_code != 200:
+					raise ValueError(
+						"Ollama call failed with status code %d. Details: %s" % (var_response.status_code, var_response.text)
+					)
+				return var_response.json()
+			except (httpx.TransportError, httpx.HTTPStatusError):
+				if var_attempt >= self.max_retries:
+					raise
+				# Tutorial: exponential backoff with jitter, so parallel requests do not retry in lockstep.
+				time.sleep(self.backoff_seconds * (2 ** var_attempt) * (0.5 + random.random()))
+				var_attempt += 1
+
+	def _func_embed_request(self, in_texts: List[str]) -> List[List[float]]:
+		"""
+		This function embeds one batch of texts with a single request.
+
+		in_texts - Texts of one request batch.
+		"""
+		with func_datasdr_stage("embedding_http"):
+			var_embeddings = self._func_embed_request_once(in_texts)
+		func_datasdr_count("embedding_requests")
+		func_datasdr_count("embedding_http_texts", len(in_texts))
+		return var_embeddings
+
+	def _func_embed_request_once(self, in_texts: List[str]) -> List[List[float]]:
+		"""
+		This function sends one batch of texts to "/api/embed", or text by text to "/api/embeddings" on older Ollama versions.
+
+		in_texts - Texts of one request batch.
+		"""
+		if self._batch_endpoint:
+			try:
+				return self._func_post("/api/embed", {"model": self.model_name, "input": in_texts})["embeddings"]
+			except ValueError as e:
+				# Tutorial: Ollama versions before 0.3 do not have "/api/embed".
+				if "status code 404" not in str(e) or "model" in str(e).lower():
+					raise
+				self._batch_endpoint = False
+		return [self._func_post("/api/embeddings", {"model": self.model_name, "prompt": one_text})["embedding"] for one_text in in_texts]
+
+	# - - - - -
+	# LlamaIndex embedding protocol.
+	def _get_query_embedding(self, query: str) -> List[float]:
+		"""Get query embedding."""
+		return self._func_embed_request([query])[0]
+
+	async def _aget_query_embedding(self, query: str) -> List[float]:
+		"""The asynchronous version of _get_query_embedding."""
+		return await asyncio.to_thread(self._get_query_embedding, query)
+
+	def _get_text_embedding(self, text: str) -> List[float]:
+		"""Get text embedding."""
+		return self._func_embed_request([text])[0]
+
+	async def _aget_text_embedding(self, text: str) -> List[float]:
+		"""Asynchronously get text embedding."""
+		return await asyncio.to_thread(self._get_text_embedding, text)
+
+	def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+		"""Get text embeddings: split into request batches and send them concurrently."""
+		var_batches = [texts[i:i + self.request_batch_size] for i in range(0, len(texts), self.request_batch_size)]
+		if len(var_batches) <= 1:
+			return self._func_embed_request(texts) if texts else []
+		var_embeddings: List[List[float]] = []
+		# Tutorial: map() keeps the results in the same order as the texts.
+		for one_result in self._func_executor().map(self._func_embed_request, var_batches):
+			var_embeddings.extend(one_result)
+		return var_embeddings
+
+	async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+		"""Asynchronously get text embeddings."""
+		return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+	def close(self) -> None:
+		"""Close the connection pool and worker threads."""
+		if self._executor is not None:
+			self._executor.shutdown(wait=True)
+			self._executor = None
+		if self._client is not None:
+			self._client.close()
+			self._client = None
+#
+#
+def func_datasdr_benchmark_embeddings(in_embed_model: BaseEmbedding, in_texts: List[str]) -> float:
+	"""
+	This function embeds a list of texts and returns the throughput in texts per second.
+
+	in_embed_model: BaseEmbedding - Embedding client to measure.
+	in_texts - Texts to embed.
+	"""
+	var_start = time.time()
+	in_embed_model.get_text_embedding_batch(in_texts)
+	return len(in_texts) / (time.time() - var_start)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_embeddings.py [<number of texts>]
+	from datasdr_fake_ollama import func_datasdr_start_fake_ollama
+	#
+	var_count = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+	var_texts = ["Clinical trial chunk number %d about cirrhosis and thrombosis." % (i) for i in range(var_count)]
+	var_server = func_datasdr_start_fake_ollama()
+	var_base_url = "http://127.0.0.1:%d" % (var_server.server_address[1])
+	#
+	print("\nEmbedding %d texts against the fake Ollama server at %s\n" % (var_count, var_base_url))
+	for var_label, var_batch, var_concurrency in [("one text per request, sequential", 1, 1), ("batched, sequential", CT_REQUEST_BATCH_SIZE, 1), ("batched, concurrent", CT_REQUEST_BATCH_SIZE, CT_MAX_CONCURRENCY)]:
+		var_model = DataSDROllamaEmbedding(model_name="nomic-embed-text", base_url=var_base_url, request_batch_size=var_batch, max_concurrency=var_concurrency)
+		var_requests = var_server.requests_served
+		var_rate = func_datasdr_benchmark_embeddings(var_model, var_texts)
+		print("%-36s %9.1f texts/sec  (%d requests)" % (var_label, var_rate, var_server.requests_served - var_requests))
+		var_model.close()
+	#
+	var_server.shutdown()
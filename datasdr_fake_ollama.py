@@ -0,0 +1,205 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_fake_ollama.py
+# Purpose: Deterministic local stand-in for the Ollama HTTP API (embeddings and chat), used for benchmarks.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+A tiny HTTP server that answers the Ollama endpoints used by the tutorials:
+	POST /api/embed        {"model": .., "input": [..]}   -> {"embeddings": [[..], ..]}
+	POST /api/embeddings   {"model": .., "prompt": ".."}  -> {"embedding": [..]}
+	POST /api/chat         {"model": .., "messages": [..], "stream": ..}  -> {"message": {"role": "assistant", "content": ..}, ..}
+	POST /api/generate     {"model": .., "prompt": "..", "stream": ..}    -> {"response": .., ..}
+
+Embeddings are derived from a hash of the text, so the same text always gets the same vector.
+An optional delay per request and per text simulates the cost of a real embedding server.
+
+Answers are made of words picked from the prompt by a hash, so the same prompt always gets the same answer.
+With "stream": true (Ollama's default) one JSON line per token is sent, as Ollama does, after a simulated
+time-to-first-token and with a simulated delay per token.
+
+Usage:
+	python3 datasdr_fake_ollama.py 11435
+	# Tutorial: then point the embedding client to base_url="http://127.0.0.1:11435"
+"""
+
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+# Tutorial: nomic-embed-text returns 768 dimensions.
+CT_FAKE_EMBEDDING_DIM = 768
+#
+# Tutorial: simulated cost of one HTTP request, and of one text inside a request, in seconds.
+CT_FAKE_REQUEST_DELAY = 0.005
+CT_FAKE_TEXT_DELAY = 0.001
+#
+# Tutorial: simulated LLM: tokens per answer, seconds before the first token, and seconds per following token.
+CT_FAKE_ANSWER_TOKENS = 32
+CT_FAKE_FIRST_TOKEN_DELAY = 0.05
+CT_FAKE_TOKEN_DELAY = 0.002
+
+
+def func_datasdr_fake_embedding(in_text: str, in_dim: int = CT_FAKE_EMBEDDING_DIM) -> List[float]:
+	"""
+	This function returns a deterministic pseudo-embedding for a text.
+
+	in_text: str - Text to embed.
+	in_dim: int - Number of dimensions.
+	"""
+	var_values = []
+	var_counter = 0
+	while len(var_values) < in_dim:
+		var_digest = hashlib.sha256(("%d:%s" % (var_counter, in_text)).encode("utf-8")).digest()
+		var_values.extend((one_byte - 127.5) / 127.5 for one_byte in var_digest)
+		var_counter += 1
+	return var_values[:in_dim]
+#
+#
+def func_datasdr_fake_answer(in_prompt: str, in_tokens: int = CT_FAKE_ANSWER_TOKENS) -> List[str]:
+	"""
+	This function returns a deterministic pseudo-answer for a prompt, as a list of tokens (" word").
+
+	in_prompt: str - Prompt sent to the LLM.
+	in_tokens: int - Number of tokens.
+	"""
+	var_words = re.findall(r"[A-Za-z]{3,}", in_prompt) or ["answer"]
+	var_digest = b""
+	var_counter = 0
+	while len(var_digest) < 2 * in_tokens:
+		var_digest += hashlib.sha256(("%d:%s" % (var_counter, in_prompt)).encode("utf-8")).digest()
+		var_counter += 1
+	return [" " + var_words[int.from_bytes(var_digest[2 * i:2 * i + 2], "big") % len(var_words)] for i in range(in_tokens)]
+#
+#
+class DataSDRFakeOllamaHandler(BaseHTTPRequestHandler):
+	"""
+	Request handler for the fake Ollama server. Settings are read from the server object.
+	"""
+
+	protocol_version = "HTTP/1.1"
+	# Tutorial: headers and body are written separately; without this, keep-alive requests stall on delayed ACKs.
+	disable_nagle_algorithm = True
+
+	def func_send_json(self, in_status: int, in_body) -> None:
+		var_data = json.dumps(in_body).encode("utf-8")
+		self.send_response(in_status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(var_data)))
+		self.end_headers()
+		self.wfile.write(var_data)
+
+	def func_send_answer(self, in_body, in_prompt: str, in_chat: int) -> None:
+		"""
+		This function sends a pseudo-answer like /api/chat (in_chat=1) or /api/generate (in_chat=0), streamed or not.
+		"""
+		var_server = self.server
+		var_tokens = func_datasdr_fake_answer(in_prompt, var_server.answer_tokens)
+		var_start = time.time()
+		#
+		def func_chunk(in_text: str, in_done: bool):
+			var_chunk = {"model": in_body.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": in_done}
+			if in_chat:
+				var_chunk["message"] = {"role": "assistant", "content": in_text}
+			else:
+				var_chunk["response"] = in_text
+			if in_done:
+				var_chunk.update({"done_reason": "stop", "prompt_eval_count": len(in_prompt.split()), "eval_count": len(var_tokens), "total_duration": int((time.time() - var_start) * 1e9)})
+			return var_chunk
+		#
+		if not in_body.get("stream", True):
+			time.sleep(var_server.first_token_delay + var_server.token_delay * (len(var_tokens) - 1))
+			self.func_send_json(200, func_chunk("".join(var_tokens).strip(), True))
+			return
+		#
+		# Tutorial: Ollama streams newline-delimited JSON; HTTP/1.1 keep-alive needs chunked transfer encoding.
+		self.send_response(200)
+		self.send_header("Content-Type", "application/x-ndjson")
+		self.send_header("Transfer-Encoding", "chunked")
+		self.end_headers()
+		time.sleep(var_server.first_token_delay)
+		for var_position, one_token in enumerate(var_tokens):
+			if var_position:
+				time.sleep(var_server.token_delay)
+			self.func_write_chunk(func_chunk(one_token.strip() if var_position == 0 else one_token, False))
+		self.func_write_chunk(func_chunk("", True))
+		self.wfile.write(b"0\r\n\r\n")
+
+	def func_write_chunk(self, in_body) -> None:
+		var_data = (json.dumps(in_body) + "\n").encode("utf-8")
+		self.wfile.write(b"%x\r\n%s\r\n" % (len(var_data), var_data))
+		self.wfile.flush()
+
+	def do_POST(self) -> None:
+		var_body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+		var_server = self.server
+		var_server.requests_served += 1
+		#
+		if self.path == "/api/embed":
+			var_texts = var_body.get("input", [])
+			if isinstance(var_texts, str):
+				var_texts = [var_texts]
+			time.sleep(var_server.request_delay + var_server.text_delay * len(var_texts))
+			self.func_send_json(200, {"model": var_body.get("model"), "embeddings": [func_datasdr_fake_embedding(one_text, var_server.embedding_dim) for one_text in var_texts]})
+		elif self.path == "/api/embeddings":
+			time.sleep(var_server.request_delay + var_server.text_delay)
+			self.func_send_json(200, {"embedding": func_datasdr_fake_embedding(var_body.get("prompt", ""), var_server.embedding_dim)})
+		elif self.path == "/api/chat":
+			var_messages = var_body.get("messages") or [{"content": ""}]
+			self.func_send_answer(var_body, var_messages[-1].get("content") or "", 1)
+		elif self.path == "/api/generate":
+			self.func_send_answer(var_body, var_body.get("prompt", ""), 0)
+		else:
+			self.func_send_json(404, {"error": "unknown endpoint %s" % (self.path)})
+
+	def log_message(self, format, *args) -> None:
+		# Tutorial: keep benchmark output clean.
+		return
+#
+#
+def func_datasdr_start_fake_ollama(
+	in_port: int = 0,
+	in_request_delay: float = CT_FAKE_REQUEST_DELAY,
+	in_text_delay: float = CT_FAKE_TEXT_DELAY,
+	in_embedding_dim: int = CT_FAKE_EMBEDDING_DIM,
+	in_answer_tokens: int = CT_FAKE_ANSWER_TOKENS,
+	in_first_token_delay: float = CT_FAKE_FIRST_TOKEN_DELAY,
+	in_token_delay: float = CT_FAKE_TOKEN_DELAY,
+) -> ThreadingHTTPServer:
+	"""
+	This function starts the fake Ollama server in a background thread and returns it.
+	The base URL is "http://127.0.0.1:%d" % server.server_address[1]. Stop it with server.shutdown().
+
+	in_port: int - TCP port. 0 picks a free port.
+	in_request_delay: float - Simulated seconds per HTTP request.
+	in_text_delay: float - Simulated seconds per embedded text.
+	in_embedding_dim: int - Number of dimensions of the returned embeddings.
+	in_answer_tokens: int - Tokens per LLM answer.
+	in_first_token_delay: float - Simulated seconds before the first token of an answer.
+	in_token_delay: float - Simulated seconds per following token.
+	"""
+	var_server = ThreadingHTTPServer(("127.0.0.1", in_port), DataSDRFakeOllamaHandler)
+	var_server.daemon_threads = True
+	var_server.request_delay = in_request_delay
+	var_server.text_delay = in_text_delay
+	var_server.embedding_dim = in_embedding_dim
+	var_server.answer_tokens = in_answer_tokens
+	var_server.first_token_delay = in_first_token_delay
+	var_server.token_delay = in_token_delay
+	var_server.requests_served = 0
+	threading.Thread(target=var_server.serve_forever, daemon=True).start()
+	return var_server
+#
+#
+if __name__ == "__main__":
+	var_server = func_datasdr_start_fake_ollama(int(sys.argv[1]) if len(sys.argv) > 1 else 11435)
+	print("Fake Ollama listening on http://127.0.0.1:%d  (Ctrl+C to stop)" % (var_server.server_address[1]))
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		var_server.shutdown()
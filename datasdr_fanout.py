@@ -0,0 +1,137 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_fanout.py
+# Purpose: Ask one question across all sponsor indices: parallel retrieval, merged top-k, one LLM call.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+To compare sponsors, Tutorial_03.py asks every sponsor index separately: nine sponsors cost nine
+retrievals and nine LLM answers, one after the other, and the answers still have to be compared by hand.
+
+This file fans a question out instead:
+* The question is embedded ONCE.
+* Every sponsor index is searched at the same time (thread pool) with that embedding.
+* The results are merged by score into one global top-k. Each chunk is labelled with its sponsor.
+* The LLM is called ONCE, with the merged chunks, so it can compare the sponsors in a single answer.
+
+Usage:
+	from datasdr_fanout import func_datasdr_load_sponsor_indices, func_datasdr_fanout_query
+	var_indices = func_datasdr_load_sponsor_indices(CT_SQLITE3_DIRECTORY, CT_SPONSORS_NAME)
+	var_result = func_datasdr_fanout_query(var_indices, "Which sponsors run studies on cirrhosis?")
+	print(var_result["answer"])
+
+	python3 datasdr_fanout.py /Users/server/Downloads/test/_Datafiles/ "Which sponsors run studies on cirrhosis?" Abbott Pfizer Sanofi
+"""
+
+import heapq
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from llama_index.core import Settings, get_response_synthesizer
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from datasdr_sqlite import func_datasdr_sponsor_index_directory
+from datasdr_vector_store import func_datasdr_load_index
+
+# Tutorial: chunks kept per sponsor, and in the merged result sent to the LLM.
+CT_FANOUT_TOP_K_PER_INDEX = 4
+CT_FANOUT_TOP_K = 8
+#
+# Tutorial: indices searched (or loaded) at the same time.
+CT_FANOUT_WORKERS = 9
+#
+# Tutorial: metadata key added to every merged chunk, so the LLM knows which sponsor it comes from.
+CT_FANOUT_SOURCE_KEY = "sponsor"
+
+
+def func_datasdr_load_sponsor_indices(in_sqlite_directory: str, in_sponsors_dict, in_workers: int = CT_FANOUT_WORKERS) -> Dict:
+	"""
+	This function loads the index of every sponsor in parallel. Sponsors without an index are skipped.
+	Returns a dictionary of sponsor name -> index.
+
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_sponsors_dict - Names of sponsors.
+	in_workers: int - Indices loaded at the same time.
+	"""
+	def func_load(in_sponsor):
+		try:
+			return in_sponsor, func_datasdr_load_index(func_datasdr_sponsor_index_directory(in_sqlite_directory, in_sponsor))
+		except FileNotFoundError:
+			print("No index for sponsor [%s], skipped." % (in_sponsor))
+			return in_sponsor, None
+	#
+	with ThreadPoolExecutor(max_workers=in_workers) as var_executor:
+		return {one_sponsor: one_index for one_sponsor, one_index in var_executor.map(func_load, in_sponsors_dict) if one_index is not None}
+#
+#
+def func_datasdr_fanout_retrieve(in_indices: Dict, in_question: str, in_top_k: int = CT_FANOUT_TOP_K, in_top_k_per_index: int = CT_FANOUT_TOP_K_PER_INDEX, in_workers: int = CT_FANOUT_WORKERS, in_filters=None) -> List[NodeWithScore]:
+	"""
+	This function searches every index in parallel and returns the global top-k chunks, best first.
+	Every returned node is a copy labelled with the name of its index (metadata key CT_FANOUT_SOURCE_KEY).
+
+	in_indices - Dictionary of name -> index, from func_datasdr_load_sponsor_indices().
+	in_question: str - Question in plain English.
+	in_top_k: int - Chunks kept after merging.
+	in_top_k_per_index: int - Chunks retrieved from each index.
+	in_workers: int - Indices searched at the same time.
+	in_filters - Optional MetadataFilters, applied in every index before scoring (see datasdr_metadata_index.py).
+	"""
+	# Tutorial: every index uses the same embedding model, so the question is embedded once, not once per sponsor.
+	var_bundle = QueryBundle(query_str=in_question, embedding=Settings.embed_model.get_query_embedding(in_question))
+	#
+	def func_retrieve(in_item):
+		var_name, var_index = in_item
+		var_nodes = var_index.as_retriever(similarity_top_k=in_top_k_per_index, filters=in_filters).retrieve(var_bundle)
+		return [(var_name, one_node) for one_node in var_nodes]
+	#
+	with ThreadPoolExecutor(max_workers=in_workers) as var_executor:
+		var_candidates = [one_pair for one_list in var_executor.map(func_retrieve, in_indices.items()) for one_pair in one_list]
+	#
+	var_merged = []
+	for var_name, one_node in heapq.nlargest(in_top_k, var_candidates, key=lambda one_pair: one_pair[1].score or 0.0):
+		# Tutorial: copy the node; the original object is shared with the docstore of its index.
+		var_node = one_node.node.copy()
+		var_node.metadata = {**one_node.node.metadata, CT_FANOUT_SOURCE_KEY: var_name}
+		var_merged.append(NodeWithScore(node=var_node, score=one_node.score))
+	return var_merged
+#
+#
+def func_datasdr_fanout_query(in_indices: Dict, in_question: str, in_top_k: int = CT_FANOUT_TOP_K, in_top_k_per_index: int = CT_FANOUT_TOP_K_PER_INDEX, in_response_mode: str = "compact", in_streaming: bool = False, in_filters=None) -> Dict:
+	"""
+	This function answers one question across all indices with a single LLM synthesis.
+	Returns a dictionary with "answer", "sources" (list of (name, score)), "retrieve_seconds" and "synthesize_seconds".
+
+	in_indices - Dictionary of name -> index, from func_datasdr_load_sponsor_indices().
+	in_question: str - Question in plain English.
+	in_top_k: int - Chunks sent to the LLM.
+	in_top_k_per_index: int - Chunks retrieved from each index.
+	in_response_mode: str - LlamaIndex response mode. "compact" packs all chunks into as few LLM calls as the context window allows.
+	in_streaming: bool - True = "answer" is a StreamingResponse; "synthesize_seconds" then only covers the start of generation.
+	in_filters - Optional MetadataFilters, e.g. func_datasdr_trial_filters(in_phase="Phase 3").
+	"""
+	var_start = time.time()
+	var_nodes = func_datasdr_fanout_retrieve(in_indices, in_question, in_top_k, in_top_k_per_index, in_filters=in_filters)
+	var_retrieved = time.time()
+	var_response = get_response_synthesizer(response_mode=in_response_mode, streaming=in_streaming).synthesize(in_question, var_nodes)
+	return {
+		"answer": var_response,
+		"sources": [(one_node.node.metadata[CT_FANOUT_SOURCE_KEY], one_node.score) for one_node in var_nodes],
+		"retrieve_seconds": var_retrieved - var_start,
+		"synthesize_seconds": time.time() - var_retrieved,
+	}
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_fanout.py <sqlite_directory> "<question>" <Sponsor> [<Sponsor> ..]
+	from llama_index.llms.ollama import Ollama
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	#
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text")
+	Settings.llm = Ollama(model="llama3", request_timeout=360.0)
+	var_indices = func_datasdr_load_sponsor_indices(sys.argv[1], sys.argv[3:])
+	var_result = func_datasdr_fanout_query(var_indices, sys.argv[2])
+	print(var_result["answer"], "\n")
+	for one_name, one_score in var_result["sources"]:
+		print("  %-24s %.4f" % (one_name, one_score or 0.0))
+	print("Retrieval: %.3f seconds, synthesis: %.3f seconds" % (var_result["retrieve_seconds"], var_result["synthesize_seconds"]))
@@ -0,0 +1,304 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_hybrid.py
+# Purpose: Hybrid retrieval: SQLite3 FTS5 (BM25) keyword search fused with vector search.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+Embeddings are good at meaning and bad at rare exact terms. The expected llama3 output of Tutorial_02.py
+says it has no information about "elastography", although NCT04175392 covers it: the chunks that
+mention the word were not among the most similar vectors.
+
+This file keeps a full-text (FTS5, BM25-ranked) index of the chunks of an index, in a SQLite3 file
+next to the index directory: "/Users/server/Downloads/test/_index" -> "/Users/server/Downloads/test/_index.fts5.sqlite3",
+".../_Datafiles/_Abbott" -> ".../_Datafiles/_Abbott.fts5.sqlite3" (next to the sponsor SQLite3 files).
+* The FTS5 file is brought in line with the docstore whenever a retriever is created: chunks added by a
+  rebuild or refresh are indexed, deleted ones are removed. Only the differences are written.
+* DataSDRHybridRetriever ranks the chunks twice, by keywords and by vector similarity, and merges both
+  rankings with Reciprocal Rank Fusion: score = sum of 1 / (CT_HYBRID_RRF_K + rank).
+* Exact-term questions (a trial ID such as "NCT04175392", or 'quoted' words) with enough chunks containing
+  every term are answered from the keyword pass alone: the question is not even embedded. Every other question,
+  however short ("Describe the protocol about Thrombosis?"), is ranked by both passes.
+* Metadata filters (datasdr_metadata_index.py) apply to both passes.
+
+Usage:
+	from datasdr_hybrid import func_datasdr_hybrid_query_engine
+	query_engine = func_datasdr_hybrid_query_engine(index, "/Users/server/Downloads/test/_index", streaming=True)
+
+	python3 datasdr_hybrid.py /Users/server/Downloads/test/_index "What do you know about elastography from the context?"
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from datasdr_metadata_index import DataSDRMetadataIndex
+from datasdr_metrics import func_datasdr_count, func_datasdr_stage
+
+# Tutorial: file name suffix of the FTS5 index, added to the index directory name.
+CT_FTS_SUFFIX = ".fts5.sqlite3"
+#
+# Tutorial: chunks returned, as similarity_top_k of index.as_query_engine() (LlamaIndex default: 2).
+CT_HYBRID_TOP_K = 2
+#
+# Tutorial: candidates taken from each ranking before fusion.
+CT_HYBRID_CANDIDATES = 10
+#
+# Tutorial: Reciprocal Rank Fusion constant. Larger values flatten the difference between ranks.
+CT_HYBRID_RRF_K = 60
+#
+# Tutorial: 1 = questions made only of exact terms (trial IDs, 'quoted' words) may be answered by the keyword pass alone.
+# 0 = always fuse.
+CT_HYBRID_KEYWORD_ONLY = 1
+#
+# Tutorial: keywords that are exact terms without quotes: trial IDs, e.g. "NCT04175392".
+CT_HYBRID_EXACT_TERM = re.compile(r"^nct\d{8}$")
+#
+# Tutorial: words ignored in keyword search.
+CT_HYBRID_STOPWORDS = set("""
+	a about above after all also an and any are as at be been before being between both but by can could
+	describe did do does doing during each explain few for from further had has have having how i if in into
+	is it its itself just know me more most my no nor not of off on once only or other our out over own
+	please same she should so some such summarize tell than that the their them then there these they this
+	those through to too under until up very was we were what when where which while who whom why will with
+	would you your context information provided document documents study studies protocol trial trials
+""".split())
+
+# Tutorial: open FTS5 indices, one per file, shared by all retrievers of the process.
+CT_FTS_INDICES: Dict[str, "DataSDRFTSIndex"] = {}
+CT_FTS_LOCK = threading.Lock()
+
+
+def func_datasdr_fts_path(in_index_directory: str) -> str:
+	"""
+	This function returns the FTS5 file of an index directory (or index ZIP): the same path, plus CT_FTS_SUFFIX.
+
+	in_index_directory: str - Index directory.
+	"""
+	return in_index_directory.rstrip("/\\") + CT_FTS_SUFFIX
+#
+#
+def func_datasdr_keywords(in_question: str) -> List[str]:
+	"""
+	This function returns the keywords of a question: lower-case words, without stop words, in order, once each.
+
+	in_question: str - Question in plain English.
+	"""
+	var_keywords = []
+	for one_word in re.findall(r"\w+", in_question.lower()):
+		if len(one_word) > 1 and one_word not in CT_HYBRID_STOPWORDS and one_word not in var_keywords:
+			var_keywords.append(one_word)
+	return var_keywords
+#
+#
+def func_datasdr_is_exact_query(in_question: str, in_keywords: List[str]) -> int:
+	"""
+	This function returns 1 if every keyword of a question is an exact term: a trial ID, or a word inside quotes.
+	Such questions want the chunks that contain the terms, not chunks with a similar meaning.
+
+	in_question: str - Question in plain English.
+	in_keywords - Keywords of the question, from func_datasdr_keywords().
+	"""
+	var_quoted = set()
+	for one_match in re.findall(r"(['\"])(.+?)\1", in_question):
+		var_quoted.update(func_datasdr_keywords(one_match[1]))
+	return int(bool(in_keywords) and all(CT_HYBRID_EXACT_TERM.match(one_keyword) or one_keyword in var_quoted for one_keyword in in_keywords))
+#
+#
+class DataSDRFTSIndex:
+	"""
+	FTS5 index of the chunks of one index. The text indexed is what the LLM sees: chunk text plus LLM metadata.
+	"""
+
+	def __init__(self, in_path: str) -> None:
+		self.path = in_path
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(in_path, check_same_thread=False)
+		self._connection.execute("PRAGMA journal_mode=WAL")
+		# Tutorial: "porter" matches word forms with a common stem ("trial" and "trials", "enrolled" and "enrollment"), not
+		# every derived word ("elastography" and "elastographic" stay apart); "remove_diacritics" matches "Sjögren" and "Sjogren".
+		self._connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(node_id UNINDEXED, text, tokenize='porter unicode61 remove_diacritics 2')")
+		self._connection.commit()
+
+	def func_sync(self, in_docstore, in_node_ids: List[str]) -> Dict[str, int]:
+		"""
+		This function adds the chunks of the index missing from the FTS5 index, and removes those no longer in the index.
+		Only the added chunks are read from the docstore.
+		Returns the number of chunks "added", "deleted" and "unchanged".
+
+		in_docstore - index.docstore.
+		in_node_ids - Node IDs of the index, e.g. index.index_struct.nodes_dict.values().
+		"""
+		var_node_ids = set(in_node_ids)
+		with self._lock:
+			var_indexed = set(one_row[0] for one_row in self._connection.execute("SELECT node_id FROM chunks"))
+			var_deleted = list(var_indexed.difference(var_node_ids))
+			var_added = [one_node for one_node in in_docstore.get_nodes(sorted(var_node_ids.difference(var_indexed)), raise_error=False) if one_node is not None]
+			with self._connection:
+				for var_start in range(0, len(var_deleted), 500):
+					var_chunk = var_deleted[var_start:var_start + 500]
+					self._connection.execute("DELETE FROM chunks WHERE node_id IN (%s)" % (",".join("?" * len(var_chunk))), var_chunk)
+				self._connection.executemany(
+					"INSERT INTO chunks (node_id, text) VALUES (?, ?)",
+					((one_node.node_id, one_node.get_content(metadata_mode=MetadataMode.LLM)) for one_node in var_added),
+				)
+		return {"added": len(var_added), "deleted": len(var_deleted), "unchanged": len(var_indexed) - len(var_deleted)}
+
+	def func_search(self, in_keywords: List[str], in_limit: int, in_all: bool = False) -> List[Tuple[str, float]]:
+		"""
+		This function returns the best chunks for the keywords, as (node_id, BM25 score), best first.
+
+		in_keywords - Keywords, from func_datasdr_keywords().
+		in_limit: int - Chunks returned.
+		in_all: bool - True = every keyword must appear in the chunk; False = any keyword.
+		"""
+		if not in_keywords:
+			return []
+		var_match = (" AND " if in_all else " OR ").join('"%s"' % (one_keyword) for one_keyword in in_keywords)
+		with self._lock:
+			var_rows = self._connection.execute(
+				"SELECT node_id, bm25(chunks) FROM chunks WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?", (var_match, in_limit)
+			).fetchall()
+		# Tutorial: FTS5's bm25() is negative, lower is better.
+		return [(one_id, -one_score) for one_id, one_score in var_rows]
+
+	def func_count(self) -> int:
+		"""
+		This function returns the number of indexed chunks.
+		"""
+		with self._lock:
+			return self._connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+#
+#
+def func_datasdr_fts_index(in_index, in_index_directory: str) -> DataSDRFTSIndex:
+	"""
+	This function opens (or creates) the FTS5 index of an index directory and syncs it with the docstore.
+
+	in_index - Loaded VectorStoreIndex.
+	in_index_directory: str - Index directory (or ZIP); the FTS5 file is written next to it.
+	"""
+	var_path = func_datasdr_fts_path(os.path.abspath(in_index_directory))
+	with CT_FTS_LOCK:
+		if var_path not in CT_FTS_INDICES:
+			CT_FTS_INDICES[var_path] = DataSDRFTSIndex(var_path)
+	var_fts = CT_FTS_INDICES[var_path]
+	with func_datasdr_stage("fts_sync"):
+		var_counts = var_fts.func_sync(in_index.docstore, in_index.index_struct.nodes_dict.values())
+	# Tutorial: reported with the other metrics (datasdr_metrics.py), not printed.
+	func_datasdr_count("fts_chunks_added", var_counts["added"])
+	func_datasdr_count("fts_chunks_deleted", var_counts["deleted"])
+	return var_fts
+#
+#
+class DataSDRHybridRetriever(BaseRetriever):
+	"""
+	Retriever that fuses an FTS5 keyword ranking with the vector ranking of an index (Reciprocal Rank Fusion).
+	"""
+
+	def __init__(
+		self,
+		in_index,
+		in_fts: DataSDRFTSIndex,
+		similarity_top_k: int = CT_HYBRID_TOP_K,
+		candidates: int = CT_HYBRID_CANDIDATES,
+		rrf_k: int = CT_HYBRID_RRF_K,
+		keyword_only: bool = CT_HYBRID_KEYWORD_ONLY == 1,
+		filters=None,
+		**kwargs: Any,
+	) -> None:
+		self._index = in_index
+		self._fts = in_fts
+		self._similarity_top_k = similarity_top_k
+		self._candidates = max(candidates, similarity_top_k)
+		self._rrf_k = rrf_k
+		self._keyword_only = keyword_only
+		self._filters = filters
+		self._vector_retriever = in_index.as_retriever(similarity_top_k=self._candidates, filters=filters)
+		super().__init__(**kwargs)
+
+	def _func_keyword_nodes(self, in_hits: List[Tuple[str, float]]) -> List[NodeWithScore]:
+		"""
+		This function loads the nodes of keyword hits from the docstore, and applies the metadata filters.
+
+		in_hits - (node_id, score) pairs from DataSDRFTSIndex.func_search().
+		"""
+		# Tutorial: a chunk deleted by a refresh since the last sync is skipped.
+		var_found = self._index.docstore.get_nodes([one_id for one_id, _ in in_hits], raise_error=False)
+		var_nodes = [NodeWithScore(node=one_node, score=one_score) for one_node, (_, one_score) in zip(var_found, in_hits) if one_node is not None]
+		if self._filters is None or not var_nodes:
+			return var_nodes
+		var_mask = DataSDRMetadataIndex([one_node.node.metadata for one_node in var_nodes]).func_mask(self._filters)
+		return [one_node for one_node, one_keep in zip(var_nodes, var_mask) if one_keep]
+
+	def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+		var_keywords = func_datasdr_keywords(query_bundle.query_str)
+		with func_datasdr_stage("keyword_search"):
+			var_all = self._func_keyword_nodes(self._fts.func_search(var_keywords, self._candidates, in_all=True))
+			if self._keyword_only and func_datasdr_is_exact_query(query_bundle.query_str, var_keywords) and len(var_all) >= self._similarity_top_k:
+				# Tutorial: an exact-term question with enough chunks containing every term; no embedding needed.
+				func_datasdr_count("keyword_only_queries")
+				return var_all[:self._similarity_top_k]
+			var_any = self._func_keyword_nodes(self._fts.func_search(var_keywords, self._candidates))
+		#
+		var_vector = self._vector_retriever.retrieve(query_bundle)
+		#
+		# Tutorial: chunks with every keyword rank before chunks with only some of them.
+		var_seen = set(one_node.node.node_id for one_node in var_all)
+		var_keyword = var_all + [one_node for one_node in var_any if one_node.node.node_id not in var_seen]
+		var_scores: Dict[str, float] = {}
+		var_nodes: Dict[str, NodeWithScore] = {}
+		for one_ranking in (var_keyword[:self._candidates], var_vector):
+			for var_rank, one_node in enumerate(one_ranking):
+				var_scores[one_node.node.node_id] = var_scores.get(one_node.node.node_id, 0.0) + 1.0 / (self._rrf_k + var_rank + 1)
+				var_nodes.setdefault(one_node.node.node_id, one_node)
+		var_best = sorted(var_scores, key=lambda one_id: -var_scores[one_id])[:self._similarity_top_k]
+		return [NodeWithScore(node=var_nodes[one_id].node, score=var_scores[one_id]) for one_id in var_best]
+#
+#
+def func_datasdr_hybrid_retriever(in_index, in_index_directory: str, **in_kwargs) -> DataSDRHybridRetriever:
+	"""
+	This function returns a hybrid retriever for an index; its FTS5 file is created or synced first.
+
+	in_index - Loaded VectorStoreIndex.
+	in_index_directory: str - Index directory (or ZIP).
+	in_kwargs - DataSDRHybridRetriever options: similarity_top_k, candidates, rrf_k, keyword_only, filters.
+	"""
+	return DataSDRHybridRetriever(in_index, func_datasdr_fts_index(in_index, in_index_directory), **in_kwargs)
+#
+#
+def func_datasdr_hybrid_query_engine(in_index, in_index_directory: str, similarity_top_k: int = CT_HYBRID_TOP_K, filters=None, **in_kwargs):
+	"""
+	This function returns a query engine that retrieves with DataSDRHybridRetriever. Drop-in for index.as_query_engine().
+
+	in_index - Loaded VectorStoreIndex.
+	in_index_directory: str - Index directory (or ZIP).
+	similarity_top_k: int - Chunks sent to the LLM.
+	filters - Optional MetadataFilters.
+	in_kwargs - Passed to RetrieverQueryEngine.from_args(), e.g. streaming=True.
+	"""
+	from llama_index.core.query_engine import RetrieverQueryEngine
+	#
+	var_retriever = func_datasdr_hybrid_retriever(in_index, in_index_directory, similarity_top_k=similarity_top_k, filters=filters)
+	return RetrieverQueryEngine.from_args(var_retriever, **in_kwargs)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_hybrid.py <index directory> "<question>"
+	from llama_index.core import Settings
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	from datasdr_vector_store import func_datasdr_load_index
+	#
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text")
+	var_index = func_datasdr_load_index(sys.argv[1])
+	var_retriever = func_datasdr_hybrid_retriever(var_index, sys.argv[1], similarity_top_k=5)
+	print("Keywords: %s\n" % (", ".join(func_datasdr_keywords(sys.argv[2]))))
+	for var_label, var_results in (("Vector only", var_index.as_retriever(similarity_top_k=5).retrieve(sys.argv[2])), ("Hybrid", var_retriever.retrieve(sys.argv[2]))):
+		print(var_label)
+		for one_node in var_results:
+			print("  %.4f  %s" % (one_node.score or 0.0, " ".join(one_node.node.get_content().split())[:110]))
+		print()
@@ -0,0 +1,342 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_index_builder.py
+# Purpose: Build the sponsor-specific indices of Tutorial_03.py in parallel.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+Tutorial_03.py builds one index per sponsor, one sponsor after the other. While one sponsor is
+being chunked, the embedding server waits; while the embedding server works, the other cores wait.
+
+This file runs several sponsors at the same time in a process pool:
+* Each worker process reads its own SQLite3 file and opens its own embedding client.
+* Each index is written to a temporary directory first, then renamed to "<directory>_<Sponsor>".
+  A crashed or interrupted build never leaves a half-written index behind.
+* Progress and timing are printed as each sponsor finishes.
+
+func_datasdr_build_sponsor_index_streaming() builds one sponsor without CT_LIMIT_RECORDS: the table
+is read page by page, and each page is chunked and embedded while the next one is read. Each page is
+written to disk (docstore.sqlite3 and a spool file of embeddings) before the next one is embedded.
+
+Usage:
+	python3 datasdr_index_builder.py /Users/server/Downloads/test/_Datafiles/ 4 Abbott Pfizer Sanofi
+"""
+
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from datasdr_sqlite import (
+	CT_STREAM_BATCH_SIZE,
+	CT_TRIALS_COLUMNS,
+	func_datasdr_ensure_nct_id_index,
+	func_datasdr_has_nct_id_index,
+	func_datasdr_iter_sponsor_rows,
+	func_datasdr_load_sponsor_documents,
+	func_datasdr_row_fingerprint,
+	func_datasdr_row_to_document,
+	func_datasdr_sponsor_index_directory,
+	func_datasdr_sponsor_sqlite_path,
+)
+from datasdr_metrics import CT_METRICS_REGISTRY, func_datasdr_count, func_datasdr_stage
+
+# Tutorial: number of sponsors processed at the same time. Start with the number of CPU cores.
+CT_BUILD_WORKERS = os.cpu_count() or 1
+#
+# Tutorial: same defaults as Tutorial_03.py.
+CT_LIMIT_RECORDS = 10
+CT_EMBEDDING_MODEL = ["nomic-embed-text"]
+
+
+def func_datasdr_index_documents(in_documents, in_storage_context=None, in_show_progress: bool = False):
+	"""
+	This function does what VectorStoreIndex.from_documents() does, in two timed stages:
+	"chunking" (Settings.transformations) and "index_build" (embedding the nodes and adding them to the index).
+	Returns the index.
+
+	in_documents - Documents to index.
+	in_storage_context - Optional StorageContext, e.g. with a DataSDRMmapVectorStore. None = func_datasdr_new_storage_context().
+	in_show_progress: bool - Show the LlamaIndex progress bars.
+	"""
+	from llama_index.core import Settings, VectorStoreIndex
+	from llama_index.core.ingestion import run_transformations
+	from datasdr_docstore import func_datasdr_new_storage_context
+	#
+	var_storage_context = in_storage_context or func_datasdr_new_storage_context()
+	for one_document in in_documents:
+		var_storage_context.docstore.set_document_hash(one_document.get_doc_id(), one_document.hash)
+	with func_datasdr_stage("chunking"):
+		var_nodes = run_transformations(in_documents, Settings.transformations, show_progress=in_show_progress)
+	func_datasdr_count("chunks", len(var_nodes))
+	with func_datasdr_stage("index_build"):
+		return VectorStoreIndex(nodes=var_nodes, storage_context=var_storage_context, show_progress=in_show_progress)
+#
+#
+def func_datasdr_build_sponsor_index(in_sponsor: str, in_sqlite_directory: str, in_limit_records: int, in_embedding_model: str, in_embedding_cache: Optional[str] = None, in_base_url: Optional[str] = None) -> Dict:
+	"""
+	This function builds and persists the index of a single sponsor. It runs inside a worker process.
+	Returns a dictionary with the sponsor name, status, number of documents and timings.
+
+	in_sponsor: str - Sponsor name, as in CT_SPONSORS_NAME.
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_limit_records: int - Maximum number of rows to retrieve.
+	in_embedding_model: str - Ollama embedding model name.
+	in_embedding_cache: str - Optional embedding cache file, shared by all workers.
+	in_base_url: str - Optional Ollama server. None = the default of DataSDROllamaEmbedding.
+	"""
+	var_result = {"sponsor": in_sponsor, "status": "built", "documents": 0, "load_seconds": 0.0, "index_seconds": 0.0, "persist_seconds": 0.0}
+	var_index_directory = func_datasdr_sponsor_index_directory(in_sqlite_directory, in_sponsor)
+	var_result["index_directory"] = var_index_directory
+	# Check if index already exists
+	if os.path.exists(var_index_directory):
+		var_result["status"] = "skipped"
+		return var_result
+	#
+	# Tutorial: SQLAlchemy would silently create an empty file for a missing sponsor.
+	if not os.path.exists(func_datasdr_sponsor_sqlite_path(in_sqlite_directory, in_sponsor)):
+		var_result["status"] = "failed"
+		var_result["error"] = "SQLite3 file not found: %s" % (func_datasdr_sponsor_sqlite_path(in_sqlite_directory, in_sponsor))
+		return var_result
+	#
+	var_tmp_directory = "%s.tmp-%d" % (var_index_directory, os.getpid())
+	# Tutorial: worker processes are re-used; only this sponsor's measurements are sent back to the parent.
+	CT_METRICS_REGISTRY.func_reset()
+	try:
+		# Tutorial: heavy imports happen inside the worker, so each process has its own clients.
+		from llama_index.core import Settings
+		from datasdr_docstore import func_datasdr_new_storage_context
+		from datasdr_embeddings import DataSDROllamaEmbedding
+		from datasdr_vector_store import DataSDRMmapVectorStore
+		#
+		Settings.embed_model = DataSDROllamaEmbedding(model_name=in_embedding_model, **({"base_url": in_base_url} if in_base_url else {}))
+		if in_embedding_cache:
+			from datasdr_embedding_cache import DataSDRCachedEmbedding
+			Settings.embed_model = DataSDRCachedEmbedding(Settings.embed_model, cache_path=in_embedding_cache)
+		#
+		var_start = time.time()
+		# Tutorial: one Document per row, with the row mapping of CT_ROW_MAPPING (datasdr_sqlite.py).
+		documents_DB = func_datasdr_load_sponsor_documents(func_datasdr_sponsor_sqlite_path(in_sqlite_directory, in_sponsor), in_sponsor, in_limit_records)
+		var_result["documents"] = len(documents_DB)
+		var_result["load_seconds"] = time.time() - var_start
+		#
+		var_start = time.time()
+		storage_context = func_datasdr_new_storage_context(DataSDRMmapVectorStore())
+		index_DB = func_datasdr_index_documents(documents_DB, storage_context)
+		var_result["index_seconds"] = time.time() - var_start
+		if in_embedding_cache:
+			var_result["cache_hits"] = Settings.embed_model.cache.hits
+			var_result["cache_misses"] = Settings.embed_model.cache.misses
+		#
+		var_start = time.time()
+		shutil.rmtree(var_tmp_directory, ignore_errors=True)
+		with func_datasdr_stage("persist", sponsor=in_sponsor):
+			index_DB.storage_context.persist(persist_dir=var_tmp_directory)
+		# Tutorial: the rename is atomic; the index directory either exists complete, or not at all.
+		try:
+			os.rename(var_tmp_directory, var_index_directory)
+		except OSError:
+			# Another process finished the same sponsor first.
+			shutil.rmtree(var_tmp_directory, ignore_errors=True)
+			var_result["status"] = "skipped"
+		var_result["persist_seconds"] = time.time() - var_start
+	except Exception as e:
+		shutil.rmtree(var_tmp_directory, ignore_errors=True)
+		var_result["status"] = "failed"
+		var_result["error"] = "%s: %s" % (type(e).__name__, str(e).splitlines()[0] if str(e) else "")
+	#
+	if CT_METRICS_REGISTRY.enabled:
+		var_result["metrics"] = CT_METRICS_REGISTRY.func_snapshot()
+	return var_result
+#
+#
+def func_datasdr_build_sponsor_index_streaming(
+	in_sponsor: str,
+	in_sqlite_directory: str,
+	in_batch_size: int = CT_STREAM_BATCH_SIZE,
+	in_limit_records: Optional[int] = None,
+	in_create_nct_id_index: bool = False,
+) -> Dict:
+	"""
+	This function builds the index of one sponsor without loading the whole table: rows are read page by page
+	(keyset on nct_id), and each page is chunked and embedded while the next page is read from SQLite3.
+	Node text goes to a "docstore.sqlite3" file and embeddings to a spool file, committed after every page,
+	so RAM holds one page plus the node IDs and metadata, whatever the table size.
+	Also writes the refresh manifest, so the index can later be refreshed with datasdr_refresh.py.
+	Uses the embedding model configured in Settings.
+
+	in_sponsor: str - Sponsor name, as in CT_SPONSORS_NAME.
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_batch_size: int - Rows per page.
+	in_limit_records: int - Optional maximum number of rows. None = whole table.
+	in_create_nct_id_index: bool - Create an index on nct_id in the sponsor's SQLite3 file, so pages are read faster.
+		This modifies the input file; off by default.
+	"""
+	from llama_index.core import StorageContext, VectorStoreIndex
+	from datasdr_docstore import CT_DOCSTORE_FNAME, DataSDRSQLiteDocumentStore, DataSDRSQLiteKVStore
+	from datasdr_refresh import func_datasdr_write_manifest
+	from datasdr_vector_store import CT_DEFAULT_BASENAME, DataSDRSpooledVectorStore
+	#
+	var_result = {"sponsor": in_sponsor, "status": "built", "documents": 0, "nodes": 0, "pages": 0, "seconds": 0.0}
+	var_sqlite_path = func_datasdr_sponsor_sqlite_path(in_sqlite_directory, in_sponsor)
+	var_index_directory = func_datasdr_sponsor_index_directory(in_sqlite_directory, in_sponsor)
+	var_result["index_directory"] = var_index_directory
+	if os.path.exists(var_index_directory):
+		var_result["status"] = "skipped"
+		return var_result
+	#
+	var_start = time.time()
+	if not func_datasdr_has_nct_id_index(var_sqlite_path, in_sponsor):
+		if in_create_nct_id_index and func_datasdr_ensure_nct_id_index(var_sqlite_path, in_sponsor):
+			print("  %s: index on nct_id created in [%s]" % (in_sponsor, var_sqlite_path))
+		else:
+			print("  %s: [%s] has no index on nct_id; every page sorts the table. in_create_nct_id_index=True adds one (writes to the file)." % (in_sponsor, var_sqlite_path))
+	# Tutorial: a reader thread keeps at most 2 pages ready, so reading overlaps with chunking and embedding.
+	var_pages: queue.Queue = queue.Queue(maxsize=2)
+	var_stop = threading.Event()
+	#
+	def func_put(in_item) -> bool:
+		# Tutorial: wait for room in the queue, but give up once the build has stopped reading it.
+		while not var_stop.is_set():
+			try:
+				var_pages.put(in_item, timeout=0.5)
+				return True
+			except queue.Full:
+				pass
+		return False
+	#
+	def func_reader() -> None:
+		var_rows = func_datasdr_iter_sponsor_rows(var_sqlite_path, in_sponsor, in_batch_size, in_limit_records)
+		try:
+			for one_page in var_rows:
+				if not func_put(one_page):
+					return
+		except Exception as e:
+			func_put(e)
+		finally:
+			# Tutorial: closes the SQLite3 connection, also when the build stopped early.
+			var_rows.close()
+		func_put(None)
+	#
+	var_reader = threading.Thread(target=func_reader, daemon=True)
+	var_reader.start()
+	#
+	# Tutorial: build straight into the temporary directory; it is renamed once complete.
+	var_tmp_directory = "%s.tmp-%d" % (var_index_directory, os.getpid())
+	shutil.rmtree(var_tmp_directory, ignore_errors=True)
+	os.makedirs(var_tmp_directory)
+	try:
+		var_docstore = DataSDRSQLiteDocumentStore(DataSDRSQLiteKVStore(os.path.join(var_tmp_directory, CT_DOCSTORE_FNAME)))
+		var_vector_store = DataSDRSpooledVectorStore(spool_path=os.path.join(var_tmp_directory, CT_DEFAULT_BASENAME + ".spool"))
+		storage_context = StorageContext.from_defaults(docstore=var_docstore, vector_store=var_vector_store)
+		func_datasdr_stream_pages(in_sponsor, var_pages, VectorStoreIndex(nodes=[], storage_context=storage_context), var_result)
+		#
+		with func_datasdr_stage("persist", sponsor=in_sponsor):
+			storage_context.persist(persist_dir=var_tmp_directory)
+		var_docstore.close()
+		for one_source in var_result["sources"].values():
+			one_source["fingerprint"] = "|".join(one_source["fingerprint"])
+		func_datasdr_write_manifest(var_tmp_directory, {"kind": "sqlite", "sources": var_result.pop("sources")})
+		os.rename(var_tmp_directory, var_index_directory)
+	except BaseException:
+		var_stop.set()
+		var_reader.join()
+		shutil.rmtree(var_tmp_directory, ignore_errors=True)
+		raise
+	var_result["seconds"] = time.time() - var_start
+	return var_result
+#
+#
+def func_datasdr_stream_pages(in_sponsor: str, in_pages: queue.Queue, in_index, io_result: Dict) -> None:
+	"""
+	This function chunks and embeds the pages of rows read by func_datasdr_build_sponsor_index_streaming(), until the reader sends None.
+	Each page is committed to the docstore file before the next one is read. Fills io_result["sources"] for the refresh manifest.
+
+	in_sponsor: str - Sponsor name.
+	in_pages: queue.Queue - Pages of rows, then None (or an exception from the reader).
+	in_index - VectorStoreIndex with a DataSDRSQLiteDocumentStore and a DataSDRSpooledVectorStore.
+	io_result: Dict - Result dictionary; "documents", "nodes" and "pages" are incremented.
+	"""
+	from llama_index.core import Settings
+	from llama_index.core.ingestion import run_transformations
+	#
+	var_updated_at = CT_TRIALS_COLUMNS.index("updated_at")
+	var_sources: Dict[str, Dict] = io_result.setdefault("sources", {})
+	var_docstore = in_index.storage_context.docstore
+	while True:
+		var_page = in_pages.get()
+		if var_page is None:
+			break
+		if isinstance(var_page, Exception):
+			raise var_page
+		var_documents = []
+		with func_datasdr_stage("documents", sponsor=in_sponsor):
+			for one_row in var_page:
+				var_document = func_datasdr_row_to_document(one_row[0], one_row[1:])
+				var_documents.append(var_document)
+				var_source = var_sources.setdefault(one_row[1], {"fingerprint": [], "doc_ids": []})
+				var_source["fingerprint"].append(func_datasdr_row_fingerprint(one_row[0], one_row[1 + var_updated_at]))
+				var_source["doc_ids"].append(var_document.doc_id)
+		func_datasdr_count("documents", len(var_documents))
+		with func_datasdr_stage("chunking", sponsor=in_sponsor):
+			var_nodes = run_transformations(var_documents, Settings.transformations)
+		func_datasdr_count("chunks", len(var_nodes))
+		with func_datasdr_stage("index_build", sponsor=in_sponsor):
+			in_index.insert_nodes(var_nodes)
+			# Tutorial: commit the page; SQLite3 keeps the node text on disk, not in RAM.
+			var_docstore.func_commit()
+		io_result["documents"] += len(var_documents)
+		io_result["nodes"] += len(var_nodes)
+		io_result["pages"] += 1
+		print("  %s: page %d, %d rows, %d nodes so far" % (in_sponsor, io_result["pages"], io_result["documents"], io_result["nodes"]))
+#
+#
+def func_datasdr_generate_indices_parallel(in_sponsors_dict, in_sqlite_directory: str, in_workers: int = CT_BUILD_WORKERS, in_limit_records: int = CT_LIMIT_RECORDS, in_embedding_model: str = CT_EMBEDDING_MODEL[0], in_embedding_cache: Optional[str] = None, in_base_url: Optional[str] = None) -> List[Dict]:
+	"""
+	This function generates sponsor-specific indices in parallel, one sponsor per worker process.
+	Returns one result dictionary per sponsor, in completion order.
+
+	in_sponsors_dict - Names of sponsors.
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_workers: int - Number of sponsors processed at the same time.
+	in_limit_records: int - Maximum number of rows to retrieve per sponsor.
+	in_embedding_model: str - Ollama embedding model name.
+	in_embedding_cache: str - Optional embedding cache file, shared by all workers.
+	in_base_url: str - Optional Ollama server. None = the default of DataSDROllamaEmbedding.
+	"""
+	var_sponsors = list(in_sponsors_dict)
+	var_results = []
+	var_start = time.time()
+	print("\n\nGenerating indices for %d sponsors with %d workers\n" % (len(var_sponsors), in_workers))
+	#
+	with ProcessPoolExecutor(max_workers=max(1, in_workers)) as executor:
+		var_futures = {
+			executor.submit(func_datasdr_build_sponsor_index, one_sponsor, in_sqlite_directory, in_limit_records, in_embedding_model, in_embedding_cache, in_base_url): one_sponsor
+			for one_sponsor in var_sponsors
+		}
+		for var_done, one_future in enumerate(as_completed(var_futures), start=1):
+			var_result = one_future.result()
+			var_results.append(var_result)
+			if "metrics" in var_result:
+				CT_METRICS_REGISTRY.func_merge(var_result.pop("metrics"))
+			var_total = var_result["load_seconds"] + var_result["index_seconds"] + var_result["persist_seconds"]
+			print("[%d/%d] %-22s %-8s %6d documents | load %7.2fs | index %7.2fs | persist %7.2fs | total %7.2fs" % (
+				var_done, len(var_sponsors), var_result["sponsor"], var_result["status"], var_result["documents"],
+				var_result["load_seconds"], var_result["index_seconds"], var_result["persist_seconds"], var_total,
+			))
+			if "cache_hits" in var_result:
+				print("        embedding cache: %d hits, %d misses" % (var_result["cache_hits"], var_result["cache_misses"]))
+			if var_result["status"] == "failed":
+				print("        %s" % (var_result["error"]))
+	#
+	print("\nAll sponsors processed in %.2f seconds\n" % (time.time() - var_start))
+	return var_results
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_index_builder.py <sqlite_directory> <workers> <Sponsor> [<Sponsor> ..]
+	# The embedding cache file "_embedding_cache.sqlite3" is kept inside <sqlite_directory>.
+	func_datasdr_generate_indices_parallel(sys.argv[3:], sys.argv[1], in_workers=int(sys.argv[2]), in_embedding_cache=os.path.join(sys.argv[1], "_embedding_cache.sqlite3"))
@@ -0,0 +1,485 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_index_server.py
+# Purpose: Long-lived local query service that keeps the PDF and sponsor indices loaded.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+Every run of Tutorial_02.py and Tutorial_03.py imports llama_index, reloads every index from disk,
+and only then answers three questions. Most of the time goes to start-up, not to the questions.
+
+This file runs a small asyncio HTTP server that:
+* Loads each index the first time it is asked for (or at start-up with --preload), then keeps it warm.
+* Serves concurrent questions, by index name: "pdf" for Tutorial_02.py, or a sponsor name for Tutorial_03.py.
+* Sends aggregate questions on sponsors to the SQL fast path in datasdr_router.py.
+* Reloads an index when its directory changes (a rebuild, a refresh, or a conversion to the binary vector store).
+  The old index keeps answering until the new one has loaded.
+
+Endpoints (JSON):
+	GET  /health
+	GET  /indexes
+	POST /query      {"index": "Abbott", "question": "..", "mode": "query" | "retrieve", "top_k": 5,
+	                  "filters": {"phase": "Phase 3", "overall_status": "Completed", "start_date_from": "2015-01-01"}}
+
+"filters" are applied before similarity scoring (see datasdr_metadata_index.py); questions with filters skip the SQL fast path.
+
+Usage:
+	python3 datasdr_index_server.py serve --sqlite-dir /Users/server/Downloads/test/_Datafiles/ --pdf-index /Users/server/Downloads/test/_index --model llama3
+	python3 datasdr_index_server.py ask Abbott "How many studies of type 'Interventional'?"
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+# Tutorial: llama_index is imported by the server only, so "ask" starts in milliseconds.
+
+CT_SERVER_HOST = "127.0.0.1"
+CT_SERVER_PORT = 8765
+CT_SERVER_URL = "http://%s:%d" % (CT_SERVER_HOST, CT_SERVER_PORT)
+#
+# Tutorial: questions answered at the same time. Each one waits on Ollama most of the time.
+CT_SERVER_WORKERS = 8
+#
+# Tutorial: how often an index directory is checked for changes, and how long it must stay unchanged before reloading.
+CT_RELOAD_CHECK_SECONDS = 2.0
+CT_RELOAD_SETTLE_SECONDS = 1.0
+#
+CT_SERVER_TOP_K = 2
+CT_REQUEST_TIMEOUT = 360.0
+#
+# Tutorial: largest request body accepted, in bytes.
+CT_MAX_BODY_BYTES = 1024 * 1024
+#
+# Tutorial: client connections, re-used across questions (keep-alive), one per server.
+CT_SERVER_CLIENTS: Dict = {}
+
+
+def func_datasdr_directory_signature(in_directory: str) -> Optional[Tuple]:
+	"""
+	This function returns a value that changes whenever a file in the directory is added, removed or rewritten.
+	SQLite3 journal and temporary files are skipped: opening the docstore must not look like a rebuild.
+	Returns None if the directory does not exist.
+
+	in_directory: str - Index directory.
+	"""
+	from datasdr_docstore import func_datasdr_is_transient_file
+	#
+	try:
+		var_inode = os.stat(in_directory).st_ino
+		if os.path.isfile(in_directory):
+			# Tutorial: an index served straight from its ZIP file.
+			var_stat = os.stat(in_directory)
+			return (var_inode, ((os.path.basename(in_directory), var_stat.st_mtime_ns, var_stat.st_size),))
+		var_files = sorted(
+			(one_entry.name, one_entry.stat().st_mtime_ns, one_entry.stat().st_size) for one_entry in os.scandir(in_directory)
+			if one_entry.is_file() and not func_datasdr_is_transient_file(one_entry.name)
+		)
+	except FileNotFoundError:
+		return None
+	return (var_inode, tuple(var_files))
+#
+#
+class DataSDRUnknownIndexError(KeyError):
+	"""
+	Raised for an index name the server does not know. Answered with HTTP 404.
+	"""
+#
+#
+def func_datasdr_validate_query(in_body) -> Optional[str]:
+	"""
+	This function checks the body of POST /query. Returns an error message for HTTP 400, or None if the body is valid.
+
+	in_body - Parsed JSON body.
+	"""
+	if not isinstance(in_body, dict):
+		return "the request body must be a JSON object"
+	for one_field in ("index", "question"):
+		if not isinstance(in_body.get(one_field), str) or not in_body[one_field].strip():
+			return "missing or empty field '%s'" % (one_field)
+	if in_body.get("mode", "query") not in ("query", "retrieve"):
+		return "'mode' must be 'query' or 'retrieve'"
+	if in_body.get("top_k") is not None and (not isinstance(in_body["top_k"], int) or isinstance(in_body["top_k"], bool) or in_body["top_k"] < 1):
+		return "'top_k' must be a positive integer"
+	if in_body.get("filters") is not None and not isinstance(in_body["filters"], dict):
+		return "'filters' must be a JSON object"
+	return None
+#
+#
+def func_datasdr_close_index(in_index) -> None:
+	"""
+	This function closes the SQLite3 docstore of an index that is no longer served. Other docstores need no closing.
+
+	in_index - Index returned by func_datasdr_load_index().
+	"""
+	var_close = getattr(in_index.docstore, "close", None)
+	if var_close is not None:
+		var_close()
+#
+#
+class DataSDRIndexTenant:
+	"""
+	One index served by the server: its directory, the loaded index and query engine, and reload state.
+	"""
+
+	def __init__(self, in_name: str, in_index_directory: str, in_sqlite_directory: Optional[str] = None) -> None:
+		self.name = in_name
+		self.index_directory = in_index_directory
+		# Tutorial: set for sponsors only; enables the SQL fast path.
+		self.sqlite_directory = in_sqlite_directory
+		self.index = None
+		self.query_engine = None
+		self.signature = None
+		self.loaded_at = 0.0
+		self.load_seconds = 0.0
+		self.last_check = 0.0
+		self.queries = 0
+		self.lock = asyncio.Lock()
+
+	def func_status(self) -> Dict:
+		return {
+			"name": self.name,
+			"index_directory": self.index_directory,
+			"loaded": self.index is not None,
+			"loaded_at": self.loaded_at,
+			"load_seconds": round(self.load_seconds, 3),
+			"queries": self.queries,
+			"sql_fast_path": self.sqlite_directory is not None,
+		}
+#
+#
+class DataSDRIndexServer:
+	"""
+	Registry of tenants plus the HTTP protocol. llama_index work runs in a thread pool, so the event loop
+	keeps accepting requests while questions are being answered.
+	"""
+
+	def __init__(self, in_tenants: List[DataSDRIndexTenant], in_top_k: int = CT_SERVER_TOP_K, in_workers: int = CT_SERVER_WORKERS) -> None:
+		self.tenants = {one_tenant.name: one_tenant for one_tenant in in_tenants}
+		self.top_k = in_top_k
+		self.executor = ThreadPoolExecutor(max_workers=in_workers, thread_name_prefix="datasdr-server")
+		self.started_at = time.time()
+
+	# - - - - -
+	# Index loading.
+	def _func_load(self, in_tenant: DataSDRIndexTenant):
+		from datasdr_vector_store import func_datasdr_load_index
+		#
+		var_start = time.time()
+		var_signature = func_datasdr_directory_signature(in_tenant.index_directory)
+		var_index = func_datasdr_load_index(in_tenant.index_directory)
+		var_query_engine = var_index.as_query_engine(similarity_top_k=self.top_k)
+		return var_index, var_query_engine, var_signature, time.time() - var_start
+
+	async def func_get_tenant(self, in_name: str) -> DataSDRIndexTenant:
+		"""
+		This function returns a loaded tenant, loading it on first use and reloading it if its directory changed.
+
+		in_name: str - Index name: "pdf" or a sponsor name.
+		"""
+		var_tenant = self.tenants.get(in_name)
+		if var_tenant is None:
+			raise DataSDRUnknownIndexError("unknown index '%s'. Known: %s" % (in_name, ", ".join(sorted(self.tenants))))
+		var_loop = asyncio.get_running_loop()
+		#
+		if var_tenant.index is not None and time.time() - var_tenant.last_check < CT_RELOAD_CHECK_SECONDS:
+			return var_tenant
+		async with var_tenant.lock:
+			var_tenant.last_check = time.time()
+			var_signature = await var_loop.run_in_executor(self.executor, func_datasdr_directory_signature, var_tenant.index_directory)
+			if var_tenant.index is not None and var_signature == var_tenant.signature:
+				return var_tenant
+			if var_signature is None:
+				if var_tenant.index is not None:
+					# Tutorial: a rebuild is swapping directories; keep serving the old index.
+					return var_tenant
+				raise FileNotFoundError("index directory [%s] does not exist" % (var_tenant.index_directory))
+			if var_tenant.index is not None:
+				# Tutorial: wait until the writer has finished, so we never load a half-written index.
+				await asyncio.sleep(CT_RELOAD_SETTLE_SECONDS)
+				if await var_loop.run_in_executor(self.executor, func_datasdr_directory_signature, var_tenant.index_directory) != var_signature:
+					return var_tenant
+			try:
+				var_index, var_query_engine, var_signature, var_seconds = await var_loop.run_in_executor(self.executor, self._func_load, var_tenant)
+			except Exception as e:
+				if var_tenant.index is None:
+					raise
+				print("Reloading [%s] failed, keeping the loaded index: %s" % (var_tenant.name, e), file=sys.stderr)
+				var_tenant.signature = var_signature
+				return var_tenant
+			print("%s index [%s] in %.2f seconds" % ("Reloaded" if var_tenant.index is not None else "Loaded", var_tenant.name, var_seconds))
+			if var_tenant.index is not None:
+				# Tutorial: questions already running may still read the old docstore; close it once they are done.
+				var_loop.call_later(CT_REQUEST_TIMEOUT, func_datasdr_close_index, var_tenant.index)
+			var_tenant.index, var_tenant.query_engine, var_tenant.signature = var_index, var_query_engine, var_signature
+			var_tenant.loaded_at, var_tenant.load_seconds = time.time(), var_seconds
+		return var_tenant
+
+	# - - - - -
+	# Questions.
+	def _func_answer_sql(self, in_tenant: DataSDRIndexTenant, in_question: str) -> Optional[Dict]:
+		"""
+		This function answers aggregate questions on a sponsor with SQL. Returns None for free-text questions.
+		"""
+		from datasdr_router import func_datasdr_plan_to_sql, func_datasdr_route_question, func_datasdr_run_plan
+		from datasdr_sqlite import func_datasdr_sponsor_sqlite_path
+		#
+		var_sqlite_path = func_datasdr_sponsor_sqlite_path(in_tenant.sqlite_directory, in_tenant.name)
+		var_plan = func_datasdr_route_question(in_question, var_sqlite_path, in_tenant.name)
+		if var_plan is None:
+			return None
+		return {"route": "sql", "answer": func_datasdr_run_plan(var_plan, var_sqlite_path, in_tenant.name), "sql": func_datasdr_plan_to_sql(var_plan, in_tenant.name)[0], "sources": []}
+
+	def _func_answer(self, in_tenant: DataSDRIndexTenant, in_question: str, in_mode: str, in_top_k: Optional[int], in_filters: Optional[Dict] = None) -> Dict:
+		from datasdr_metadata_index import func_datasdr_filters_from_dict
+		#
+		var_filters = func_datasdr_filters_from_dict(in_filters)
+		var_top_k = in_top_k or self.top_k
+		if in_mode == "retrieve":
+			var_retriever = in_tenant.index.as_retriever(similarity_top_k=var_top_k, filters=var_filters)
+			var_nodes = var_retriever.retrieve(in_question)
+			return {"route": "retrieve", "answer": None, "sources": func_datasdr_sources(var_nodes)}
+		var_query_engine = in_tenant.query_engine
+		if var_filters is not None or var_top_k != self.top_k:
+			# Tutorial: query engines are cheap; the index and its metadata postings are shared.
+			var_query_engine = in_tenant.index.as_query_engine(similarity_top_k=var_top_k, filters=var_filters)
+		var_response = var_query_engine.query(in_question)
+		return {"route": "rag", "answer": str(var_response), "sources": func_datasdr_sources(var_response.source_nodes)}
+
+	async def func_query(self, in_body: Dict) -> Dict:
+		"""
+		This function answers one question against one index.
+
+		in_body - {"index": .., "question": .., "mode": "query" | "retrieve", "top_k": .., "filters": {..}}
+		"""
+		var_start = time.time()
+		var_loop = asyncio.get_running_loop()
+		var_mode = in_body.get("mode", "query")
+		var_result = None
+		var_tenant = self.tenants.get(in_body["index"])
+		if var_tenant is not None and var_tenant.sqlite_directory is not None and var_mode == "query" and not in_body.get("filters"):
+			# Tutorial: the SQL fast path does not need the index, so it never waits for a (re)load.
+			var_result = await var_loop.run_in_executor(self.executor, self._func_answer_sql, var_tenant, in_body["question"])
+		if var_result is None:
+			var_tenant = await self.func_get_tenant(in_body["index"])
+			var_result = await var_loop.run_in_executor(
+				self.executor, self._func_answer, var_tenant, in_body["question"], var_mode, in_body.get("top_k"), in_body.get("filters")
+			)
+		var_tenant.queries += 1
+		var_result["index"] = var_tenant.name
+		var_result["seconds"] = round(time.time() - var_start, 4)
+		return var_result
+
+	# - - - - -
+	# HTTP/1.1 with keep-alive; just enough for JSON requests from func_datasdr_ask_server() or curl.
+	async def func_handle_connection(self, in_reader: asyncio.StreamReader, in_writer: asyncio.StreamWriter) -> None:
+		try:
+			while True:
+				var_request_line = await in_reader.readline()
+				if not var_request_line:
+					break
+				var_method, var_path = var_request_line.decode("latin-1").split()[:2]
+				var_headers = {}
+				while True:
+					var_line = await in_reader.readline()
+					if var_line in (b"\r\n", b"\n", b""):
+						break
+					var_key, _, var_value = var_line.decode("latin-1").partition(":")
+					var_headers[var_key.strip().lower()] = var_value.strip()
+				var_length = int(var_headers.get("content-length", 0))
+				if var_length > CT_MAX_BODY_BYTES:
+					await self.func_send(in_writer, 413, {"error": "request body too large"})
+					break
+				var_body = await in_reader.readexactly(var_length) if var_length else b""
+				var_status, var_response = await self.func_dispatch(var_method, var_path, var_body)
+				await self.func_send(in_writer, var_status, var_response)
+				if var_headers.get("connection", "").lower() == "close":
+					break
+		except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+			pass
+		finally:
+			in_writer.close()
+
+	async def func_dispatch(self, in_method: str, in_path: str, in_body: bytes):
+		try:
+			if in_method == "GET" and in_path == "/health":
+				return 200, {"status": "ok", "uptime_seconds": round(time.time() - self.started_at, 1)}
+			if in_method == "GET" and in_path == "/indexes":
+				return 200, {"indexes": [one_tenant.func_status() for one_tenant in self.tenants.values()]}
+			if in_method == "POST" and in_path == "/query":
+				try:
+					var_body = json.loads(in_body or b"{}")
+				except ValueError as e:
+					return 400, {"error": "invalid JSON: %s" % (e)}
+				var_error = func_datasdr_validate_query(var_body)
+				if var_error is not None:
+					return 400, {"error": var_error}
+				return 200, await self.func_query(var_body)
+			return 404, {"error": "unknown endpoint %s %s" % (in_method, in_path)}
+		except DataSDRUnknownIndexError as e:
+			return 404, {"error": str(e).strip("'\"")}
+		except FileNotFoundError as e:
+			return 503, {"error": str(e)}
+		except Exception as e:
+			return 500, {"error": "%s: %s" % (type(e).__name__, e)}
+
+	async def func_send(self, in_writer: asyncio.StreamWriter, in_status: int, in_body: Dict) -> None:
+		var_data = json.dumps(in_body).encode("utf-8")
+		var_reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}[in_status]
+		in_writer.write(
+			b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % (in_status, var_reason.encode("latin-1"), len(var_data)) + var_data
+		)
+		await in_writer.drain()
+
+	async def func_serve(self, in_host: str = CT_SERVER_HOST, in_port: int = CT_SERVER_PORT, in_unix_socket: Optional[str] = None, in_preload: bool = False) -> None:
+		"""
+		This function serves until cancelled.
+
+		in_host: str - TCP address to listen on.
+		in_port: int - TCP port to listen on.
+		in_unix_socket: str - Listen on this Unix socket instead of TCP.
+		in_preload: bool - Load every index before accepting requests.
+		"""
+		if in_preload:
+			for one_name in self.tenants:
+				await self.func_get_tenant(one_name)
+		if in_unix_socket:
+			var_server = await asyncio.start_unix_server(self.func_handle_connection, path=in_unix_socket)
+			print("Index server listening on unix socket %s" % (in_unix_socket))
+		else:
+			var_server = await asyncio.start_server(self.func_handle_connection, in_host, in_port)
+			print("Index server listening on http://%s:%d" % (in_host, var_server.sockets[0].getsockname()[1]))
+		print("Indices: %s" % (", ".join(self.tenants)))
+		async with var_server:
+			await var_server.serve_forever()
+#
+#
+def func_datasdr_sources(in_nodes) -> List[Dict]:
+	"""
+	This function summarizes retrieved nodes: id, score, and the first characters of their text.
+
+	in_nodes - List of NodeWithScore.
+	"""
+	return [{"node_id": one_node.node.node_id, "score": one_node.score, "text": one_node.node.get_content()[:200]} for one_node in in_nodes]
+#
+#
+def func_datasdr_ask_server(in_index: str, in_question: str, in_url: str = CT_SERVER_URL, in_mode: str = "query", in_unix_socket: Optional[str] = None, in_timeout: float = CT_REQUEST_TIMEOUT, in_filters: Optional[Dict] = None, in_top_k: Optional[int] = None) -> Dict:
+	"""
+	This function sends one question to a running index server and returns its JSON answer.
+
+	in_index: str - Index name: "pdf" or a sponsor name.
+	in_question: str - Question in plain English.
+	in_url: str - Server URL.
+	in_mode: str - "query" (answer with the LLM or SQL) or "retrieve" (return the top nodes only).
+	in_unix_socket: str - Unix socket of the server, instead of TCP.
+	in_timeout: float - Seconds to wait for the answer.
+	in_filters - Optional metadata filters, e.g. {"phase": "Phase 3"}; see func_datasdr_filters_from_dict().
+	in_top_k: int - Chunks retrieved for the question. None = the server's --top-k.
+	"""
+	var_key = (in_url, in_unix_socket)
+	if var_key not in CT_SERVER_CLIENTS:
+		var_transport = httpx.HTTPTransport(uds=in_unix_socket) if in_unix_socket else None
+		CT_SERVER_CLIENTS[var_key] = httpx.Client(base_url=in_url, timeout=in_timeout, transport=var_transport)
+	var_body = {"index": in_index, "question": in_question, "mode": in_mode, "filters": in_filters or {}}
+	if in_top_k is not None:
+		var_body["top_k"] = in_top_k
+	var_response = CT_SERVER_CLIENTS[var_key].post("/query", json=var_body)
+	var_result = var_response.json()
+	if var_response.status_code != 200:
+		raise ValueError("Index server error %d: %s" % (var_response.status_code, var_result.get("error")))
+	return var_result
+#
+#
+def func_datasdr_configure_settings(in_model: str, in_embedding_model: str, in_embedding_cache: Optional[str], in_ollama_url: str) -> None:
+	"""
+	This function sets the LLM and embedding model used by every index, as the tutorials do.
+	"""
+	from llama_index.core import Settings
+	from llama_index.llms.ollama import Ollama
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	from datasdr_embedding_cache import DataSDRCachedEmbedding
+	#
+	var_embed_model = DataSDROllamaEmbedding(model_name=in_embedding_model, base_url=in_ollama_url)
+	if in_embedding_cache:
+		var_embed_model = DataSDRCachedEmbedding(var_embed_model, cache_path=in_embedding_cache)
+	Settings.embed_model = var_embed_model
+	Settings.llm = Ollama(model=in_model, base_url=in_ollama_url, request_timeout=CT_REQUEST_TIMEOUT)
+#
+#
+def func_datasdr_build_tenants(in_sqlite_directory: Optional[str], in_sponsors: List[str], in_pdf_index: Optional[str]) -> List[DataSDRIndexTenant]:
+	"""
+	This function lists the indices to serve: every sponsor index under in_sqlite_directory, plus the PDF index.
+
+	in_sqlite_directory: str - Directory where SQLite3 files and sponsor indices are located at.
+	in_sponsors - Sponsor names. Empty = every sponsor with both a SQLite3 file and an index.
+	in_pdf_index: str - Index directory of Tutorial_02.py.
+	"""
+	from datasdr_sqlite import func_datasdr_sponsor_index_directory, func_datasdr_sponsor_sqlite_path
+	#
+	var_tenants = []
+	if in_pdf_index:
+		var_tenants.append(DataSDRIndexTenant("pdf", in_pdf_index))
+	if in_sqlite_directory:
+		var_sponsors = list(in_sponsors)
+		if not var_sponsors:
+			# Tutorial: every SQLite3 file that already has an index.
+			var_prefix, var_suffix = func_datasdr_sponsor_sqlite_path(in_sqlite_directory, "*").split("*")
+			var_sponsors = sorted(
+				one_path[len(var_prefix):-len(var_suffix)] for one_path in glob.glob(func_datasdr_sponsor_sqlite_path(in_sqlite_directory, "*"))
+				if os.path.isdir(func_datasdr_sponsor_index_directory(in_sqlite_directory, one_path[len(var_prefix):-len(var_suffix)]))
+			)
+		for one_sponsor in var_sponsors:
+			var_tenants.append(DataSDRIndexTenant(one_sponsor, func_datasdr_sponsor_index_directory(in_sqlite_directory, one_sponsor), in_sqlite_directory))
+	return var_tenants
+#
+#
+if __name__ == "__main__":
+	var_parser = argparse.ArgumentParser(description="DataSDR index server.")
+	var_commands = var_parser.add_subparsers(dest="command", required=True)
+	var_serve = var_commands.add_parser("serve", help="Run the server.")
+	var_serve.add_argument("--sqlite-dir", help="Directory with the sponsor SQLite3 files (Tutorial_03.py CT_SQLITE3_DIRECTORY).")
+	var_serve.add_argument("--sponsor", action="append", default=[], help="Sponsor to serve. Repeat. Default: every sponsor index found.")
+	var_serve.add_argument("--pdf-index", help="Index directory of Tutorial_02.py (CT_INDEX_DIR), served as 'pdf'.")
+	var_serve.add_argument("--model", default="llama3")
+	var_serve.add_argument("--embedding-model", default="nomic-embed-text")
+	var_serve.add_argument("--embedding-cache", default=None)
+	var_serve.add_argument("--ollama-url", default="http://localhost:11434")
+	var_serve.add_argument("--host", default=CT_SERVER_HOST)
+	var_serve.add_argument("--port", type=int, default=CT_SERVER_PORT)
+	var_serve.add_argument("--unix-socket", default=None)
+	var_serve.add_argument("--top-k", type=int, default=CT_SERVER_TOP_K)
+	var_serve.add_argument("--workers", type=int, default=CT_SERVER_WORKERS)
+	var_serve.add_argument("--preload", action="store_true", help="Load every index at start-up.")
+	var_ask = var_commands.add_parser("ask", help="Send one question to a running server.")
+	var_ask.add_argument("index")
+	var_ask.add_argument("question")
+	var_ask.add_argument("--url", default=CT_SERVER_URL)
+	var_ask.add_argument("--unix-socket", default=None)
+	var_ask.add_argument("--retrieve", action="store_true", help="Return the top nodes only, without the LLM.")
+	var_ask.add_argument("--top-k", type=int, default=None, help="Chunks retrieved for the question. Default: the server's --top-k.")
+	var_arguments = var_parser.parse_args()
+	#
+	if var_arguments.command == "ask":
+		var_result = func_datasdr_ask_server(var_arguments.index, var_arguments.question, var_arguments.url, "retrieve" if var_arguments.retrieve else "query", var_arguments.unix_socket, in_top_k=var_arguments.top_k)
+		if var_result["answer"] is not None:
+			print(var_result["answer"])
+		for one_source in var_result["sources"]:
+			print("  [%.4f] %s" % (one_source["score"] or 0.0, one_source["text"][:100].replace("\n", " ")))
+		print("(%s, %.3f seconds)" % (var_result["route"], var_result["seconds"]))
+	else:
+		var_tenants = func_datasdr_build_tenants(var_arguments.sqlite_dir, var_arguments.sponsor, var_arguments.pdf_index)
+		if not var_tenants:
+			var_parser.error("nothing to serve: give --sqlite-dir and/or --pdf-index")
+		func_datasdr_configure_settings(var_arguments.model, var_arguments.embedding_model, var_arguments.embedding_cache, var_arguments.ollama_url)
+		var_server = DataSDRIndexServer(var_tenants, var_arguments.top_k, var_arguments.workers)
+		try:
+			asyncio.run(var_server.func_serve(var_arguments.host, var_arguments.port, var_arguments.unix_socket, var_arguments.preload))
+		except KeyboardInterrupt:
+			pass
@@ -0,0 +1,262 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_metadata_index.py
+# Purpose: Inverted index over node metadata, so metadata filters are applied before similarity scoring.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+"Phase 3 completed trials" is a metadata question, not a similarity question. LlamaIndex's default
+filter (_build_metadata_filter_fn) calls a Python function for every node of the index, on every query.
+
+This file keeps an inverted index over the node metadata of DataSDRMmapVectorStore:
+* For every metadata key used in a filter: value -> row numbers (posting list), plus the values sorted
+  once for range filters (dates, enrollment, ..). Built the first time a key is filtered on, then kept.
+* Each filter becomes a bitmap (NumPy boolean mask) over the matrix rows; AND / OR combine bitmaps.
+* Only the rows left in the bitmap are scored against the query embedding.
+
+Operators: ==, !=, >, >=, <, <=, in, nin, text_match, contains, any, all, and nested MetadataFilters.
+"in" / "nin" match when the node's value is (not) in the filter's list of values.
+MetadataFilter does not accept booleans: filter flags such as "has_dmc" with 1 / 0 (True == 1 in Python).
+
+func_datasdr_trial_filters() builds the filters of the sponsor indices (see CT_ROW_MAPPING in datasdr_sqlite.py)
+from plain arguments. Pass them to any query engine or retriever:
+	index.as_query_engine(filters=func_datasdr_trial_filters(in_phase="Phase 3", in_overall_status="Completed"))
+
+Usage:
+	python3 datasdr_metadata_index.py /Users/server/Downloads/test/_Datafiles/_Pfizer phase="Phase 3" overall_status=Completed
+"""
+
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+#
+from llama_index.core.vector_stores.types import (
+	FilterCondition,
+	FilterOperator,
+	MetadataFilter,
+	MetadataFilters,
+)
+
+# Tutorial: metadata keys behind the arguments of func_datasdr_trial_filters(). "name" is the sponsor name of the row.
+CT_TRIAL_FILTER_KEYS = {
+	"sponsor": "name",
+	"nct_id": "nct_id",
+	"phase": "phase",
+	"overall_status": "overall_status",
+	"study_type": "study_type",
+}
+#
+# Tutorial: date columns that accept a "<column>_from" / "<column>_to" range in func_datasdr_trial_filters().
+CT_TRIAL_DATE_KEYS = ["start_date", "completion_date", "primary_completion_date", "study_first_posted_date", "last_update_posted_date"]
+
+
+class DataSDRMetadataIndex:
+	"""
+	Inverted index over a list of metadata dictionaries, one per matrix row.
+	Posting lists are built per key, the first time a filter uses that key.
+	"""
+
+	def __init__(self, in_metadata: List[Dict[str, Any]]) -> None:
+		self.metadata = in_metadata
+		self.rows = len(in_metadata)
+		self._postings: Dict[str, Dict[Any, np.ndarray]] = {}
+		self._sorted: Dict[str, Dict[str, tuple]] = {}
+		self._present: Dict[str, np.ndarray] = {}
+
+	def _func_key(self, in_key: str) -> None:
+		"""
+		This function builds the posting lists, presence bitmap and sorted values of one key.
+		List values (e.g. from other indices) are posted once per element.
+
+		in_key: str - Metadata key.
+		"""
+		if in_key in self._postings:
+			return
+		var_lists: Dict[Any, List[int]] = {}
+		var_present = np.zeros(self.rows, dtype=bool)
+		for one_row, one_metadata in enumerate(self.metadata):
+			var_value = one_metadata.get(in_key)
+			if var_value is None:
+				continue
+			var_present[one_row] = True
+			for one_value in (var_value if isinstance(var_value, list) else [var_value]):
+				try:
+					var_lists.setdefault(one_value, []).append(one_row)
+				except TypeError:
+					# Tutorial: unhashable values (dictionaries) cannot be filtered on.
+					pass
+		self._postings[in_key] = {one_value: np.asarray(one_rows, dtype=np.int64) for one_value, one_rows in var_lists.items()}
+		self._present[in_key] = var_present
+		# Tutorial: numbers and strings are sorted separately; they cannot be compared with each other.
+		self._sorted[in_key] = {}
+		for var_kind, var_test in (("number", lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)), ("string", lambda v: isinstance(v, str))):
+			var_values = sorted([one_value for one_value in self._postings[in_key] if var_test(one_value)])
+			if var_values:
+				self._sorted[in_key][var_kind] = (np.asarray(var_values), [self._postings[in_key][one_value] for one_value in var_values])
+
+	def _func_bitmap(self, in_rows_list: List[np.ndarray]) -> np.ndarray:
+		"""
+		This function turns posting lists into one bitmap (their union).
+
+		in_rows_list - List of posting lists.
+		"""
+		var_mask = np.zeros(self.rows, dtype=bool)
+		for one_rows in in_rows_list:
+			var_mask[one_rows] = True
+		return var_mask
+
+	def _func_range(self, in_key: str, in_operator: FilterOperator, in_value: Any) -> np.ndarray:
+		"""
+		This function returns the bitmap of a range filter (>, >=, <, <=) with a binary search over the sorted values.
+
+		in_key: str - Metadata key.
+		in_operator: FilterOperator - Comparison.
+		in_value - Filter value.
+		"""
+		var_kind = "number" if isinstance(in_value, (int, float)) and not isinstance(in_value, bool) else "string"
+		if var_kind not in self._sorted[in_key] or not isinstance(in_value, (int, float, str)):
+			return np.zeros(self.rows, dtype=bool)
+		var_values, var_rows = self._sorted[in_key][var_kind]
+		if in_operator == FilterOperator.GT:
+			var_slice = var_rows[np.searchsorted(var_values, in_value, side="right"):]
+		elif in_operator == FilterOperator.GTE:
+			var_slice = var_rows[np.searchsorted(var_values, in_value, side="left"):]
+		elif in_operator == FilterOperator.LT:
+			var_slice = var_rows[:np.searchsorted(var_values, in_value, side="left")]
+		else:
+			var_slice = var_rows[:np.searchsorted(var_values, in_value, side="right")]
+		return self._func_bitmap(var_slice)
+
+	def func_filter_mask(self, in_filter: MetadataFilter) -> np.ndarray:
+		"""
+		This function returns the bitmap of the rows matching one filter. Rows without the key never match.
+
+		in_filter: MetadataFilter - One filter.
+		"""
+		self._func_key(in_filter.key)
+		var_postings = self._postings[in_filter.key]
+		var_operator = FilterOperator(in_filter.operator)
+		var_value = in_filter.value
+		var_empty = np.zeros(0, dtype=np.int64)
+		#
+		if var_operator in (FilterOperator.EQ, FilterOperator.CONTAINS):
+			if isinstance(var_value, list):
+				return np.zeros(self.rows, dtype=bool)
+			var_mask = self._func_bitmap([var_postings.get(var_value, var_empty)])
+			if var_operator == FilterOperator.CONTAINS and isinstance(var_value, str):
+				# Tutorial: "contains" on a string value is a substring test, as in LlamaIndex.
+				var_mask |= self._func_bitmap([one_rows for one_key, one_rows in var_postings.items() if isinstance(one_key, str) and var_value in one_key])
+			return var_mask
+		if var_operator == FilterOperator.NE:
+			return self._present[in_filter.key] & ~self._func_bitmap([var_postings.get(var_value, var_empty)])
+		if var_operator in (FilterOperator.GT, FilterOperator.GTE, FilterOperator.LT, FilterOperator.LTE):
+			return self._func_range(in_filter.key, var_operator, var_value)
+		if var_operator in (FilterOperator.IN, FilterOperator.ANY):
+			return self._func_bitmap([var_postings.get(one_value, var_empty) for one_value in var_value])
+		if var_operator == FilterOperator.NIN:
+			return self._present[in_filter.key] & ~self._func_bitmap([var_postings.get(one_value, var_empty) for one_value in var_value])
+		if var_operator == FilterOperator.ALL:
+			var_mask = self._present[in_filter.key].copy()
+			for one_value in var_value:
+				var_mask &= self._func_bitmap([var_postings.get(one_value, var_empty)])
+			return var_mask
+		if var_operator == FilterOperator.TEXT_MATCH:
+			var_text = str(var_value).lower()
+			return self._func_bitmap([one_rows for one_key, one_rows in var_postings.items() if isinstance(one_key, str) and var_text in one_key.lower()])
+		raise ValueError("Invalid operator: %s" % (in_filter.operator))
+
+	def func_mask(self, in_filters: MetadataFilters) -> np.ndarray:
+		"""
+		This function returns the bitmap of the rows matching a set of filters, nested filters included.
+
+		in_filters: MetadataFilters - Filters, combined with their condition ("and" / "or").
+		"""
+		var_condition = FilterCondition(in_filters.condition or FilterCondition.AND)
+		var_mask = None
+		for one_filter in in_filters.filters:
+			if isinstance(one_filter, MetadataFilters):
+				var_one = self.func_mask(one_filter)
+			else:
+				var_one = self.func_filter_mask(one_filter)
+			if var_mask is None:
+				var_mask = var_one
+			elif var_condition == FilterCondition.AND:
+				var_mask &= var_one
+			else:
+				var_mask |= var_one
+		if var_mask is None:
+			return np.ones(self.rows, dtype=bool)
+		return var_mask
+
+	def func_keys_built(self) -> List[str]:
+		"""
+		This function returns the metadata keys that already have posting lists.
+		"""
+		return sorted(self._postings)
+#
+#
+def func_datasdr_trial_filters(
+	in_sponsor: Optional[str] = None,
+	in_nct_id=None,
+	in_phase=None,
+	in_overall_status=None,
+	in_study_type=None,
+	**in_ranges: str,
+) -> Optional[MetadataFilters]:
+	"""
+	This function builds the metadata filters of a sponsor index. Returns None when no filter is given.
+	Every argument is optional; a list means "any of these values".
+
+	in_sponsor: str - Sponsor name; matches rows whose "name" contains it (case-insensitive).
+	in_nct_id - One nct_id, or a list.
+	in_phase - E.g. "Phase 3", or ["Phase 2/Phase 3", "Phase 3"].
+	in_overall_status - E.g. "Completed".
+	in_study_type - E.g. "Interventional".
+	in_ranges - Date ranges on CT_TRIAL_DATE_KEYS, as ISO dates: start_date_from="2015-01-01", completion_date_to="2020-12-31".
+	"""
+	var_filters: List[MetadataFilter] = []
+	if in_sponsor:
+		var_filters.append(MetadataFilter(key=CT_TRIAL_FILTER_KEYS["sponsor"], value=in_sponsor, operator=FilterOperator.TEXT_MATCH))
+	for one_name, one_value in (("nct_id", in_nct_id), ("phase", in_phase), ("overall_status", in_overall_status), ("study_type", in_study_type)):
+		if one_value is None:
+			continue
+		if isinstance(one_value, (list, tuple)):
+			var_filters.append(MetadataFilter(key=CT_TRIAL_FILTER_KEYS[one_name], value=list(one_value), operator=FilterOperator.IN))
+		else:
+			var_filters.append(MetadataFilter(key=CT_TRIAL_FILTER_KEYS[one_name], value=one_value, operator=FilterOperator.EQ))
+	for one_name, one_value in in_ranges.items():
+		var_key, _, var_side = one_name.rpartition("_")
+		if var_key not in CT_TRIAL_DATE_KEYS or var_side not in ("from", "to"):
+			raise ValueError("Unknown filter [%s]; date ranges are <column>_from / <column>_to, with column in %s" % (one_name, CT_TRIAL_DATE_KEYS))
+		if one_value:
+			var_filters.append(MetadataFilter(key=var_key, value=one_value, operator=FilterOperator.GTE if var_side == "from" else FilterOperator.LTE))
+	return MetadataFilters(filters=var_filters) if var_filters else None
+#
+#
+def func_datasdr_filters_from_dict(in_dict: Optional[Dict[str, Any]]) -> Optional[MetadataFilters]:
+	"""
+	This function builds filters from a dictionary such as {"phase": "Phase 3", "start_date_from": "2015-01-01"},
+	e.g. a Tutorial constant or the "filters" field of a request to datasdr_index_server.py.
+
+	in_dict - Dictionary of func_datasdr_trial_filters() argument names, without the "in_" prefix. None or {} = no filter.
+	"""
+	if not in_dict:
+		return None
+	var_dict = dict(in_dict)
+	var_arguments = {"in_%s" % (one_name): var_dict.pop(one_name) for one_name in list(var_dict) if one_name in CT_TRIAL_FILTER_KEYS}
+	return func_datasdr_trial_filters(**var_arguments, **var_dict)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_metadata_index.py <index directory> key=value [key=value ..]
+	from llama_index.core.vector_stores.types import VectorStoreQuery
+	from datasdr_vector_store import DataSDRMmapVectorStore
+	#
+	# Tutorial: only the vector store is opened; no embedding model is needed.
+	var_store = DataSDRMmapVectorStore.from_persist_dir(sys.argv[1])
+	var_query = VectorStoreQuery(filters=func_datasdr_filters_from_dict(dict(one_argument.split("=", 1) for one_argument in sys.argv[2:])))
+	for one_label in ("first query, posting lists built", "next queries"):
+		var_start = time.time()
+		var_rows = var_store.func_candidate_rows(var_query)
+		print("%d of %d nodes match (%s: %.3f ms)" % (len(var_rows), len(var_store.func_metadata_index().metadata), one_label, (time.time() - var_start) * 1000.0))
@@ -0,0 +1,380 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_metrics.py
+# Purpose: Per-stage pipeline instrumentation: timers, counters and token counts, exported as JSON lines or Prometheus text.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+When Tutorial_03.py runs for 40 minutes, the final "--- Runtime ---" line does not say where the time went.
+
+This file times every stage of the pipeline and counts what each stage processed:
+	sqlite_query    rows read from the SQLite3 files          (counter: sqlite_rows)
+	documents       Documents built from the rows             (counter: documents)
+	chunking        Documents split into nodes                (counter: chunks)
+	embedding       LlamaIndex embedding calls                (counter: embedding_texts)
+	embedding_http  HTTP requests to Ollama /api/embed        (counters: embedding_requests, embedding_http_texts)
+	index_build     nodes embedded and added to the index
+	persist         index written to disk
+	index_load      index read from disk
+	retrieval       similarity search, query embedding included
+	keyword_search  FTS5 keyword search (datasdr_hybrid.py)   (counter: keyword_only_queries)
+	fts_sync        FTS5 keyword index brought in line with the docstore
+	synthesis       answer generation, LLM calls included
+	llm             LLM calls                                 (counters: llm_prompt_tokens, llm_completion_tokens)
+	query           whole query_engine.query(..) calls
+
+* Disabled by default. When disabled, every timer is a shared no-op object: the overhead is one attribute test.
+* Enabled with func_datasdr_enable_metrics(). Worker processes (datasdr_index_builder.py) inherit it
+  through environment variables, and their measurements are merged into the parent process.
+* Sinks: one JSON line per timed stage (optional file), a summary table, and Prometheus text exposition
+  (write it where node_exporter's textfile collector looks, or serve it).
+* Profiling hook: func_datasdr_profile() runs any block under cProfile and prints the top functions.
+
+Usage:
+	from datasdr_metrics import func_datasdr_enable_metrics, func_datasdr_stage, CT_METRICS_REGISTRY
+	func_datasdr_enable_metrics("/Users/server/Downloads/test/_metrics.jsonl")
+	with func_datasdr_stage("persist"):
+		index.storage_context.persist(persist_dir=CT_INDEX_DIR)
+	print(CT_METRICS_REGISTRY.func_report())
+	CT_METRICS_REGISTRY.func_write_prometheus("/Users/server/Downloads/test/datasdr.prom")
+
+	python3 datasdr_metrics.py /Users/server/Downloads/test/_metrics.jsonl     # summarize a JSON lines file
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+# Tutorial: environment variables read at import time, so worker processes start with the parent's settings.
+CT_METRICS_ENV = "DATASDR_METRICS"
+CT_METRICS_JSONL_ENV = "DATASDR_METRICS_JSONL"
+#
+# Tutorial: prefix of every Prometheus metric name.
+CT_METRICS_PREFIX = "datasdr"
+#
+# Tutorial: functions listed by the profiling hook.
+CT_PROFILE_TOP = 25
+
+
+class DataSDRMetrics:
+	"""
+	Registry of stage timers and counters for one process. Safe to share between threads.
+	"""
+
+	def __init__(self) -> None:
+		self.enabled = False
+		self.jsonl_path: Optional[str] = None
+		self.handler_attached = False
+		self._lock = threading.Lock()
+		self._jsonl = None
+		self._timers: Dict[str, list] = {}
+		self._counters: Dict[str, float] = {}
+
+	def func_enable(self, in_jsonl_path: Optional[str] = None) -> None:
+		"""
+		This function starts recording, optionally appending one JSON line per timed stage to a file.
+
+		in_jsonl_path: str - JSON lines file. None = keep the measurements in memory only.
+		"""
+		with self._lock:
+			if in_jsonl_path and in_jsonl_path != self.jsonl_path:
+				if self._jsonl is not None:
+					self._jsonl.close()
+				# Tutorial: line buffered, so lines from several processes do not interleave.
+				self._jsonl = open(in_jsonl_path, "a", buffering=1)
+				self.jsonl_path = in_jsonl_path
+			self.enabled = True
+
+	def func_disable(self) -> None:
+		"""
+		This function stops recording and closes the JSON lines file. Measurements so far are kept.
+		"""
+		with self._lock:
+			self.enabled = False
+			if self._jsonl is not None:
+				self._jsonl.close()
+				self._jsonl = None
+				self.jsonl_path = None
+
+	def func_observe(self, in_stage: str, in_seconds: float, **in_labels: Any) -> None:
+		"""
+		This function records one timed execution of a stage.
+
+		in_stage: str - Stage name, e.g. "embedding".
+		in_seconds: float - Duration.
+		in_labels - Extra fields for the JSON line, e.g. sponsor="Abbott".
+		"""
+		with self._lock:
+			var_timer = self._timers.setdefault(in_stage, [0, 0.0, 0.0])
+			var_timer[0] += 1
+			var_timer[1] += in_seconds
+			var_timer[2] = max(var_timer[2], in_seconds)
+			if self._jsonl is not None:
+				self._jsonl.write(json.dumps({"time": time.time(), "pid": os.getpid(), "stage": in_stage, "seconds": in_seconds, **in_labels}) + "\n")
+
+	def func_count(self, in_name: str, in_value: float = 1) -> None:
+		"""
+		This function adds to a counter.
+
+		in_name: str - Counter name, e.g. "sqlite_rows".
+		in_value - Amount to add.
+		"""
+		with self._lock:
+			self._counters[in_name] = self._counters.get(in_name, 0) + in_value
+
+	def func_snapshot(self) -> Dict[str, Dict]:
+		"""
+		This function returns a copy of all measurements: {"timers": {stage: [calls, seconds, max]}, "counters": {..}}.
+		"""
+		with self._lock:
+			return {"timers": {one_stage: list(one_timer) for one_stage, one_timer in self._timers.items()}, "counters": dict(self._counters)}
+
+	def func_merge(self, in_snapshot: Dict[str, Dict]) -> None:
+		"""
+		This function adds the measurements of another process, from its func_snapshot().
+
+		in_snapshot - Snapshot to add.
+		"""
+		with self._lock:
+			for one_stage, (var_calls, var_seconds, var_max) in in_snapshot.get("timers", {}).items():
+				var_timer = self._timers.setdefault(one_stage, [0, 0.0, 0.0])
+				var_timer[0] += var_calls
+				var_timer[1] += var_seconds
+				var_timer[2] = max(var_timer[2], var_max)
+			for one_name, one_value in in_snapshot.get("counters", {}).items():
+				self._counters[one_name] = self._counters.get(one_name, 0) + one_value
+
+	def func_reset(self) -> None:
+		"""
+		This function clears all measurements.
+		"""
+		with self._lock:
+			self._timers.clear()
+			self._counters.clear()
+
+	def func_report(self) -> str:
+		"""
+		This function returns a table of stages (calls, total, mean and max seconds) followed by the counters.
+		"""
+		var_snapshot = self.func_snapshot()
+		var_lines = ["%-22s %8s %12s %12s %12s" % ("stage", "calls", "total (s)", "mean (ms)", "max (ms)")]
+		for one_stage, (var_calls, var_seconds, var_max) in sorted(var_snapshot["timers"].items(), key=lambda one_item: -one_item[1][1]):
+			var_lines.append("%-22s %8d %12.3f %12.2f %12.2f" % (one_stage, var_calls, var_seconds, 1000.0 * var_seconds / var_calls, 1000.0 * var_max))
+		for one_name, one_value in sorted(var_snapshot["counters"].items()):
+			var_lines.append("%-22s %8d" % (one_name, one_value))
+		return "\n".join(var_lines)
+
+	def func_prometheus(self) -> str:
+		"""
+		This function returns all measurements in the Prometheus text exposition format.
+		"""
+		var_snapshot = self.func_snapshot()
+		var_lines = []
+		for var_name, var_type, var_help, var_position in [
+			("stage_seconds_total", "counter", "Time spent in each pipeline stage.", 1),
+			("stage_calls_total", "counter", "Executions of each pipeline stage.", 0),
+			("stage_seconds_max", "gauge", "Longest single execution of each pipeline stage.", 2),
+		]:
+			var_lines.append("# HELP %s_%s %s" % (CT_METRICS_PREFIX, var_name, var_help))
+			var_lines.append("# TYPE %s_%s %s" % (CT_METRICS_PREFIX, var_name, var_type))
+			for one_stage, one_timer in sorted(var_snapshot["timers"].items()):
+				var_lines.append('%s_%s{stage="%s"} %s' % (CT_METRICS_PREFIX, var_name, one_stage, repr(float(one_timer[var_position]))))
+		var_lines.append("# HELP %s_items_total Items processed (rows, documents, chunks, texts, tokens)." % (CT_METRICS_PREFIX))
+		var_lines.append("# TYPE %s_items_total counter" % (CT_METRICS_PREFIX))
+		for one_name, one_value in sorted(var_snapshot["counters"].items()):
+			var_lines.append('%s_items_total{name="%s"} %s' % (CT_METRICS_PREFIX, one_name, repr(float(one_value))))
+		return "\n".join(var_lines) + "\n"
+
+	def func_write_prometheus(self, in_path: str) -> None:
+		"""
+		This function writes the Prometheus text atomically, e.g. for node_exporter's textfile collector.
+
+		in_path: str - Output file, usually ending in ".prom".
+		"""
+		var_tmp_path = "%s.tmp-%d" % (in_path, os.getpid())
+		with open(var_tmp_path, "w") as f:
+			f.write(self.func_prometheus())
+		os.replace(var_tmp_path, in_path)
+#
+#
+CT_METRICS_REGISTRY = DataSDRMetrics()
+#
+# Tutorial: returned by func_datasdr_stage() while metrics are disabled; entering and leaving it does nothing.
+CT_NULL_STAGE = contextlib.nullcontext()
+
+
+class DataSDRStageTimer:
+	"""
+	Context manager that times one execution of a stage.
+	"""
+
+	__slots__ = ("stage", "labels", "start")
+
+	def __init__(self, in_stage: str, in_labels: Dict[str, Any]) -> None:
+		self.stage = in_stage
+		self.labels = in_labels
+		self.start = 0.0
+
+	def __enter__(self) -> "DataSDRStageTimer":
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *in_exc_info) -> None:
+		CT_METRICS_REGISTRY.func_observe(self.stage, time.perf_counter() - self.start, **self.labels)
+#
+#
+def func_datasdr_stage(in_stage: str, **in_labels: Any):
+	"""
+	This function returns a context manager that times a stage: with func_datasdr_stage("persist"): ..
+
+	in_stage: str - Stage name.
+	in_labels - Extra fields for the JSON line, e.g. sponsor="Abbott".
+	"""
+	if not CT_METRICS_REGISTRY.enabled:
+		return CT_NULL_STAGE
+	return DataSDRStageTimer(in_stage, in_labels)
+#
+#
+def func_datasdr_count(in_name: str, in_value: float = 1) -> None:
+	"""
+	This function adds to a counter when metrics are enabled.
+
+	in_name: str - Counter name.
+	in_value - Amount to add.
+	"""
+	if CT_METRICS_REGISTRY.enabled:
+		CT_METRICS_REGISTRY.func_count(in_name, in_value)
+#
+#
+def func_datasdr_llama_index_handler():
+	"""
+	This function returns a LlamaIndex event handler that times retrieval, synthesis, embedding, LLM calls and queries,
+	and counts embedded texts and LLM tokens (Ollama's "prompt_eval_count" and "eval_count").
+	"""
+	from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+	from llama_index.core.instrumentation.events import embedding, llm, query, retrieval, synthesis
+	#
+	var_starts = {
+		embedding.EmbeddingStartEvent: "embedding",
+		retrieval.RetrievalStartEvent: "retrieval",
+		synthesis.SynthesizeStartEvent: "synthesis",
+		llm.LLMChatStartEvent: "llm",
+		llm.LLMCompletionStartEvent: "llm",
+		query.QueryStartEvent: "query",
+	}
+	var_ends = {
+		embedding.EmbeddingEndEvent: "embedding",
+		retrieval.RetrievalEndEvent: "retrieval",
+		synthesis.SynthesizeEndEvent: "synthesis",
+		llm.LLMChatEndEvent: "llm",
+		llm.LLMCompletionEndEvent: "llm",
+		query.QueryEndEvent: "query",
+	}
+	# Tutorial: start times are kept per thread and per stage; a stage may nest in itself (a query inside a query).
+	var_local = threading.local()
+	#
+	class DataSDRMetricsEventHandler(BaseEventHandler):
+		@classmethod
+		def class_name(cls) -> str:
+			return "DataSDRMetricsEventHandler"
+
+		def handle(self, event, **kwargs) -> None:
+			if not CT_METRICS_REGISTRY.enabled:
+				return
+			var_stage = var_starts.get(type(event))
+			if var_stage is not None:
+				if not hasattr(var_local, "starts"):
+					var_local.starts = {}
+				var_local.starts.setdefault(var_stage, []).append(time.perf_counter())
+				return
+			var_stage = var_ends.get(type(event))
+			if var_stage is None or not getattr(var_local, "starts", {}).get(var_stage):
+				return
+			CT_METRICS_REGISTRY.func_observe(var_stage, time.perf_counter() - var_local.starts[var_stage].pop())
+			if var_stage == "embedding":
+				CT_METRICS_REGISTRY.func_count("embedding_texts", len(event.chunks))
+			elif var_stage == "llm" and event.response is not None:
+				var_raw = event.response.raw or {}
+				CT_METRICS_REGISTRY.func_count("llm_calls")
+				CT_METRICS_REGISTRY.func_count("llm_prompt_tokens", var_raw.get("prompt_eval_count") or 0)
+				CT_METRICS_REGISTRY.func_count("llm_completion_tokens", var_raw.get("eval_count") or 0)
+	#
+	return DataSDRMetricsEventHandler()
+#
+#
+def func_datasdr_enable_metrics(in_jsonl_path: Optional[str] = None) -> DataSDRMetrics:
+	"""
+	This function enables metrics in this process and in worker processes started afterwards,
+	and attaches the LlamaIndex event handler (once). Returns the registry.
+
+	in_jsonl_path: str - Optional JSON lines file, one line per timed stage.
+	"""
+	os.environ[CT_METRICS_ENV] = "1"
+	if in_jsonl_path:
+		os.environ[CT_METRICS_JSONL_ENV] = in_jsonl_path
+	CT_METRICS_REGISTRY.func_enable(in_jsonl_path)
+	if not CT_METRICS_REGISTRY.handler_attached:
+		import llama_index.core.instrumentation as instrument
+		instrument.get_dispatcher().add_event_handler(func_datasdr_llama_index_handler())
+		CT_METRICS_REGISTRY.handler_attached = True
+	return CT_METRICS_REGISTRY
+#
+#
+def func_datasdr_start_profiler() -> cProfile.Profile:
+	"""
+	This function starts cProfile and returns the profiler, for scripts that cannot use a "with" block.
+	"""
+	var_profiler = cProfile.Profile()
+	var_profiler.enable()
+	return var_profiler
+#
+#
+def func_datasdr_stop_profiler(in_profiler: cProfile.Profile, in_path: Optional[str] = None, in_top: int = CT_PROFILE_TOP) -> None:
+	"""
+	This function stops cProfile, prints the functions with the highest cumulative time and optionally saves the profile.
+	Open a saved profile with "python3 -m pstats <file>" or snakeviz.
+
+	in_profiler - From func_datasdr_start_profiler().
+	in_path: str - Output file. None = print only.
+	in_top: int - Functions printed.
+	"""
+	in_profiler.disable()
+	if in_path:
+		in_profiler.dump_stats(in_path)
+		print("Profile written to [%s]" % (in_path))
+	pstats.Stats(in_profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(in_top)
+#
+#
+@contextlib.contextmanager
+def func_datasdr_profile(in_path: Optional[str] = None, in_top: int = CT_PROFILE_TOP) -> Iterator[None]:
+	"""
+	This function profiles a block with cProfile: with func_datasdr_profile("/tmp/tutorial_03.prof"): ..
+
+	in_path: str - Output file. None = print only.
+	in_top: int - Functions printed.
+	"""
+	var_profiler = func_datasdr_start_profiler()
+	try:
+		yield
+	finally:
+		func_datasdr_stop_profiler(var_profiler, in_path, in_top)
+#
+#
+# Tutorial: worker processes inherit the parent's settings through the environment.
+if os.environ.get(CT_METRICS_ENV) == "1":
+	func_datasdr_enable_metrics(os.environ.get(CT_METRICS_JSONL_ENV) or None)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_metrics.py <metrics JSON lines file> [--prometheus]
+	var_registry = DataSDRMetrics()
+	with open(sys.argv[1], "r") as f:
+		for one_line in f:
+			one_record = json.loads(one_line)
+			var_registry.func_observe(one_record["stage"], one_record["seconds"])
+	print(var_registry.func_prometheus() if "--prometheus" in sys.argv[2:] else var_registry.func_report())
@@ -0,0 +1,257 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_pdf_extract.py
+# Purpose: Extract PDF pages in a process pool, and cache the extracted text per (file hash, page).
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+SimpleDirectoryReader(CT_DATA_DIR).load_data() parses every PDF page by page, on one core, before
+the first chunk is embedded. A protocol or SAP PDF can have hundreds of pages.
+
+This file:
+* Splits every PDF into blocks of pages and extracts the blocks in a process pool.
+* Keeps the extracted text in a SQLite3 cache, keyed by SHA-256 of the PDF file and page number.
+  Re-indexing (or a refresh) never parses a PDF it has already seen, even if it was renamed or moved.
+* Reports pages per second, so you can choose the number of workers.
+
+The Documents are the same as SimpleDirectoryReader's (same text, page labels, metadata and IDs):
+the cache is plugged in as SimpleDirectoryReader's PDF reader.
+
+Usage:
+	from datasdr_pdf_extract import func_datasdr_load_pdf_documents
+	documents = func_datasdr_load_pdf_documents(CT_DATA_DIR, CT_PDF_TEXT_CACHE, in_workers=4)
+
+	python3 datasdr_pdf_extract.py /Users/server/Downloads/test/_data /Users/server/Downloads/test/_pdf_text_cache.sqlite3 4
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.readers.base import BaseReader
+from llama_index.core.schema import Document
+
+from datasdr_refresh import func_datasdr_file_sha256
+
+# Tutorial: processes extracting pages. Start with the number of CPU cores.
+CT_EXTRACT_WORKERS = os.cpu_count() or 1
+#
+# Tutorial: pages per task. Each task opens the PDF once, so very small blocks waste time re-reading the file.
+CT_EXTRACT_PAGES_PER_TASK = 16
+
+
+def func_datasdr_pdf_page_count(in_path: str) -> int:
+	"""
+	This function returns the number of pages of a PDF.
+
+	in_path: str - PDF file.
+	"""
+	import pypdf
+	#
+	with open(in_path, "rb") as f:
+		return len(pypdf.PdfReader(f).pages)
+#
+#
+def func_datasdr_extract_pages(in_path: str, in_first_page: int, in_last_page: int) -> List[Tuple[int, str, str]]:
+	"""
+	This function extracts a block of pages exactly as LlamaIndex's PDFReader does. It runs inside a worker process.
+	Returns a list of (page number, page label, text).
+
+	in_path: str - PDF file.
+	in_first_page: int - First page, 0-based.
+	in_last_page: int - Last page, excluded.
+	"""
+	import pypdf
+	#
+	var_pages = []
+	with open(in_path, "rb") as f:
+		var_pdf = pypdf.PdfReader(f)
+		for one_page in range(in_first_page, in_last_page):
+			var_pages.append((one_page, var_pdf.page_labels[one_page], var_pdf.pages[one_page].extract_text()))
+	return var_pages
+#
+#
+class DataSDRPDFTextCache:
+	"""
+	SQLite3 cache of extracted PDF text, keyed by (SHA-256 of the file, page number).
+	The SHA-256 of a path is only re-computed when the file's modification time or size changes.
+	"""
+
+	def __init__(self, in_cache_path: str) -> None:
+		self.cache_path = in_cache_path
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(in_cache_path, timeout=60.0, check_same_thread=False)
+		self._connection.execute("PRAGMA journal_mode=WAL")
+		self._connection.execute("PRAGMA synchronous=NORMAL")
+		self._connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, sha256 TEXT NOT NULL)")
+		self._connection.execute("CREATE TABLE IF NOT EXISTS documents (sha256 TEXT PRIMARY KEY, pages INTEGER NOT NULL, extracted_at REAL NOT NULL)")
+		self._connection.execute(
+			"CREATE TABLE IF NOT EXISTS pages (sha256 TEXT NOT NULL, page INTEGER NOT NULL, label TEXT, text TEXT NOT NULL, PRIMARY KEY (sha256, page))"
+		)
+		self._connection.commit()
+
+	def func_file_key(self, in_path: str) -> str:
+		"""
+		This function returns the SHA-256 of a file, re-using the stored value when the file was not touched.
+
+		in_path: str - PDF file.
+		"""
+		var_path = os.path.realpath(in_path)
+		var_stat = os.stat(var_path)
+		with self._lock:
+			var_row = self._connection.execute("SELECT mtime, size, sha256 FROM files WHERE path = ?", (var_path,)).fetchone()
+		if var_row is not None and var_row[0] == var_stat.st_mtime and var_row[1] == var_stat.st_size:
+			return var_row[2]
+		var_sha256 = func_datasdr_file_sha256(var_path)
+		with self._lock:
+			self._connection.execute("INSERT OR REPLACE INTO files (path, mtime, size, sha256) VALUES (?, ?, ?, ?)", (var_path, var_stat.st_mtime, var_stat.st_size, var_sha256))
+			self._connection.commit()
+		return var_sha256
+
+	def func_get_pages(self, in_key: str) -> Optional[List[Tuple[int, str, str]]]:
+		"""
+		This function returns the cached pages of a file, or None if the file was not (completely) extracted.
+
+		in_key: str - SHA-256 of the file.
+		"""
+		with self._lock:
+			var_document = self._connection.execute("SELECT pages FROM documents WHERE sha256 = ?", (in_key,)).fetchone()
+			if var_document is None:
+				return None
+			var_pages = self._connection.execute("SELECT page, label, text FROM pages WHERE sha256 = ? ORDER BY page", (in_key,)).fetchall()
+		return var_pages if len(var_pages) == var_document[0] else None
+
+	def func_put_pages(self, in_key: str, in_pages: List[Tuple[int, str, str]]) -> None:
+		"""
+		This function stores every page of a file. A file is only visible once all of its pages are stored.
+
+		in_key: str - SHA-256 of the file.
+		in_pages - List of (page number, page label, text).
+		"""
+		with self._lock:
+			self._connection.executemany(
+				"INSERT OR REPLACE INTO pages (sha256, page, label, text) VALUES (?, ?, ?, ?)", [(in_key,) + tuple(one_page) for one_page in in_pages]
+			)
+			self._connection.execute("INSERT OR REPLACE INTO documents (sha256, pages, extracted_at) VALUES (?, ?, ?)", (in_key, len(in_pages), time.time()))
+			self._connection.commit()
+
+	def close(self) -> None:
+		with self._lock:
+			self._connection.close()
+#
+#
+class DataSDRCachedPDFReader(BaseReader):
+	"""
+	PDF reader for SimpleDirectoryReader that answers from DataSDRPDFTextCache.
+	Files missing from the cache are extracted here, in the current process, and stored.
+	"""
+
+	def __init__(self, in_cache: DataSDRPDFTextCache) -> None:
+		self.cache = in_cache
+
+	def load_data(self, file: Path, extra_info: Optional[Dict] = None, **kwargs) -> List[Document]:
+		var_key = self.cache.func_file_key(str(file))
+		var_pages = self.cache.func_get_pages(var_key)
+		if var_pages is None:
+			var_pages = func_datasdr_extract_pages(str(file), 0, func_datasdr_pdf_page_count(str(file)))
+			self.cache.func_put_pages(var_key, var_pages)
+		# Tutorial: same Documents as PDFReader: one per page, with "page_label" and "file_name".
+		var_documents = []
+		for one_page, one_label, one_text in var_pages:
+			var_metadata = {"page_label": one_label, "file_name": Path(file).name}
+			if extra_info is not None:
+				var_metadata.update(extra_info)
+			var_documents.append(Document(text=one_text, metadata=var_metadata))
+		return var_documents
+#
+#
+def func_datasdr_extract_pdfs(in_paths: List[str], in_cache: DataSDRPDFTextCache, in_workers: int = CT_EXTRACT_WORKERS, in_pages_per_task: int = CT_EXTRACT_PAGES_PER_TASK) -> Dict:
+	"""
+	This function extracts every PDF that is not in the cache yet, using a process pool, and stores the pages.
+	Returns a dictionary with counts and the extraction speed in pages per second.
+
+	in_paths - PDF files.
+	in_cache: DataSDRPDFTextCache - Text cache.
+	in_workers: int - Worker processes.
+	in_pages_per_task: int - Pages extracted per task.
+	"""
+	var_start = time.time()
+	var_stats = {"files": len(in_paths), "cached_files": 0, "extracted_files": 0, "pages": 0, "seconds": 0.0, "pages_per_second": 0.0}
+	var_missing: Dict[str, str] = {}
+	for one_path in in_paths:
+		var_key = in_cache.func_file_key(one_path)
+		if in_cache.func_get_pages(var_key) is not None:
+			var_stats["cached_files"] += 1
+		else:
+			# Tutorial: the same PDF under two names is only extracted once.
+			var_missing.setdefault(var_key, one_path)
+	if not var_missing:
+		var_stats["seconds"] = time.time() - var_start
+		return var_stats
+	#
+	var_pages: Dict[str, List] = {one_key: [] for one_key in var_missing}
+	var_remaining: Dict[str, int] = {}
+	with ProcessPoolExecutor(max_workers=in_workers) as var_executor:
+		var_counts = dict(zip(var_missing, var_executor.map(func_datasdr_pdf_page_count, var_missing.values())))
+		var_futures = {}
+		for one_key, one_path in var_missing.items():
+			var_tasks = range(0, var_counts[one_key], in_pages_per_task)
+			var_remaining[one_key] = len(var_tasks)
+			for one_first in var_tasks:
+				var_futures[var_executor.submit(func_datasdr_extract_pages, one_path, one_first, min(one_first + in_pages_per_task, var_counts[one_key]))] = one_key
+			if not var_tasks:
+				in_cache.func_put_pages(one_key, [])
+		for one_future in as_completed(var_futures):
+			var_key = var_futures[one_future]
+			var_pages[var_key].extend(one_future.result())
+			var_remaining[var_key] -= 1
+			# Tutorial: store each file as soon as its last block is done, so an interrupted run keeps its progress.
+			if var_remaining[var_key] == 0:
+				in_cache.func_put_pages(var_key, sorted(var_pages.pop(var_key)))
+	#
+	var_stats["extracted_files"] = len(var_missing)
+	var_stats["pages"] = sum(var_counts.values())
+	var_stats["seconds"] = time.time() - var_start
+	var_stats["pages_per_second"] = var_stats["pages"] / var_stats["seconds"] if var_stats["seconds"] else 0.0
+	return var_stats
+#
+#
+def func_datasdr_load_pdf_documents(in_data_directory: Optional[str], in_cache_path: str, in_workers: int = CT_EXTRACT_WORKERS, in_input_files: Optional[List[str]] = None, in_filename_as_id: bool = False) -> List[Document]:
+	"""
+	This function is a drop-in replacement for SimpleDirectoryReader(..).load_data(): PDFs are extracted
+	in parallel and through the text cache; other file types are read by SimpleDirectoryReader as usual.
+
+	in_data_directory: str - Directory with the PDFs, as CT_DATA_DIR. None when in_input_files is given.
+	in_cache_path: str - SQLite3 file of the text cache.
+	in_workers: int - Worker processes for PDF extraction.
+	in_input_files - Explicit list of files, instead of a directory.
+	in_filename_as_id: bool - Same as SimpleDirectoryReader's "filename_as_id".
+	"""
+	var_cache = DataSDRPDFTextCache(in_cache_path)
+	try:
+		var_reader = SimpleDirectoryReader(
+			input_dir=in_data_directory,
+			input_files=in_input_files,
+			file_extractor={".pdf": DataSDRCachedPDFReader(var_cache)},
+			filename_as_id=in_filename_as_id,
+		)
+		var_pdfs = [str(one_path) for one_path in var_reader.input_files if str(one_path).lower().endswith(".pdf")]
+		var_stats = func_datasdr_extract_pdfs(var_pdfs, var_cache, in_workers)
+		print("PDF text: %d files (%d cached, %d extracted), %d pages extracted in %.2f seconds = %.1f pages/sec with %d workers" % (
+			var_stats["files"], var_stats["cached_files"], var_stats["extracted_files"], var_stats["pages"], var_stats["seconds"], var_stats["pages_per_second"], in_workers))
+		return var_reader.load_data()
+	finally:
+		var_cache.close()
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_pdf_extract.py <data_directory> <cache file> [<workers>]
+	var_workers = int(sys.argv[3]) if len(sys.argv) > 3 else CT_EXTRACT_WORKERS
+	var_start = time.time()
+	var_documents = func_datasdr_load_pdf_documents(sys.argv[1], sys.argv[2], var_workers)
+	print("%d Documents in %.2f seconds" % (len(var_documents), time.time() - var_start))
@@ -0,0 +1,321 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_quantize.py
+# Purpose: int8 quantized embeddings in RAM for the first-pass search, exact re-ranking of a shortlist from disk.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+DataSDRMmapVectorStore reads the float32 matrix with mmap, but a brute-force search touches every row
+of it for every question, so the whole matrix ends up in RAM (page cache) anyway: 3 KB per chunk with
+nomic-embed-text (768 dimensions), 1.2 GB for 400,000 chunks.
+
+This file keeps a 4x smaller copy of the embeddings in RAM instead:
+* Every embedding is scaled to unit length and stored as 768 int8 codes plus one float32 scale per row.
+* A question is first scored against the int8 codes of all candidate rows (approximate cosine similarity).
+* The best "top_k x rerank_factor" rows are then scored again with their full-precision vectors from the
+  ".npy" file; only those rows are read from disk. The scores returned are exact.
+* Rows added after quantization (refresh) are always re-ranked exactly, until the next persist quantizes them.
+* Metadata filters (datasdr_metadata_index.py) are applied before the first pass, as in DataSDRMmapVectorStore.
+
+Files written next to the binary vector store:
+	default__vector_store.int8.npz   - int8 codes, per-row scales and norms.
+
+func_datasdr_load_index() in datasdr_vector_store.py picks up the int8 file automatically. An index
+directory uses either the int8 file or an IVF file (datasdr_ann.py); if it has both, int8 is used.
+
+Usage:
+	# Tutorial: quantize an existing index directory, then measure the memory saved and the recall lost.
+	python3 datasdr_quantize.py /Users/server/Downloads/test/_index
+	python3 datasdr_quantize.py /Users/server/Downloads/test/_Datafiles/_Abbott --rerank 0,1,2,4,8
+	# Tutorial: recall check only.
+	python3 datasdr_quantize.py /Users/server/Downloads/test/_index --check
+"""
+
+import argparse
+import io
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import fsspec
+import numpy as np
+#
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode, VectorStoreQueryResult
+
+from datasdr_vector_store import (
+	CT_DEFAULT_JSON_FNAME,
+	DataSDRMmapVectorStore,
+	func_datasdr_convert_index_directory,
+	func_datasdr_has_mmap_store,
+	func_datasdr_vector_store_base,
+	func_datasdr_write_atomic,
+)
+
+CT_QUANT_SUFFIX = ".int8.npz"
+#
+# Tutorial: rows re-ranked exactly = top_k x CT_QUANT_RERANK_FACTOR. 0 = return the approximate int8 scores.
+CT_QUANT_RERANK_FACTOR = 4
+#
+# Tutorial: rows scored at a time by the int8 first pass; bounds the copy made for filtered queries (16384 x 768 bytes = 12 MB).
+CT_QUANT_BLOCK_ROWS = 16384
+#
+# Tutorial: random seed of the recall-check queries.
+CT_QUANT_SEED = 42
+
+
+def func_datasdr_quantize_vectors(in_vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	This function quantizes embeddings to int8. Returns (codes, scales, norms):
+	unit vector ~= codes x scale, and the original vector = unit vector x norm.
+
+	in_vectors: np.ndarray - N x D matrix (float32 or float16).
+	"""
+	var_vectors = np.asarray(in_vectors, dtype=np.float32)
+	var_norms = np.linalg.norm(var_vectors, axis=1)
+	var_norms[var_norms == 0] = 1.0
+	var_unit = var_vectors / var_norms[:, None]
+	# Tutorial: one scale per row, so the largest component of every row uses the full -127..127 range.
+	var_scales = np.abs(var_unit).max(axis=1) / 127.0
+	var_scales[var_scales == 0] = 1.0
+	var_codes = np.clip(np.rint(var_unit / var_scales[:, None]), -127, 127).astype(np.int8)
+	return var_codes, var_scales.astype(np.float32), var_norms.astype(np.float32)
+#
+#
+class DataSDRQuantizedVectorStore(DataSDRMmapVectorStore):
+	"""
+	DataSDRMmapVectorStore with int8 codes in RAM for the first pass, and exact re-ranking of a shortlist.
+	"""
+
+	rerank_factor: int = Field(default=CT_QUANT_RERANK_FACTOR, ge=0, description="Rows re-ranked exactly = top_k x rerank_factor. 0 = no re-ranking.")
+
+	_codes: Optional[np.ndarray] = PrivateAttr(default=None)
+	_scales: np.ndarray = PrivateAttr(default_factory=lambda: np.zeros(0, dtype=np.float32))
+	_row_norms: np.ndarray = PrivateAttr(default_factory=lambda: np.zeros(0, dtype=np.float32))
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "DataSDRQuantizedVectorStore"
+
+	@classmethod
+	def from_persist_path(cls, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> "DataSDRQuantizedVectorStore":
+		"""
+		This function opens the binary vector store plus its int8 file, if there is one.
+		The int8 codes are read into RAM; the float32 matrix stays memory-mapped.
+
+		persist_path: str - Path of the JSON vector store file, with or without ".json".
+		"""
+		var_store = super().from_persist_path(persist_path, fs=fs)
+		var_quant_path = func_datasdr_vector_store_base(persist_path) + CT_QUANT_SUFFIX
+		if os.path.exists(var_quant_path):
+			with np.load(var_quant_path) as var_quant:
+				# Tutorial: a crash between writing the int8 file and the sidecar leaves them out of step; then we search exactly.
+				if len(var_quant["codes"]) == len(var_store._ids):
+					var_store._codes = var_quant["codes"]
+					var_store._scales = var_quant["scales"]
+					var_store._row_norms = var_quant["norms"]
+					var_store.rerank_factor = int(var_quant["rerank_factor"])
+		return var_store
+
+	# - - - - -
+	# Quantization.
+	def func_quantize(self) -> None:
+		"""
+		This function quantizes the rows that have no int8 codes yet (all rows, the first time).
+		"""
+		self._func_flush_pending()
+		if self._matrix is None:
+			return
+		var_done = 0 if self._codes is None else len(self._codes)
+		if var_done >= len(self._matrix):
+			return
+		var_parts = [(self._codes, self._scales, self._row_norms)] if var_done else []
+		for var_start in range(var_done, len(self._matrix), CT_QUANT_BLOCK_ROWS):
+			var_parts.append(func_datasdr_quantize_vectors(self._matrix[var_start:var_start + CT_QUANT_BLOCK_ROWS]))
+		self._codes = np.concatenate([one_part[0] for one_part in var_parts])
+		self._scales = np.concatenate([one_part[1] for one_part in var_parts])
+		self._row_norms = np.concatenate([one_part[2] for one_part in var_parts])
+		self._norms = None
+
+	def _func_norms(self) -> np.ndarray:
+		"""
+		This function returns the L2 norm of every row. Quantized rows use the norms saved with their codes,
+		so the float32 matrix is never read in full.
+		"""
+		if self._norms is None:
+			var_known = len(self._row_norms)
+			var_tail = np.empty(max(0, len(self._matrix) - var_known), dtype=np.float32)
+			for var_start in range(0, len(var_tail), 65536):
+				var_block = np.asarray(self._matrix[var_known + var_start:var_known + var_start + 65536], dtype=np.float32)
+				var_tail[var_start:var_start + len(var_block)] = np.linalg.norm(var_block, axis=1)
+			var_tail[var_tail == 0] = 1.0
+			self._norms = np.concatenate([self._row_norms, var_tail])
+		return self._norms
+
+	def func_approximate_scores(self, in_query_embedding: List[float], in_rows: np.ndarray) -> np.ndarray:
+		"""
+		This function returns the approximate cosine similarity between the query and quantized rows, from the int8 codes.
+
+		in_query_embedding - Query embedding.
+		in_rows: np.ndarray - Row numbers, all lower than the number of quantized rows.
+		"""
+		var_query = np.asarray(in_query_embedding, dtype=np.float32)
+		var_query = var_query / (np.linalg.norm(var_query) or 1.0)
+		var_scores = np.empty(len(in_rows), dtype=np.float32)
+		var_all = len(in_rows) == len(self._codes)
+		for var_start in range(0, len(in_rows), CT_QUANT_BLOCK_ROWS):
+			var_block_rows = in_rows[var_start:var_start + CT_QUANT_BLOCK_ROWS]
+			# Tutorial: a full scan reads contiguous slices; filtered scans gather only their rows.
+			if var_all:
+				var_codes = self._codes[var_start:var_start + len(var_block_rows)]
+			else:
+				var_codes = self._codes[var_block_rows]
+			# Tutorial: einsum multiplies the int8 codes directly; "codes.astype(np.float32) @ query" would copy every block to float32 first (3x slower).
+			var_scores[var_start:var_start + len(var_block_rows)] = np.einsum("ij,j->i", var_codes, var_query) * self._scales[var_block_rows]
+		return var_scores
+
+	# - - - - -
+	# LlamaIndex vector store protocol.
+	def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+		"""Return the top-k most similar nodes. Pass rerank_factor=.. through vector_store_kwargs to override it."""
+		if query.mode != VectorStoreQueryMode.DEFAULT:
+			raise ValueError("DataSDRQuantizedVectorStore only supports the default query mode, not [%s]" % (query.mode))
+		self._func_flush_pending()
+		if self._codes is None:
+			return super().query(query, **kwargs)
+		if self._matrix is None or len(self._ids) == 0:
+			return VectorStoreQueryResult(similarities=[], ids=[])
+		#
+		var_rows = self.func_candidate_rows(query)
+		if len(var_rows) == 0:
+			return VectorStoreQueryResult(similarities=[], ids=[])
+		var_factor = kwargs.get("rerank_factor", self.rerank_factor)
+		var_quantized = var_rows[var_rows < len(self._codes)]
+		# Tutorial: rows added after quantization have no codes yet; they are always re-ranked.
+		var_unquantized = var_rows[var_rows >= len(self._codes)]
+		var_scores = self.func_approximate_scores(query.query_embedding, var_quantized)
+		#
+		if var_factor == 0 and len(var_unquantized) == 0:
+			var_top_k = min(query.similarity_top_k, len(var_quantized))
+			var_top = np.argpartition(-var_scores, var_top_k - 1)[:var_top_k]
+			var_top = var_top[np.argsort(-var_scores[var_top])]
+			return VectorStoreQueryResult(similarities=[float(var_scores[i]) for i in var_top], ids=[self._ids[var_quantized[i]] for i in var_top])
+		var_shortlist = min(query.similarity_top_k * max(1, var_factor), len(var_quantized))
+		if var_shortlist > 0:
+			var_best = var_quantized[np.argpartition(-var_scores, var_shortlist - 1)[:var_shortlist]]
+		else:
+			var_best = var_quantized[:0]
+		# Tutorial: only the shortlisted rows are read from the memory-mapped float32 matrix.
+		return self.func_top_k(query.query_embedding, np.sort(np.concatenate([var_best, var_unquantized])), query.similarity_top_k)
+
+	def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+		"""
+		Quantize new rows, write the int8 file, then the binary vector store.
+		"""
+		self._func_flush_pending()
+		self.func_quantize()
+		if self._codes is not None:
+			var_alive = np.flatnonzero(self._alive)
+			var_buffer = io.BytesIO()
+			np.savez(
+				var_buffer, codes=self._codes[var_alive], scales=self._scales[var_alive], norms=self._row_norms[var_alive], rerank_factor=np.int32(self.rerank_factor)
+			)
+			func_datasdr_write_atomic(func_datasdr_vector_store_base(persist_path) + CT_QUANT_SUFFIX, lambda f: f.write(var_buffer.getvalue()))
+		# Tutorial: the files only keep live rows; in memory, deleted rows stay hidden by the "alive" mask.
+		super().persist(persist_path, fs=fs)
+
+	def func_memory_report(self) -> Dict[str, int]:
+		"""
+		This function returns the bytes needed in RAM by a brute-force float32 search and by the int8 first pass.
+		"""
+		var_rows, var_dim = (0, 0) if self._matrix is None else self._matrix.shape
+		var_int8 = 0 if self._codes is None else self._codes.nbytes + self._scales.nbytes + self._row_norms.nbytes
+		return {"rows": var_rows, "dimensions": var_dim, "float32_bytes": var_rows * var_dim * 4, "int8_bytes": var_int8}
+#
+#
+def func_datasdr_quantize_index_directory(in_index_directory: str, in_rerank_factor: int = CT_QUANT_RERANK_FACTOR) -> DataSDRQuantizedVectorStore:
+	"""
+	This function adds an int8 file to an index directory, converting its JSON vector store to the binary format first if needed.
+
+	in_index_directory: str - Index directory.
+	in_rerank_factor: int - Default re-rank factor, saved with the index.
+	"""
+	if not func_datasdr_has_mmap_store(in_index_directory):
+		func_datasdr_convert_index_directory(in_index_directory)
+	var_persist_path = os.path.join(in_index_directory, CT_DEFAULT_JSON_FNAME)
+	var_store = DataSDRQuantizedVectorStore.from_persist_path(var_persist_path)
+	var_start = time.time()
+	var_store.rerank_factor = in_rerank_factor
+	var_store.func_quantize()
+	var_store.persist(var_persist_path)
+	var_memory = var_store.func_memory_report()
+	print("int8 codes for [%s]: %d vectors x %d dimensions in %.2f seconds. RAM for search: %d bytes float32 -> %d bytes int8 (%.0f%% saved)" % (
+		in_index_directory, var_memory["rows"], var_memory["dimensions"], time.time() - var_start,
+		var_memory["float32_bytes"], var_memory["int8_bytes"], 100.0 * (1.0 - var_memory["int8_bytes"] / max(1, var_memory["float32_bytes"])),
+	))
+	return var_store
+#
+#
+def func_datasdr_quantized_recall(in_index_directory: str, in_factors: List[int], in_queries: int = 200, in_top_k: int = 10, in_seed: int = CT_QUANT_SEED) -> List[Dict]:
+	"""
+	This function measures recall@k and latency of the int8 search against an exact float32 search, for several re-rank factors.
+	Queries are the midpoints of two random stored embeddings, as in datasdr_ann.py.
+	Returns one dictionary per re-rank factor.
+
+	in_index_directory: str - Index directory with an int8 file.
+	in_factors - Re-rank factors to measure. 0 = int8 scores only.
+	in_queries: int - Number of queries.
+	in_top_k: int - k of recall@k.
+	in_seed: int - Random seed for the queries.
+	"""
+	from datasdr_ann import func_datasdr_normalize
+	#
+	var_store = DataSDRQuantizedVectorStore.from_persist_dir(in_index_directory)
+	if var_store._codes is None:
+		raise ValueError("No int8 file in [%s]: run 'python3 datasdr_quantize.py %s' first" % (in_index_directory, in_index_directory))
+	var_rng = np.random.default_rng(in_seed)
+	var_pairs = var_rng.integers(0, len(var_store._ids), size=(in_queries, 2))
+	var_query_vectors = func_datasdr_normalize(
+		func_datasdr_normalize(var_store._matrix[var_pairs[:, 0]]) + func_datasdr_normalize(var_store._matrix[var_pairs[:, 1]])
+	)
+	var_queries = [VectorStoreQuery(query_embedding=one_vector.tolist(), similarity_top_k=in_top_k) for one_vector in var_query_vectors]
+	#
+	var_start = time.time()
+	var_exact = [set(DataSDRMmapVectorStore.query(var_store, one_query).ids) for one_query in var_queries]
+	var_exact_ms = (time.time() - var_start) * 1000.0 / in_queries
+	#
+	var_results = []
+	for one_factor in in_factors:
+		var_start = time.time()
+		var_found = [var_store.query(one_query, rerank_factor=one_factor).ids for one_query in var_queries]
+		var_ms = (time.time() - var_start) * 1000.0 / in_queries
+		var_recall = np.mean([len(var_exact[i] & set(one_ids)) / max(1, len(var_exact[i])) for i, one_ids in enumerate(var_found)])
+		var_results.append({"rerank_factor": one_factor, "recall": float(var_recall), "ms_per_query": var_ms, "exact_ms_per_query": var_exact_ms})
+	return var_results
+#
+#
+if __name__ == "__main__":
+	var_parser = argparse.ArgumentParser(description="Quantize the embeddings of an index to int8 and measure the recall lost.")
+	var_parser.add_argument("index_directory", nargs="+")
+	var_parser.add_argument("--rerank", default="0,1,2,4,8", help="Re-rank factors for the recall check. The first value >= 99%% recall is saved as default.")
+	var_parser.add_argument("--queries", type=int, default=200)
+	var_parser.add_argument("--top-k", type=int, default=10)
+	var_parser.add_argument("--check", action="store_true", help="Only run the recall check.")
+	var_arguments = var_parser.parse_args()
+	var_factors = [int(one_value) for one_value in var_arguments.rerank.split(",")]
+	#
+	for one_directory in var_arguments.index_directory:
+		if not var_arguments.check:
+			func_datasdr_quantize_index_directory(one_directory)
+		var_results = func_datasdr_quantized_recall(one_directory, var_factors, var_arguments.queries, var_arguments.top_k)
+		print("\n%s  (recall@%d over %d queries; exact float32 search: %.3f ms/query)" % (one_directory, var_arguments.top_k, var_arguments.queries, var_results[0]["exact_ms_per_query"]))
+		print("%8s %8s %12s" % ("rerank", "recall", "ms/query"))
+		for one_result in var_results:
+			print("%8d %8.3f %12.3f" % (one_result["rerank_factor"], one_result["recall"], one_result["ms_per_query"]))
+		if not var_arguments.check:
+			# Tutorial: save the smallest re-rank factor that reaches 99% recall as the default of this index.
+			var_good = [one_result["rerank_factor"] for one_result in var_results if one_result["recall"] >= 0.99]
+			if var_good:
+				var_store = DataSDRQuantizedVectorStore.from_persist_dir(one_directory)
+				var_store.rerank_factor = min(var_good)
+				var_store.persist(os.path.join(one_directory, CT_DEFAULT_JSON_FNAME))
+				print("Default re-rank factor saved: %d" % (var_store.rerank_factor))
@@ -0,0 +1,251 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_reembed.py
+# Purpose: Re-embed the chunks of an existing index with another embedding model, into a second vector store next to the first.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+Trying another embedding model (CT_EMBEDDING_MODEL) means deleting the index directory and parsing
+the PDFs, or reading the 90 columns of every SQLite3 row, all over again. The chunks themselves do not
+change: their text and metadata are already in the docstore of the index.
+
+This file re-embeds an index from its docstore only:
+* Nodes are streamed out of the docstore ("docstore.sqlite3" is read page by page; "docstore.json" is read once).
+* They are embedded in batches of CT_REEMBED_BATCH_NODES with the new model, with the same text LlamaIndex
+  embeds (MetadataMode.EMBED), so the new vectors match a fresh build.
+* The vectors are written to a second, binary vector store in the same directory, named after the model:
+	mxbai_embed_large__vector_store.npy
+	mxbai_embed_large__vector_store.ids.json
+  "default__vector_store.*" and the docstore are not modified; both models can be queried side by side.
+* A refresh (datasdr_refresh.py) changes the docstore, so it removes these vector stores; run this file again after it.
+  An index whose vector store no longer matches its docstore is refused at load time.
+
+func_datasdr_load_index(.., in_namespace="mxbai_embed_large") loads the index with the new vector store.
+Settings.embed_model must then be the new model, so questions are embedded the same way.
+
+Usage:
+	# Tutorial: re-embed an index; the new vector store is named after the model.
+	python3 datasdr_reembed.py /Users/server/Downloads/test/_index mxbai-embed-large
+
+	# Tutorial: A/B test: the same question against both vector stores.
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="mxbai-embed-large")
+	index_new = func_datasdr_load_index("/Users/server/Downloads/test/_index", in_namespace="mxbai_embed_large")
+"""
+
+import argparse
+import os
+import re
+import time
+from typing import Dict, Iterator, List, Optional
+
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from datasdr_docstore import CT_DOCSTORE_JSON_FNAME, DataSDRSQLiteDocumentStore, func_datasdr_has_sqlite_docstore
+from datasdr_metrics import func_datasdr_count, func_datasdr_stage
+from datasdr_vector_store import CT_MATRIX_SUFFIX, DataSDRMmapVectorStore, func_datasdr_vector_store_base
+
+# Tutorial: nodes sent to the embedding model per batch. DataSDROllamaEmbedding splits each batch into concurrent requests.
+CT_REEMBED_BATCH_NODES = 512
+#
+# Tutorial: LlamaIndex vector store files are "<namespace>__vector_store.json"; "default" is the one the index was built with.
+CT_REEMBED_DEFAULT_NAMESPACE = "default"
+CT_REEMBED_FNAME = "__vector_store.json"
+
+
+def func_datasdr_embedding_namespace(in_model_name: str) -> str:
+	"""
+	This function returns the vector store namespace of an embedding model, e.g. "mxbai-embed-large" -> "mxbai_embed_large".
+
+	in_model_name: str - Embedding model name.
+	"""
+	return re.sub(r"[^A-Za-z0-9]+", "_", in_model_name).strip("_").lower()
+#
+#
+def func_datasdr_namespace_path(in_index_directory: str, in_namespace: str) -> str:
+	"""
+	This function returns the persist path LlamaIndex uses for a vector store namespace, e.g. ".../_index/mxbai_embed_large__vector_store.json".
+
+	in_index_directory: str - Index directory.
+	in_namespace: str - Vector store namespace.
+	"""
+	return os.path.join(in_index_directory, in_namespace + CT_REEMBED_FNAME)
+#
+#
+def func_datasdr_list_namespaces(in_index_directory: str) -> List[str]:
+	"""
+	This function returns the namespaces of the vector stores written by func_datasdr_reembed_index() in an index directory.
+
+	in_index_directory: str - Index directory.
+	"""
+	var_suffix = func_datasdr_vector_store_base(CT_REEMBED_FNAME) + CT_MATRIX_SUFFIX
+	var_namespaces = [one_name[: -len(var_suffix)] for one_name in os.listdir(in_index_directory) if one_name.endswith(var_suffix)]
+	return sorted(one_namespace for one_namespace in var_namespaces if one_namespace != CT_REEMBED_DEFAULT_NAMESPACE)
+#
+#
+def func_datasdr_remove_namespace(in_index_directory: str, in_namespace: str) -> int:
+	"""
+	This function deletes the files of a namespace vector store (matrix, IDs, IVF and int8 files). Returns the number of files deleted.
+
+	in_index_directory: str - Index directory.
+	in_namespace: str - Vector store namespace, e.g. "mxbai_embed_large".
+	"""
+	var_prefix = os.path.basename(func_datasdr_vector_store_base(func_datasdr_namespace_path(in_index_directory, in_namespace))) + "."
+	var_removed = 0
+	for one_name in os.listdir(in_index_directory):
+		if one_name.startswith(var_prefix):
+			os.remove(os.path.join(in_index_directory, one_name))
+			var_removed += 1
+	return var_removed
+#
+#
+def func_datasdr_docstore_node_ids(in_docstore) -> List[str]:
+	"""
+	This function returns the node IDs of a docstore. "docstore.sqlite3" returns them without reading the nodes.
+
+	in_docstore - DataSDRSQLiteDocumentStore or SimpleDocumentStore.
+	"""
+	if hasattr(in_docstore, "func_node_ids"):
+		return in_docstore.func_node_ids()
+	return list(in_docstore.docs)
+#
+#
+def func_datasdr_iter_docstore_nodes(in_index_directory: str) -> Iterator[BaseNode]:
+	"""
+	This function yields every node of the docstore of an index directory.
+
+	in_index_directory: str - Index directory.
+	"""
+	if func_datasdr_has_sqlite_docstore(in_index_directory):
+		yield from DataSDRSQLiteDocumentStore.from_persist_dir(in_index_directory).func_iter_nodes()
+		return
+	from llama_index.core.storage.docstore import SimpleDocumentStore
+	#
+	var_docstore = SimpleDocumentStore.from_persist_path(os.path.join(in_index_directory, CT_DOCSTORE_JSON_FNAME))
+	yield from var_docstore.docs.values()
+#
+#
+def func_datasdr_reembed_index(
+	in_index_directory: str,
+	in_embed_model,
+	in_namespace: Optional[str] = None,
+	in_batch_nodes: int = CT_REEMBED_BATCH_NODES,
+	in_overwrite: bool = False,
+) -> Dict:
+	"""
+	This function embeds every node of an index with another model and writes the vectors to a new vector store in the same directory.
+	Returns a dictionary with "namespace", "nodes", "dimensions", "seconds" and "embeddings_per_second".
+
+	in_index_directory: str - Index directory created by "storage_context.persist(..)".
+	in_embed_model - Embedding model, e.g. DataSDROllamaEmbedding(model_name="mxbai-embed-large").
+	in_namespace: str - Vector store namespace. None = derived from the model name.
+	in_batch_nodes: int - Nodes embedded per batch.
+	in_overwrite: bool - Replace an existing vector store with the same namespace.
+	"""
+	var_namespace = in_namespace or func_datasdr_embedding_namespace(in_embed_model.model_name)
+	if var_namespace == CT_REEMBED_DEFAULT_NAMESPACE:
+		raise ValueError("Namespace [%s] is the vector store the index was built with; choose another one" % (var_namespace))
+	var_persist_path = func_datasdr_namespace_path(in_index_directory, var_namespace)
+	if os.path.exists(func_datasdr_vector_store_base(var_persist_path) + CT_MATRIX_SUFFIX) and not in_overwrite:
+		raise FileExistsError("[%s] already has a vector store [%s]; pass in_overwrite=True to replace it" % (in_index_directory, var_namespace))
+	#
+	var_store = DataSDRMmapVectorStore()
+	var_start = time.time()
+	var_nodes = 0
+	var_batch: List[BaseNode] = []
+	#
+	def func_embed_batch() -> None:
+		with func_datasdr_stage("embedding", model=in_embed_model.model_name):
+			var_embeddings = in_embed_model.get_text_embedding_batch([one_node.get_content(metadata_mode=MetadataMode.EMBED) for one_node in var_batch])
+		for one_node, one_embedding in zip(var_batch, var_embeddings):
+			one_node.embedding = one_embedding
+		var_store.add(var_batch)
+		func_datasdr_count("embedded_texts", len(var_batch))
+		# Tutorial: the text is not needed any more; only the vectors are kept until the store is written.
+		var_batch.clear()
+	#
+	for one_node in func_datasdr_iter_docstore_nodes(in_index_directory):
+		var_batch.append(one_node)
+		var_nodes += 1
+		if len(var_batch) >= in_batch_nodes:
+			func_embed_batch()
+			print("  %d nodes embedded, %.1f embeddings/sec" % (var_nodes, var_nodes / max(time.time() - var_start, 1e-9)))
+	if var_batch:
+		func_embed_batch()
+	#
+	with func_datasdr_stage("persist"):
+		var_store.persist(var_persist_path)
+	var_seconds = time.time() - var_start
+	var_dimensions = 0 if var_store._matrix is None else int(var_store._matrix.shape[1])
+	print("Re-embedded [%s] with [%s]: %d nodes x %d dimensions in %.2f seconds (%.1f embeddings/sec) -> [%s]" % (
+		in_index_directory, in_embed_model.model_name, var_nodes, var_dimensions, var_seconds, var_nodes / max(var_seconds, 1e-9), var_namespace,
+	))
+	return {
+		"namespace": var_namespace,
+		"nodes": var_nodes,
+		"dimensions": var_dimensions,
+		"seconds": var_seconds,
+		"embeddings_per_second": var_nodes / max(var_seconds, 1e-9),
+	}
+#
+#
+def func_datasdr_load_namespace_index(in_index_directory: str, in_namespace: str, in_docstore=None, **in_kwargs):
+	"""
+	This function loads an index with the vector store of a namespace written by func_datasdr_reembed_index().
+	The index is built over the node IDs of that vector store, so it also works for indices persisted as a
+	SummaryIndex (e.g. 100_Drugs_FDA), which have no vectors of their own.
+
+	in_index_directory: str - Index directory.
+	in_namespace: str - Vector store namespace, e.g. "mxbai_embed_large".
+	in_docstore - Optional docstore already opened, e.g. DataSDRSQLiteDocumentStore.
+	in_kwargs - Passed to VectorStoreIndex(), e.g. show_progress=True.
+	"""
+	from llama_index.core import StorageContext, VectorStoreIndex
+	from llama_index.core.data_structs.data_structs import IndexDict
+	from datasdr_ann import CT_IVF_SUFFIX, DataSDRIVFVectorStore
+	from datasdr_quantize import CT_QUANT_SUFFIX, DataSDRQuantizedVectorStore
+	#
+	var_persist_path = func_datasdr_namespace_path(in_index_directory, in_namespace)
+	var_base = func_datasdr_vector_store_base(var_persist_path)
+	if not os.path.exists(var_base + CT_MATRIX_SUFFIX):
+		raise FileNotFoundError("No vector store [%s] in [%s]: run 'python3 datasdr_reembed.py %s <embedding model>' first" % (in_namespace, in_index_directory, in_index_directory))
+	var_store_class = DataSDRMmapVectorStore
+	if os.path.exists(var_base + CT_QUANT_SUFFIX):
+		var_store_class = DataSDRQuantizedVectorStore
+	elif os.path.exists(var_base + CT_IVF_SUFFIX):
+		var_store_class = DataSDRIVFVectorStore
+	var_store = var_store_class.from_persist_path(var_persist_path)
+	#
+	storage_context = StorageContext.from_defaults(persist_dir=in_index_directory, vector_store=var_store, docstore=in_docstore)
+	# Tutorial: a refresh changes the docstore but cannot embed with this model. A vector store that does not hold exactly
+	# the docstore's nodes would return deleted nodes and miss new ones, so it is refused.
+	var_node_ids = set(func_datasdr_docstore_node_ids(storage_context.docstore))
+	var_deleted = sum(1 for one_id in var_store._row_by_id if one_id not in var_node_ids)
+	var_missing = len(var_node_ids) - (len(var_store._row_by_id) - var_deleted)
+	if var_deleted or var_missing:
+		raise ValueError("Vector store [%s] of [%s] is stale: %d of its nodes are no longer in the docstore, %d docstore nodes are not in it. Run 'python3 datasdr_reembed.py %s <embedding model> --overwrite'" % (
+			in_namespace, in_index_directory, var_deleted, var_missing, in_index_directory,
+		))
+	# Tutorial: VectorStoreIndex maps vector store IDs to docstore node IDs; re-embedded nodes keep their IDs.
+	var_index_struct = IndexDict(index_id=in_namespace)
+	var_index_struct.nodes_dict = {one_id: one_id for one_id in var_store._row_by_id}
+	return VectorStoreIndex(nodes=None, index_struct=var_index_struct, storage_context=storage_context, **in_kwargs)
+#
+#
+if __name__ == "__main__":
+	from datasdr_embeddings import CT_OLLAMA_BASE_URL, DataSDROllamaEmbedding
+	#
+	var_parser = argparse.ArgumentParser(description="Re-embed an index with another embedding model, next to its current vector store.")
+	var_parser.add_argument("index_directory")
+	var_parser.add_argument("embedding_model", help="Ollama embedding model, e.g. mxbai-embed-large. Download it first with 'ollama pull <model>'.")
+	var_parser.add_argument("--namespace", default="", help="Vector store namespace. Default: the model name, e.g. mxbai_embed_large.")
+	var_parser.add_argument("--batch", type=int, default=CT_REEMBED_BATCH_NODES)
+	var_parser.add_argument("--embedding-cache", default="", help="Embedding cache file; keep it outside the index directory.")
+	var_parser.add_argument("--ollama-url", default=CT_OLLAMA_BASE_URL)
+	var_parser.add_argument("--overwrite", action="store_true")
+	var_args = var_parser.parse_args()
+	#
+	var_embed_model = DataSDROllamaEmbedding(model_name=var_args.embedding_model, base_url=var_args.ollama_url)
+	if var_args.embedding_cache:
+		from datasdr_embedding_cache import DataSDRCachedEmbedding
+		var_embed_model = DataSDRCachedEmbedding(var_embed_model, cache_path=var_args.embedding_cache)
+	var_result = func_datasdr_reembed_index(var_args.index_directory, var_embed_model, var_args.namespace or None, var_args.batch, var_args.overwrite)
+	print("Load it with: func_datasdr_load_index(\"%s\", in_namespace=\"%s\")" % (var_args.index_directory, var_result["namespace"]))
@@ -0,0 +1,318 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_refresh.py
+# Purpose: Incremental index refresh: only new, changed or deleted documents touch the index.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+Tutorial_02.py and Tutorial_03.py only check whether the index directory exists. Adding one PDF,
+or one new nct_id row, means deleting the directory and rebuilding everything.
+
+The refresh mode keeps a manifest ("datasdr_manifest.json") inside the index directory with one
+fingerprint per source document:
+	PDFs:    file modification time, size and SHA-256 of the file contents.
+	SQLite3: nct_id, plus the rowid and "updated_at" of each of its rows.
+
+On each run the fingerprints are compared with the manifest, and only the affected documents
+are inserted, updated or deleted in the existing index and docstore.
+
+If the index directory has no manifest yet, it is rebuilt once, with a manifest.
+
+Usage:
+	python3 datasdr_refresh.py pdf /Users/server/Downloads/test/_data /Users/server/Downloads/test/_index
+	python3 datasdr_refresh.py sqlite /Users/server/Downloads/test/_Datafiles/ Abbott 10
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from datasdr_sqlite import (
+	func_datasdr_sponsor_documents,
+	func_datasdr_sponsor_fingerprints,
+	func_datasdr_sponsor_index_directory,
+	func_datasdr_sponsor_sqlite_path,
+)
+from datasdr_metrics import func_datasdr_stage
+from datasdr_vector_store import func_datasdr_write_atomic
+
+# Tutorial: file name of the manifest inside the index directory.
+CT_MANIFEST_FNAME = "datasdr_manifest.json"
+
+
+def func_datasdr_read_manifest(in_index_directory: str) -> Optional[Dict]:
+	"""
+	This function returns the manifest of an index directory, or None if there is none.
+
+	in_index_directory: str - Index directory.
+	"""
+	var_path = os.path.join(in_index_directory, CT_MANIFEST_FNAME)
+	if not os.path.exists(var_path):
+		return None
+	with open(var_path, "r") as f:
+		return json.load(f)
+#
+#
+def func_datasdr_write_manifest(in_index_directory: str, in_manifest: Dict) -> None:
+	"""
+	This function writes the manifest of an index directory.
+
+	in_index_directory: str - Index directory.
+	in_manifest - Manifest dictionary.
+	"""
+	var_data = json.dumps(in_manifest, indent=1, sort_keys=True).encode("utf-8")
+	func_datasdr_write_atomic(os.path.join(in_index_directory, CT_MANIFEST_FNAME), lambda f: f.write(var_data))
+#
+#
+def func_datasdr_file_sha256(in_path: str) -> str:
+	"""
+	This function returns the SHA-256 of a file, read in 1 MB blocks.
+
+	in_path: str - File to hash.
+	"""
+	var_hash = hashlib.sha256()
+	with open(in_path, "rb") as f:
+		for var_block in iter(lambda: f.read(1048576), b""):
+			var_hash.update(var_block)
+	return var_hash.hexdigest()
+#
+#
+def func_datasdr_replace_directory(in_tmp_directory: str, in_index_directory: str) -> None:
+	"""
+	This function renames a complete temporary index directory into place, replacing the old one if there is one.
+
+	in_tmp_directory: str - Complete index directory, e.g. "<index directory>.tmp-<pid>".
+	in_index_directory: str - Final index directory.
+	"""
+	if os.path.exists(in_index_directory):
+		var_old_directory = "%s.old-%d" % (in_index_directory, os.getpid())
+		os.rename(in_index_directory, var_old_directory)
+		os.rename(in_tmp_directory, in_index_directory)
+		shutil.rmtree(var_old_directory, ignore_errors=True)
+	else:
+		os.rename(in_tmp_directory, in_index_directory)
+#
+#
+def func_datasdr_link_missing_files(in_index_directory: str, in_tmp_directory: str) -> int:
+	"""
+	This function hard-links into the temporary directory the files of the index directory it does not have yet,
+	e.g. files the refresh did not rewrite. Files are copied where hard links are not supported. Returns the number of files linked.
+
+	in_index_directory: str - Current index directory.
+	in_tmp_directory: str - Temporary index directory, renamed into place afterwards.
+	"""
+	from datasdr_docstore import func_datasdr_is_transient_file
+	#
+	var_linked = 0
+	for one_name in os.listdir(in_index_directory):
+		var_source = os.path.join(in_index_directory, one_name)
+		var_target = os.path.join(in_tmp_directory, one_name)
+		if func_datasdr_is_transient_file(one_name) or not os.path.isfile(var_source) or os.path.exists(var_target):
+			continue
+		try:
+			os.link(var_source, var_target)
+		except OSError:
+			shutil.copy2(var_source, var_target)
+		var_linked += 1
+	return var_linked
+#
+#
+def func_datasdr_refresh_index(in_index_directory: str, in_kind: str, in_fingerprints: Dict[str, object], in_load_documents: Callable[[List[str]], Dict[str, List]], in_manifest_extra: Dict = None) -> Dict[str, int]:
+	"""
+	This function brings an index up to date with its sources. Returns the number of sources added, updated, deleted and unchanged.
+
+	in_index_directory: str - Index directory.
+	in_kind: str - "pdf" or "sqlite"; stored in the manifest.
+	in_fingerprints - Dictionary of source key -> current fingerprint.
+	in_load_documents - Function that loads the Documents of a list of source keys, as a dictionary of key -> Documents.
+	in_manifest_extra - Optional extra entries saved in the manifest, e.g. file modification times.
+	"""
+	from datasdr_docstore import CT_DOCSTORE_FNAME, DataSDRSQLiteDocumentStore, func_datasdr_has_sqlite_docstore, func_datasdr_new_storage_context
+	from datasdr_index_builder import func_datasdr_index_documents
+	from datasdr_reembed import func_datasdr_list_namespaces, func_datasdr_remove_namespace
+	from datasdr_vector_store import DataSDRMmapVectorStore, func_datasdr_load_index
+	#
+	var_counts = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+	var_manifest = func_datasdr_read_manifest(in_index_directory) if os.path.exists(in_index_directory) else None
+	#
+	if var_manifest is None:
+		# Tutorial: no manifest, no way to know which nodes came from which source: rebuild once.
+		var_keys = sorted(in_fingerprints)
+		var_documents = in_load_documents(var_keys)
+		var_sources = {}
+		var_all_documents = []
+		for one_key in var_keys:
+			var_sources[one_key] = {"fingerprint": in_fingerprints[one_key], "doc_ids": [one_doc.doc_id for one_doc in var_documents.get(one_key, [])]}
+			var_all_documents.extend(var_documents.get(one_key, []))
+		#
+		storage_context = func_datasdr_new_storage_context(DataSDRMmapVectorStore())
+		index = func_datasdr_index_documents(var_all_documents, storage_context)
+		#
+		var_tmp_directory = "%s.tmp-%d" % (in_index_directory, os.getpid())
+		shutil.rmtree(var_tmp_directory, ignore_errors=True)
+		with func_datasdr_stage("persist"):
+			index.storage_context.persist(persist_dir=var_tmp_directory)
+		func_datasdr_write_manifest(var_tmp_directory, dict(in_manifest_extra or {}, kind=in_kind, sources=var_sources))
+		for one_namespace in func_datasdr_list_namespaces(in_index_directory) if os.path.exists(in_index_directory) else []:
+			print("Removed vector store [%s] of [%s]: the index was rebuilt. Run 'python3 datasdr_reembed.py %s <embedding model>' again." % (one_namespace, in_index_directory, in_index_directory))
+		func_datasdr_replace_directory(var_tmp_directory, in_index_directory)
+		var_counts["added"] = len(var_keys)
+		return var_counts
+	#
+	var_sources = var_manifest["sources"]
+	var_deleted = [one_key for one_key in var_sources if one_key not in in_fingerprints]
+	var_added = [one_key for one_key in in_fingerprints if one_key not in var_sources]
+	var_updated = [one_key for one_key in in_fingerprints if one_key in var_sources and var_sources[one_key]["fingerprint"] != in_fingerprints[one_key]]
+	var_counts["unchanged"] = len(in_fingerprints) - len(var_added) - len(var_updated)
+	if not (var_deleted or var_added or var_updated):
+		if in_manifest_extra and any(var_manifest.get(one_key) != one_value for one_key, one_value in in_manifest_extra.items()):
+			var_manifest.update(in_manifest_extra)
+			func_datasdr_write_manifest(in_index_directory, var_manifest)
+		return var_counts
+	#
+	# Tutorial: the changed index is written to a temporary directory, renamed into place once complete.
+	# Readers (e.g. datasdr_index_server.py) see the old index or the new one, never a half-written one.
+	# The index is read from the current directory; only "docstore.sqlite3", which SQLite changes in place, is copied first.
+	var_tmp_directory = "%s.tmp-%d" % (in_index_directory, os.getpid())
+	shutil.rmtree(var_tmp_directory, ignore_errors=True)
+	os.makedirs(var_tmp_directory)
+	try:
+		var_docstore = None
+		if func_datasdr_has_sqlite_docstore(in_index_directory):
+			shutil.copy2(os.path.join(in_index_directory, CT_DOCSTORE_FNAME), os.path.join(var_tmp_directory, CT_DOCSTORE_FNAME))
+			var_docstore = DataSDRSQLiteDocumentStore.from_persist_dir(var_tmp_directory)
+		index = func_datasdr_load_index(in_index_directory, in_docstore=var_docstore)
+		# Tutorial: an updated source is deleted, then inserted again.
+		for one_key in var_deleted + var_updated:
+			for one_doc_id in var_sources[one_key]["doc_ids"]:
+				index.delete_ref_doc(one_doc_id, delete_from_docstore=True)
+			if one_key in var_deleted:
+				del var_sources[one_key]
+		#
+		var_documents = in_load_documents(var_added + var_updated)
+		for one_key in var_added + var_updated:
+			for one_document in var_documents.get(one_key, []):
+				index.insert(one_document)
+			var_sources[one_key] = {"fingerprint": in_fingerprints[one_key], "doc_ids": [one_doc.doc_id for one_doc in var_documents.get(one_key, [])]}
+		#
+		with func_datasdr_stage("persist"):
+			index.storage_context.persist(persist_dir=var_tmp_directory)
+		if hasattr(index.docstore, "close"):
+			index.docstore.close()
+		var_manifest.update(in_manifest_extra or {})
+		func_datasdr_write_manifest(var_tmp_directory, var_manifest)
+		# Tutorial: files the refresh did not write (e.g. IVF or int8 files) are hard-linked, not copied.
+		func_datasdr_link_missing_files(in_index_directory, var_tmp_directory)
+		# Tutorial: vector stores written by datasdr_reembed.py still hold the old nodes, and new nodes cannot be embedded
+		# here without their model. They are removed, so no question is answered from them; re-embed the index again.
+		for one_namespace in func_datasdr_list_namespaces(var_tmp_directory):
+			func_datasdr_remove_namespace(var_tmp_directory, one_namespace)
+			print("Removed vector store [%s] of [%s]: it no longer matches the docstore. Run 'python3 datasdr_reembed.py %s <embedding model>' again." % (one_namespace, in_index_directory, in_index_directory))
+	except BaseException:
+		shutil.rmtree(var_tmp_directory, ignore_errors=True)
+		raise
+	func_datasdr_replace_directory(var_tmp_directory, in_index_directory)
+	var_counts["added"], var_counts["updated"], var_counts["deleted"] = len(var_added), len(var_updated), len(var_deleted)
+	return var_counts
+#
+#
+def func_datasdr_pdf_fingerprints(in_data_directory: str, in_index_directory: str):
+	"""
+	This function returns the SHA-256 of each file in the data directory, plus each file's (mtime, size).
+	Files whose modification time and size match the manifest are not hashed again.
+	Returns (fingerprints, stats).
+
+	in_data_directory: str - Directory with the PDFs, as CT_DATA_DIR.
+	in_index_directory: str - Index directory, to re-use the previous fingerprints.
+	"""
+	var_manifest = (func_datasdr_read_manifest(in_index_directory) if os.path.exists(in_index_directory) else None) or {}
+	var_previous_sources = var_manifest.get("sources", {})
+	var_previous_stats = var_manifest.get("stats", {})
+	var_fingerprints = {}
+	var_stats = {}
+	for root, dirs, files in os.walk(in_data_directory):
+		for one_name in files:
+			if one_name.startswith("."):
+				continue
+			var_path = os.path.join(root, one_name)
+			var_stat = os.stat(var_path)
+			var_stats[var_path] = [var_stat.st_mtime, var_stat.st_size]
+			# Tutorial: hashing is the expensive part; skip it when the file was not touched.
+			if var_previous_stats.get(var_path) == var_stats[var_path] and var_path in var_previous_sources:
+				var_fingerprints[var_path] = var_previous_sources[var_path]["fingerprint"]
+			else:
+				var_fingerprints[var_path] = func_datasdr_file_sha256(var_path)
+	return var_fingerprints, var_stats
+#
+#
+def func_datasdr_refresh_pdf_index(in_data_directory: str, in_index_directory: str, in_text_cache: Optional[str] = None, in_extract_workers: int = 1) -> Dict[str, int]:
+	"""
+	This function refreshes the index of a directory of PDFs (Tutorial_02.py).
+
+	in_data_directory: str - Directory with the PDFs, as CT_DATA_DIR.
+	in_index_directory: str - Index directory, as CT_INDEX_DIR.
+	in_text_cache: str - SQLite3 file of the extracted-text cache (datasdr_pdf_extract.py). None = no cache.
+	in_extract_workers: int - Worker processes for PDF extraction, when in_text_cache is set.
+	"""
+	from llama_index.core import SimpleDirectoryReader
+	from datasdr_pdf_extract import func_datasdr_load_pdf_documents
+	#
+	def func_load(in_paths: List[str]) -> Dict[str, List]:
+		if not in_paths:
+			return {}
+		# Tutorial: "filename_as_id" gives every page a stable ID, e.g. "<path>_part_3".
+		if in_text_cache:
+			var_documents = func_datasdr_load_pdf_documents(None, in_text_cache, in_extract_workers, in_input_files=in_paths, in_filename_as_id=True)
+		else:
+			var_documents = SimpleDirectoryReader(input_files=in_paths, filename_as_id=True).load_data()
+		var_by_path: Dict[str, List] = {}
+		for one_document in var_documents:
+			var_by_path.setdefault(one_document.metadata.get("file_path"), []).append(one_document)
+		# Tutorial: SimpleDirectoryReader may report the path slightly differently; match by real path.
+		var_real = {os.path.realpath(one_path): one_path for one_path in in_paths}
+		return {var_real.get(os.path.realpath(one_path), one_path): one_docs for one_path, one_docs in var_by_path.items()}
+	#
+	var_start = time.time()
+	var_fingerprints, var_stats = func_datasdr_pdf_fingerprints(in_data_directory, in_index_directory)
+	var_counts = func_datasdr_refresh_index(in_index_directory, "pdf", var_fingerprints, func_load, in_manifest_extra={"stats": var_stats})
+	print("Refreshed [%s]: %d added, %d updated, %d deleted, %d unchanged in %.2f seconds" % (
+		in_index_directory, var_counts["added"], var_counts["updated"], var_counts["deleted"], var_counts["unchanged"], time.time() - var_start))
+	return var_counts
+#
+#
+def func_datasdr_refresh_sqlite_index(in_sqlite_directory: str, in_sponsor: str, in_limit_records: Optional[int]) -> Dict[str, int]:
+	"""
+	This function refreshes the index of one sponsor SQLite3 file (Tutorial_03.py).
+
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_sponsor: str - Sponsor name, as in CT_SPONSORS_NAME.
+	in_limit_records: int - Maximum number of rows, as CT_LIMIT_RECORDS. None = whole table.
+	"""
+	var_sqlite_path = func_datasdr_sponsor_sqlite_path(in_sqlite_directory, in_sponsor)
+	var_index_directory = func_datasdr_sponsor_index_directory(in_sqlite_directory, in_sponsor)
+	#
+	var_start = time.time()
+	var_counts = func_datasdr_refresh_index(
+		var_index_directory,
+		"sqlite",
+		func_datasdr_sponsor_fingerprints(var_sqlite_path, in_sponsor, in_limit_records),
+		lambda in_nct_ids: func_datasdr_sponsor_documents(var_sqlite_path, in_sponsor, in_nct_ids),
+	)
+	print("Refreshed [%s]: %d added, %d updated, %d deleted, %d unchanged in %.2f seconds" % (
+		var_index_directory, var_counts["added"], var_counts["updated"], var_counts["deleted"], var_counts["unchanged"], time.time() - var_start))
+	return var_counts
+#
+#
+if __name__ == "__main__":
+	# Tutorial: the embedding model must be configured before refreshing.
+	from llama_index.core import Settings
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text")
+	#
+	if sys.argv[1] == "pdf":
+		func_datasdr_refresh_pdf_index(sys.argv[2], sys.argv[3])
+	else:
+		func_datasdr_refresh_sqlite_index(sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else None)
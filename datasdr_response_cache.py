@@ -0,0 +1,348 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_response_cache.py
+# Purpose: Persistent LLM response cache for repeated questions against the same index snapshot.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+The tutorials ask the same fixed questions on every run ("Describe the protocol about Thrombosis?").
+Every run pays for a full Ollama generation, which can take minutes on modest hardware.
+
+This file puts a persistent cache (one SQLite3 file) in front of the LLM:
+* Retrieval still runs (it takes milliseconds; the query embedding comes from the embedding cache).
+* The answer is cached under SHA-256 of: normalized question + LLM model name + retrieved node IDs + index version.
+  A different model, different retrieved chunks or a rebuilt index is a different key.
+* The index version is computed from the files of the index directory (name, size, modification time).
+  When an index is rebuilt, its old answers are deleted the first time it is queried again.
+* Entries expire after a time-to-live, and the least recently used entries are evicted above a maximum count.
+
+Usage:
+	from datasdr_response_cache import func_datasdr_cached_query_engine
+	query_engine = func_datasdr_cached_query_engine(index, CT_INDEX_DIR, "/Users/server/Downloads/test/_response_cache.sqlite3")
+	print(query_engine.query("Describe the protocol about Thrombosis?"))
+	print(query_engine.func_cache_report())
+
+Inspect or empty a cache file:
+	python3 datasdr_response_cache.py /Users/server/Downloads/test/_response_cache.sqlite3
+	python3 datasdr_response_cache.py /Users/server/Downloads/test/_response_cache.sqlite3 --clear
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import RESPONSE_TYPE, Response, StreamingResponse
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from datasdr_docstore import func_datasdr_is_transient_file
+
+# Tutorial: cached answers older than this are asked again. 7 days.
+CT_RESPONSE_CACHE_TTL = 7 * 24 * 3600.0
+#
+# Tutorial: maximum number of cached answers; the least recently used ones are evicted first.
+CT_RESPONSE_CACHE_MAX_ENTRIES = 10000
+#
+# Tutorial: one cache object per file, shared by every query engine of the process.
+CT_RESPONSE_CACHES: Dict[str, "DataSDRResponseCache"] = {}
+
+
+def func_datasdr_normalize_question(in_question: str) -> str:
+	"""
+	This function normalizes a question for the cache key: lower case, single spaces, no trailing punctuation.
+	"Describe the protocol about Thrombosis?" and "describe the protocol  about thrombosis" share an answer.
+
+	in_question: str - Question in plain English.
+	"""
+	return re.sub(r"\s+", " ", in_question).strip().rstrip("?!. ").lower()
+#
+#
+def func_datasdr_index_version(in_index_directory: str) -> str:
+	"""
+	This function returns the version of a persisted index: a hash of the name, size and modification time of its files.
+	Rebuilding or refreshing the index changes the version; SQLite3 journal and temporary files do not. Works with an index ZIP file too.
+
+	in_index_directory: str - Index directory (or ZIP file).
+	"""
+	if os.path.isfile(in_index_directory):
+		var_files = [(os.path.basename(in_index_directory), os.stat(in_index_directory))]
+	else:
+		var_files = [
+			(one_entry.name, one_entry.stat()) for one_entry in os.scandir(in_index_directory)
+			if one_entry.is_file() and not func_datasdr_is_transient_file(one_entry.name)
+		]
+	var_signature = "\n".join("%s %d %d" % (one_name, one_stat.st_size, one_stat.st_mtime_ns) for one_name, one_stat in sorted(var_files))
+	return hashlib.sha256(var_signature.encode("utf-8")).hexdigest()[:16]
+#
+#
+def func_datasdr_response_key(in_question: str, in_model_name: str, in_node_ids: List[str], in_index_version: str) -> str:
+	"""
+	This function returns the cache key of an answer.
+
+	in_question: str - Question in plain English (normalized here).
+	in_model_name: str - LLM model name, e.g. "llama3".
+	in_node_ids - IDs of the retrieved chunks, in the order they are sent to the LLM.
+	in_index_version: str - From func_datasdr_index_version().
+	"""
+	var_parts = [func_datasdr_normalize_question(in_question), in_model_name, in_index_version] + list(in_node_ids)
+	return hashlib.sha256("\x00".join(var_parts).encode("utf-8")).hexdigest()
+#
+#
+class DataSDRResponseCache:
+	"""
+	SQLite3-backed LLM answer cache with time-to-live, LRU eviction and per-index invalidation.
+	Safe to share between threads; several processes may use the same file.
+	"""
+
+	def __init__(self, in_cache_path: str, in_ttl: float = CT_RESPONSE_CACHE_TTL, in_max_entries: int = CT_RESPONSE_CACHE_MAX_ENTRIES) -> None:
+		self.cache_path = in_cache_path
+		self.ttl = in_ttl
+		self.max_entries = in_max_entries
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+		self._versions: Dict[str, str] = {}
+		self._lock = threading.Lock()
+		self._connection = sqlite3.connect(in_cache_path, timeout=60.0, check_same_thread=False)
+		self._connection.execute("PRAGMA journal_mode=WAL")
+		self._connection.execute("PRAGMA synchronous=NORMAL")
+		self._connection.execute(
+			"CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, index_name TEXT NOT NULL, index_version TEXT NOT NULL, "
+			"model TEXT NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+		)
+		self._connection.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)")
+		self._connection.execute("CREATE INDEX IF NOT EXISTS ix_responses_index ON responses (index_name, index_version)")
+		self._connection.commit()
+
+	def func_get(self, in_key: str) -> Optional[str]:
+		"""
+		This function returns the cached answer for a key, or None if it is missing or expired.
+
+		in_key: str - Cache key from func_datasdr_response_key().
+		"""
+		var_now = time.time()
+		with self._lock:
+			var_row = self._connection.execute("SELECT answer FROM responses WHERE key = ? AND created >= ?", (in_key, var_now - self.ttl)).fetchone()
+			if var_row is None:
+				self.misses += 1
+				return None
+			# Tutorial: touching "last_used" is what makes the eviction least-recently-used.
+			self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (var_now, in_key))
+			self._connection.commit()
+			self.hits += 1
+		return var_row[0]
+
+	def func_put(self, in_key: str, in_index_name: str, in_index_version: str, in_model_name: str, in_question: str, in_answer: str) -> None:
+		"""
+		This function stores an answer, then evicts expired and least recently used entries.
+
+		in_key: str - Cache key from func_datasdr_response_key().
+		in_index_name: str - Index the answer comes from (its directory).
+		in_index_version: str - From func_datasdr_index_version().
+		in_model_name: str - LLM model name.
+		in_question: str - Question as asked.
+		in_answer: str - LLM answer.
+		"""
+		var_now = time.time()
+		with self._lock:
+			self._connection.execute(
+				"INSERT OR REPLACE INTO responses (key, index_name, index_version, model, question, answer, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(in_key, in_index_name, in_index_version, in_model_name, in_question, in_answer, var_now, var_now),
+			)
+			self._connection.commit()
+			self._func_evict(var_now)
+
+	def func_check_version(self, in_index_name: str, in_index_version: str) -> int:
+		"""
+		This function deletes the answers of an index built from another version (i.e. before a rebuild).
+		Only the first call per index and version touches the database. Returns the number of deleted answers.
+
+		in_index_name: str - Index (its directory).
+		in_index_version: str - Current version, from func_datasdr_index_version().
+		"""
+		with self._lock:
+			if self._versions.get(in_index_name) == in_index_version:
+				return 0
+			var_deleted = self._connection.execute(
+				"DELETE FROM responses WHERE index_name = ? AND index_version != ?", (in_index_name, in_index_version)
+			).rowcount
+			self._connection.commit()
+			self._versions[in_index_name] = in_index_version
+			self.invalidations += var_deleted
+		return var_deleted
+
+	def _func_evict(self, in_now: float) -> None:
+		"""
+		This function deletes expired answers, then the least recently used ones above max_entries.
+
+		in_now: float - Current time.
+		"""
+		var_expired = self._connection.execute("DELETE FROM responses WHERE created < ?", (in_now - self.ttl,)).rowcount
+		var_count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+		var_drop = var_count - self.max_entries
+		if var_drop > 0:
+			self._connection.execute(
+				"DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)", (var_drop,)
+			)
+		self._connection.commit()
+		self.evictions += var_expired + max(var_drop, 0)
+
+	def func_clear(self) -> int:
+		"""
+		This function deletes every cached answer. Returns the number of deleted answers.
+		"""
+		with self._lock:
+			var_deleted = self._connection.execute("DELETE FROM responses").rowcount
+			self._connection.commit()
+			self._versions.clear()
+		return var_deleted
+
+	def func_stats(self) -> Dict[str, Any]:
+		"""
+		This function returns hit/miss counts for this session plus the number of cached answers.
+		"""
+		with self._lock:
+			var_rows = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+		var_lookups = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": (self.hits / var_lookups) if var_lookups else 0.0,
+			"evictions": self.evictions,
+			"invalidations": self.invalidations,
+			"entries": var_rows,
+			"max_entries": self.max_entries,
+		}
+
+	def close(self) -> None:
+		with self._lock:
+			self._connection.close()
+#
+#
+def func_datasdr_response_cache(in_cache_path: str) -> DataSDRResponseCache:
+	"""
+	This function returns the cache object of a file, opening it the first time.
+
+	in_cache_path: str - SQLite3 cache file.
+	"""
+	if in_cache_path not in CT_RESPONSE_CACHES:
+		CT_RESPONSE_CACHES[in_cache_path] = DataSDRResponseCache(in_cache_path)
+	return CT_RESPONSE_CACHES[in_cache_path]
+#
+#
+class DataSDRCachedQueryEngine(BaseQueryEngine):
+	"""
+	Query engine wrapper: retrieves with the wrapped engine, then answers from DataSDRResponseCache or, on a miss, with the LLM.
+	Cached responses carry metadata {"response_cache": "hit"}; they are complete Response objects even for a streaming engine.
+	"""
+
+	def __init__(self, in_query_engine: BaseQueryEngine, in_cache: DataSDRResponseCache, in_index_directory: str, in_model_name: Optional[str] = None) -> None:
+		self._query_engine = in_query_engine
+		self._cache = in_cache
+		self._index_name = os.path.abspath(in_index_directory)
+		self._model_name = in_model_name
+		super().__init__(callback_manager=in_query_engine.callback_manager)
+
+	def _get_prompt_modules(self) -> Dict[str, Any]:
+		return {"query_engine": self._query_engine}
+
+	@property
+	def cache(self) -> DataSDRResponseCache:
+		return self._cache
+
+	def _func_key(self, in_query_bundle: QueryBundle, in_nodes: List[NodeWithScore]):
+		"""
+		This function returns (key, index version, model name) for a question and its retrieved chunks.
+		A changed index version invalidates the old answers of this index.
+
+		in_query_bundle - Question.
+		in_nodes - Retrieved chunks.
+		"""
+		var_version = func_datasdr_index_version(self._index_name)
+		self._cache.func_check_version(self._index_name, var_version)
+		var_model_name = self._model_name or Settings.llm.metadata.model_name
+		var_key = func_datasdr_response_key(in_query_bundle.query_str, var_model_name, [one_node.node.node_id for one_node in in_nodes], var_version)
+		return var_key, var_version, var_model_name
+
+	def _func_store(self, in_query_bundle: QueryBundle, in_key_tuple, in_response: RESPONSE_TYPE) -> RESPONSE_TYPE:
+		"""
+		This function caches a complete answer. A streaming answer is cached once its last token has been read.
+		"""
+		var_key, var_version, var_model_name = in_key_tuple
+		if isinstance(in_response, Response) and in_response.response is not None:
+			self._cache.func_put(var_key, self._index_name, var_version, var_model_name, in_query_bundle.query_str, in_response.response)
+		elif isinstance(in_response, StreamingResponse) and in_response.response_gen is not None:
+			var_generator = in_response.response_gen
+			#
+			def func_tokens():
+				var_parts = []
+				for one_token in var_generator:
+					var_parts.append(one_token)
+					yield one_token
+				self._cache.func_put(var_key, self._index_name, var_version, var_model_name, in_query_bundle.query_str, "".join(var_parts))
+			#
+			in_response.response_gen = func_tokens()
+		return in_response
+
+	def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+		var_nodes = self._query_engine.retrieve(query_bundle)
+		var_key_tuple = self._func_key(query_bundle, var_nodes)
+		var_answer = self._cache.func_get(var_key_tuple[0])
+		if var_answer is not None:
+			return Response(response=var_answer, source_nodes=var_nodes, metadata={"response_cache": "hit"})
+		return self._func_store(query_bundle, var_key_tuple, self._query_engine.synthesize(query_bundle, var_nodes))
+
+	async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+		var_nodes = await self._query_engine.aretrieve(query_bundle)
+		var_key_tuple = self._func_key(query_bundle, var_nodes)
+		var_answer = self._cache.func_get(var_key_tuple[0])
+		if var_answer is not None:
+			return Response(response=var_answer, source_nodes=var_nodes, metadata={"response_cache": "hit"})
+		return self._func_store(query_bundle, var_key_tuple, await self._query_engine.asynthesize(query_bundle, var_nodes))
+
+	def retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+		return self._query_engine.retrieve(query_bundle)
+
+	def func_cache_report(self) -> str:
+		"""
+		This function returns a one-line summary of cache hits and misses.
+		"""
+		var_stats = self._cache.func_stats()
+		return "Response cache: %d hits, %d misses (%.1f%% hit rate), %d answers invalidated, %d entries of %d" % (
+			var_stats["hits"], var_stats["misses"], 100.0 * var_stats["hit_rate"], var_stats["invalidations"],
+			var_stats["entries"], var_stats["max_entries"],
+		)
+#
+#
+def func_datasdr_cached_query_engine(in_index, in_index_directory: str, in_cache_path: str, in_query_engine: Optional[BaseQueryEngine] = None, **in_kwargs) -> DataSDRCachedQueryEngine:
+	"""
+	This function creates a query engine on an index, with cached LLM answers.
+
+	in_index - Index loaded from in_index_directory.
+	in_index_directory: str - Directory (or ZIP file) the index was loaded from; its files give the index version.
+	in_cache_path: str - SQLite3 cache file.
+	in_query_engine: BaseQueryEngine - Optional query engine to wrap, e.g. a hybrid one; None = index.as_query_engine(**in_kwargs).
+	in_kwargs - Passed to index.as_query_engine(), e.g. similarity_top_k or streaming=True.
+	"""
+	if in_query_engine is None:
+		in_query_engine = in_index.as_query_engine(**in_kwargs)
+	return DataSDRCachedQueryEngine(in_query_engine, func_datasdr_response_cache(in_cache_path), in_index_directory)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_response_cache.py <cache file> [--clear]
+	var_cache = DataSDRResponseCache(sys.argv[1])
+	if "--clear" in sys.argv[2:]:
+		print("%d answers deleted." % (var_cache.func_clear()))
+	for one_index, one_model, one_count, one_newest in var_cache._connection.execute(
+		"SELECT index_name, model, COUNT(*), MAX(created) FROM responses GROUP BY index_name, model ORDER BY index_name, model"
+	):
+		print("%-60s %-20s %8d answers, newest %s" % (one_index, one_model, one_count, time.strftime("%Y-%m-%d %H:%M", time.localtime(one_newest))))
+	print("%d answers in total." % (var_cache.func_stats()["entries"]))
+	var_cache.close()
@@ -0,0 +1,492 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_router.py
+# Purpose: Answer count / filter / group-by questions with SQL; send only free-text questions to the LLM.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+The questions in Tutorial_03.py are aggregates over columns that already exist in the SQLite3 files:
+	"How many studies has this sponsor conducted?"
+	"How many studies of type 'Interventional'?"
+	"How many studies have an overall status of 'Completed'?"
+
+Vector retrieval only shows the LLM a handful of chunks, so it cannot count. The expected outputs
+at the bottom of Tutorial_03.py show the wrong answers.
+
+This file detects such questions and answers them with indexed SQL in milliseconds:
+* Counts:           "How many studies ..?"
+* Aggregates:       "What is the average enrollment ..?"  (average, total, minimum, maximum)
+* Filters:          known column values, quoted or not ('Interventional', Phase 3, completed, ..),
+                    numeric comparisons ("enrollment greater than 100"), and start / completion years
+                    ("started after 2015", "completed before 2010").
+* Group-by:         ".. per phase", ".. by overall status", ".. for each study type".
+
+Anything else ("Describe the protocol about ..") goes to the RAG query engine. So does any question with a word
+the plan cannot express ("not completed", "other than 'Completed'", "Phase 2 or Phase 3", "in March 2020"):
+a wrong number answered in milliseconds is worse than a slow answer.
+
+The router only reads the SQLite3 files. Set CT_ROUTER_CREATE_INDEXES = 1 to let it add column indexes.
+
+Usage:
+	python3 datasdr_router.py /Users/server/Downloads/test/_Datafiles/ Abbott "How many studies of type 'Interventional'?"
+	python3 datasdr_router.py /Users/server/Downloads/test/_Datafiles/ Abbott --check
+"""
+
+import re
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from datasdr_sqlite import func_datasdr_sponsor_sqlite_path
+
+# Tutorial: categorical columns the router can filter and group on, with the words used to name them in a question.
+CT_ROUTER_CATEGORICAL_COLUMNS = {
+	"study_type": ["study type", "type"],
+	"overall_status": ["overall status", "status"],
+	"phase": ["phase"],
+	"enrollment_type": ["enrollment type"],
+	"source_class": ["source class", "sponsor class"],
+	"lead_or_collaborator": ["lead or collaborator", "sponsor role", "role"],
+	"last_known_status": ["last known status"],
+}
+#
+# Tutorial: numeric columns the router can compare and aggregate.
+CT_ROUTER_NUMERIC_COLUMNS = {
+	"enrollment": ["enrollment", "enrolment", "participants", "patients", "subjects"],
+	"number_of_arms": ["number of arms", "arms"],
+}
+#
+# Tutorial: date columns filtered by year.
+CT_ROUTER_DATE_COLUMNS = {
+	"start_date": ["start", "started", "starting", "begun", "began"],
+	"completion_date": ["completion", "completed", "ended", "finished"],
+}
+#
+# Tutorial: values shorter than this are only matched when quoted, to avoid false positives.
+CT_ROUTER_MIN_VALUE_LENGTH = 4
+
+CT_ROUTER_COMPARATORS = [
+	(r"greater than or equal to|at least|no less than|>=", ">="),
+	(r"less than or equal to|at most|no more than|<=", "<="),
+	(r"greater than|more than|larger than|over|above|exceeding|>", ">"),
+	(r"less than|fewer than|smaller than|under|below|<", "<"),
+	(r"equal to|exactly|=", "="),
+]
+CT_ROUTER_AGGREGATES = {"average": "AVG", "mean": "AVG", "total": "SUM", "sum of": "SUM", "minimum": "MIN", "smallest": "MIN", "maximum": "MAX", "largest": "MAX"}
+#
+# Tutorial: words that mean the question needs the documents' text, not the table.
+CT_ROUTER_TEXT_WORDS = ["describe", "explain", "summarize", "summarise", "what do you know", "tell me about", "why", "protocol about"]
+#
+# Tutorial: words that exclude values. The plan only has "=" filters, so these questions go to RAG.
+CT_ROUTER_EXCLUSION_WORDS = ["other than", "except", "excluding", "apart from", "besides", "rather than", "instead of"]
+#
+# Tutorial: words a structured question may contain besides values, column names and numbers.
+# Any other word left in the question ("not", "or", "march", ..) means the plan would ignore it: the question goes to RAG.
+CT_ROUTER_FILLER_WORDS = {
+	"a", "an", "the", "of", "in", "on", "with", "and", "for", "to", "by", "per", "each", "from", "as", "s",
+	"is", "are", "was", "were", "be", "been", "has", "have", "had", "do", "does", "did", "there",
+	"this", "that", "these", "those", "their", "its", "it", "what", "which", "how", "many", "number", "all",
+	"study", "studies", "trial", "trials", "clinical", "sponsor", "sponsored", "conducted", "run", "registered", "enrolled",
+}
+#
+# Tutorial: 1 = the first question on a SQLite3 file adds one index per filterable column to it, so the router's SQL
+# never scans the whole table. This writes to your SQLite3 files. 0 = open them read-only.
+CT_ROUTER_CREATE_INDEXES = 0
+
+# Tutorial: distinct values of each categorical column, read once per SQLite3 file.
+CT_ROUTER_VALUES_CACHE: Dict = {}
+#
+# Tutorial: questions pinned to their route by --check: (question, "sql" or "rag", filtered columns of the SQL plan).
+CT_ROUTER_CHECK_QUESTIONS = [
+	("How many studies has this sponsor conducted?", "sql", []),
+	("How many studies of type 'Interventional'?", "sql", ["study_type"]),
+	("How many studies have an overall status of 'Completed'?", "sql", ["overall_status"]),
+	("How many studies are completed?", "sql", ["overall_status"]),
+	("How many studies completed before 2010?", "sql", ["completion_date"]),
+	("How many studies completed after 2018?", "sql", ["completion_date"]),
+	("How many studies completed in 2020?", "sql", ["completion_date", "completion_date"]),
+	("How many studies started after 2015?", "sql", ["start_date"]),
+	("How many interventional studies per phase?", "sql", ["study_type"]),
+	("What is the average enrollment of Phase 3 studies?", "sql", ["phase"]),
+	("How many patients were enrolled?", "sql", []),
+	("How many studies with enrollment greater than 100?", "sql", ["enrollment"]),
+	("How many studies are not completed?", "rag", None),
+	("How many interventional studies not recruiting?", "rag", None),
+	("How many studies with status other than 'Completed'?", "rag", None),
+	("How many studies in 2020?", "rag", None),
+	("How many studies completed in March 2020?", "rag", None),
+	("How many studies in Phase 2 or Phase 3?", "rag", None),
+	("Describe the protocol about Thrombosis?", "rag", None),
+]
+
+
+def func_datasdr_router_connect(in_sqlite_path: str) -> sqlite3.Connection:
+	"""
+	This function opens a sponsor SQLite3 file read-only.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	"""
+	return sqlite3.connect("file:%s?mode=ro" % (in_sqlite_path), uri=True)
+#
+#
+def func_datasdr_ensure_router_indexes(in_sqlite_path: str, in_sponsor: str) -> int:
+	"""
+	This function creates one index per filterable column, so the router's SQL never scans the whole table.
+	It writes to the SQLite3 file: only called when asked, see CT_ROUTER_CREATE_INDEXES.
+	Returns 0 if the file is read-only and the indexes could not be created.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	"""
+	var_columns = ["nct_id"] + list(CT_ROUTER_CATEGORICAL_COLUMNS) + list(CT_ROUTER_NUMERIC_COLUMNS) + list(CT_ROUTER_DATE_COLUMNS)
+	try:
+		var_connection = sqlite3.connect(in_sqlite_path)
+		try:
+			for one_column in var_columns:
+				var_connection.execute('CREATE INDEX IF NOT EXISTS "ix_%s_%s" ON "%s" (%s)' % (in_sponsor, one_column, in_sponsor, one_column))
+			var_connection.commit()
+		finally:
+			var_connection.close()
+	except sqlite3.OperationalError:
+		return 0
+	return 1
+#
+#
+def func_datasdr_router_values(in_sqlite_path: str, in_sponsor: str, in_create_indexes: bool = False) -> Dict[str, List[str]]:
+	"""
+	This function returns the distinct values of every categorical column, cached per file.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	in_create_indexes: bool - True (or CT_ROUTER_CREATE_INDEXES = 1): the first call for a file also creates the column indexes.
+		This writes to the SQLite3 file.
+	"""
+	var_key = (in_sqlite_path, in_sponsor)
+	if var_key not in CT_ROUTER_VALUES_CACHE:
+		if in_create_indexes or CT_ROUTER_CREATE_INDEXES:
+			func_datasdr_ensure_router_indexes(in_sqlite_path, in_sponsor)
+		var_values = {}
+		var_connection = func_datasdr_router_connect(in_sqlite_path)
+		try:
+			for one_column in CT_ROUTER_CATEGORICAL_COLUMNS:
+				var_values[one_column] = [one_row[0] for one_row in var_connection.execute('SELECT DISTINCT %s FROM "%s" WHERE %s IS NOT NULL' % (one_column, in_sponsor, one_column))]
+		finally:
+			var_connection.close()
+		CT_ROUTER_VALUES_CACHE[var_key] = var_values
+	return CT_ROUTER_VALUES_CACHE[var_key]
+#
+#
+def func_datasdr_route_question(in_question: str, in_sqlite_path: str, in_sponsor: str, in_create_indexes: bool = False) -> Optional[Dict]:
+	"""
+	This function turns a question into a structured query plan, or returns None if the question needs the RAG path.
+	The plan is a dictionary with "aggregate", "column", "filters" (list of (column, operator, value)) and "group_by".
+	A plan is only returned when every content word of the question is used by it: a word the plan
+	cannot express ("not", "or", a year without a date column, ..) would otherwise be silently ignored.
+
+	in_question: str - Question in plain English.
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	in_create_indexes: bool - Passed to func_datasdr_router_values(). False keeps the SQLite3 file untouched.
+	"""
+	var_text = " ".join(in_question.lower().replace("?", " ").split())
+	if any(one_word in var_text for one_word in CT_ROUTER_TEXT_WORDS):
+		return None
+	if re.search(r"\b(%s)\b" % ("|".join(re.escape(one_word) for one_word in CT_ROUTER_EXCLUSION_WORDS)), var_text):
+		return None
+	#
+	# Tutorial: var_rest is var_text with the parts used by the plan blanked out, position by position.
+	var_rest = var_text
+	#
+	def func_consume(in_start: int, in_end: int):
+		nonlocal var_rest
+		var_rest = var_rest[:in_start] + " " * (in_end - in_start) + var_rest[in_end:]
+	#
+	var_plan = {"aggregate": None, "column": None, "filters": [], "group_by": None}
+	# Tutorial: "how many patients were enrolled?" asks for a total of a numeric column, not for a number of studies.
+	var_how_many = re.search(r"\bhow many\s+(?:total\s+)?", var_text)
+	if var_how_many is not None:
+		for one_column, one_names in CT_ROUTER_NUMERIC_COLUMNS.items():
+			for one_name in one_names:
+				var_match = re.compile(r"%s\b" % (re.escape(one_name))).match(var_text, var_how_many.end())
+				if var_match:
+					var_plan["aggregate"], var_plan["column"] = "SUM", one_column
+					func_consume(var_how_many.start(), var_match.end())
+					break
+			if var_plan["aggregate"]:
+				break
+	var_count = re.search(r"\bhow many\b|\bnumber of (studies|trials)\b|\bcount\b", var_text)
+	if var_plan["aggregate"] is None and var_count is not None:
+		var_plan["aggregate"] = "COUNT"
+		func_consume(var_count.start(), var_count.end())
+	elif var_plan["aggregate"] is None:
+		for one_word, one_function in CT_ROUTER_AGGREGATES.items():
+			var_match = re.search(r"\b%s\b" % (one_word), var_text)
+			if var_match is None:
+				continue
+			for one_column, one_names in CT_ROUTER_NUMERIC_COLUMNS.items():
+				for one_name in one_names:
+					var_name = re.compile(r"\b%s\b" % (re.escape(one_name))).search(var_text, var_match.end())
+					if var_name:
+						var_plan["aggregate"], var_plan["column"] = one_function, one_column
+						func_consume(var_match.start(), var_match.end())
+						func_consume(var_name.start(), var_name.end())
+						break
+				if var_plan["aggregate"]:
+					break
+			if var_plan["aggregate"]:
+				break
+	if var_plan["aggregate"] is None:
+		return None
+	#
+	# Tutorial: group-by, e.g. "per phase", "by overall status", "for each study type".
+	for one_column, one_names in CT_ROUTER_CATEGORICAL_COLUMNS.items():
+		for one_name in sorted(one_names, key=len, reverse=True):
+			var_match = re.search(r"\b(per|by|for each|each|broken down by|grouped by)\s+%s\b" % (re.escape(one_name)), var_text)
+			if var_match:
+				var_plan["group_by"] = one_column
+				func_consume(var_match.start(), var_match.end())
+				break
+		if var_plan["group_by"]:
+			break
+	#
+	# Tutorial: years, e.g. "started after 2015", "start in 2020", "completed before 2010". Read before the column
+	# values, so the "completed" of "completed before 2010" is a completion date and not the status 'Completed'.
+	for one_column, one_names in CT_ROUTER_DATE_COLUMNS.items():
+		var_names = "|".join(re.escape(one_name) for one_name in one_names)
+		var_match = re.search(r"\b(?:%s)\s+(?:date\s+)?(in|after|before|since|from)\s+((?:19|20)\d\d)\b" % (var_names), var_rest)
+		if var_match:
+			var_operator = {"in": "year", "after": ">", "before": "<", "since": ">=", "from": ">="}[var_match.group(1)]
+			var_year = var_match.group(2)
+			if var_operator == "year":
+				var_plan["filters"].append((one_column, ">=", "%s-01-01" % (var_year)))
+				var_plan["filters"].append((one_column, "<=", "%s-12-31" % (var_year)))
+			elif var_operator == ">":
+				var_plan["filters"].append((one_column, ">", "%s-12-31" % (var_year)))
+			else:
+				var_plan["filters"].append((one_column, var_operator, "%s-01-01" % (var_year)))
+			func_consume(var_match.start(), var_match.end())
+	#
+	# Tutorial: categorical filters. Quoted values are matched first, then known values written in the question.
+	var_values = func_datasdr_router_values(in_sqlite_path, in_sponsor, in_create_indexes)
+	var_quoted = [one_match[1] for one_match in re.findall(r"(['\"])(.+?)\1", in_question)]
+	var_quoted_spans = [one_match.span() for one_match in re.finditer(r"(['\"])(.+?)\1", var_text)]
+	var_used_columns = set()
+	for one_quoted, one_span in zip(var_quoted, var_quoted_spans):
+		var_found = False
+		for one_column, one_column_values in var_values.items():
+			for one_value in one_column_values:
+				if str(one_value).lower() == one_quoted.lower() and one_column not in var_used_columns:
+					var_plan["filters"].append((one_column, "=", one_value))
+					var_used_columns.add(one_column)
+					var_found = True
+					break
+			if var_found:
+				break
+		if not var_found:
+			# Tutorial: an unknown quoted value means "zero matches" only if we can tell which column it belongs to.
+			for one_column, one_names in CT_ROUTER_CATEGORICAL_COLUMNS.items():
+				if one_column not in var_used_columns and any(re.search(r"\b%s\b" % (re.escape(one_name)), var_text) for one_name in one_names):
+					var_plan["filters"].append((one_column, "=", one_quoted))
+					var_used_columns.add(one_column)
+					var_found = True
+					break
+		if not var_found:
+			return None
+		func_consume(*one_span)
+	var_candidates = []
+	for one_column, one_column_values in var_values.items():
+		if one_column in var_used_columns or one_column == var_plan["group_by"]:
+			continue
+		for one_value in one_column_values:
+			var_value = str(one_value).lower()
+			if len(var_value) < CT_ROUTER_MIN_VALUE_LENGTH:
+				continue
+			var_match = re.search(r"(?<![\w/])%s(?![\w/])" % (re.escape(var_value)), var_rest)
+			if var_match:
+				var_candidates.append((len(var_value), var_match.start(), one_column, one_value))
+	# Tutorial: longest value wins, so "Phase 2/Phase 3" is not read as "Phase 2".
+	var_taken: List = []
+	for var_length, var_position, one_column, one_value in sorted(var_candidates, reverse=True):
+		if one_column in var_used_columns:
+			continue
+		if any(var_position < one_end and var_position + var_length > one_start for one_start, one_end in var_taken):
+			continue
+		var_plan["filters"].append((one_column, "=", one_value))
+		var_used_columns.add(one_column)
+		var_taken.append((var_position, var_position + var_length))
+	for one_start, one_end in var_taken:
+		func_consume(one_start, one_end)
+	#
+	# Tutorial: numeric comparisons, e.g. "enrollment greater than 100", "more than 500 participants".
+	var_number = r"(\d+(?:\.\d+)?)"
+	for one_column, one_names in CT_ROUTER_NUMERIC_COLUMNS.items():
+		for one_name in one_names:
+			for one_words, one_operator in CT_ROUTER_COMPARATORS:
+				var_name = re.escape(one_name)
+				var_match = (
+					re.search(r"\b%s\s+(?:is\s+|of\s+)?(?:%s)\s+%s" % (var_name, one_words, var_number), var_rest)
+					or re.search(r"(?:%s)\s+%s\s+%s\b" % (one_words, var_number, var_name), var_rest)
+				)
+				if var_match:
+					var_plan["filters"].append((one_column, one_operator, float(var_match.group(1))))
+					func_consume(var_match.start(), var_match.end())
+					break
+			else:
+				continue
+			break
+	#
+	# Tutorial: every word left must be a filler word, the sponsor's name, or the name of a column the plan uses.
+	# "not completed" leaves "not", "completed in March 2020" leaves "march": such questions go to RAG.
+	var_columns = set(one_filter[0] for one_filter in var_plan["filters"]) | {var_plan["column"], var_plan["group_by"]}
+	var_names = [in_sponsor.lower()]
+	for one_columns in (CT_ROUTER_CATEGORICAL_COLUMNS, CT_ROUTER_NUMERIC_COLUMNS):
+		var_names += [one_name for one_column, one_names in one_columns.items() if one_column in var_columns for one_name in one_names]
+	for one_name in sorted(var_names, key=len, reverse=True):
+		var_rest = re.sub(r"\b%s\b" % (re.escape(one_name)), " ", var_rest)
+	if any(one_word not in CT_ROUTER_FILLER_WORDS for one_word in re.findall(r"[a-z0-9]+", var_rest)):
+		return None
+	#
+	return var_plan
+#
+#
+def func_datasdr_plan_to_sql(in_plan: Dict, in_sponsor: str):
+	"""
+	This function turns a query plan into a parameterized SELECT statement. Returns (sql, parameters).
+
+	in_plan - Plan from func_datasdr_route_question().
+	in_sponsor: str - Sponsor name. It is also the table name.
+	"""
+	if in_plan["aggregate"] == "COUNT":
+		# Tutorial: a trial may have several rows (one per document); count trials, not rows.
+		var_select = "COUNT(DISTINCT nct_id)"
+	else:
+		var_select = "%s(CAST(%s AS REAL))" % (in_plan["aggregate"], in_plan["column"])
+	# Tutorial: values are matched to the stored spelling in func_datasdr_route_question(), so a plain "=" can use the column index.
+	var_where = []
+	var_parameters = []
+	for one_column, one_operator, one_value in in_plan["filters"]:
+		if isinstance(one_value, float):
+			var_where.append("CAST(%s AS REAL) %s ?" % (one_column, one_operator))
+		else:
+			var_where.append("%s %s ?" % (one_column, one_operator))
+		var_parameters.append(one_value)
+	if in_plan["column"]:
+		var_where.append("%s IS NOT NULL" % (in_plan["column"]))
+	#
+	var_sql = 'SELECT %s%s FROM "%s"' % ("%s, " % (in_plan["group_by"]) if in_plan["group_by"] else "", var_select, in_sponsor)
+	if var_where:
+		var_sql += " WHERE " + " AND ".join(var_where)
+	if in_plan["group_by"]:
+		var_sql += " GROUP BY %s ORDER BY 2 DESC" % (in_plan["group_by"])
+	return var_sql, var_parameters
+#
+#
+def func_datasdr_plan_description(in_plan: Dict) -> str:
+	"""
+	This function describes the filters of a plan in words, e.g. "with study_type = 'Interventional'".
+
+	in_plan - Plan from func_datasdr_route_question().
+	"""
+	var_parts = []
+	for one_column, one_operator, one_value in in_plan["filters"]:
+		var_parts.append("%s %s %s" % (one_column, one_operator, ("%g" % one_value) if isinstance(one_value, float) else "'%s'" % (one_value)))
+	return (" with " + " and ".join(var_parts)) if var_parts else ""
+#
+#
+def func_datasdr_run_plan(in_plan: Dict, in_sqlite_path: str, in_sponsor: str) -> str:
+	"""
+	This function runs a query plan and returns the answer as a sentence.
+
+	in_plan - Plan from func_datasdr_route_question().
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	"""
+	var_sql, var_parameters = func_datasdr_plan_to_sql(in_plan, in_sponsor)
+	var_connection = func_datasdr_router_connect(in_sqlite_path)
+	try:
+		var_rows = var_connection.execute(var_sql, var_parameters).fetchall()
+	finally:
+		var_connection.close()
+	#
+	var_subject = "studies" if in_plan["aggregate"] == "COUNT" else "%s %s of studies" % ({"AVG": "average", "SUM": "total", "MIN": "minimum", "MAX": "maximum"}[in_plan["aggregate"]], in_plan["column"])
+	var_description = func_datasdr_plan_description(in_plan)
+	if in_plan["group_by"]:
+		var_lines = ["%s: %s %s%s, by %s:" % (in_sponsor, "Number of" if in_plan["aggregate"] == "COUNT" else "The", var_subject, var_description, in_plan["group_by"])]
+		for one_group, one_value in var_rows:
+			var_lines.append("\t%s: %s" % ("(not set)" if one_group is None else one_group, func_datasdr_format_number(one_value)))
+		return "\n".join(var_lines)
+	var_value = var_rows[0][0] if var_rows else None
+	if in_plan["aggregate"] == "COUNT":
+		return "%s has %s %s%s." % (in_sponsor, func_datasdr_format_number(var_value), var_subject, var_description)
+	return "%s: the %s%s is %s." % (in_sponsor, var_subject, var_description, func_datasdr_format_number(var_value))
+#
+#
+def func_datasdr_format_number(in_value) -> str:
+	"""
+	This function formats a SQL result for display: integers without decimals, others with 1 decimal.
+
+	in_value - Number, or None.
+	"""
+	if in_value is None:
+		return "n/a"
+	if float(in_value).is_integer():
+		return "%d" % (in_value)
+	return "%.1f" % (in_value)
+#
+#
+def func_datasdr_answer_question(in_question: str, in_sqlite_directory: str, in_sponsor: str, in_get_query_engine: Callable, in_create_indexes: bool = False) -> Dict:
+	"""
+	This function answers one question: with SQL when it is an aggregate over known columns, otherwise with RAG.
+	Returns a dictionary with "route" ("sql" or "rag"), "answer", "sql" and "seconds".
+
+	in_question: str - Question in plain English.
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_sponsor: str - Sponsor name, as in CT_SPONSORS_NAME.
+	in_get_query_engine - Function with no arguments that returns the query engine. Only called for RAG questions,
+		so the index is not even loaded when every question is structured.
+	in_create_indexes: bool - True: add the router's column indexes to the SQLite3 file, see CT_ROUTER_CREATE_INDEXES.
+	"""
+	var_start = time.time()
+	var_sqlite_path = func_datasdr_sponsor_sqlite_path(in_sqlite_directory, in_sponsor)
+	var_plan = func_datasdr_route_question(in_question, var_sqlite_path, in_sponsor, in_create_indexes)
+	if var_plan is not None:
+		var_sql, var_parameters = func_datasdr_plan_to_sql(var_plan, in_sponsor)
+		var_answer = func_datasdr_run_plan(var_plan, var_sqlite_path, in_sponsor)
+		return {"route": "sql", "answer": var_answer, "sql": var_sql, "parameters": var_parameters, "seconds": time.time() - var_start}
+	#
+	var_response = in_get_query_engine().query(in_question)
+	return {"route": "rag", "answer": var_response, "sql": None, "parameters": None, "seconds": time.time() - var_start}
+#
+#
+def func_datasdr_check_routes(in_sqlite_path: str, in_sponsor: str) -> int:
+	"""
+	This function routes every question of CT_ROUTER_CHECK_QUESTIONS and prints the ones that take the wrong route.
+	Returns the number of failures.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	"""
+	var_failures = 0
+	for one_question, one_route, one_columns in CT_ROUTER_CHECK_QUESTIONS:
+		var_plan = func_datasdr_route_question(one_question, in_sqlite_path, in_sponsor)
+		var_route = "rag" if var_plan is None else "sql"
+		var_columns = None if var_plan is None else sorted(one_filter[0] for one_filter in var_plan["filters"])
+		var_ok = var_route == one_route and (one_columns is None or var_columns == sorted(one_columns))
+		var_failures += 0 if var_ok else 1
+		print("%s  %s  %s%s" % ("ok  " if var_ok else "FAIL", var_route, one_question, "" if var_plan is None else func_datasdr_plan_description(var_plan)))
+	print("%d of %d questions routed as expected." % (len(CT_ROUTER_CHECK_QUESTIONS) - var_failures, len(CT_ROUTER_CHECK_QUESTIONS)))
+	return var_failures
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_router.py <sqlite_directory> <Sponsor> "<question>" | --check
+	var_sqlite_path = func_datasdr_sponsor_sqlite_path(sys.argv[1], sys.argv[2])
+	if sys.argv[3] == "--check":
+		sys.exit(1 if func_datasdr_check_routes(var_sqlite_path, sys.argv[2]) else 0)
+	var_plan = func_datasdr_route_question(sys.argv[3], var_sqlite_path, sys.argv[2])
+	if var_plan is None:
+		print("Not a structured question: it would be sent to the RAG query engine.")
+	else:
+		var_start = time.time()
+		print(func_datasdr_run_plan(var_plan, var_sqlite_path, sys.argv[2]))
+		print("SQL: %s %s  (%.1f ms)" % (func_datasdr_plan_to_sql(var_plan, sys.argv[2]) + ((time.time() - var_start) * 1000.0,)))
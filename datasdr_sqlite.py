@@ -0,0 +1,407 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_sqlite.py
+# Purpose: Shared definitions for the sponsor-specific TrialTwin SQLite3 files.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+Each TrialTwin SQLite3 file (e.g. "TrialTwin_Abbott.sqlite3") has one table named after the sponsor.
+This file keeps the file naming rules and the list of columns in one place, so Tutorial_03.py and
+the helper files build exactly the same query.
+
+It also decides how a row becomes a Document (CT_ROW_MAPPING):
+* "flat": every column is embedded as "column: value, column: value", like DatabaseReader does.
+  Dates, codes ("datasdr_code_phase") and flags ("is_fda_regulated_drug") are embedded too, and sent
+  to the LLM with every retrieved chunk.
+* "schema": only the narrative columns (CT_TRIALS_TEXT_COLUMNS) are embedded. Every other column is
+  typed node metadata: integers, booleans and ISO dates, usable with MetadataFilters. A few of them
+  (CT_TRIALS_LLM_METADATA_COLUMNS) are shown to the LLM next to each chunk; none are embedded.
+
+Usage:
+	python3 datasdr_sqlite.py /Users/server/Downloads/test/_Datafiles/ Abbott 100     # embedded tokens per trial, flat vs. schema
+"""
+
+import hashlib
+import json
+import sqlite3
+import sys
+from typing import Any, Dict, Iterator, List, Optional
+
+from datasdr_metrics import func_datasdr_count, func_datasdr_stage
+
+# Tutorial: rows read from SQLite3 per page by the streaming reader.
+CT_STREAM_BATCH_SIZE = 200
+#
+# Tutorial: columns retrieved from each sponsor table.
+CT_TRIALS_COLUMNS = [
+	"nct_id", "nlm_download_date_description", "study_first_submitted_date",
+	"results_first_submitted_date", "disposition_first_submitted_date", "last_update_submitted_date",
+	"study_first_submitted_qc_date", "study_first_posted_date", "study_first_posted_date_type",
+	"results_first_submitted_qc_date", "results_first_posted_date", "results_first_posted_date_type",
+	"disposition_first_submitted_qc_date", "disposition_first_posted_date",
+	"disposition_first_posted_date_type", "last_update_submitted_qc_date", "last_update_posted_date",
+	"last_update_posted_date_type", "start_month_year", "start_date_type", "start_date",
+	"verification_month_year", "verification_date", "completion_month_year", "completion_date_type",
+	"completion_date", "primary_completion_month_year", "primary_completion_date_type",
+	"primary_completion_date", "target_duration", "study_type", "acronym", "baseline_population",
+	"brief_title", "official_title", "overall_status", "last_known_status", "phase", "enrollment",
+	"enrollment_type", "source", "limitations_and_caveats", "number_of_arms", "number_of_groups",
+	"why_stopped", "has_expanded_access", "expanded_access_type_individual",
+	"expanded_access_type_intermediate", "expanded_access_type_treatment", "has_dmc",
+	"is_fda_regulated_drug", "is_fda_regulated_device", "is_unapproved_device", "is_ppsd",
+	"is_us_export", "biospec_retention", "biospec_description", "ipd_time_frame",
+	"ipd_access_criteria", "ipd_url", "plan_to_share_ipd", "plan_to_share_ipd_description",
+	"created_at", "updated_at", "source_class", "delayed_posting", "expanded_access_nctid",
+	"expanded_access_status_for_nctid", "fdaaa801_violation", "baseline_type_units_analyzed",
+	"datasdr_brief_summaries__description", "datasdr_downcase_name_list",
+	"datasdr_baseline_counts__count", "datasdr_baseline_counts__ctgov_group_code",
+	"datasdr_baseline_counts__result_group_id", "datasdr_baseline_counts__scope",
+	"datasdr_baseline_counts__units", "datasdr_code_biospec_retention",
+	"datasdr_code_enrollment_type", "datasdr_code_expanded_access_status_for_nctid",
+	"datasdr_code_last_known_status", "datasdr_code_overall_status", "datasdr_code_phase",
+	"datasdr_code_plan_to_share_ipd", "datasdr_code_source_class", "datasdr_code_study_type",
+	"datasdr_pdf_file_contents", "datasdr_pdf_file_number_pages", "datasdr_pdf_document_type",
+	"lead_or_collaborator", "name",
+]
+#
+# Tutorial: how rows become Documents: "schema" (narrative text embedded, the rest typed metadata) or "flat" (everything embedded).
+CT_ROW_MAPPING = "schema"
+#
+# Tutorial: narrative columns, the only ones embedded with "schema".
+CT_TRIALS_TEXT_COLUMNS = [
+	"brief_title", "official_title", "datasdr_downcase_name_list",
+	"datasdr_brief_summaries__description", "datasdr_pdf_file_contents",
+]
+#
+# Tutorial: metadata shown to the LLM next to each retrieved chunk (never embedded). Other metadata is only used for filtering.
+CT_TRIALS_LLM_METADATA_COLUMNS = [
+	"nct_id", "name", "overall_status", "phase", "study_type", "enrollment",
+	"start_date", "completion_date", "why_stopped",
+]
+#
+# Tutorial: type of the metadata columns. Columns not listed are kept as strings; dates are already ISO strings ("2003-05-16").
+CT_TRIALS_METADATA_TYPES = {
+	"enrollment": "int", "number_of_arms": "int", "number_of_groups": "int",
+	"datasdr_baseline_counts__count": "int", "datasdr_pdf_file_number_pages": "int",
+	"datasdr_code_biospec_retention": "int", "datasdr_code_enrollment_type": "int",
+	"datasdr_code_expanded_access_status_for_nctid": "int", "datasdr_code_last_known_status": "int",
+	"datasdr_code_overall_status": "int", "datasdr_code_phase": "int", "datasdr_code_plan_to_share_ipd": "int",
+	"datasdr_code_source_class": "int", "datasdr_code_study_type": "int",
+	"has_expanded_access": "bool", "expanded_access_type_individual": "bool",
+	"expanded_access_type_intermediate": "bool", "expanded_access_type_treatment": "bool",
+	"has_dmc": "bool", "is_fda_regulated_drug": "bool", "is_fda_regulated_device": "bool",
+	"is_unapproved_device": "bool", "is_ppsd": "bool", "is_us_export": "bool",
+}
+#
+#
+def func_datasdr_sponsor_sqlite_path(in_sqlite_directory: str, in_sponsor: str) -> str:
+	"""
+	This function returns the path of the SQLite3 file for one sponsor.
+
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_sponsor: str - Sponsor name, as in CT_SPONSORS_NAME.
+	"""
+	return "%sTrialTwin_%s.sqlite3" % (in_sqlite_directory, in_sponsor)
+#
+#
+def func_datasdr_sponsor_sqlite_uri(in_sqlite_directory: str, in_sponsor: str) -> str:
+	"""
+	This function returns the SQLAlchemy URI used by DatabaseReader for one sponsor.
+
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_sponsor: str - Sponsor name, as in CT_SPONSORS_NAME.
+	"""
+	return "sqlite:///%s" % (func_datasdr_sponsor_sqlite_path(in_sqlite_directory, in_sponsor))
+#
+#
+def func_datasdr_sponsor_index_directory(in_sqlite_directory: str, in_sponsor: str) -> str:
+	"""
+	This function returns the index directory for one sponsor, e.g. ".../_Datafiles/_Abbott".
+
+	in_sqlite_directory: str - Directory where SQLite3 files are located at.
+	in_sponsor: str - Sponsor name, as in CT_SPONSORS_NAME.
+	"""
+	return "%s_%s" % (in_sqlite_directory, in_sponsor)
+#
+#
+def func_datasdr_sponsor_query(in_sponsor: str, in_limit_records: int) -> str:
+	"""
+	This function returns the SELECT statement used to build the index of one sponsor.
+
+	in_sponsor: str - Sponsor name. It is also the table name.
+	in_limit_records: int - Maximum number of rows to retrieve.
+	"""
+	return "SELECT %s FROM %s ORDER BY nct_id ASC LIMIT %d;" % (", ".join(CT_TRIALS_COLUMNS), in_sponsor, in_limit_records)
+#
+#
+def func_datasdr_row_to_text(in_columns, in_row) -> str:
+	"""
+	This function flattens one row into text, exactly like DatabaseReader does: "column: value, column: value".
+
+	in_columns - Column names.
+	in_row - Row values, in the same order.
+	"""
+	return ", ".join(["%s: %s" % (one_column, one_value) for one_column, one_value in zip(in_columns, in_row)])
+#
+#
+def func_datasdr_typed_value(in_column: str, in_value) -> Any:
+	"""
+	This function converts one column value to its metadata type (CT_TRIALS_METADATA_TYPES). Empty values return None.
+	Values that do not convert (e.g. a non-numeric "enrollment") are kept as strings.
+
+	in_column: str - Column name.
+	in_value - Value read from SQLite3.
+	"""
+	if in_value is None or in_value == "":
+		return None
+	var_type = CT_TRIALS_METADATA_TYPES.get(in_column, "str")
+	try:
+		if var_type == "int":
+			return int(float(in_value))
+		if var_type == "bool" and in_value in ("t", "f"):
+			return in_value == "t"
+	except ValueError:
+		pass
+	return str(in_value)
+#
+#
+def func_datasdr_row_mapping_version(in_mapping: Optional[str] = None) -> str:
+	"""
+	This function returns a short version of the row mapping, e.g. "schema-1a2b3c4d".
+	It changes whenever the mapping or its column lists change, so refreshed indices re-embed their rows.
+
+	in_mapping: str - "schema" or "flat". None = CT_ROW_MAPPING.
+	"""
+	var_mapping = in_mapping or CT_ROW_MAPPING
+	if var_mapping == "flat":
+		return "flat"
+	var_config = json.dumps([CT_TRIALS_TEXT_COLUMNS, CT_TRIALS_LLM_METADATA_COLUMNS, CT_TRIALS_METADATA_TYPES], sort_keys=True)
+	return "%s-%s" % (var_mapping, hashlib.sha1(var_config.encode("utf-8")).hexdigest()[:8])
+#
+#
+def func_datasdr_row_to_schema_fields(in_row):
+	"""
+	This function splits one row of CT_TRIALS_COLUMNS into the text to embed and the typed metadata.
+	Returns (text, metadata). Text columns are "column: value" lines; empty columns are left out of both.
+
+	in_row - Row values, in the order of CT_TRIALS_COLUMNS.
+	"""
+	var_text_lines = []
+	var_metadata = {}
+	for one_column, one_value in zip(CT_TRIALS_COLUMNS, in_row):
+		if one_column in CT_TRIALS_TEXT_COLUMNS:
+			if one_value not in (None, ""):
+				var_text_lines.append("%s: %s" % (one_column, one_value))
+			continue
+		var_value = func_datasdr_typed_value(one_column, one_value)
+		if var_value is not None:
+			var_metadata[one_column] = var_value
+	return "\n".join(var_text_lines), var_metadata
+#
+#
+def func_datasdr_row_to_document(in_rowid: int, in_row, in_mapping: Optional[str] = None):
+	"""
+	This function turns one row of CT_TRIALS_COLUMNS into a LlamaIndex Document with a stable ID, "<nct_id>#<rowid>".
+
+	in_rowid: int - SQLite3 rowid of the row.
+	in_row - Row values, in the order of CT_TRIALS_COLUMNS.
+	in_mapping: str - "schema" or "flat". None = CT_ROW_MAPPING.
+	"""
+	from llama_index.core import Document
+	#
+	var_id = "%s#%s" % (in_row[0], in_rowid)
+	if (in_mapping or CT_ROW_MAPPING) == "flat":
+		return Document(text=func_datasdr_row_to_text(CT_TRIALS_COLUMNS, in_row), id_=var_id)
+	var_text, var_metadata = func_datasdr_row_to_schema_fields(in_row)
+	return Document(
+		text=var_text,
+		id_=var_id,
+		metadata=var_metadata,
+		# Tutorial: metadata is never embedded; only a few fields are shown to the LLM.
+		excluded_embed_metadata_keys=list(var_metadata),
+		excluded_llm_metadata_keys=[one_key for one_key in var_metadata if one_key not in CT_TRIALS_LLM_METADATA_COLUMNS],
+	)
+#
+#
+def func_datasdr_row_fingerprint(in_rowid: int, in_updated_at, in_mapping: Optional[str] = None) -> str:
+	"""
+	This function returns the fingerprint of one row. The fingerprint of an nct_id joins those of its rows with "|".
+	Except for "flat", the row mapping version is part of the fingerprint: a new mapping re-embeds every row on refresh.
+
+	in_rowid: int - SQLite3 rowid of the row.
+	in_updated_at - Value of the "updated_at" column.
+	in_mapping: str - "schema" or "flat". None = CT_ROW_MAPPING.
+	"""
+	if (in_mapping or CT_ROW_MAPPING) == "flat":
+		return "%s@%s" % (in_rowid, in_updated_at)
+	return "%s@%s@%s" % (in_rowid, in_updated_at, func_datasdr_row_mapping_version(in_mapping))
+#
+#
+def func_datasdr_sponsor_fingerprints(in_sqlite_path: str, in_sponsor: str, in_limit_records: Optional[int]) -> Dict[str, str]:
+	"""
+	This function returns one fingerprint per nct_id, built from the "updated_at" of its rows.
+	Only the rows selected by func_datasdr_sponsor_query() are considered.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	in_limit_records: int - Maximum number of rows, as in func_datasdr_sponsor_query(). None = whole table.
+	"""
+	var_fingerprints: Dict[str, List[str]] = {}
+	var_connection = sqlite3.connect("file:%s?mode=ro" % (in_sqlite_path), uri=True)
+	try:
+		var_rows = var_connection.execute(
+			'SELECT nct_id, rowid, updated_at FROM "%s" ORDER BY nct_id ASC, rowid ASC LIMIT %d' % (in_sponsor, -1 if in_limit_records is None else in_limit_records)
+		)
+		for one_nct_id, one_rowid, one_updated_at in var_rows:
+			var_fingerprints.setdefault(one_nct_id, []).append(func_datasdr_row_fingerprint(one_rowid, one_updated_at))
+	finally:
+		var_connection.close()
+	return {one_nct_id: "|".join(one_parts) for one_nct_id, one_parts in var_fingerprints.items()}
+#
+#
+def func_datasdr_sponsor_documents(in_sqlite_path: str, in_sponsor: str, in_nct_ids: List[str]):
+	"""
+	This function loads the rows of the given nct_ids as LlamaIndex Documents, one Document per row.
+	Document IDs are stable ("<nct_id>#<rowid>"), so the same row always replaces its previous version.
+	Returns a dictionary of nct_id -> list of Documents.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	in_nct_ids - nct_id values to load.
+	"""
+	var_documents: Dict[str, List] = {}
+	var_connection = sqlite3.connect("file:%s?mode=ro" % (in_sqlite_path), uri=True)
+	try:
+		for var_start in range(0, len(in_nct_ids), 500):
+			var_chunk = in_nct_ids[var_start:var_start + 500]
+			with func_datasdr_stage("sqlite_query"):
+				var_rows = var_connection.execute(
+					'SELECT rowid, %s FROM "%s" WHERE nct_id IN (%s) ORDER BY nct_id ASC, rowid ASC' % (", ".join(CT_TRIALS_COLUMNS), in_sponsor, ",".join("?" * len(var_chunk))),
+					var_chunk,
+				).fetchall()
+			func_datasdr_count("sqlite_rows", len(var_rows))
+			with func_datasdr_stage("documents"):
+				for one_row in var_rows:
+					var_documents.setdefault(one_row[1], []).append(func_datasdr_row_to_document(one_row[0], one_row[1:]))
+			func_datasdr_count("documents", len(var_rows))
+	finally:
+		var_connection.close()
+	return var_documents
+#
+#
+def func_datasdr_has_nct_id_index(in_sqlite_path: str, in_sponsor: str) -> int:
+	"""
+	This function returns 1 if the sponsor table has an index that starts with nct_id. The file is opened read-only.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	"""
+	var_connection = sqlite3.connect("file:%s?mode=ro" % (in_sqlite_path), uri=True)
+	try:
+		for one_index in var_connection.execute('PRAGMA index_list("%s")' % (in_sponsor)).fetchall():
+			var_columns = var_connection.execute('PRAGMA index_info("%s")' % (one_index[1])).fetchall()
+			if var_columns and var_columns[0][2] == "nct_id":
+				return 1
+	finally:
+		var_connection.close()
+	return 0
+#
+#
+def func_datasdr_ensure_nct_id_index(in_sqlite_path: str, in_sponsor: str) -> int:
+	"""
+	This function creates an index on nct_id, so each page of func_datasdr_iter_sponsor_rows() is a short index range scan.
+	It writes to the SQLite3 file of the sponsor: only call it when the user asked for it.
+	Returns 0 if the file is read-only and the index could not be created.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	"""
+	try:
+		var_connection = sqlite3.connect(in_sqlite_path)
+		try:
+			var_connection.execute('CREATE INDEX IF NOT EXISTS "ix_%s_nct_id" ON "%s" (nct_id)' % (in_sponsor, in_sponsor))
+			var_connection.commit()
+		finally:
+			var_connection.close()
+	except sqlite3.OperationalError:
+		return 0
+	return 1
+#
+#
+def func_datasdr_iter_sponsor_rows(in_sqlite_path: str, in_sponsor: str, in_batch_size: int = CT_STREAM_BATCH_SIZE, in_limit_records: Optional[int] = None) -> Iterator[List]:
+	"""
+	This generator pages through a sponsor table with a (nct_id, rowid) keyset and yields lists of at most in_batch_size rows.
+	Each row is (rowid, <values of CT_TRIALS_COLUMNS>). Only one page is held in memory at a time, whatever the table size.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	in_batch_size: int - Rows per page.
+	in_limit_records: int - Optional maximum number of rows, as CT_LIMIT_RECORDS. None = whole table.
+	"""
+	var_query = 'SELECT rowid, %s FROM "%s" WHERE (nct_id, rowid) > (?, ?) ORDER BY nct_id ASC, rowid ASC LIMIT ?' % (", ".join(CT_TRIALS_COLUMNS), in_sponsor)
+	var_connection = sqlite3.connect("file:%s?mode=ro" % (in_sqlite_path), uri=True)
+	try:
+		# Tutorial: "" sorts before every nct_id, so the first page starts at the beginning of the table.
+		var_last_key = ("", -1)
+		var_remaining = in_limit_records
+		while var_remaining is None or var_remaining > 0:
+			var_page_size = in_batch_size if var_remaining is None else min(in_batch_size, var_remaining)
+			with func_datasdr_stage("sqlite_query"):
+				var_rows = var_connection.execute(var_query, (var_last_key[0], var_last_key[1], var_page_size)).fetchall()
+			func_datasdr_count("sqlite_rows", len(var_rows))
+			if not var_rows:
+				break
+			yield var_rows
+			var_last_key = (var_rows[-1][1], var_rows[-1][0])
+			if var_remaining is not None:
+				var_remaining -= len(var_rows)
+	finally:
+		var_connection.close()
+#
+#
+def func_datasdr_load_sponsor_documents(in_sqlite_path: str, in_sponsor: str, in_limit_records: Optional[int] = None) -> List:
+	"""
+	This function loads the first rows of a sponsor table as Documents, one per row, with the row mapping of CT_ROW_MAPPING.
+	Selects the same rows as func_datasdr_sponsor_query(), which DatabaseReader used.
+
+	in_sqlite_path: str - SQLite3 file of the sponsor.
+	in_sponsor: str - Sponsor name. It is also the table name.
+	in_limit_records: int - Maximum number of rows, as CT_LIMIT_RECORDS. None = whole table.
+	"""
+	var_documents = []
+	for one_page in func_datasdr_iter_sponsor_rows(in_sqlite_path, in_sponsor, in_limit_records=in_limit_records):
+		with func_datasdr_stage("documents", sponsor=in_sponsor):
+			var_documents.extend([func_datasdr_row_to_document(one_row[0], one_row[1:]) for one_row in one_page])
+		func_datasdr_count("documents", len(one_page))
+	return var_documents
+#
+#
+def func_datasdr_embedded_tokens(in_documents) -> Dict[str, float]:
+	"""
+	This function counts the tokens embedded and the tokens sent to the LLM for a list of Documents, before chunking.
+	Returns "documents", "embed_tokens", "llm_tokens" and their per-document means.
+
+	in_documents - LlamaIndex Documents.
+	"""
+	from llama_index.core.schema import MetadataMode
+	from llama_index.core.utils import get_tokenizer
+	#
+	var_tokenizer = get_tokenizer()
+	var_counts = {"documents": len(in_documents), "embed_tokens": 0, "llm_tokens": 0}
+	for one_document in in_documents:
+		var_counts["embed_tokens"] += len(var_tokenizer(one_document.get_content(metadata_mode=MetadataMode.EMBED)))
+		var_counts["llm_tokens"] += len(var_tokenizer(one_document.get_content(metadata_mode=MetadataMode.LLM)))
+	var_counts["embed_tokens_per_document"] = var_counts["embed_tokens"] / max(1, len(in_documents))
+	var_counts["llm_tokens_per_document"] = var_counts["llm_tokens"] / max(1, len(in_documents))
+	return var_counts
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_sqlite.py <SQLite3 directory> <sponsor> [<rows>]
+	var_sqlite_path = func_datasdr_sponsor_sqlite_path(sys.argv[1], sys.argv[2])
+	var_rows = [one_row for one_page in func_datasdr_iter_sponsor_rows(var_sqlite_path, sys.argv[2], in_limit_records=int(sys.argv[3]) if len(sys.argv) > 3 else None) for one_row in one_page]
+	var_trials = len(set([one_row[1] for one_row in var_rows]))
+	print("%s: %d rows, %d trials" % (sys.argv[2], len(var_rows), var_trials))
+	print("%-8s %16s %16s %16s" % ("mapping", "embed tokens", "per trial", "LLM per trial"))
+	for one_mapping in ("flat", "schema"):
+		var_counts = func_datasdr_embedded_tokens([func_datasdr_row_to_document(one_row[0], one_row[1:], one_mapping) for one_row in var_rows])
+		print("%-8s %16d %16.1f %16.1f" % (one_mapping, var_counts["embed_tokens"], var_counts["embed_tokens"] / max(1, var_trials), var_counts["llm_tokens"] / max(1, var_trials)))
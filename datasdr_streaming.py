@@ -0,0 +1,147 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_streaming.py
+# Purpose: Stream answers token by token, and report time-to-first-token and tokens/sec for every question.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+query_engine.query(..) returns only when the LLM has finished. With 70B models ("llama3:70b") that is
+minutes of silence before anything is printed.
+
+With a streaming query engine ( index.as_query_engine(streaming=True) ) Ollama's tokens are printed as they
+are generated, and every answer is measured:
+* "ttft_seconds": time-to-first-token, from the question (retrieval included) to the first token.
+* "tokens" and "tokens_per_second": generation speed after the first token.
+  Ollama streams one token per chunk, so chunks are counted as tokens.
+* "seconds": total time.
+
+Usage:
+	from datasdr_streaming import func_datasdr_print_answer, func_datasdr_stream_query
+	query_engine = index.as_query_engine(streaming=True)
+	var_stats = func_datasdr_print_answer(query_engine, "Describe the protocol about Thrombosis?")
+	print(var_stats["ttft_seconds"], var_stats["tokens_per_second"])
+
+	# Tutorial: or handle every token yourself:
+	var_stats = func_datasdr_stream_query(query_engine, "Describe the protocol about Thrombosis?", in_on_token=my_function)
+
+	python3 datasdr_streaming.py /Users/server/Downloads/test/_index "Describe the protocol about Thrombosis?" llama3
+"""
+
+import sys
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+from llama_index.core.base.response.schema import StreamingResponse
+
+
+def func_datasdr_stream_tokens(in_response, in_stats: Dict, in_start: Optional[float] = None) -> Iterator[str]:
+	"""
+	This function yields the tokens of a response as the LLM generates them, and fills in_stats while doing so.
+	A complete (non-streaming) response, e.g. a cached answer, is yielded as a single chunk.
+
+	in_response - Response or StreamingResponse from query_engine.query().
+	in_stats - Dictionary filled with "answer", "streamed", "ttft_seconds", "tokens", "tokens_per_second" and "seconds".
+	in_start: float - time.time() when the question was asked. None = now.
+	"""
+	var_start = time.time() if in_start is None else in_start
+	var_first = None
+	var_last = var_start
+	var_parts = []
+	in_stats.update({"answer": "", "streamed": isinstance(in_response, StreamingResponse), "ttft_seconds": None, "tokens": 0, "tokens_per_second": 0.0})
+	#
+	if isinstance(in_response, StreamingResponse):
+		var_generator = in_response.response_gen
+	else:
+		var_generator = iter([str(in_response)])
+	for one_token in var_generator:
+		var_last = time.time()
+		if var_first is None:
+			var_first = var_last
+			in_stats["ttft_seconds"] = var_first - var_start
+		var_parts.append(one_token)
+		in_stats["tokens"] += 1
+		yield one_token
+	#
+	in_stats["answer"] = "".join(var_parts)
+	in_stats["seconds"] = time.time() - var_start
+	# Tutorial: the first token is excluded: its wait is already reported as time-to-first-token.
+	if in_stats["tokens"] > 1 and var_last > var_first:
+		in_stats["tokens_per_second"] = (in_stats["tokens"] - 1) / (var_last - var_first)
+	if isinstance(in_response, StreamingResponse):
+		# Tutorial: the generator is consumed; keep the text so str(response) still works.
+		in_response.response_txt = in_stats["answer"]
+#
+#
+def func_datasdr_stream_query(in_query_engine, in_question: str, in_on_token: Optional[Callable[[str], None]] = None) -> Dict:
+	"""
+	This function asks one question and passes every token to in_on_token as soon as it arrives.
+	Returns the statistics of func_datasdr_stream_tokens(), plus "response" (the response object).
+
+	in_query_engine - Query engine, created with streaming=True.
+	in_question: str - Question in plain English.
+	in_on_token - Function called with every token. None = tokens are only collected.
+	"""
+	var_start = time.time()
+	var_response = in_query_engine.query(in_question)
+	var_stats: Dict = {"response": var_response}
+	for one_token in func_datasdr_stream_tokens(var_response, var_stats, var_start):
+		if in_on_token is not None:
+			in_on_token(one_token)
+	return var_stats
+#
+#
+def func_datasdr_stats_line(in_stats: Dict) -> str:
+	"""
+	This function returns a one-line summary of the latency of an answer.
+
+	in_stats - Statistics from func_datasdr_stream_query().
+	"""
+	if in_stats["ttft_seconds"] is None:
+		return "[No answer after %.2f seconds]" % (in_stats["seconds"])
+	return "[First token after %.2f seconds, %d tokens, %.1f tokens/sec, %.2f seconds in total]" % (
+		in_stats["ttft_seconds"], in_stats["tokens"], in_stats["tokens_per_second"], in_stats["seconds"],
+	)
+#
+#
+def func_datasdr_print_response(in_response, in_start: Optional[float] = None, in_show_stats: int = 1) -> Dict:
+	"""
+	This function prints a response as it is generated, then (for streamed answers) its latency summary.
+	Returns the statistics of func_datasdr_stream_tokens().
+
+	in_response - Response or StreamingResponse.
+	in_start: float - time.time() when the question was asked. None = now.
+	in_show_stats: int - 1 = print the time-to-first-token and tokens/sec after streamed answers.
+	"""
+	var_stats: Dict = {"response": in_response}
+	for one_token in func_datasdr_stream_tokens(in_response, var_stats, in_start):
+		sys.stdout.write(one_token)
+		sys.stdout.flush()
+	print("\n")
+	if in_show_stats and var_stats["streamed"]:
+		print(func_datasdr_stats_line(var_stats), "\n")
+	return var_stats
+#
+#
+def func_datasdr_print_answer(in_query_engine, in_question: str, in_show_stats: int = 1) -> Dict:
+	"""
+	This function asks one question and prints the answer token by token.
+	Works with non-streaming query engines too: the answer is then printed when complete.
+	Returns the statistics of func_datasdr_stream_tokens(), plus "response".
+
+	in_query_engine - Query engine, preferably created with streaming=True.
+	in_question: str - Question in plain English.
+	in_show_stats: int - 1 = print the time-to-first-token and tokens/sec after the answer.
+	"""
+	var_start = time.time()
+	return func_datasdr_print_response(in_query_engine.query(in_question), var_start, in_show_stats)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_streaming.py <index directory> "<question>" [<model name>]
+	from llama_index.core import Settings
+	from llama_index.llms.ollama import Ollama
+	from datasdr_embeddings import DataSDROllamaEmbedding
+	from datasdr_vector_store import func_datasdr_load_index
+	#
+	Settings.embed_model = DataSDROllamaEmbedding(model_name="nomic-embed-text")
+	Settings.llm = Ollama(model=sys.argv[3] if len(sys.argv) > 3 else "llama3", request_timeout=360.0)
+	func_datasdr_print_answer(func_datasdr_load_index(sys.argv[1]).as_query_engine(streaming=True), sys.argv[2])
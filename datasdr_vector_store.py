@@ -0,0 +1,540 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_vector_store.py
+# Purpose: Binary, memory-mapped vector store to replace the JSON "default__vector_store.json" file.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+The default LlamaIndex vector store saves every embedding as a list of Python floats inside
+"default__vector_store.json". Loading an index means parsing the whole JSON file, which is slow
+and uses a lot of RAM once the corpus grows.
+
+This file stores the embeddings as one contiguous float32 (or float16) matrix in a NumPy ".npy"
+file. The matrix is opened with mmap, so only the pages touched by a query are read from disk,
+and similarity scoring is done with NumPy.
+
+Files written next to the other index files:
+	default__vector_store.npy        - N x D matrix of embeddings.
+	default__vector_store.ids.json   - node IDs, ref_doc IDs and metadata, in matrix row order, plus the row count
+	                                   and a checksum of the matrix. A matrix and sidecar from different writes are refused.
+
+Usage:
+	# Tutorial: convert an existing index directory once.
+	python3 datasdr_vector_store.py /Users/server/Downloads/test/_index
+
+	# Tutorial: then load it from your own code.
+	from datasdr_vector_store import func_datasdr_load_index
+	index = func_datasdr_load_index("/Users/server/Downloads/test/_index")
+"""
+
+import json
+import os
+import sys
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+import fsspec
+import numpy as np
+#
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+	BasePydanticVectorStore,
+	VectorStoreQuery,
+	VectorStoreQueryMode,
+	VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+from datasdr_metadata_index import DataSDRMetadataIndex
+from datasdr_metrics import func_datasdr_stage
+
+# Tutorial: "float32" keeps full precision. "float16" halves the size on disk and in the page cache.
+CT_VECTOR_DTYPE = "float32"
+#
+# Tutorial: file name suffixes used next to the original JSON file name.
+CT_MATRIX_SUFFIX = ".npy"
+CT_IDS_SUFFIX = ".ids.json"
+#
+# Tutorial: LlamaIndex names the default vector store file "<namespace>__vector_store.json".
+CT_DEFAULT_BASENAME = "default__vector_store"
+CT_DEFAULT_JSON_FNAME = CT_DEFAULT_BASENAME + ".json"
+
+
+def func_datasdr_vector_store_base(in_persist_path: str) -> str:
+	"""
+	This function returns the path of a vector store file without its ".json" extension.
+
+	in_persist_path: str - Path LlamaIndex uses for the JSON vector store, or a path without extension.
+	"""
+	if in_persist_path.endswith(".json"):
+		return in_persist_path[: -len(".json")]
+	return in_persist_path
+#
+#
+def func_datasdr_write_atomic(in_path: str, in_writer) -> None:
+	"""
+	This function writes a file through a temporary file and renames it into place.
+	Readers never see a half-written file.
+
+	in_path: str - Final file name.
+	in_writer - Function that receives an open binary file object.
+	"""
+	var_tmp_path = "%s.tmp-%d" % (in_path, os.getpid())
+	with open(var_tmp_path, "wb") as f:
+		in_writer(f)
+	os.replace(var_tmp_path, in_path)
+#
+#
+def func_datasdr_matrix_checksum(in_rows: int, in_get_row: Callable[[int], np.ndarray]) -> int:
+	"""
+	This function returns the CRC-32 of the first, middle and last rows of a matrix. Stored in the ".ids.json" sidecar,
+	it tells a matrix from another one of the same size without reading the whole file.
+
+	in_rows: int - Rows in the matrix.
+	in_get_row - Function that returns one row of the matrix, by row number.
+	"""
+	var_crc = 0
+	for one_row in sorted(set([0, in_rows // 2, in_rows - 1])) if in_rows else []:
+		var_crc = zlib.crc32(np.ascontiguousarray(in_get_row(one_row)).tobytes(), var_crc)
+	return var_crc
+#
+#
+class DataSDRMmapVectorStore(BasePydanticVectorStore):
+	"""
+	Vector store that keeps embeddings in a memory-mapped NumPy matrix.
+
+	Like the default SimpleVectorStore, it does not store node text: the text stays in the docstore.
+	"""
+
+	stores_text: bool = False
+	dtype: str = CT_VECTOR_DTYPE
+
+	_matrix: Optional[np.ndarray] = PrivateAttr(default=None)
+	_norms: Optional[np.ndarray] = PrivateAttr(default=None)
+	_alive: Optional[np.ndarray] = PrivateAttr(default=None)
+	_ids: List[str] = PrivateAttr(default_factory=list)
+	_ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+	_metadata: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+	_row_by_id: Dict[str, int] = PrivateAttr(default_factory=dict)
+	_pending: List[np.ndarray] = PrivateAttr(default_factory=list)
+	_rows_by_ref: Optional[Dict[str, List[int]]] = PrivateAttr(default=None)
+	_metadata_index: Optional[DataSDRMetadataIndex] = PrivateAttr(default=None)
+
+	def __init__(self, dtype: str = CT_VECTOR_DTYPE, **kwargs: Any) -> None:
+		super().__init__(dtype=dtype, **kwargs)
+		self._alive = np.zeros(0, dtype=bool)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "DataSDRMmapVectorStore"
+
+	@property
+	def client(self) -> Any:
+		return None
+
+	# - - - - -
+	# Loading.
+	@classmethod
+	def from_persist_path(cls, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> "DataSDRMmapVectorStore":
+		"""
+		This function opens a persisted ".npy" matrix with mmap, plus its ".ids.json" sidecar.
+
+		persist_path: str - Path of the JSON vector store file, with or without ".json".
+		"""
+		var_base = func_datasdr_vector_store_base(persist_path)
+		with open(var_base + CT_IDS_SUFFIX, "r") as f:
+			var_sidecar = json.load(f)
+		#
+		var_store = cls(dtype=var_sidecar.get("dtype", CT_VECTOR_DTYPE))
+		var_store._matrix = np.load(var_base + CT_MATRIX_SUFFIX, mmap_mode="r")
+		# Tutorial: the matrix and the sidecar are two files; a crash between their writes leaves them out of step.
+		var_rows = var_store._matrix.shape[0]
+		if var_rows != len(var_sidecar["ids"]) or var_rows != var_sidecar.get("rows", var_rows) or (
+			"checksum" in var_sidecar and var_sidecar["checksum"] != func_datasdr_matrix_checksum(var_rows, lambda i: var_store._matrix[i])
+		):
+			raise ValueError("Vector store [%s] is incomplete: the matrix has %d rows and does not match its %s file (%d node IDs). Build or refresh the index again." % (
+				var_base, var_rows, CT_IDS_SUFFIX, len(var_sidecar["ids"]),
+			))
+		var_store._ids = var_sidecar["ids"]
+		var_store._ref_doc_ids = var_sidecar["ref_doc_ids"]
+		var_store._metadata = var_sidecar.get("metadata") or [{} for _ in var_store._ids]
+		var_store._row_by_id = {one_id: i for i, one_id in enumerate(var_store._ids)}
+		var_store._alive = np.ones(len(var_store._ids), dtype=bool)
+		return var_store
+
+	@classmethod
+	def from_persist_dir(cls, persist_dir: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> "DataSDRMmapVectorStore":
+		"""
+		This function opens the default vector store of an index directory.
+
+		persist_dir: str - Index directory.
+		"""
+		return cls.from_persist_path(os.path.join(persist_dir, CT_DEFAULT_BASENAME), fs=fs)
+
+	@classmethod
+	def from_json_dict(cls, in_json_dict: Dict[str, Any], dtype: str = CT_VECTOR_DTYPE) -> "DataSDRMmapVectorStore":
+		"""
+		This function builds an in-memory store from the contents of a "default__vector_store.json" file.
+
+		in_json_dict - Parsed JSON file.
+		dtype: str - "float32" or "float16".
+		"""
+		var_store = cls(dtype=dtype)
+		var_embeddings = in_json_dict.get("embedding_dict", {})
+		var_ref_docs = in_json_dict.get("text_id_to_ref_doc_id", {})
+		var_metadata = in_json_dict.get("metadata_dict") or {}
+		#
+		var_store._ids = list(var_embeddings.keys())
+		var_store._ref_doc_ids = [var_ref_docs.get(one_id, "None") for one_id in var_store._ids]
+		var_store._metadata = [var_metadata.get(one_id, {}) for one_id in var_store._ids]
+		var_store._row_by_id = {one_id: i for i, one_id in enumerate(var_store._ids)}
+		if var_store._ids:
+			var_store._matrix = np.asarray([var_embeddings[one_id] for one_id in var_store._ids], dtype=dtype)
+		var_store._alive = np.ones(len(var_store._ids), dtype=bool)
+		return var_store
+
+	# - - - - -
+	# Internal helpers.
+	def _func_flush_pending(self) -> None:
+		"""
+		This function appends embeddings added since the last query to the matrix.
+		The mmap is replaced by an in-memory copy while the index is being written to.
+		"""
+		if not self._pending:
+			return
+		var_new = np.stack(self._pending)
+		if self._matrix is None or len(self._matrix) == 0:
+			self._matrix = var_new
+		else:
+			self._matrix = np.concatenate([np.asarray(self._matrix), var_new])
+		self._alive = np.concatenate([self._alive, np.ones(len(var_new), dtype=bool)])
+		self._pending = []
+		self._norms = None
+
+	def _func_norms(self) -> np.ndarray:
+		"""
+		This function returns the L2 norm of every row. Norms are computed once and kept in memory.
+		"""
+		if self._norms is None:
+			var_norms = np.empty(len(self._matrix), dtype=np.float32)
+			# Tutorial: work in blocks so a float16 matrix is never fully converted to float32 in RAM.
+			for var_start in range(0, len(self._matrix), 65536):
+				var_block = np.asarray(self._matrix[var_start:var_start + 65536], dtype=np.float32)
+				var_norms[var_start:var_start + len(var_block)] = np.linalg.norm(var_block, axis=1)
+			var_norms[var_norms == 0] = 1.0
+			self._norms = var_norms
+		return self._norms
+
+	def func_metadata_index(self) -> DataSDRMetadataIndex:
+		"""
+		This function returns the inverted index over the metadata of every row. It is rebuilt after nodes are added.
+		"""
+		if self._metadata_index is None or self._metadata_index.rows != len(self._metadata):
+			self._metadata_index = DataSDRMetadataIndex(self._metadata)
+		return self._metadata_index
+
+	def func_candidate_rows(self, query: VectorStoreQuery) -> np.ndarray:
+		"""
+		This function returns the matrix rows a query is allowed to score.
+
+		query: VectorStoreQuery - Query from the retriever.
+		"""
+		var_mask = self._alive.copy()
+		if query.node_ids is not None:
+			var_id_mask = np.zeros(len(self._ids), dtype=bool)
+			var_rows = [self._row_by_id[one_id] for one_id in query.node_ids if one_id in self._row_by_id]
+			var_id_mask[var_rows] = True
+			var_mask &= var_id_mask
+		if query.doc_ids is not None:
+			var_doc_ids = set(query.doc_ids)
+			var_mask &= np.fromiter((one_ref in var_doc_ids for one_ref in self._ref_doc_ids), dtype=bool, count=len(self._ids))
+		if query.filters is not None:
+			# Tutorial: filters are bitmaps from the inverted index; rows outside them are never scored.
+			var_mask &= self.func_metadata_index().func_mask(query.filters)
+		return np.flatnonzero(var_mask)
+
+	def func_score_rows(self, in_query_embedding: List[float], in_rows: np.ndarray) -> np.ndarray:
+		"""
+		This function returns the cosine similarity between the query and the given matrix rows.
+
+		in_query_embedding - Query embedding.
+		in_rows: np.ndarray - Row numbers to score.
+		"""
+		var_query = np.asarray(in_query_embedding, dtype=np.float32)
+		var_query_norm = np.linalg.norm(var_query) or 1.0
+		if len(in_rows) == len(self._matrix):
+			var_vectors = self._matrix
+		else:
+			var_vectors = self._matrix[in_rows]
+		var_scores = np.asarray(var_vectors @ var_query.astype(var_vectors.dtype), dtype=np.float32)
+		return var_scores / (self._func_norms()[in_rows] * var_query_norm)
+
+	# - - - - -
+	# LlamaIndex vector store protocol.
+	def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+		"""Add nodes to the store."""
+		for one_node in nodes:
+			if one_node.node_id in self._row_by_id:
+				# Tutorial: re-adding a node replaces it; the old row is hidden and dropped on persist.
+				if self._row_by_id[one_node.node_id] >= len(self._alive):
+					self._func_flush_pending()
+				self._alive[self._row_by_id[one_node.node_id]] = False
+			var_metadata = node_to_metadata_dict(one_node, remove_text=True, flat_metadata=False)
+			var_metadata.pop("_node_content", None)
+			self._row_by_id[one_node.node_id] = len(self._ids)
+			self._ids.append(one_node.node_id)
+			self._ref_doc_ids.append(one_node.ref_doc_id or "None")
+			self._metadata.append(var_metadata)
+			# Tutorial: keep pending rows as compact NumPy arrays, not lists of Python floats.
+			self._pending.append(np.asarray(one_node.get_embedding(), dtype=self.dtype))
+		self._rows_by_ref = None
+		return [one_node.node_id for one_node in nodes]
+
+	def get(self, text_id: str) -> List[float]:
+		"""Get the embedding of one node."""
+		self._func_flush_pending()
+		return np.asarray(self._matrix[self._row_by_id[text_id]], dtype=np.float32).tolist()
+
+	def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+		"""Delete every node that belongs to ref_doc_id."""
+		self._func_flush_pending()
+		if self._rows_by_ref is None:
+			self._rows_by_ref = {}
+			for i, one_ref in enumerate(self._ref_doc_ids):
+				self._rows_by_ref.setdefault(one_ref, []).append(i)
+		for i in self._rows_by_ref.pop(ref_doc_id, []):
+			self._alive[i] = False
+			if self._row_by_id.get(self._ids[i]) == i:
+				self._row_by_id.pop(self._ids[i])
+
+	def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Any = None, **delete_kwargs: Any) -> None:
+		"""Delete nodes by ID."""
+		self._func_flush_pending()
+		for one_id in node_ids or []:
+			var_row = self._row_by_id.pop(one_id, None)
+			if var_row is not None:
+				self._alive[var_row] = False
+
+	def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+		"""Return the top-k most similar nodes."""
+		if query.mode != VectorStoreQueryMode.DEFAULT:
+			raise ValueError("DataSDRMmapVectorStore only supports the default query mode, not [%s]" % (query.mode))
+		self._func_flush_pending()
+		if self._matrix is None or len(self._ids) == 0:
+			return VectorStoreQueryResult(similarities=[], ids=[])
+		#
+		var_rows = self.func_candidate_rows(query)
+		if len(var_rows) == 0:
+			return VectorStoreQueryResult(similarities=[], ids=[])
+		return self.func_top_k(query.query_embedding, var_rows, query.similarity_top_k)
+
+	def func_top_k(self, in_query_embedding: List[float], in_rows: np.ndarray, in_top_k: int) -> VectorStoreQueryResult:
+		"""
+		This function scores the given rows and returns the in_top_k best ones, best first.
+
+		in_query_embedding - Query embedding.
+		in_rows: np.ndarray - Row numbers to score.
+		in_top_k: int - Number of results.
+		"""
+		var_scores = self.func_score_rows(in_query_embedding, in_rows)
+		#
+		var_top_k = min(in_top_k, len(in_rows))
+		var_top = np.argpartition(-var_scores, var_top_k - 1)[:var_top_k]
+		var_top = var_top[np.argsort(-var_scores[var_top])]
+		return VectorStoreQueryResult(
+			similarities=[float(var_scores[i]) for i in var_top],
+			ids=[self._ids[in_rows[i]] for i in var_top],
+		)
+
+	def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+		"""
+		Write the ".npy" matrix and ".ids.json" sidecar. Deleted rows are dropped.
+		persist_path is the JSON path LlamaIndex passes in; only its base name is used.
+		"""
+		self._func_flush_pending()
+		var_base = func_datasdr_vector_store_base(persist_path)
+		os.makedirs(os.path.dirname(var_base) or ".", exist_ok=True)
+		#
+		var_rows = np.flatnonzero(self._alive) if self._alive is not None else np.zeros(0, dtype=np.int64)
+		if self._matrix is None or len(var_rows) == 0:
+			var_matrix = np.zeros((0, 0), dtype=self.dtype)
+		else:
+			var_matrix = np.ascontiguousarray(self._matrix[var_rows], dtype=self.dtype)
+		var_sidecar = {
+			"dtype": self.dtype,
+			"rows": len(var_matrix),
+			"checksum": func_datasdr_matrix_checksum(len(var_matrix), lambda i: var_matrix[i]),
+			"ids": [self._ids[i] for i in var_rows],
+			"ref_doc_ids": [self._ref_doc_ids[i] for i in var_rows],
+			"metadata": [self._metadata[i] for i in var_rows],
+		}
+		# Tutorial: the matrix goes first; the sidecar is the "commit" that makes it visible.
+		func_datasdr_write_atomic(var_base + CT_MATRIX_SUFFIX, lambda f: np.save(f, var_matrix))
+		func_datasdr_write_atomic(var_base + CT_IDS_SUFFIX, lambda f: f.write(json.dumps(var_sidecar).encode("utf-8")))
+#
+#
+class DataSDRSpooledVectorStore(DataSDRMmapVectorStore):
+	"""
+	Write-only vector store for builds larger than RAM (func_datasdr_build_sponsor_index_streaming()).
+	Embeddings are appended to a spool file as soon as they are added; persist() copies the spool into the ".npy"
+	matrix block by block and removes it, so persist it once. Only node IDs and metadata stay in memory.
+	Load the persisted index with func_datasdr_load_index() to query it.
+	"""
+
+	spool_path: str = ""
+
+	_spooled_rows: int = PrivateAttr(default=0)
+	_dimensions: int = PrivateAttr(default=0)
+
+	@classmethod
+	def class_name(cls) -> str:
+		return "DataSDRSpooledVectorStore"
+
+	def _func_flush_pending(self) -> None:
+		"""
+		This function appends the embeddings added since the last call to the spool file.
+		"""
+		if not self._pending:
+			return
+		var_new = np.stack(self._pending)
+		self._dimensions = var_new.shape[1]
+		with open(self.spool_path, "ab") as f:
+			f.write(np.ascontiguousarray(var_new, dtype=self.dtype).tobytes())
+		self._spooled_rows += len(var_new)
+		self._alive = np.concatenate([self._alive, np.ones(len(var_new), dtype=bool)])
+		self._pending = []
+
+	def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+		"""Add nodes to the store; their embeddings go straight to the spool file."""
+		var_ids = super().add(nodes, **add_kwargs)
+		self._func_flush_pending()
+		return var_ids
+
+	def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+		raise NotImplementedError("DataSDRSpooledVectorStore is write-only; persist it and load the index with func_datasdr_load_index()")
+
+	def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+		"""
+		Write the ".npy" matrix from the spool file, 65536 rows at a time, and the ".ids.json" sidecar. Deleted rows are dropped.
+		"""
+		self._func_flush_pending()
+		var_base = func_datasdr_vector_store_base(persist_path)
+		os.makedirs(os.path.dirname(var_base) or ".", exist_ok=True)
+		#
+		var_rows = np.flatnonzero(self._alive)
+		var_spool = None
+		if self._spooled_rows:
+			var_spool = np.memmap(self.spool_path, dtype=self.dtype, mode="r", shape=(self._spooled_rows, self._dimensions))
+		var_shape = (len(var_rows), self._dimensions) if var_spool is not None else (0, 0)
+		#
+		def func_write_matrix(f) -> None:
+			np.lib.format.write_array_header_1_0(f, {"descr": np.lib.format.dtype_to_descr(np.dtype(self.dtype)), "fortran_order": False, "shape": var_shape})
+			for var_start in range(0, len(var_rows) if var_spool is not None else 0, 65536):
+				f.write(np.ascontiguousarray(var_spool[var_rows[var_start:var_start + 65536]]).tobytes())
+		#
+		var_sidecar = {
+			"dtype": self.dtype,
+			"rows": var_shape[0],
+			"checksum": func_datasdr_matrix_checksum(var_shape[0], lambda i: var_spool[var_rows[i]]),
+			"ids": [self._ids[i] for i in var_rows],
+			"ref_doc_ids": [self._ref_doc_ids[i] for i in var_rows],
+			"metadata": [self._metadata[i] for i in var_rows],
+		}
+		# Tutorial: the matrix goes first; the sidecar is the "commit" that makes it visible.
+		func_datasdr_write_atomic(var_base + CT_MATRIX_SUFFIX, func_write_matrix)
+		func_datasdr_write_atomic(var_base + CT_IDS_SUFFIX, lambda f: f.write(json.dumps(var_sidecar).encode("utf-8")))
+		del var_spool
+		if os.path.exists(self.spool_path):
+			os.remove(self.spool_path)
+#
+#
+def func_datasdr_has_mmap_store(in_index_directory: str) -> int:
+	"""
+	This function returns 1 if an index directory contains a binary vector store.
+
+	in_index_directory: str - Index directory.
+	"""
+	var_base = os.path.join(in_index_directory, CT_DEFAULT_BASENAME)
+	if os.path.exists(var_base + CT_MATRIX_SUFFIX) and os.path.exists(var_base + CT_IDS_SUFFIX):
+		return 1
+	return 0
+#
+#
+def func_datasdr_convert_index_directory(in_index_directory: str, in_dtype: str = CT_VECTOR_DTYPE, in_remove_json: bool = False) -> int:
+	"""
+	This function converts the "default__vector_store.json" of an existing "_index" directory to the binary format.
+
+	in_index_directory: str - Index directory created by "storage_context.persist(..)".
+	in_dtype: str - "float32" or "float16".
+	in_remove_json: bool - Delete the JSON file after a successful conversion.
+	"""
+	var_json_path = os.path.join(in_index_directory, CT_DEFAULT_JSON_FNAME)
+	if not os.path.exists(var_json_path):
+		print("No [%s] found in [%s]" % (CT_DEFAULT_JSON_FNAME, in_index_directory))
+		return 0
+	#
+	with open(var_json_path, "r") as f:
+		var_store = DataSDRMmapVectorStore.from_json_dict(json.load(f), dtype=in_dtype)
+	var_store.persist(var_json_path)
+	#
+	var_json_size = os.path.getsize(var_json_path)
+	var_npy_size = os.path.getsize(os.path.join(in_index_directory, CT_DEFAULT_BASENAME + CT_MATRIX_SUFFIX))
+	print("Converted [%s]: %d vectors, %d bytes JSON -> %d bytes %s" % (in_index_directory, len(var_store._ids), var_json_size, var_npy_size, in_dtype))
+	#
+	if in_remove_json:
+		os.remove(var_json_path)
+	return 1
+#
+#
+def func_datasdr_load_index(in_index_directory: str, in_namespace: Optional[str] = None, in_docstore=None, **in_kwargs):
+	"""
+	This function loads an index, using the binary vector store when the directory has one.
+	Otherwise it falls back to the standard JSON files.
+
+	in_index_directory: str - Index directory, or a ZIP file with a persisted index (read in place).
+	in_namespace: str - Vector store written by datasdr_reembed.py, e.g. "mxbai_embed_large". None = the vector store the index was built with.
+	in_docstore - Docstore already opened, e.g. a copy being refreshed. None = the docstore of the directory.
+	"""
+	from llama_index.core import StorageContext, load_index_from_storage
+	#
+	if in_index_directory.lower().endswith(".zip") and os.path.isfile(in_index_directory):
+		if in_namespace:
+			raise ValueError("Vector store namespaces are only supported for index directories, not ZIP files: [%s]" % (in_index_directory))
+		from datasdr_zip import func_datasdr_load_index_from_zip
+		with func_datasdr_stage("index_load"):
+			return func_datasdr_load_index_from_zip(in_index_directory, **in_kwargs)
+	with func_datasdr_stage("index_load"):
+		var_docstore = in_docstore
+		# Tutorial: directories with a "docstore.sqlite3" (see datasdr_docstore.py) read their nodes lazily.
+		from datasdr_docstore import DataSDRSQLiteDocumentStore, func_datasdr_has_sqlite_docstore
+		if var_docstore is None and func_datasdr_has_sqlite_docstore(in_index_directory):
+			var_docstore = DataSDRSQLiteDocumentStore.from_persist_dir(in_index_directory)
+		if in_namespace:
+			from datasdr_reembed import func_datasdr_load_namespace_index
+			return func_datasdr_load_namespace_index(in_index_directory, in_namespace, var_docstore, **in_kwargs)
+		if func_datasdr_has_mmap_store(in_index_directory):
+			var_store_class = DataSDRMmapVectorStore
+			# Tutorial: directories with an IVF file (see datasdr_ann.py) get approximate nearest-neighbour search.
+			from datasdr_ann import CT_IVF_SUFFIX, DataSDRIVFVectorStore
+			if os.path.exists(os.path.join(in_index_directory, CT_DEFAULT_BASENAME + CT_IVF_SUFFIX)):
+				var_store_class = DataSDRIVFVectorStore
+			# Tutorial: directories with an int8 file (see datasdr_quantize.py) search int8 codes, then re-rank exactly.
+			from datasdr_quantize import CT_QUANT_SUFFIX, DataSDRQuantizedVectorStore
+			if os.path.exists(os.path.join(in_index_directory, CT_DEFAULT_BASENAME + CT_QUANT_SUFFIX)):
+				var_store_class = DataSDRQuantizedVectorStore
+			storage_context = StorageContext.from_defaults(
+				persist_dir=in_index_directory,
+				vector_store=var_store_class.from_persist_dir(in_index_directory),
+				docstore=var_docstore,
+			)
+		else:
+			storage_context = StorageContext.from_defaults(persist_dir=in_index_directory, docstore=var_docstore)
+		return load_index_from_storage(storage_context, **in_kwargs)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_vector_store.py <index_dir> [<index_dir> ..] [--float16] [--remove-json]
+	var_dtype = "float16" if "--float16" in sys.argv else CT_VECTOR_DTYPE
+	var_remove_json = "--remove-json" in sys.argv
+	for one_directory in [one_arg for one_arg in sys.argv[1:] if not one_arg.startswith("--")]:
+		func_datasdr_convert_index_directory(one_directory, in_dtype=var_dtype, in_remove_json=var_remove_json)
@@ -0,0 +1,249 @@
+# (c) 2020-2024 Data Santander, SL.
+# File: datasdr_zip.py
+# Purpose: Read PDFs, SQLite3 files and pre-generated indices straight from the shipped ZIP files.
+# ver 01 - Tue 04 June 2024 - Jose.Lacal@DataSDR.com
+#
+"""
+func_datasdr_unzip_files() in Tutorial_03.py calls "extractall" on every ZIP it finds:
+* Every file is copied to disk again, on every run, even if it was extracted before.
+* The macOS resource-fork junk ("__MACOSX/._*") in ClinicalTrials_gov_10_PDFs.zip and 100_Drugs_FDA.zip is extracted too.
+
+This file:
+* Skips "__MACOSX/", "._*" and ".DS_Store" entries everywhere.
+* Streams PDF members straight from the ZIP into SimpleDirectoryReader (nothing is written to disk).
+* Extracts SQLite3 members only when they are missing or stale: the member's CRC-32 and size are
+  compared with the last extraction (or, the first time, with the file on disk).
+* Loads pre-generated indices (ClinicalTrials_gov_10_PDFs__index.zip, 100_Drugs_FDA.zip) in place.
+  func_datasdr_load_index() in datasdr_vector_store.py accepts a ".zip" path directly.
+
+Usage:
+	python3 datasdr_zip.py /Users/server/Downloads/test/_Datafiles/          # extract missing / stale SQLite3 files
+	python3 datasdr_zip.py ClinicalTrials_gov_10_PDFs.zip                    # list the useful members of a ZIP
+"""
+
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence
+from zipfile import ZipFile, ZipInfo
+
+import fsspec
+
+# Tutorial: members that are never read: macOS resource forks and Finder files.
+CT_ZIP_JUNK_DIRECTORIES = ("__MACOSX/",)
+CT_ZIP_JUNK_NAMES = (".DS_Store",)
+#
+# Tutorial: members extracted to disk. SQLite3 needs a real file; everything else is read in place.
+CT_ZIP_EXTRACT_SUFFIXES = (".sqlite3",)
+#
+# Tutorial: CRC-32 and size of every extracted member (by member name), kept in the destination directory.
+CT_ZIP_MANIFEST_FNAME = ".datasdr_unzipped.json"
+#
+CT_ZIP_COPY_BUFFER = 1024 * 1024
+
+
+def func_datasdr_zip_is_junk(in_name: str) -> int:
+	"""
+	This function returns 1 for ZIP members that are not data: directories, "__MACOSX/..", "._*" and ".DS_Store".
+
+	in_name: str - Member name inside the ZIP.
+	"""
+	var_basename = in_name.rstrip("/").split("/")[-1]
+	if in_name.endswith("/") or in_name.startswith(CT_ZIP_JUNK_DIRECTORIES):
+		return 1
+	if var_basename.startswith("._") or var_basename in CT_ZIP_JUNK_NAMES:
+		return 1
+	return 0
+#
+#
+def func_datasdr_zip_members(in_zip_path: str, in_suffixes: Optional[Sequence[str]] = None) -> List[ZipInfo]:
+	"""
+	This function lists the data members of a ZIP, optionally only those with the given suffixes.
+
+	in_zip_path: str - ZIP file.
+	in_suffixes - File name endings, e.g. (".pdf",). None = every data member.
+	"""
+	with ZipFile(in_zip_path) as var_zip:
+		return [
+			one_info for one_info in var_zip.infolist()
+			if not func_datasdr_zip_is_junk(one_info.filename) and (in_suffixes is None or one_info.filename.lower().endswith(tuple(in_suffixes)))
+		]
+#
+#
+def func_datasdr_file_crc32(in_path: str) -> int:
+	"""
+	This function returns the CRC-32 of a file, as stored in ZIP headers.
+
+	in_path: str - File.
+	"""
+	var_crc = 0
+	with open(in_path, "rb") as f:
+		for var_block in iter(lambda: f.read(CT_ZIP_COPY_BUFFER), b""):
+			var_crc = zlib.crc32(var_block, var_crc)
+	return var_crc
+#
+#
+def func_datasdr_extract_stale_members(in_zip_path: str, in_destination: str, in_suffixes: Sequence[str] = CT_ZIP_EXTRACT_SUFFIXES) -> Dict[str, int]:
+	"""
+	This function extracts the members of a ZIP that are missing or stale in the destination directory.
+	A member is up to date when its CRC-32 and size match the last extraction. Files changed locally
+	after extraction (e.g. indexes added by datasdr_router.py) are therefore not overwritten.
+	Returns a dictionary with the number of members "extracted" and "up_to_date".
+
+	in_zip_path: str - ZIP file.
+	in_destination: str - Directory to extract to. Member paths inside the ZIP are kept.
+	in_suffixes - File name endings to extract.
+	"""
+	var_manifest_path = os.path.join(in_destination, CT_ZIP_MANIFEST_FNAME)
+	var_manifest = {}
+	if os.path.exists(var_manifest_path):
+		with open(var_manifest_path, "r") as f:
+			var_manifest = json.load(f)
+	var_counts = {"extracted": 0, "up_to_date": 0}
+	#
+	with ZipFile(in_zip_path) as var_zip:
+		for one_info in var_zip.infolist():
+			if func_datasdr_zip_is_junk(one_info.filename) or not one_info.filename.lower().endswith(tuple(in_suffixes)):
+				continue
+			var_target = os.path.join(in_destination, *one_info.filename.split("/"))
+			var_member = {"crc": one_info.CRC, "size": one_info.file_size}
+			if os.path.exists(var_target):
+				if var_manifest.get(one_info.filename) == var_member:
+					var_counts["up_to_date"] += 1
+					continue
+				# Tutorial: extracted by hand, or by the original func_datasdr_unzip_files(): compare the file itself.
+				if one_info.filename not in var_manifest and os.path.getsize(var_target) == one_info.file_size and func_datasdr_file_crc32(var_target) == one_info.CRC:
+					var_manifest[one_info.filename] = var_member
+					var_counts["up_to_date"] += 1
+					continue
+			#
+			os.makedirs(os.path.dirname(var_target), exist_ok=True)
+			var_tmp_path = "%s.tmp-%d" % (var_target, os.getpid())
+			with var_zip.open(one_info) as var_source, open(var_tmp_path, "wb") as var_file:
+				while True:
+					var_block = var_source.read(CT_ZIP_COPY_BUFFER)
+					if not var_block:
+						break
+					var_file.write(var_block)
+			os.replace(var_tmp_path, var_target)
+			var_manifest[one_info.filename] = var_member
+			var_counts["extracted"] += 1
+	#
+	var_tmp_path = "%s.tmp-%d" % (var_manifest_path, os.getpid())
+	with open(var_tmp_path, "w") as f:
+		json.dump(var_manifest, f, indent=1)
+	os.replace(var_tmp_path, var_manifest_path)
+	return var_counts
+#
+#
+def func_datasdr_unzip_sqlite_files(in_directory: str) -> Dict[str, int]:
+	"""
+	This function extracts the missing or stale SQLite3 files of every ZIP in a directory (and its sub-directories).
+	Other members (PDFs, indices) stay in their ZIP and are read in place.
+
+	in_directory: str - Directory where ZIPped files are located at.
+	"""
+	var_start = time.time()
+	var_totals = {"extracted": 0, "up_to_date": 0}
+	for root, dirs, files in os.walk(in_directory):
+		for one_name in sorted(files):
+			if one_name.lower().endswith(".zip") and not one_name.startswith("._"):
+				var_counts = func_datasdr_extract_stale_members(os.path.join(root, one_name), in_directory)
+				for one_key in var_totals:
+					var_totals[one_key] += var_counts[one_key]
+	print("SQLite3 files in [%s]: %d extracted, %d up to date, in %.2f seconds" % (in_directory, var_totals["extracted"], var_totals["up_to_date"], time.time() - var_start))
+	return var_totals
+#
+#
+def func_datasdr_zip_filesystem(in_zip_path: str) -> fsspec.AbstractFileSystem:
+	"""
+	This function opens a ZIP as a read-only fsspec file system. Members are decompressed on demand.
+
+	in_zip_path: str - ZIP file.
+	"""
+	return fsspec.filesystem("zip", fo=in_zip_path)
+#
+#
+def func_datasdr_load_zip_documents(in_zip_path: str, in_filename_as_id: bool = False):
+	"""
+	This function reads the documents (e.g. PDFs) of a ZIP with SimpleDirectoryReader, without extracting them.
+	Returns a list of Documents; "file_path" is the member path inside the ZIP.
+
+	in_zip_path: str - ZIP file, e.g. ClinicalTrials_gov_10_PDFs.zip.
+	in_filename_as_id: bool - Same as SimpleDirectoryReader's "filename_as_id".
+	"""
+	from llama_index.core import SimpleDirectoryReader
+	#
+	var_members = [one_info.filename for one_info in func_datasdr_zip_members(in_zip_path)]
+	if not var_members:
+		return []
+	return SimpleDirectoryReader(input_files=var_members, fs=func_datasdr_zip_filesystem(in_zip_path), filename_as_id=in_filename_as_id).load_data()
+#
+#
+def func_datasdr_zip_persist_dir(in_zip_path: str) -> str:
+	"""
+	This function returns the directory, inside a ZIP, that holds the persisted index files ("/" = ZIP root).
+
+	in_zip_path: str - ZIP file with a persisted index.
+	"""
+	for one_info in func_datasdr_zip_members(in_zip_path, ("docstore.json", "docstore.sqlite3")):
+		return os.path.dirname(one_info.filename) or "/"
+	raise FileNotFoundError("No persisted index (docstore.json or docstore.sqlite3) in [%s]" % (in_zip_path))
+#
+#
+def func_datasdr_extract_zip_docstore(in_zip_path: str, in_persist_dir: str) -> Optional[str]:
+	"""
+	This function extracts the "docstore.sqlite3" of a zipped index to a temporary directory, removed when Python exits.
+	SQLite3 cannot open a file inside a ZIP. Returns the temporary directory, or None if the index has a "docstore.json" only.
+
+	in_zip_path: str - ZIP file with a persisted index.
+	in_persist_dir: str - From func_datasdr_zip_persist_dir().
+	"""
+	from datasdr_docstore import CT_DOCSTORE_FNAME
+	#
+	var_member = CT_DOCSTORE_FNAME if in_persist_dir == "/" else in_persist_dir + "/" + CT_DOCSTORE_FNAME
+	with ZipFile(in_zip_path) as var_zip:
+		if var_member not in var_zip.NameToInfo:
+			return None
+		var_directory = tempfile.mkdtemp(prefix="datasdr_zip_docstore_")
+		atexit.register(shutil.rmtree, var_directory, True)
+		with var_zip.open(var_member) as var_source, open(os.path.join(var_directory, CT_DOCSTORE_FNAME), "wb") as var_target:
+			shutil.copyfileobj(var_source, var_target, CT_ZIP_COPY_BUFFER)
+	return var_directory
+#
+#
+def func_datasdr_load_index_from_zip(in_zip_path: str, **in_kwargs):
+	"""
+	This function loads a persisted index straight from its ZIP. The JSON files are read in place;
+	a "docstore.sqlite3" (see datasdr_docstore.py) is extracted to a temporary file first.
+
+	in_zip_path: str - ZIP file, e.g. ClinicalTrials_gov_10_PDFs__index.zip.
+	"""
+	from llama_index.core import StorageContext, load_index_from_storage
+	#
+	var_persist_dir = func_datasdr_zip_persist_dir(in_zip_path)
+	var_docstore = None
+	var_docstore_directory = func_datasdr_extract_zip_docstore(in_zip_path, var_persist_dir)
+	if var_docstore_directory is not None:
+		from datasdr_docstore import DataSDRSQLiteDocumentStore
+		var_docstore = DataSDRSQLiteDocumentStore.from_persist_dir(var_docstore_directory)
+	storage_context = StorageContext.from_defaults(persist_dir=var_persist_dir, fs=func_datasdr_zip_filesystem(in_zip_path), docstore=var_docstore)
+	return load_index_from_storage(storage_context, **in_kwargs)
+#
+#
+if __name__ == "__main__":
+	# Tutorial: python3 datasdr_zip.py <directory with ZIPs> | <file.zip>
+	for one_path in sys.argv[1:]:
+		if os.path.isdir(one_path):
+			func_datasdr_unzip_sqlite_files(one_path)
+		else:
+			var_all = ZipFile(one_path).infolist()
+			var_members = func_datasdr_zip_members(one_path)
+			print("%s: %d members, %d junk entries skipped" % (one_path, len(var_members), len([one_info for one_info in var_all if not one_info.filename.endswith("/")]) - len(var_members)))
+			for one_info in var_members:
+				print("  %10d  %s" % (one_info.file_size, one_info.filename))